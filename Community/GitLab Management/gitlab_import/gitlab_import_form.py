@@ -24,7 +24,7 @@ Workflow form template
 
 from wtforms import SubmitField
 from bluecat.wtform_extensions import GatewayForm
-from bluecat.wtform_fields import CustomStringField
+from bluecat.wtform_fields import CustomStringField, CustomBooleanField
 from . import gitlab_import_config
 from .custom_wtform_fields import gitlab_import_entities
 
@@ -59,5 +59,11 @@ class GenericFormTemplate(GatewayForm):
         enable_dependencies={'on_complete': ['submit']}
     )
 
+    incremental = CustomBooleanField(
+        label='Only import changed workflows',
+        default=True,
+        is_disabled_on_start=False
+    )
+
     submit = SubmitField(label='Import')
 
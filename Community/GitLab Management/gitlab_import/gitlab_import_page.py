@@ -30,13 +30,11 @@ import requests
 from flask import url_for, redirect, render_template, flash, g
 
 import config.default_config as config
-from Administration.admin.workflow_export_import import get_workflow_path
 from bluecat import route, util
 from bluecat.internal.app_helper import load_permissions_json
-from file_modified_handler import unload_modules_in_dir, remove_registered_workflow_functions
 from main_app import app
 from .gitlab_import_form import GenericFormTemplate
-from . import gitlab_import_config, gitlab_import_util
+from . import gitlab_import_config, gitlab_import_util, gitlab_import_sync
 from bluecat.util import get_password_from_file
 
 
@@ -72,6 +70,23 @@ def gitlab_import_gitlab_import_page_form():
     form.gitlab_groups.choices = gitlab_import_util.get_gitlab_groups(default_val=True)
     if form.validate_on_submit():
 
+        if form.incremental.data:
+            try:
+                imported = gitlab_import_sync.import_changed_workflows(form.gitlab_groups.data)
+            # pylint: disable=broad-except
+            except Exception as e:
+                app.logger.exception("Failed to load GitLab workflows: {}".format(str(e)))
+                g.user.logger.warning('%s' % util.safe_str(e), msg_type=g.user.logger.EXCEPTION)
+                flash('Unable to import GitLab workflows properly: ' + util.safe_str(e))
+                return redirect(url_for('gitlab_importgitlab_import_gitlab_import_page'))
+
+            g.user.logger.info('SUCCESS')
+            if imported:
+                flash('Imported changed GitLab workflows successfully: ' + ', '.join(imported), 'succeed')
+            else:
+                flash('GitLab workflows are already up to date', 'succeed')
+            return redirect(url_for('gitlab_importgitlab_import_gitlab_import_page'))
+
         try:
             # This is to get and download the archive zip
             response = {}
@@ -158,15 +173,7 @@ def gitlab_import_gitlab_import_page_form():
                 if os.path.isdir(os.path.join(gitlab_import_config.workflow_dir, folder_name, gitlab_import_config.gitlab_import_directory, dir)):
                     if os.path.exists(os.path.join(gitlab_import_config.workflow_dir, gitlab_import_config.gitlab_import_directory, dir)):
                         # Unregister existing mapped functions
-                        for workflow_name, workflow_fields in list(config.workflows.items()):
-                            if dir in workflow_fields['categories']:
-                                app.logger.info("Unloading workflow %s", workflow_name)
-                                workflow_path = get_workflow_path(workflow_name)
-                                if not remove_registered_workflow_functions(workflow_path.replace(os.path.sep, '.')):
-                                    raise Exception("Removal failed {}".format(workflow_path.replace(os.path.sep, '.')))
-                                unload_modules_in_dir(workflow_path.replace(os.path.sep, '.'),
-                                                      os.listdir(workflow_path))
-                                config.workflows.pop(workflow_name)
+                        gitlab_import_sync.unload_workflows(dir)
                         shutil.rmtree(os.path.join(gitlab_import_config.workflow_dir, gitlab_import_config.gitlab_import_directory, dir))
                     shutil.move(os.path.join(gitlab_import_config.workflow_dir, folder_name, gitlab_import_config.gitlab_import_directory, dir),
                                 os.path.join(gitlab_import_config.workflow_dir, gitlab_import_config.gitlab_import_directory))
@@ -174,12 +181,8 @@ def gitlab_import_gitlab_import_page_form():
 
             permissions = load_permissions_json()
 
-            status = True
             # Refresh config.workflows
-            for dir in gitlab_directories:
-                if not gitlab_import_util.custom_workflow_navigator(os.path.join(gitlab_import_config.workflow_dir, gitlab_import_config.gitlab_import_directory, dir),
-                                                                    permissions):
-                    status = False
+            status = gitlab_import_util.reload_workflows(gitlab_directories, permissions)
 
             if not status:
                 raise Exception("Failed to load workflows in memory")
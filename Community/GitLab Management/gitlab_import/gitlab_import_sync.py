@@ -0,0 +1,232 @@
+# Copyright 2020 BlueCat Networks (USA) Inc. and its affiliates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# By: BlueCat Networks
+# Date: 2020-06-01
+# Gateway Version: 19.5.1
+# Description: Incremental GitLab import of the workflows whose files changed
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import zipfile
+from datetime import datetime
+
+import requests
+
+import config.default_config as config
+from Administration.admin.workflow_export_import import get_workflow_path
+from bluecat.internal.app_helper import load_permissions_json
+from bluecat.util import get_password_from_file
+from file_modified_handler import unload_modules_in_dir, remove_registered_workflow_functions
+from main_app import app
+from . import gitlab_import_config, gitlab_import_util
+
+CHUNK_SIZE = 1024 * 1024
+DOWNLOAD_TIMEOUT = 300
+# Compiled files are not part of the repository and never count as a change
+IGNORED_DIRS = ('__pycache__',)
+IGNORED_SUFFIXES = ('.pyc', '.pyo')
+
+
+def _ignored(path):
+    parts = path.split('/')
+    return any(part in IGNORED_DIRS for part in parts[:-1]) or parts[-1].endswith(IGNORED_SUFFIXES)
+
+
+def file_hash(f):
+    digest = hashlib.sha256()
+    for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+def download_archive(project_id, directory):
+    """Stream the archive.zip of a project to a temporary file in directory and return its path"""
+    url = gitlab_import_config.gitlab_url + 'projects/' + str(project_id) + '/repository/archive.zip'
+    headers = {'PRIVATE-TOKEN': get_password_from_file(gitlab_import_config.secret_file)}
+    fd, path = tempfile.mkstemp(prefix='gitlab_import-', suffix='.zip', dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as archive_file:
+            with requests.get(url, headers=headers, stream=True, timeout=DOWNLOAD_TIMEOUT) as response:
+                response.raise_for_status()
+                for chunk in response.iter_content(CHUNK_SIZE):
+                    archive_file.write(chunk)
+    except Exception:
+        os.remove(path)
+        raise
+    return path
+
+
+def archive_hashes(archive, prefix):
+    """Return {path: sha256} of the files below prefix in the archive, paths relative to prefix"""
+    hashes = {}
+    for info in archive.infolist():
+        if info.filename.endswith('/') or not info.filename.startswith(prefix):
+            continue
+        path = info.filename[len(prefix):]
+        if _ignored(path):
+            continue
+        with archive.open(info) as member:
+            hashes[path] = file_hash(member)
+    return hashes
+
+
+def deployed_hashes(directory):
+    """Return {path: sha256} of the files below a deployed directory, paths relative to it"""
+    hashes = {}
+    for root, dirs, files in os.walk(directory):
+        dirs[:] = [name for name in dirs if name not in IGNORED_DIRS]
+        for name in files:
+            full_path = os.path.join(root, name)
+            path = os.path.relpath(full_path, directory).replace(os.path.sep, '/')
+            if _ignored(path):
+                continue
+            with open(full_path, 'rb') as f:
+                hashes[path] = file_hash(f)
+    return hashes
+
+
+def group_by_directory(hashes):
+    """Split {path: sha256} into {top level directory: {path below it: sha256}}, skipping top level files"""
+    groups = {}
+    for path, digest in hashes.items():
+        directory, _, rest = path.partition('/')
+        if rest:
+            groups.setdefault(directory, {})[rest] = digest
+    return groups
+
+
+def diff_hashes(deployed, imported):
+    """Return the added, changed and removed paths, or None when both sides hold the same files"""
+    added = sorted(set(imported) - set(deployed))
+    removed = sorted(set(deployed) - set(imported))
+    changed = sorted(path for path in set(imported) & set(deployed) if imported[path] != deployed[path])
+    if not (added or removed or changed):
+        return None
+    return {'added': added, 'changed': changed, 'removed': removed}
+
+
+def backup_changes(source_dir, changes, backup_dir):
+    """Copy the deployed files an import overwrites or removes, and a list of all of its changes, to backup_dir"""
+    for path in changes['changed'] + changes['removed']:
+        target = os.path.join(backup_dir, *path.split('/'))
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        shutil.copy2(os.path.join(source_dir, *path.split('/')), target)
+    os.makedirs(backup_dir, exist_ok=True)
+    with open(os.path.join(backup_dir, 'gitlab_import_changes.json'), 'w') as f:
+        json.dump(changes, f, indent=4)
+
+
+def extract_directory(archive, prefix, target):
+    """Extract the files below prefix in the archive into target"""
+    target = os.path.abspath(target)
+    for info in archive.infolist():
+        if info.filename.endswith('/') or not info.filename.startswith(prefix):
+            continue
+        path = os.path.abspath(os.path.join(target, info.filename[len(prefix):]))
+        if not path.startswith(target + os.path.sep):
+            raise Exception('Invalid path {} in the GitLab archive'.format(info.filename))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with archive.open(info) as member, open(path, 'wb') as f:
+            shutil.copyfileobj(member, f, CHUNK_SIZE)
+
+
+def unload_workflows(directory):
+    """Unregister and unload the loaded workflows of a workflow directory"""
+    for workflow_name, workflow_fields in list(config.workflows.items()):
+        if directory in workflow_fields['categories']:
+            app.logger.info("Unloading workflow %s", workflow_name)
+            workflow_path = get_workflow_path(workflow_name)
+            if not remove_registered_workflow_functions(workflow_path.replace(os.path.sep, '.')):
+                raise Exception("Removal failed {}".format(workflow_path.replace(os.path.sep, '.')))
+            unload_modules_in_dir(workflow_path.replace(os.path.sep, '.'),
+                                  os.listdir(workflow_path))
+            config.workflows.pop(workflow_name)
+
+
+def import_changed_workflows(project_id):
+    """
+    Import the workflow directories of a GitLab project whose files differ from the deployed ones.
+
+    The archive is streamed to disk and the SHA-256 of every file in it is compared with the
+    deployed files, so only changed workflow directories and a changed util directory are
+    extracted and moved in place. Before that, the deployed files they overwrite or remove are
+    copied to a time stamped folder under the backups folder. The changed workflows are then
+    reloaded together with one read of the permissions.
+
+    :return: The names of the imported workflow directories.
+    """
+    workflow_root = os.path.join(gitlab_import_config.workflow_dir, gitlab_import_config.gitlab_import_directory)
+    backups_root = os.path.join('bluecat_portal', gitlab_import_config.backups_folder)
+    time_format = datetime.now().strftime("%Y_%m_%d_%H_%M_%S")
+
+    archive_path = download_archive(project_id, gitlab_import_config.workflow_dir)
+    staging_dir = tempfile.mkdtemp(prefix='gitlab_import-', dir=gitlab_import_config.workflow_dir)
+    try:
+        with zipfile.ZipFile(archive_path) as archive:
+            names = archive.namelist()
+            if not names:
+                raise Exception('The GitLab archive is empty')
+            # Everything in a GitLab archive is below a <project>-<ref>-<sha> folder
+            top = names[0].split('/')[0] + '/'
+
+            utils_changed = False
+            if gitlab_import_config.gitlab_import_utils_directory:
+                utils_prefix = top + gitlab_import_config.gitlab_import_utils_directory + '/'
+                utils_dir = os.path.join('bluecat_portal', gitlab_import_config.gw_utils_directory)
+                imported_utils = archive_hashes(archive, utils_prefix)
+                changes = diff_hashes(deployed_hashes(utils_dir), imported_utils) if imported_utils else None
+                if changes is not None:
+                    app.logger.info("GitLab util folder changed: %s", changes)
+                    backup_changes(utils_dir, changes, os.path.join(
+                        backups_root, gitlab_import_config.gitlab_import_utils_directory + '-' + time_format))
+                    extract_directory(archive, utils_prefix, os.path.join(staging_dir, 'utils'))
+                    utils_changed = True
+
+            workflows_prefix = top + gitlab_import_config.gitlab_import_directory + '/'
+            imported = group_by_directory(archive_hashes(archive, workflows_prefix))
+            changed_dirs = []
+            for directory, hashes in sorted(imported.items()):
+                deployed_dir = os.path.join(workflow_root, directory)
+                changes = diff_hashes(deployed_hashes(deployed_dir), hashes)
+                if changes is None:
+                    continue
+                app.logger.info("GitLab workflow directory %s changed: %s", directory, changes)
+                backup_changes(deployed_dir, changes, os.path.join(
+                    backups_root, gitlab_import_config.gitlab_import_directory + '-' + time_format, directory))
+                extract_directory(archive, workflows_prefix + directory + '/', os.path.join(staging_dir, 'workflows', directory))
+                changed_dirs.append(directory)
+
+        if utils_changed:
+            utils_dir = os.path.join('bluecat_portal', gitlab_import_config.gw_utils_directory)
+            if os.path.exists(utils_dir):
+                shutil.rmtree(utils_dir)
+            shutil.move(os.path.join(staging_dir, 'utils'), utils_dir)
+
+        for directory in changed_dirs:
+            deployed_dir = os.path.join(workflow_root, directory)
+            if os.path.exists(deployed_dir):
+                unload_workflows(directory)
+                shutil.rmtree(deployed_dir)
+            shutil.move(os.path.join(staging_dir, 'workflows', directory), deployed_dir)
+    finally:
+        os.remove(archive_path)
+        shutil.rmtree(staging_dir, ignore_errors=True)
+
+    if changed_dirs and not gitlab_import_util.reload_workflows(changed_dirs, load_permissions_json()):
+        raise Exception("Failed to load workflows in memory")
+    return changed_dirs
@@ -71,30 +71,51 @@ def get_gitlab_groups(default_val=False):
     return result
 
 
-def custom_workflow_navigator(workflow_dir, permissions, builtin=False):
-    """ reloads workflows if user has permissions to them"""
+def reload_workflow(workflow_name, permissions, builtin=False):
+    """ reloads one workflow directory if user has permissions to it"""
+
+    import_dir = os.path.join(gitlab_import_config.workflow_dir, gitlab_import_config.gitlab_import_directory)
+    if not os.path.isfile('%s/%s/__init__.py' % (import_dir, workflow_name)):
+        return True
+    if workflow_name in permissions:
+        page_permissions = permissions[workflow_name]
+    else:
+        page_permissions = {}
+
+    try:
+        result = refresh_workflow(import_dir, workflow_name, page_permissions, builtin)
+    # pylint: disable=broad-except
+    except Exception as e:
+        app.logger.error("Failed to load workflow %s, error was %s", workflow_name, str(e))
+        return False
+
+    if result:
+        branch_dir = os.path.join(import_dir, workflow_name)
+        if not os.path.isfile(branch_dir):
+            if not workflow_navigator(branch_dir, permissions, builtin):
+                return False
+    return True
+
 
+def reload_workflows(workflow_names, permissions, builtin=False):
+    """ reloads the given workflow directories one after another, sharing one permissions read"""
+
+    # Registering a workflow changes config.workflows and the URL map, neither is safe to change concurrently
     status = True
-    for workflow_name in os.listdir(os.path.join(gitlab_import_config.workflow_dir, gitlab_import_config.gitlab_import_directory)):
-        if os.path.isfile('%s/%s/__init__.py' % (os.path.join(gitlab_import_config.workflow_dir, gitlab_import_config.gitlab_import_directory), workflow_name)):
-            if workflow_name in permissions:
-                page_permissions = permissions[workflow_name]
-            else:
-                page_permissions = {}
-
-            try:
-                result = refresh_workflow(os.path.join(gitlab_import_config.workflow_dir, gitlab_import_config.gitlab_import_directory), workflow_name, page_permissions, builtin)
-            # pylint: disable=broad-except
-            except Exception as e:
-                app.logger.error("Failed to load workflow %s, error was %s", workflow_name, str(e))
+    for workflow_name in workflow_names:
+        with app.app_context():
+            if not reload_workflow(workflow_name, permissions, builtin):
                 status = False
-                continue
+    return status
 
-            if result:
-                branch_dir = os.path.join(os.path.join(gitlab_import_config.workflow_dir, gitlab_import_config.gitlab_import_directory), workflow_name)
-                if not os.path.isfile(branch_dir):
-                    if not workflow_navigator(branch_dir, permissions, builtin):
-                        status = False
 
-    return status
+def custom_workflow_navigator(workflow_dir, permissions, builtin=False):
+    """ reloads workflows if user has permissions to them"""
+
+    import_dir = os.path.join(gitlab_import_config.workflow_dir, gitlab_import_config.gitlab_import_directory)
+    status = True
+    for workflow_name in os.listdir(import_dir):
+        if not reload_workflow(workflow_name, permissions, builtin):
+            status = False
 
+    return status
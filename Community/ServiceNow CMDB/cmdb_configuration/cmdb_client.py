@@ -0,0 +1,172 @@
+# Copyright 2020 BlueCat Networks. All rights reserved.
+"""
+ServiceNow Table API client shared by the CMDB workflows
+"""
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from bluecat.util import get_password_from_file
+from main_app import app
+from . import cmdb_config
+
+# Records asked for per Table API call
+PAGE_SIZE = 1000
+POOL_SIZE = 4
+TIMEOUT = 60
+# Seconds reference tables (manufacturers, locations) are kept before being read again
+REFERENCE_TTL = 3600
+# Seconds a CI snapshot is shown before it is refreshed in the background
+SNAPSHOT_TTL = 300
+
+
+class ServiceNowException(Exception):
+    pass
+
+
+def reference_value(field):
+    """Return the sys_id a reference field points at, whether it comes with its link or not"""
+    if isinstance(field, dict):
+        return field.get('value', '')
+    return field or ''
+
+
+class ServiceNowClient(object):
+    """
+    Table API calls over one pooled, authenticated requests.Session.
+    The password is read from the secret file once per client instead of once per call.
+    """
+
+    def __init__(self, url, username, secret_file):
+        self.url = url
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.session.auth = (username, get_password_from_file(secret_file))
+        self.session.headers.update({'Accept': 'application/json'})
+        self.session.verify = False
+        self._references = {}
+        self._references_lock = threading.Lock()
+
+    def get_page(self, table, fields, query=None, offset=0, limit=PAGE_SIZE):
+        params = {
+            'sysparm_fields': ','.join(fields),
+            'sysparm_limit': limit,
+            'sysparm_offset': offset,
+        }
+        if query:
+            params['sysparm_query'] = query
+        response = self.session.get(self.url + '/api/now/table/' + table, params=params, timeout=TIMEOUT)
+        if response.status_code != 200:
+            raise ServiceNowException('%s returned HTTP %d' % (table, response.status_code))
+        return response.json()['result']
+
+    def iter_table(self, table, fields, query=None, limit=None):
+        """Yield the records of a table with only the given fields, PAGE_SIZE per call and at most limit"""
+        offset = 0
+        while limit is None or offset < limit:
+            count = PAGE_SIZE if limit is None else min(PAGE_SIZE, limit - offset)
+            records = self.get_page(table, fields, query, offset, count)
+            for record in records:
+                yield record
+            if len(records) < count:
+                return
+            offset += count
+
+    def get_reference_names(self, table, query=None):
+        """Return {sys_id: name} of a reference table, read again once REFERENCE_TTL has passed"""
+        key = (table, query)
+        with self._references_lock:
+            cached = self._references.get(key)
+        if cached is not None and time.time() < cached[0]:
+            return cached[1]
+        names = dict((record['sys_id'], record['name']) for record in self.iter_table(table, ['sys_id', 'name'], query))
+        with self._references_lock:
+            self._references[key] = (time.time() + REFERENCE_TTL, names)
+        return names
+
+
+class CISnapshot(object):
+    """
+    The table rows of one CI class as last read from ServiceNow.
+    Only the first call waits for ServiceNow. Later calls return the rows at hand and, once they
+    are older than SNAPSHOT_TTL, start a background thread that reads them again, so a page is
+    never held up by a refresh. A failed refresh keeps the previous rows.
+    """
+
+    def __init__(self, name, load_rows):
+        self.name = name
+        self.refreshed_at = None
+        self._load_rows = load_rows
+        self._rows = []
+        self._refreshing = False
+        self._lock = threading.Lock()
+        self._first_load = threading.Lock()
+
+    def _refresh(self):
+        try:
+            rows = self._load_rows(get_client())
+            with self._lock:
+                self._rows = rows
+                self.refreshed_at = time.time()
+        except Exception:
+            app.logger.exception('Failed to refresh the ServiceNow %s snapshot' % self.name)
+        finally:
+            with self._lock:
+                self._refreshing = False
+
+    def rows(self):
+        if self.refreshed_at is None:
+            with self._first_load:
+                if self.refreshed_at is None:
+                    with self._lock:
+                        self._refreshing = True
+                    self._refresh()
+            return self._rows
+        with self._lock:
+            if self._refreshing or time.time() < self.refreshed_at + SNAPSHOT_TTL:
+                return self._rows
+            self._refreshing = True
+        thread = threading.Thread(target=self._refresh, name='cmdb-%s-refresh' % self.name)
+        thread.daemon = True
+        thread.start()
+        return self._rows
+
+
+_client = None
+_client_key = None
+_snapshots = {}
+_lock = threading.Lock()
+
+
+def get_client():
+    """Return the client for the current cmdb_config settings"""
+    global _client, _client_key
+    key = (cmdb_config.servicenow_url, cmdb_config.servicenow_username, cmdb_config.servicenow_secret_file)
+    with _lock:
+        if _client is None or _client_key != key:
+            _client = ServiceNowClient(*key)
+            _client_key = key
+        return _client
+
+
+def get_snapshot(name, load_rows):
+    """Return the CISnapshot of that name, load_rows(client) returning its table rows"""
+    with _lock:
+        snapshot = _snapshots.get(name)
+        if snapshot is None:
+            snapshot = CISnapshot(name, load_rows)
+            _snapshots[name] = snapshot
+        return snapshot
+
+
+def reset():
+    """Drop the client, its cached reference tables and every snapshot, after the settings changed"""
+    global _client, _client_key
+    with _lock:
+        _client = None
+        _client_key = None
+        _snapshots.clear()
@@ -13,6 +13,7 @@ import config.default_config as config
 from main_app import app
 from .cmdb_configuration_form import GenericFormTemplate
 from . import cmdb_config
+from . import cmdb_client
 
 def module_path():
     encoding = sys.getfilesystemencoding()
@@ -88,6 +89,7 @@ def cmdb_configuration_cmdb_configuration_page_form():
 
         with open(os.path.join('bluecat_portal', 'workflows', 'ServiceNow CMDB', 'cmdb_configuration', 'cmdb_config.py'), 'w') as config_file:
             config_file.write(content)
+        cmdb_client.reset()
 
         g.user.logger.info('SUCCESS')
         flash('success', 'succeed')
@@ -2,9 +2,9 @@
 """
 Component logic
 """
-from bluecat.util import get_password_from_file
-from ..cmdb_configuration import cmdb_config
-import requests
+from ..cmdb_configuration.cmdb_client import get_snapshot, reference_value
+
+FIELDS = ['name', 'ip_address', 'serial_number', 'firmware_version', 'ports', 'manufacturer', 'location']
 
 
 def raw_table_data(*args, **kwargs):
@@ -17,44 +17,25 @@ def raw_table_data(*args, **kwargs):
                         {'title': 'Manufacturer'},
                         {'title': 'Location'},
                         ],
-            'data': []}
-
-    # HTTP request
-    headers = {"Accept": "application/json"}
-    cmdb_url = cmdb_config.servicenow_url + '/api/now/table/cmdb_ci_ip_router'
-    response = requests.get(cmdb_url, auth=(cmdb_config.servicenow_username, get_password_from_file(cmdb_config.servicenow_secret_file)), headers=headers, verify=False)
-
-    # Check for HTTP codes other than 200
-    if response.status_code == 200:
-        routers = response.json()
-
-        for router in routers['result']:
-            router_name = router['name']
-            router_ip = router['ip_address']
-            router_serial = router['serial_number']
-            firmware_version = router['firmware_version']
-            ports = router['ports']
-
-            if router['manufacturer']:
-                router_manufacturer = get_router_manufacturer(router['manufacturer']['link'])
-
-            if router['location']:
-                router_location = get_router_location(router['location']['link'])
-
-            data['data'].append([router_name, router_ip, firmware_version, ports, router_serial, router_manufacturer, router_location])
+            'data': get_snapshot('cmdb_ci_ip_router', get_router_rows).rows()}
 
     return data
 
 
-def get_router_manufacturer(link):
-    headers = {"Accept": "application/json"}
-    response = requests.get(link, auth=(cmdb_config.servicenow_username, get_password_from_file(cmdb_config.servicenow_secret_file)), headers=headers, verify=False)
-    manufacturer = response.json()
-    return manufacturer['result']['name']
+def get_router_rows(client):
+    manu_dict = client.get_reference_names('core_company')
+    location_dict = client.get_reference_names('cmn_location')
+
+    rows = []
+    for router in client.iter_table('cmdb_ci_ip_router', FIELDS):
+        router_name = router['name']
+        router_ip = router['ip_address']
+        router_serial = router['serial_number']
+        firmware_version = router['firmware_version']
+        ports = router['ports']
+        router_manufacturer = manu_dict.get(reference_value(router['manufacturer']), '')
+        router_location = location_dict.get(reference_value(router['location']), '')
 
+        rows.append([router_name, router_ip, firmware_version, ports, router_serial, router_manufacturer, router_location])
 
-def get_router_location(link):
-    headers = {"Accept": "application/json"}
-    response = requests.get(link, auth=(cmdb_config.servicenow_username, get_password_from_file(cmdb_config.servicenow_secret_file)), headers=headers, verify=False)
-    location = response.json()
-    return location['result']['name']
\ No newline at end of file
+    return rows
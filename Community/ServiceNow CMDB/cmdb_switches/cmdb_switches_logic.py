@@ -2,9 +2,9 @@
 """
 Component logic
 """
-from bluecat.util import get_password_from_file
-from ..cmdb_configuration import cmdb_config
-import requests
+from ..cmdb_configuration.cmdb_client import get_snapshot, reference_value
+
+FIELDS = ['name', 'ip_address', 'serial_number', 'manufacturer']
 
 
 def raw_table_data(*args, **kwargs):
@@ -14,32 +14,21 @@ def raw_table_data(*args, **kwargs):
                         {'title': 'Serial Number'},
                         {'title': 'Manufacturer'},
                         ],
-            'data': []}
-
-    # HTTP request
-    headers = {"Accept": "application/json"}
-    cmdb_url = cmdb_config.servicenow_url + '/api/now/table/cmdb_ci_ip_switch'
-    response = requests.get(cmdb_url, auth=(cmdb_config.servicenow_username, get_password_from_file(cmdb_config.servicenow_secret_file)), headers=headers, verify=False)
-
-    # Check for HTTP codes other than 200
-    if response.status_code == 200:
-        switches = response.json()
+            'data': get_snapshot('cmdb_ci_ip_switch', get_switch_rows).rows()}
 
-        for switch in switches['result']:
-            switch_name = switch['name']
-            switch_ip = switch['ip_address']
-            switch_serial = switch['serial_number']
+    return data
 
-            if switch['manufacturer']:
-                switch_manufacturer = get_switch_manufacturer(switch['manufacturer']['link'])
 
-            data['data'].append([switch_name, switch_ip, switch_serial, switch_manufacturer])
+def get_switch_rows(client):
+    manu_dict = client.get_reference_names('core_company')
 
-    return data
+    rows = []
+    for switch in client.iter_table('cmdb_ci_ip_switch', FIELDS):
+        switch_name = switch['name']
+        switch_ip = switch['ip_address']
+        switch_serial = switch['serial_number']
+        switch_manufacturer = manu_dict.get(reference_value(switch['manufacturer']), '')
 
+        rows.append([switch_name, switch_ip, switch_serial, switch_manufacturer])
 
-def get_switch_manufacturer(link):
-    headers = {"Accept": "application/json"}
-    response = requests.get(link, auth=(cmdb_config.servicenow_username, get_password_from_file(cmdb_config.servicenow_secret_file)), headers=headers, verify=False)
-    manufacturer = response.json()
-    return manufacturer['result']['name']
+    return rows
@@ -3,22 +3,28 @@
 # Various Flask framework items.
 import os
 import sys
-import ipaddress
+import time
 
 from flask import render_template, g, request, jsonify
 from flask_mail import Mail, Message
 
 from bluecat import route, util
-from bluecat.api_exception import APIException
 import config.default_config as config
 from main_app import app
 from .SubnetStatus_form import GenericFormTemplate
+from .utilization import UtilizationEngine
+from .snapshots import SnapshotScheduler
 
 
 def module_path():
     return os.path.dirname(os.path.abspath(str(__file__)))
 
 
+snapshot_scheduler = SnapshotScheduler.get_instance(debug=True)
+if snapshot_scheduler.register_job():
+    print("SubnetStatus snapshot job is registered.......")
+
+
 # The workflow name must be the first part of any endpoints defined in this file.
 # If you break this rule, you will trip up on other people's endpoint names and
 # chaos will ensue.
@@ -104,7 +110,7 @@ def get_subnets():
 def run_stats():
     json_data = request.get_json()
 
-    data = run_stats_common(json_data['subnet_id'])
+    data = run_stats_common(json_data['subnet_id'], json_data.get('max_age'))
     if 'email' in json_data:
         email_report(json_data['email'], data['report'])
 
@@ -116,16 +122,44 @@ def run_stats():
 @util.rest_exception_catcher
 def get_stats():
 
-    return jsonify(run_stats_common(request.form['subnet_id']))
+    return jsonify(run_stats_common(request.form['subnet_id'], request.form.get('max_age')))
+
+
+def get_accessible_entity(bam_id):
+    """
+    Return the block or network as the current user sees it. Reading the entity under g.user first
+    keeps BAM access rights enforced, even for entities the user has snapshots of from before a change.
+    """
+    return g.user.get_api().get_entity_by_id(str(bam_id))
 
 
-def run_stats_common(bam_id):
-    bam_object = g.user.get_api().get_entity_by_id(str(bam_id))
+def get_utilization(bam_id, max_age=None):
+    """
+    Return the statistics of a block or network from the latest snapshot if it is at most max_age
+    seconds old (the configured max_age by default), otherwise compute and record them now.
+    """
+    bam_object = get_accessible_entity(bam_id)
+    if max_age is None:
+        max_age = snapshot_scheduler.get_value('max_age')
+    snapshot = snapshot_scheduler.store.latest(g.user.get_username(), bam_id, float(max_age))
+    if snapshot is not None:
+        return snapshot[1]
 
     if 'Network' in bam_object.get_type():
-        return_data = {'network': calculate_network_stats(bam_object)}
+        data = calculate_network_stats(bam_object)
     else:
-        return_data = {'block': calculate_block_stats(bam_object)}
+        data = calculate_block_stats(bam_object)
+    snapshot_scheduler.store.store(g.user.get_username(), data)
+    return data
+
+
+def run_stats_common(bam_id, max_age=None):
+    data = get_utilization(bam_id, max_age)
+
+    if 'Network' in data['type']:
+        return_data = {'network': data}
+    else:
+        return_data = {'block': data}
 
     report = generate_report(return_data)
     return_data.update({'report': report})
@@ -137,9 +171,7 @@ def run_stats_common(bam_id):
 @util.workflow_permission_required('SubnetStatus_page')
 @util.exception_catcher
 def get_network_stat():
-    network = g.user.get_api().get_entity_by_id(str(request.form['subnet_id']))
-
-    return_data = calculate_network_stats(network)
+    return_data = get_utilization(request.form['subnet_id'], request.form.get('max_age'))
 
     return jsonify(return_data)
 
@@ -148,119 +180,30 @@ def get_network_stat():
 @util.workflow_permission_required('SubnetStatus_page')
 @util.exception_catcher
 def get_block_stat():
-    bam_block = g.user.get_api().get_entity_by_id(str(request.form['subnet_id']))
-
-    return_data = calculate_block_stats(bam_block)
+    return_data = get_utilization(request.form['subnet_id'], request.form.get('max_age'))
 
     return jsonify(return_data)
 
 
-def calculate_block_stats(bam_block):
-    if bam_block.get_type() == 'IP6Block':
-        block_address = bam_block.get_property('prefix')
-        block = ipaddress.ip_network(block_address)
-    else:
-        block_address = bam_block.get_property('CIDR')
-        block = ipaddress.ip_network(block_address)
-    block_data = {}
-    block_data.update({'address_space': block_address})
-    block_data.update({'id': bam_block.get_id()})
-
-    total_block_size = block.num_addresses - 2
-    block_data.update({'total_size': total_block_size})
-    block_data.update({'type': bam_block.get_type()})
-    total_free = total_block_size
-
-    if bam_block.get_type() == 'IP4Block':
-        for network in bam_block.get_ip4_networks():
-            return_data = calculate_network_stats(network)
-            total_free -= return_data['total_allocated']
-            block_data.update({network.get_property('CIDR'): return_data})
-
-        for found_block in bam_block.get_ip4_blocks():
-            return_data = calculate_block_stats(found_block)
-            total_free -= return_data['total_allocated']
-            block_data.update({found_block.get_property('CIDR'): return_data})
-
-        next_address = bam_block.get_next_available_ip4_address()
-        if next_address != '':
-            block_data.update({'next_available_address': next_address})
-        try:
-            next_available = bam_block.get_next_available_ip4_network(256, auto_create=False)
-            block_data.update({'next_available_network': next_available})
-        except APIException as e:
-            # Nothing to do here since we aren't adding anything to the object
-            next_available = ''
-    else:
-        for network in bam_block.get_ip6_networks():
-            return_data = calculate_network_stats(network)
-            total_free -= return_data['total_allocated']
-            block_data.update({network.get_property('prefix'): return_data})
-
-        for found_block in bam_block.get_ip6_blocks():
-            return_data = calculate_block_stats(found_block)
-            total_free -= return_data['total_allocated']
-            block_data.update({found_block.get_property('prefix'): return_data})
-
-    if total_free < total_block_size:
-        block_data.update({'percent_free': round((float(total_free) / float(total_block_size)) * 100, 0)})
-    else:
-        block_data.update({'percent_free': 100})
-
-    block_data.update({'total_free': total_free})
-    block_data.update({'total_allocated': total_block_size - total_free})
-
-    return block_data
+@route(app, '/SubnetStatus/get_trend', methods=['POST'])
+@util.rest_workflow_permission_required('SubnetStatus_page')
+@util.rest_exception_catcher
+def get_trend():
+    # Served from the user's own snapshot history once the user is known to have access to the entity
+    get_accessible_entity(request.form['subnet_id'])
+    days = float(request.form.get('days', 30))
+    trend = snapshot_scheduler.store.trend(g.user.get_username(), request.form['subnet_id'],
+                                           time.time() - days * 86400)
 
+    return jsonify({'subnet_id': request.form['subnet_id'], 'trend': trend})
 
-def calculate_network_stats(bam_network):
-    if bam_network.get_type() == 'IP4Network':
-        network_address = bam_network.get_property('CIDR')
-        network = ipaddress.ip_network(network_address)
-    else:
-        network_address = bam_network.get_property('prefix')
-        network = ipaddress.ip_network(network_address)
-    network_data = {}
-    network_data.update({'address_space': network_address})
-    network_data.update({'id': bam_network.get_id()})
-
-    total_network_size = network.num_addresses - 2
-    network_data.update({'total_size': total_network_size})
-    network_data.update({'type': bam_network.get_type()})
-    total_free = total_network_size
-
-    if bam_network.get_type() == 'IP4Network':
-        for n in bam_network.get_children_of_type('IP4Address'):
-            total_free = total_free - 1
-            if n.get_property('state') == 'GATEWAY':
-                network_data.update({'gateway': n.get_address()})
-
-        for d in bam_network.get_children_of_type('DHCP4Range'):
-            network_data.update({'dhcp_start': d.get_property('start')})
-            network_data.update({'dhcp_end': d.get_property('end')})
-
-        next_address = bam_network.get_next_available_ip4_address()
-        if next_address != '':
-            network_data.update({'next_available_address': next_address})
-    else:
-        for n in bam_network.get_children_of_type('IP6Address'):
-            total_free = total_free - 1
-            if n.get_property('state') == 'GATEWAY':
-                network_data.update({'gateway': n.get_address()})
-
-        for d in bam_network.get_children_of_type('DHCP6Range'):
-            network_data.update({'dhcp_start': d.get_property('start')})
-            network_data.update({'dhcp_end': d.get_property('end')})
 
-    if total_free < total_network_size:
-        network_data.update({'percent_free': round((float(total_free) / float(total_network_size)) * 100, 0)})
-    else:
-        network_data.update({'percent_free': 100})
+def calculate_block_stats(bam_block):
+    return UtilizationEngine(g.user.get_api(), g.user.get_username()).stats(bam_block)
 
-    network_data.update({'total_free': total_free})
-    network_data.update({'total_allocated': total_network_size - total_free})
 
-    return network_data
+def calculate_network_stats(bam_network):
+    return UtilizationEngine(g.user.get_api(), g.user.get_username()).stats(bam_network)
 
 
 def generate_report(json_data):
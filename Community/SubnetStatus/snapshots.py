@@ -0,0 +1,210 @@
+# Copyright 2020 BlueCat Networks. All rights reserved.
+""" SubnetStatus - scheduled utilization snapshots and trend history """
+import ipaddress
+import json
+import os
+import sqlite3
+import threading
+import time
+import traceback
+
+import pytz
+from apscheduler.schedulers.background import BackgroundScheduler
+
+from bluecat import api
+import config.default_config as config
+
+from .utilization import UtilizationEngine
+
+# Every row belongs to the BAM user whose access rights the statistics were computed with
+SCHEMA = [
+    # Latest full statistics tree of every block or network a snapshot was taken of
+    'CREATE TABLE IF NOT EXISTS latest (owner TEXT, root_id INTEGER, taken_at REAL, data TEXT, '
+    'PRIMARY KEY (owner, root_id))',
+    # Where every block and network of those trees can be found, to serve sub-blocks without BAM
+    'CREATE TABLE IF NOT EXISTS entity_index (owner TEXT, entity_id INTEGER, root_id INTEGER, taken_at REAL, '
+    'path TEXT, PRIMARY KEY (owner, entity_id))',
+    # One compact row per block or network and snapshot, for trends
+    'CREATE TABLE IF NOT EXISTS utilization (owner TEXT, entity_id INTEGER, taken_at REAL, address_space TEXT, '
+    'type TEXT, total_size INTEGER, total_allocated INTEGER, total_free INTEGER, percent_free REAL)',
+    'CREATE INDEX IF NOT EXISTS utilization_entity ON utilization (owner, entity_id, taken_at)',
+]
+
+
+def iter_subtree(data, path=()):
+    """Yield (path, data) for a statistics tree and every block and network nested in it"""
+    yield path, data
+    for key, value in data.items():
+        if isinstance(value, dict):
+            for item in iter_subtree(value, path + (key,)):
+                yield item
+
+
+def address_space_size(entity):
+    address_space = entity.get_property('prefix' if '6' in entity.get_type() else 'CIDR')
+    return ipaddress.ip_network(address_space).num_addresses
+
+
+class SnapshotStore(object):
+    """
+    SQLite store of utilization snapshots.
+    The latest tree of each snapshotted root is kept whole, so get_stats can be answered for the
+    root or any block or network below it, while the history only keeps one row of totals per
+    entity and snapshot. Snapshots and history are kept per owner, the BAM user they were computed
+    as, and are only read back for that owner, since another user may not see the same children.
+    """
+
+    def __init__(self, db_file):
+        self.db_file = db_file
+        self._lock = threading.Lock()
+        with self._connect() as connection:
+            for statement in SCHEMA:
+                connection.execute(statement)
+
+    def _connect(self):
+        return sqlite3.connect(self.db_file, timeout=30)
+
+    def store(self, owner, data, taken_at=None):
+        """Record the statistics tree of one block or network computed as owner"""
+        taken_at = taken_at or time.time()
+        root_id = data['id']
+        utilization = []
+        index = []
+        for path, node in iter_subtree(data):
+            utilization.append((owner, node['id'], taken_at, node['address_space'], node['type'], node['total_size'],
+                                node['total_allocated'], node['total_free'], node['percent_free']))
+            index.append((node['id'], root_id, taken_at, json.dumps(path), taken_at))
+        with self._lock, self._connect() as connection:
+            connection.execute('INSERT OR REPLACE INTO latest VALUES (?, ?, ?, ?)',
+                               (owner, root_id, taken_at, json.dumps(data)))
+            connection.executemany('INSERT INTO utilization VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', utilization)
+            # Keep the most recent location of an entity that appears below several roots
+            connection.executemany(
+                'INSERT OR REPLACE INTO entity_index '
+                'SELECT ?, ?, ?, ?, ? WHERE NOT EXISTS '
+                '(SELECT 1 FROM entity_index WHERE owner = ? AND entity_id = ? AND taken_at > ?)',
+                [(owner, entity_id, root, taken, path, owner, entity_id, newer)
+                 for entity_id, root, taken, path, newer in index])
+
+    def latest(self, owner, entity_id, max_age):
+        """
+        Return (taken_at, data) of the entity from a snapshot of owner at most max_age seconds old,
+        or None
+        """
+        entity_id = int(entity_id)
+        with self._connect() as connection:
+            row = connection.execute(
+                'SELECT latest.taken_at, latest.data, entity_index.path FROM entity_index '
+                'JOIN latest ON latest.owner = entity_index.owner AND latest.root_id = entity_index.root_id '
+                'WHERE entity_index.owner = ? AND entity_index.entity_id = ?',
+                (owner, entity_id)).fetchone()
+        if row is None or row[0] < time.time() - max_age:
+            return None
+        data = json.loads(row[1])
+        for key in json.loads(row[2]):
+            data = data.get(key)
+            if not isinstance(data, dict):
+                return None
+        if data.get('id') != entity_id:
+            return None
+        return row[0], data
+
+    def trend(self, owner, entity_id, since, until=None):
+        """Return the utilization history of one block or network recorded for owner between since and until"""
+        until = until or time.time()
+        with self._connect() as connection:
+            rows = connection.execute(
+                'SELECT taken_at, total_size, total_allocated, total_free, percent_free FROM utilization '
+                'WHERE owner = ? AND entity_id = ? AND taken_at BETWEEN ? AND ? ORDER BY taken_at',
+                (owner, int(entity_id), since, until)).fetchall()
+        return [{'taken_at': taken_at, 'total_size': total_size, 'total_allocated': total_allocated,
+                 'total_free': total_free, 'percent_free': percent_free}
+                for taken_at, total_size, total_allocated, total_free, percent_free in rows]
+
+    def prune(self, retention_days):
+        """Drop history older than retention_days"""
+        with self._lock, self._connect() as connection:
+            connection.execute('DELETE FROM utilization WHERE taken_at < ?',
+                               (time.time() - retention_days * 86400,))
+
+
+class SnapshotScheduler(object):
+    """
+    Takes snapshots of the configured blocks and networks in the background.
+    Snapshots run as the BAM user set in config.json, every `interval` seconds, and are recorded
+    for that user. The roots are computed largest first, so the sub-blocks of a root that is also
+    configured on its own are taken from the utilization engine's subtree cache instead of BAM.
+    """
+    _instance = None
+
+    def __init__(self, debug=False):
+        self._debug = debug
+        self._config = {}
+        self._scheduler = None
+        self._job = None
+        self.last_run = None
+        self.last_error = ''
+        self.load()
+        self.store = SnapshotStore(os.path.join(self.module_path(), 'snapshots.db'))
+
+    @classmethod
+    def get_instance(cls, debug=False):
+        if cls._instance is None:
+            cls._instance = cls(debug)
+        return cls._instance
+
+    @staticmethod
+    def module_path():
+        return os.path.dirname(os.path.abspath(str(__file__)))
+
+    def load(self):
+        with open(os.path.join(self.module_path(), 'config.json')) as config_file:
+            self._config = json.load(config_file)
+
+    def get_value(self, key):
+        return self._config['snapshot'].get(key)
+
+    def take_snapshots(self):
+        conn = api.API(config.api_url[0][1])
+        try:
+            conn.login(self.get_value('user'), self.get_value('password'))
+            owner = self.get_value('user')
+            engine = UtilizationEngine(conn, owner)
+            roots = [conn.get_entity_by_id(entity_id) for entity_id in self.get_value('subnet_ids')]
+            roots.sort(key=address_space_size, reverse=True)
+            for entity in roots:
+                self.store.store(owner, engine.stats(entity))
+            self.store.prune(self.get_value('retention_days'))
+            self.last_error = ''
+        except Exception as e:
+            self.last_error = str(e)
+            if self._debug:
+                traceback.print_exc()
+        finally:
+            self.last_run = time.time()
+            try:
+                conn.logout()
+            except Exception:
+                pass
+
+    def register_job(self):
+        succeed = False
+        try:
+            interval = self.get_value('interval')
+            if self._scheduler is None:
+                self._scheduler = BackgroundScheduler(daemon=True, timezone=pytz.utc)
+                self._scheduler.start()
+
+            if self._job is not None:
+                self._job.remove()
+                self._job = None
+
+            if interval is not None and 0 < interval and self.get_value('subnet_ids'):
+                self._job = self._scheduler.add_job(self.take_snapshots, 'interval', seconds=interval,
+                                                    max_instances=1, coalesce=True)
+                succeed = True
+
+        except Exception as e:
+            if self._debug:
+                print('DEBUG: Exception <%s>' % str(e))
+        return succeed
@@ -0,0 +1,279 @@
+# Copyright 2020 BlueCat Networks. All rights reserved.
+""" SubnetStatus - bulk fetched, bottom-up aggregated block and network utilization """
+from concurrent.futures import ThreadPoolExecutor
+import ipaddress
+import threading
+import time
+
+from bluecat.util import has_response
+
+PAGE_SIZE = 1000
+MAX_WORKERS = 8
+# Seconds a computed subtree is reused by later requests of the same user for it or for a block containing it
+CACHE_TTL = 60
+# Size of the network reported as next_available_network for IPv4 blocks
+NEXT_NETWORK_SIZE = 256
+
+IP4 = {
+    'block': 'IP4Block', 'network': 'IP4Network', 'address': 'IP4Address', 'range': 'DHCP4Range',
+    'address_space': 'CIDR',
+}
+IP6 = {
+    'block': 'IP6Block', 'network': 'IP6Network', 'address': 'IP6Address', 'range': 'DHCP6Range',
+    'address_space': 'prefix',
+}
+
+
+def parse_properties(properties):
+    """Split a BAM 'key=value|key=value|' property string"""
+    result = {}
+    for prop in (properties or '').split('|'):
+        if '=' in prop:
+            key, value = prop.split('=', 1)
+            result[key] = value
+    return result
+
+
+def next_free_address(network, allocated, ranges):
+    """
+    Return the lowest host address of network that is neither allocated nor inside a DHCP range,
+    '' if there is none. allocated is a set of integer addresses, ranges a list of (start, end).
+    """
+    first = int(network.network_address)
+    last = int(network.broadcast_address)
+    if 2 < network.num_addresses:
+        first += 1
+        last -= 1
+    taken = sorted([(address, address) for address in allocated] + list(ranges))
+    candidate = first
+    for start, end in taken:
+        if candidate < start:
+            break
+        candidate = max(candidate, end + 1)
+    if candidate > last:
+        return ''
+    return str(ipaddress.ip_address(candidate))
+
+
+def clone_client(shared):
+    """Return a clone of a suds client for one thread, suds clients are not thread safe"""
+    try:
+        # A cloned suds client starts with an empty cookie jar, carry the BAM session over
+        client = shared.clone()
+        for cookie in shared.options.transport.cookiejar:
+            client.options.transport.cookiejar.set_cookie(cookie)
+    except AttributeError:
+        return shared
+    return client
+
+
+class SubtreeCache(object):
+    """Computed block and network results by (owner, entity ID), each kept for ttl seconds"""
+
+    def __init__(self, ttl=CACHE_TTL):
+        self.ttl = ttl
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, owner, entity_id):
+        key = (owner, entity_id)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.time():
+                del self._entries[key]
+                return None
+            return entry[1]
+
+    def put(self, owner, entity_id, data):
+        with self._lock:
+            self._entries[(owner, entity_id)] = (time.time() + self.ttl, data)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+subtree_cache = SubtreeCache()
+
+
+class UtilizationEngine(object):
+    """
+    Computes the utilization of a block or network with as few BAM calls as possible.
+    The tree below the requested entity is fetched one level at a time, every getEntities call of a
+    level running concurrently and paging PAGE_SIZE entities at a time. Allocated and free counts
+    are then aggregated bottom-up in a single pass, and the next available address of each network
+    is derived from its addresses and DHCP ranges instead of being asked for per network.
+    Results are memoised in subtree_cache under the owner, the name of the BAM user the api is logged
+    in as, so overlapping requests of one user reuse each other's subtrees but never another user's.
+    """
+
+    def __init__(self, api, owner, max_workers=MAX_WORKERS, page_size=PAGE_SIZE, cache=subtree_cache):
+        self._api = api
+        self._owner = owner
+        self._max_workers = max_workers
+        self._page_size = page_size
+        self._cache = cache
+        self._local = threading.local()
+        self.calls = 0
+        self._calls_lock = threading.Lock()
+
+    def _client(self):
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self._local.client = clone_client(self._api._api_client)
+        return client
+
+    def _count_call(self):
+        with self._calls_lock:
+            self.calls += 1
+
+    def _fetch(self, parent_id, entity_type):
+        """Return (id, type, properties) of every child of parent_id of the given type"""
+        client = self._client()
+        children = []
+        start = 0
+        while True:
+            self._count_call()
+            page = client.service.getEntities(parent_id, entity_type, start, self._page_size)
+            if not has_response(page):
+                break
+            children.extend((item.id, item.type, parse_properties(item.properties)) for item in page.item)
+            if len(page.item) < self._page_size:
+                break
+            start += self._page_size
+        return children
+
+    def _fetch_next_address(self, block_id):
+        self._count_call()
+        try:
+            return self._client().service.getNextAvailableIP4Address(block_id) or ''
+        except Exception:
+            return ''
+
+    def _fetch_next_network(self, block_id):
+        self._count_call()
+        try:
+            return self._client().service.getNextAvailableIP4Network(block_id, NEXT_NETWORK_SIZE, False, False)
+        except Exception:
+            return None
+
+    def stats(self, bam_entity):
+        """Return the block or network statistics of a BAM entity in the calculate_*_stats format"""
+        entity_type = bam_entity.get_type()
+        family = IP6 if '6' in entity_type else IP4
+        root = {
+            'id': bam_entity.get_id(),
+            'type': entity_type,
+            'address_space': bam_entity.get_property(family['address_space']),
+            'family': family,
+        }
+        self._expand(root)
+        return self._aggregate(root)
+
+    def _child_nodes(self, children, family):
+        return [{'id': entity_id, 'type': entity_type, 'address_space': properties.get(family['address_space']),
+                 'family': family} for entity_id, entity_type, properties in children]
+
+    def _expand(self, root):
+        """Fetch the tree below root breadth first, one level of concurrent calls at a time"""
+        with ThreadPoolExecutor(max_workers=self._max_workers) as pool:
+            frontier = [root]
+            while frontier:
+                pending = []
+                for node in frontier:
+                    node['cached'] = self._cache.get(self._owner, node['id'])
+                    if node['cached'] is not None:
+                        continue
+                    family = node['family']
+                    if node['type'] == family['network']:
+                        pending.append((node, 'addresses', pool.submit(self._fetch, node['id'], family['address'])))
+                        pending.append((node, 'ranges', pool.submit(self._fetch, node['id'], family['range'])))
+                    else:
+                        pending.append((node, 'networks', pool.submit(self._fetch, node['id'], family['network'])))
+                        pending.append((node, 'blocks', pool.submit(self._fetch, node['id'], family['block'])))
+                        if family is IP4:
+                            pending.append((node, 'next_address', pool.submit(self._fetch_next_address, node['id'])))
+                            pending.append((node, 'next_network', pool.submit(self._fetch_next_network, node['id'])))
+                frontier = []
+                for node, key, future in pending:
+                    result = future.result()
+                    if key in ('networks', 'blocks'):
+                        result = self._child_nodes(result, node['family'])
+                        frontier.extend(result)
+                    node[key] = result
+
+    def _aggregate(self, node):
+        if node['cached'] is not None:
+            return node['cached']
+        if node['type'] == node['family']['network']:
+            data = self._network_stats(node)
+        else:
+            data = self._block_stats(node)
+        self._cache.put(self._owner, node['id'], data)
+        return data
+
+    def _network_stats(self, node):
+        network = ipaddress.ip_network(node['address_space'])
+        network_data = {}
+        network_data.update({'address_space': node['address_space']})
+        network_data.update({'id': node['id']})
+
+        total_network_size = network.num_addresses - 2
+        network_data.update({'total_size': total_network_size})
+        network_data.update({'type': node['type']})
+
+        allocated = set()
+        for entity_id, entity_type, properties in node['addresses']:
+            allocated.add(int(ipaddress.ip_address(properties['address'])))
+            if properties.get('state') == 'GATEWAY':
+                network_data.update({'gateway': properties['address']})
+        total_free = total_network_size - len(node['addresses'])
+
+        ranges = []
+        for entity_id, entity_type, properties in node['ranges']:
+            network_data.update({'dhcp_start': properties.get('start')})
+            network_data.update({'dhcp_end': properties.get('end')})
+            ranges.append((int(ipaddress.ip_address(properties['start'])), int(ipaddress.ip_address(properties['end']))))
+
+        if node['family'] is IP4:
+            next_address = next_free_address(network, allocated, ranges)
+            if next_address != '':
+                network_data.update({'next_available_address': next_address})
+
+        return self._finish(network_data, total_network_size, total_free)
+
+    def _block_stats(self, node):
+        block = ipaddress.ip_network(node['address_space'])
+        block_data = {}
+        block_data.update({'address_space': node['address_space']})
+        block_data.update({'id': node['id']})
+
+        total_block_size = block.num_addresses - 2
+        block_data.update({'total_size': total_block_size})
+        block_data.update({'type': node['type']})
+        total_free = total_block_size
+
+        for child in node['networks'] + node['blocks']:
+            return_data = self._aggregate(child)
+            total_free -= return_data['total_allocated']
+            block_data.update({child['address_space']: return_data})
+
+        if node['family'] is IP4:
+            if node['next_address'] != '':
+                block_data.update({'next_available_address': node['next_address']})
+            if node['next_network']:
+                block_data.update({'next_available_network': node['next_network']})
+
+        return self._finish(block_data, total_block_size, total_free)
+
+    def _finish(self, data, total_size, total_free):
+        if total_free < total_size:
+            data.update({'percent_free': round((float(total_free) / float(total_size)) * 100, 0)})
+        else:
+            data.update({'percent_free': 100})
+
+        data.update({'total_free': total_free})
+        data.update({'total_allocated': total_size - total_free})
+        return data
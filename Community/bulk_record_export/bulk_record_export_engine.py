@@ -0,0 +1,107 @@
+# Copyright 2020 BlueCat Networks. All rights reserved.
+"""
+Paged address and host record walk of a network
+"""
+import copy
+import ipaddress
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from bluecat.util import has_response
+
+PAGE_SIZE = 1000
+SESSIONS = 4
+
+
+def clone_client(shared):
+    """Return a clone of a suds client for one thread, suds clients are not thread safe"""
+    try:
+        # A cloned suds client starts with an empty cookie jar, carry the BAM session over
+        client = shared.clone()
+        for cookie in shared.options.transport.cookiejar:
+            client.options.transport.cookiejar.set_cookie(cookie)
+    except AttributeError:
+        return shared
+    return client
+
+
+class AddressRecordExporter(object):
+    """
+    Walks every IP4 address of a network PAGE_SIZE addresses at a time and yields one row per
+    host or PTR record linked to them, in address page order.
+    Up to `sessions` address pages are fetched at once and the records of each page are resolved
+    with one get_host_records_by_ip call as soon as the page arrives. Each worker thread does both
+    through its own copy of the user's API, whose SOAP client is a clone of the user's, and its own
+    copy of the configuration read through it.
+    No more than `lookahead` pages are held at once, so memory does not grow with the network.
+    """
+
+    def __init__(self, api, configuration, sessions=SESSIONS, lookahead=None, page_size=PAGE_SIZE):
+        self._api = api
+        self._configuration = configuration
+        self._sessions = max(1, sessions)
+        self._lookahead = lookahead or self._sessions * 2
+        self._page_size = page_size
+        self._local = threading.local()
+
+    def _session(self):
+        """Return the (api, configuration) of the current thread"""
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            api, configuration = self._api, self._configuration
+            client = clone_client(api._api_client)
+            if client is not api._api_client:
+                api = copy.copy(api)
+                api._api_client = client
+                configuration = api.get_entity_by_id(configuration.get_id())
+            session = self._local.session = (api, configuration)
+        return session
+
+    def _fetch_page(self, network_id, start):
+        """Return (number of addresses, rows) of the address page starting at start"""
+        api, configuration = self._session()
+        page = api._api_client.service.getEntities(network_id, 'IP4Address', start, self._page_size)
+        if not has_response(page):
+            return 0, []
+        addresses = [api.instantiate_entity(item) for item in page.item]
+        records = configuration.get_host_records_by_ip(addresses)
+        rows = []
+        for record in records:
+            ipinfo = record[0]
+            address = ipinfo.get_property('address')
+            addstate = ipinfo.get_property('state')
+            for dns in record[1]:
+                rows.append([address, addstate, dns.get_property('absoluteName'), dns.name,
+                             dns.get_property('reverseRecord')])
+        return len(page.item), rows
+
+    def iter_rows(self, network):
+        """Yield [address, state, absolute name, host name, PTR record] for every record in the network"""
+        network_id = network.get_id()
+        size = ipaddress.ip_network(network.get_property('CIDR')).num_addresses
+        starts = iter(range(0, size, self._page_size))
+        pending = deque()
+        pool = ThreadPoolExecutor(max_workers=self._sessions)
+
+        def fill():
+            while len(pending) < self._lookahead:
+                start = next(starts, None)
+                if start is None:
+                    return
+                pending.append(pool.submit(self._fetch_page, network_id, start))
+
+        try:
+            fill()
+            while pending:
+                count, rows = pending.popleft().result()
+                for row in rows:
+                    yield row
+                # A short page is the last one, the pages fetched ahead of it are empty
+                if count < self._page_size:
+                    break
+                fill()
+        finally:
+            for future in pending:
+                future.cancel()
+            pool.shutdown(wait=True)
@@ -2,9 +2,16 @@
 """
 Component logic
 """
+import csv
+import io
+import itertools
+import json
+
 from flask import g
 from flask import jsonify
 from flask import request
+from flask import Response
+from flask import stream_with_context
 
 from main_app import app
 from bluecat import entity
@@ -14,18 +21,26 @@ from bluecat.util import rest_workflow_permission_required
 from bluecat.server_endpoints import empty_decorator
 from bluecat.server_endpoints import get_result_template
 import config.default_config as config
+from .bulk_record_export_engine import AddressRecordExporter
+
+CSV_CHUNK_ROWS = 1000
+
+COLUMNS = [
+    {'title': 'IP Address'},
+    {'title': 'State'},
+    {'title': 'Absolute Name'},
+    {'title': 'Host Name'},
+    {'title': 'PTR Record'},
+]
+# Stands in for the table rows while the result around them is serialized
+ROWS_MARKER = '__rows__'
+
 
 def raw_table_data(*args, **kwargs):
     """Returns table formatted data for display in the TableField component"""
     # pylint: disable=unused-argument
     return {
-        "columns": [
-            {"title": "IP Address"},
-            {'title': 'State'},
-            {'title': 'Absolute Name'},
-            {'title': 'Host Name'},
-            {'title': 'PTR Record'},
-        ],
+        "columns": COLUMNS,
         "data": [
 
         ]
@@ -33,11 +48,7 @@ def raw_table_data(*args, **kwargs):
 
 def raw_entities_to_table_data(records):
     # pylint: disable=redefined-outer-name
-    data = {'columns': [{'title': 'IP Address'},
-                        {'title': 'State'},
-                        {'title': 'Absolute Name'},
-                        {'title': 'Host Name'},
-                        {'title': 'PTR Record'},],
+    data = {'columns': COLUMNS,
             'data': []}
 
     # Iterate through each record
@@ -54,6 +65,38 @@ def raw_entities_to_table_data(records):
             data['data'].append([address , addstate , absname , dnsname , reverse])
     return data
 
+def get_network_rows(ip4_network):
+    """Return the rows of every host record in the network, read page by page while they are consumed"""
+    configuration = g.user.get_api().get_configuration(config.default_configuration)
+    networks = configuration.get_ip4_networks_by_hint(ip4_network.split('/', 1)[0])
+    network = networks[0]
+    print("Exporting IP Addresses of Network {}".format(network.get_property('CIDR')))
+    exporter = AddressRecordExporter(g.user.get_api(), configuration)
+    return exporter.iter_rows(network)
+
+def generate_table_json(result, rows):
+    """Stream result as JSON with the rows written in place of ROWS_MARKER"""
+    prefix, suffix = json.dumps(result).split(json.dumps(ROWS_MARKER), 1)
+    yield prefix + '['
+    separator = ''
+    for row in rows:
+        yield separator + json.dumps(row)
+        separator = ','
+    yield ']' + suffix
+
+def generate_csv(rows):
+    """Stream the rows as CSV, one chunk per CSV_CHUNK_ROWS rows"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')
+    writer.writerow([column['title'] for column in COLUMNS])
+    for index, row in enumerate(rows, 1):
+        writer.writerow(row)
+        if index % CSV_CHUNK_ROWS == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
 def find_objects_by_type_endpoint(workflow_name, element_id, permissions, result_decorator=None):
     """Endpoint for retrieving the selected objects"""
     # pylint: disable=unused-argument
@@ -75,35 +118,21 @@ def find_objects_by_type_endpoint(workflow_name, element_id, permissions, result
         """Retrieve a list of properties for the table"""
         # pylint: disable=broad-except
         try:
-            ip4_network = request.form['ip4_network']
-            configuration = g.user.get_api().get_configuration(config.default_configuration)
-            networks = configuration.get_ip4_networks_by_hint(ip4_network.split('/', 1)[0])
-            net_id = networks[0].get_id()
-            network = g.user.get_api().get_entity_by_id(net_id)
-            ip4_addresses = g.user.get_api()._api_client.service.getEntities(network.get_id(), 'IP4Address', 0, 100)
-
-            new_ip4_address = []
-            for ip4_address in ip4_addresses.item:
-                ip4_address = g.user.get_api().instantiate_entity(ip4_address)
-                new_ip4_address.append(ip4_address)
-
-            print("Found {} IP Addresses with Network {}".format(len(new_ip4_address), network.get_property('CIDR')))
-
-            # Calling the new API
-            records = configuration.get_host_records_by_ip(new_ip4_address)
-
-            # Parse response object into table data
-            data = raw_entities_to_table_data(records)
+            rows = get_network_rows(request.form['ip4_network'])
 
             # If no entities were found return with failure state and message
+            first = next(rows, None)
             result = get_result_template()
-            if len(data['data']) == 0:
+            if first is None:
                 result['status'] = 'FAIL'
                 result['message'] = 'No records  were found.'
-            else:
-                result['status'] = 'SUCCESS'
-            result['data'] = {"table_field": data}
-            return jsonify(result_decorator(result))
+                result['data'] = {"table_field": raw_table_data()}
+                return jsonify(result_decorator(result))
+
+            result['status'] = 'SUCCESS'
+            result['data'] = {"table_field": {'columns': COLUMNS, 'data': ROWS_MARKER}}
+            body = generate_table_json(result_decorator(result), itertools.chain([first], rows))
+            return Response(stream_with_context(body), mimetype='application/json')
 
         except Exception as e:
             result = get_result_template()
@@ -113,52 +142,6 @@ def find_objects_by_type_endpoint(workflow_name, element_id, permissions, result
 
     return endpoint
 
-def find_objects_for_report(result_decorator=None):
-    """Retrieve a list of properties for the table"""
-    # pylint: disable=broad-except
-    try:
-        ip4_network = request.form['ip4_network']
-        configuration = g.user.get_api().get_configuration(config.default_configuration)
-        networks = configuration.get_ip4_networks_by_hint(ip4_network.split('/', 1)[0])
-        net_id = networks[0].get_id()
-        network = g.user.get_api().get_entity_by_id(net_id)
-        ip4_addresses = g.user.get_api()._api_client.service.getEntities(network.get_id(), 'IP4Address', 0, 100)
-
-        new_ip4_address = []
-        for ip4_address in ip4_addresses.item:
-            ip4_address = g.user.get_api().instantiate_entity(ip4_address)
-            new_ip4_address.append(ip4_address)
-
-        print("Found {} IP Addresses with Network {}".format(len(new_ip4_address), network.get_property('CIDR')))
-
-        # Calling the new API
-        records = configuration.get_host_records_by_ip(new_ip4_address)
-
-        data = []
-
-        for record in records:
-            ipinfo = record[0]
-            address = ipinfo.get_property('address')
-            addstate = ipinfo.get_property('state')
-
-            dnsinfo = record[1]
-            for dns in dnsinfo:
-                absname = dns.get_property('absoluteName')
-                dnsname = dns.name
-                reverse = dns.get_property('reverseRecord')
-                data.append([address, addstate, absname, dnsname, reverse])
-
-        return data
-
-        # If no entities were found return with failure state and message
-        if len(data) == 0:
-            data['status'] = 'FAIL'
-            data['message'] = 'No records  were found.'
-        else:
-            data['status'] = 'SUCCESS'
-        return data
-
-    except Exception as e:
-        data['status'] = 'FAIL'
-        data['message'] = str(e)
-        return data
\ No newline at end of file
+def find_objects_for_report(ip4_network):
+    """Return the CSV report of every host record in the network as a stream of text chunks"""
+    return generate_csv(get_network_rows(ip4_network))
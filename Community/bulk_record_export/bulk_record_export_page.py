@@ -1,16 +1,20 @@
 # Copyright 2020 BlueCat Networks. All rights reserved.
 
 # Various Flask framework items.
+import datetime
 import os
 import sys
 
 
-from flask import url_for, redirect, render_template, flash, g, request, make_response
+from flask import url_for, redirect, render_template, flash, g, request, make_response, Response, stream_with_context
 
 from bluecat import route, util
 import config.default_config as config
 from main_app import app
 from .bulk_record_export_form import GenericFormTemplate
+from .bulk_record_export_logic import find_objects_for_report
+
+CSV_FILE_NAME = 'bulk_record_export_{:%Y%m%d%H%M%S}.csv'
 
 def module_path():
     encoding = sys.getfilesystemencoding()
@@ -52,4 +56,14 @@ def bulk_record_export_bulk_record_export_page_form():
         )
 
 
-
+@route(app, '/bulk_record_export/export_csv')
+@util.workflow_permission_required('bulk_record_export_page')
+@util.exception_catcher
+def bulk_record_export_export_csv():
+    filename = CSV_FILE_NAME.format(datetime.datetime.now())
+    report = find_objects_for_report(request.args['ip4_network'])
+    return Response(
+        stream_with_context(report),
+        mimetype='text/csv',
+        headers={'Content-Disposition': 'attachment; filename=%s' % filename},
+    )
@@ -25,36 +25,27 @@ import sys
 from flask import url_for, redirect, render_template, flash, g, request, jsonify
 
 from bluecat import route, util, user_group
+from bluecat.entity import Entity
+from bluecat.util import map_to_properties
 import config.default_config as config
 from main_app import app
 
 from .bulk_register_group_form import get_resource_text
 from .bulk_register_group_form import GenericFormTemplate
+from .bulk_upsert import BulkUpserter, wanted_properties, summarize, FAILED
+
+def group_changes(line):
+    return None, wanted_properties(DivisionCode=line[1], Comments=line[2])
+
+def add_group(client, line):
+    properties = {'isAdministrator': 'false'}
+    properties.update(wanted_properties(DivisionCode=line[1], Comments=line[2]))
+    return client.service.addUserGroup(line[0], map_to_properties(properties))
 
 def register_group(api, group_list):
-    for line in group_list:
-        group_name = line[0]
-        division_code = line[1]
-        comments = line[2]
-        
-        try:
-            group = api.get_group(group_name)
-            #print('Found group(%s) id(%d)' % (group_name, group.get_id()))
-            if 0 < len(division_code):
-                group.set_property('DivisionCode', division_code)
-            if 0 < len(comments):
-                group.set_property('Comments', comments)
-            group.update()
-                        
-        except Exception as e:
-            print('Exception %s' % util.safe_str(e))
-            properties = 'isAdministrator=false'
-            if 0 < len(division_code):
-                properties += '|DivisionCode=' + division_code
-            if 0 < len(comments):
-                properties += '|Comments=' + comments
-            #print('Adding group %s' % group_name)
-            group = api.add_group(group_name, properties)
+    upserter = BulkUpserter(api)
+    existing = upserter.scan(0, Entity.UserGroup)
+    return upserter.run(group_list, lambda line: line[0], existing, group_changes, add_group)
 
 
 # The workflow name must be the first part of any endpoints defined in this file.
@@ -78,9 +69,15 @@ def bulk_register_group_bulk_register_group_page():
 @util.exception_catcher
 def bulk_register_group_bulk_register_group_page_submit_bulk_group_list():
     group_list = request.get_json()  
-    register_group(g.user.get_api(), group_list)
+    report = register_group(g.user.get_api(), group_list)
+    for entry in report:
+        if entry['action'] == FAILED:
+            g.user.logger.error('Failed to register group %s: %s' % (entry['key'], entry['error']))
 
     text=get_resource_text()
-    g.user.logger.info('SUCCESS')
-    flash(text['success'], 'succeed')
-    return jsonify('', 200)
+    summary = summarize(report)
+    if summary[FAILED] == 0:
+        g.user.logger.info('SUCCESS')
+        flash(text['success'], 'succeed')
+    flash(text['result'].format(**summary), 'succeed' if summary[FAILED] == 0 else 'failed')
+    return jsonify(report)
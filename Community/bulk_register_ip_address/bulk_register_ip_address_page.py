@@ -19,47 +19,65 @@
 # Description: Bulk Register IP Address Page
 
 # Various Flask framework items.
+import ipaddress
 import os
 import sys
 
 from flask import url_for, redirect, render_template, flash, g, request, jsonify
 
 from bluecat import route, util
+from bluecat.entity import Entity
+from bluecat.util import has_response, properties_to_map, map_to_properties
 import config.default_config as config
 from main_app import app
 
 from .bulk_register_ip_address_form import get_resource_text
 from .bulk_register_ip_address_form import GenericFormTemplate
+from .bulk_upsert import BulkUpserter, wanted_properties, summarize, FAILED
 
 def get_configuration(api, config_name):
     configuration = api.get_configuration(config_name)
     return configuration
 
+def address_key(item):
+    return properties_to_map(item.properties)['address']
+
+def scan_ip4_addresses(upserter, configuration_id, addresses):
+    """
+    Return {address: SOAP item} of the assigned addresses in the networks holding addresses.
+    Each network is read once with a paged scan, whatever the number of rows in it.
+    """
+    existing = {}
+    networks = []
+    for address in addresses:
+        try:
+            ip = ipaddress.ip_address(address)
+        except ValueError:
+            # Left to fail on its own row
+            continue
+        if any(ip in network for network in networks):
+            continue
+        network = upserter.client().service.getIPRangedByIP(configuration_id, Entity.IP4Network, address)
+        if not has_response(network) or network.id == 0:
+            continue
+        networks.append(ipaddress.ip_network(properties_to_map(network.properties)['CIDR']))
+        upserter.scan(network.id, Entity.IP4Address, address_key, existing)
+    return existing
+
+def ip_address_changes(line):
+    return line[1] or None, wanted_properties(macAddress=line[2], Comments=line[3])
+
 def register_by_api(api, ip_address_list):
     configuration = get_configuration(api, config.default_configuration)
-    for line in ip_address_list:
-        address = line[0]
-        name = line[1]
-        mac_address = line[2]
-        comments = line[3]
-        
-        try:
-            ip_address = configuration.get_ip4_address(address)
-            if 0 < len(name):
-                ip_address.set_name(name)
-            if 0 < len(mac_address):
-                ip_address.set_property('macAddress', mac_address)
-            if 0 < len(comments):
-                ip_address.set_property('Comments', comments)
-            ip_address.update()
-                
-        except Exception as e:
-            properties = ''
-            if 0 < len(name):
-                properties = 'name=' + name
-            if 0 < len(comments):
-                properties += '|Comments=' + comments
-            ip_address = configuration.assign_ip4_address(address, mac_address, '', 'MAKE_STATIC', properties)
+    upserter = BulkUpserter(api)
+    existing = scan_ip4_addresses(upserter, configuration.get_id(), [line[0] for line in ip_address_list])
+
+    def assign_ip_address(client, line):
+        properties = wanted_properties(name=line[1], Comments=line[3])
+        return client.service.assignIP4Address(configuration.get_id(), line[0], line[2], '', 'MAKE_STATIC',
+                                               map_to_properties(properties))
+
+    return upserter.run(ip_address_list, lambda line: line[0], existing, ip_address_changes, assign_ip_address)
 
 # The workflow name must be the first part of any endpoints defined in this file.
 # If you break this rule, you will trip up on other people's endpoint names and
@@ -81,9 +99,15 @@ def bulk_register_ip_address_bulk_register_ip_address_page():
 @util.exception_catcher
 def bulk_register_ip_address_bulk_register_ip_address_page_submit_bulk_ip_address_list():
     ip_address_list = request.get_json()  
-    register_by_api(g.user.get_api(), ip_address_list)
+    report = register_by_api(g.user.get_api(), ip_address_list)
+    for entry in report:
+        if entry['action'] == FAILED:
+            g.user.logger.error('Failed to register IP address %s: %s' % (entry['key'], entry['error']))
 
     text=get_resource_text()
-    g.user.logger.info('SUCCESS')
-    flash(text['success'], 'succeed')
-    return jsonify('', 200)
+    summary = summarize(report)
+    if summary[FAILED] == 0:
+        g.user.logger.info('SUCCESS')
+        flash(text['success'], 'succeed')
+    flash(text['result'].format(**summary), 'succeed' if summary[FAILED] == 0 else 'failed')
+    return jsonify(report)
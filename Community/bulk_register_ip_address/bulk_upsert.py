@@ -0,0 +1,170 @@
+# Copyright 2020 BlueCat Networks (USA) Inc. and its affiliates
+# -*- coding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# By: BlueCat Networks
+# Date: 2020-06-01
+# Gateway Version: 18.10.2
+# Description: Bulk create or update of BAM objects, the same file in each bulk_register workflow
+# The copies must stay identical, a change made to one has to be made to all four
+#
+# Usage:
+#
+#     from .bulk_upsert import BulkUpserter
+#
+#     upserter = BulkUpserter(g.user.get_api())
+#     existing = upserter.scan(0, 'UserGroup')
+#     report = upserter.run(rows, lambda row: row[0], existing, changes, create)
+
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from bluecat.util import has_response, properties_to_map, map_to_properties, safe_str
+
+PAGE_SIZE = 1000
+# Writes sent to BAM at once, each on its own copy of the user's SOAP client
+SESSIONS = 8
+
+CREATED = 'created'
+UPDATED = 'updated'
+UNCHANGED = 'unchanged'
+FAILED = 'failed'
+
+
+def wanted_properties(**properties):
+    """Return the properties a row asks for, leaving out empty values like the row by row code did"""
+    return dict((name, value) for name, value in properties.items() if value)
+
+
+def clone_client(shared):
+    """Return a clone of a suds client for one thread, suds clients are not thread safe"""
+    try:
+        # A cloned suds client starts with an empty cookie jar, carry the BAM session over
+        client = shared.clone()
+        for cookie in shared.options.transport.cookiejar:
+            client.options.transport.cookiejar.set_cookie(cookie)
+    except AttributeError:
+        return shared
+    return client
+
+
+class BulkUpserter(object):
+    """
+    Creates or updates one BAM object per row.
+    The objects that already exist are read up front with paged getEntities scans, so rows are
+    sorted into creates, updates and unchanged rows without a lookup per row or an exception as
+    the not found signal. An update only sends the name and properties that differ from what
+    BAM holds, and rows that would change nothing are not written at all. The remaining writes
+    run on `sessions` threads, rows sharing a key one after another in row order.
+    """
+
+    def __init__(self, api, sessions=SESSIONS, page_size=PAGE_SIZE):
+        self._api = api
+        self._sessions = max(1, sessions)
+        self._page_size = page_size
+        self._local = threading.local()
+
+    def client(self):
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self._local.client = clone_client(self._api._api_client)
+        return client
+
+    def iter_children(self, parent_id, entity_type):
+        start = 0
+        while True:
+            page = self.client().service.getEntities(parent_id, entity_type, start, self._page_size)
+            if not has_response(page):
+                return
+            for item in page.item:
+                yield item
+            if len(page.item) < self._page_size:
+                return
+            start += self._page_size
+
+    def scan(self, parent_id, entity_type, key=None, existing=None):
+        """
+        Return {key: SOAP item} of the children of parent_id of entity_type, added to existing if given.
+        key(item) defaults to the item name.
+        """
+        existing = {} if existing is None else existing
+        for item in self.iter_children(parent_id, entity_type):
+            existing[key(item) if key else item.name] = item
+        return existing
+
+    def run(self, rows, key, existing, changes, create, extra=None):
+        """
+        Create or update the object of every row and return one report entry per row, in row order.
+
+        :param key: key(row) of the object in existing.
+        :param existing: {key: SOAP item} of the objects that already exist, see scan.
+        :param changes: changes(row) returning (name, properties) wanted for an existing object, name None to keep it.
+        :param create: create(client, row) adding the object and returning its ID.
+        :param extra: extra(client, item, row) for writes an existing object needs besides its properties,
+            returning True if it made any.
+        :return: List of {'row', 'key', 'action', 'error'}, action one of created, updated, unchanged or failed.
+        """
+        keys = OrderedDict()
+        for index, row in enumerate(rows):
+            keys.setdefault(key(row), []).append(index)
+        report = [None] * len(rows)
+
+        def apply(row_key, indexes):
+            item = existing.get(row_key)
+            for position, index in enumerate(indexes):
+                row = rows[index]
+                error = ''
+                try:
+                    if item is None:
+                        entity_id = create(self.client(), row)
+                        action = CREATED
+                        if position + 1 < len(indexes):
+                            item = self.client().service.getEntityById(entity_id)
+                    else:
+                        action = self._update(item, row, changes, extra)
+                # pylint: disable=broad-except
+                except Exception as e:
+                    action = FAILED
+                    error = safe_str(e)
+                report[index] = {'row': index, 'key': row_key, 'action': action, 'error': error}
+
+        with ThreadPoolExecutor(max_workers=self._sessions) as pool:
+            for future in [pool.submit(apply, row_key, indexes) for row_key, indexes in keys.items()]:
+                future.result()
+        return report
+
+    def _update(self, item, row, changes, extra):
+        name, properties = changes(row)
+        current = properties_to_map(item.properties or '')
+        changed = dict((prop, value) for prop, value in properties.items() if current.get(prop, '') != value)
+        action = UNCHANGED
+        if changed or (name and name != item.name):
+            current.update(changed)
+            item.properties = map_to_properties(current)
+            if name:
+                item.name = name
+            self.client().service.update(item)
+            action = UPDATED
+        if extra is not None and extra(self.client(), item, row):
+            action = UPDATED
+        return action
+
+
+def summarize(report):
+    """Return the number of rows per action of a report"""
+    summary = OrderedDict((action, 0) for action in (CREATED, UPDATED, UNCHANGED, FAILED))
+    for entry in report:
+        summary[entry['action']] += 1
+    return summary
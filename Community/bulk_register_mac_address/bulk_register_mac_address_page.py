@@ -26,33 +26,23 @@ import json
 from flask import request, url_for, redirect, render_template, flash, jsonify, g
 
 from bluecat import route, util
-import config.default_config as config
 from main_app import app
 from .bulk_register_mac_address_form import GenericFormTemplate
 
 from .bulk_register_mac_address_form import module_path, get_resource_text
-from .migration import register_mac_address, construct_xml, store_xml, migrate_xml
+from .migration import register_mac_addresses, migrate_mac_addresses
+from .bulk_upsert import summarize, FAILED
 
 def get_configuration(api, config_name):
     configuration = api.get_configuration(config_name)
     return configuration
 
 def register_by_xml(api, workflow_dir, mac_address_list):
-    dom = construct_xml(workflow_dir, mac_address_list)
-    store_xml(workflow_dir, dom)
-    migrate_xml(api, workflow_dir)
-    dom.unlink()
+    migrate_mac_addresses(api, workflow_dir, mac_address_list)
 
 def register_by_api(api, mac_address_list):
-    configuration = get_configuration(api, config.default_configuration)
-    for line in mac_address_list:
-        print(line)
-        asset_code = str(line[0])
-        address = str(line[1])
-        employee_code = str(line[2])
-        update_date = str(line[3])
-        register_mac_address(configuration, address, asset_code, employee_code, update_date)
-        
+    return register_mac_addresses(api, mac_address_list)
+
 
 # The workflow name must be the first part of any endpoints defined in this file.
 # If you break this rule, you will trip up on other people's endpoint names and
@@ -76,13 +66,21 @@ def bulk_register_mac_address_bulk_register_mac_address_page():
 def bulk_register_mac_address_bulk_register_mac_address_page_submit_bulk_mac_address_list():
     mac_address_list = request.get_json()
     print('Size of mac_address_list %d' % len(mac_address_list))
+    report = None
     if len(mac_address_list) > 1000:
         register_by_xml(g.user.get_api(), module_path(), mac_address_list)
     else:
-        register_by_api(g.user.get_api(), mac_address_list)
+        report = register_by_api(g.user.get_api(), mac_address_list)
+        for entry in report:
+            if entry['action'] == FAILED:
+                g.user.logger.error('Failed to register MAC address %s: %s' % (entry['key'], entry['error']))
 
     text=get_resource_text()
-    g.user.logger.info('SUCCESS')
-    flash(text['success'], 'succeed')
-    return jsonify('', 200)
+    summary = summarize(report) if report is not None else None
+    if summary is None or summary[FAILED] == 0:
+        g.user.logger.info('SUCCESS')
+        flash(text['success'], 'succeed')
+    if summary is not None:
+        flash(text['result'].format(**summary), 'succeed' if summary[FAILED] == 0 else 'failed')
+    return jsonify(report)
 
@@ -24,97 +24,58 @@ import datetime
 import os
 import sys
 
-from paramiko import SSHClient, AutoAddPolicy
-from scp import SCPClient
-from suds import WebFault
-from urllib.parse import urlparse
-from xml.dom.minidom import parse
-
 from bluecat import route, tag, util
 from bluecat.entity import Entity
-from bluecat.api_exception import BAMException, PortalException
 from bluecat_portal import config
+from bluecat.util import properties_to_map, map_to_properties
 from main_app import app
+from .bulk_upsert import BulkUpserter
+from .migration_writer import migrate_elements, ROWS_PER_FILE
 
-def create_udf_node(dom, attribute, value):
-    child = dom.createElement('value')
-    child.setAttribute('name', attribute)
-    child.setAttribute('data', value)
-    return child
+# Upload migration files gzip compressed and uncompress them on BAM
+COMPRESS_MIGRATION = False
 
-def get_udf_value(node, attribute):
-    for child in node.childNodes:
-        if child.nodeType == child.ELEMENT_NODE:
-            if child.tagName == 'value':
-                if child.getAttribute('name') == attribute:
-                    return child.getAttribute('data')
-    return ''
-    
-def construct_xml(workflow_dir, mac_address_list):
-    dom = parse(workflow_dir + '/templates/' + 'config.xml')
-    elm_config = dom.getElementsByTagName('configuration')[0]
-    elm_config.setAttribute('name', config.default_configuration)
-    
+def mac_address_elements(mac_address_list):
     for line in mac_address_list:
-        child = dom.createElement('mac')
-        child.setAttribute('address', str(line[1]))
-        child.appendChild(create_udf_node(dom, 'AssetCode', str(line[0])))
-        child.appendChild(create_udf_node(dom, 'EmployeeCode', str(line[2])))
-        child.appendChild(create_udf_node(dom, 'UpdateDate', normalize_date_format(line[3])))
-        elm_config.appendChild(child)
-    return dom
-    
-def store_xml(workflow_dir, dom):
-    f = open(workflow_dir + '/temporary.xml', 'w', encoding='utf-8')
-    f.write(dom.toprettyxml())
-    f.close()
-
-def get_mac_address(configuration, address):
-    mac_addr = None
-    try:
-        mac_addr = configuration.get_mac_address(address)
-    except PortalException:
-        pass
-    return mac_addr
+        udfs = [
+            ('AssetCode', str(line[0])),
+            ('EmployeeCode', str(line[2])),
+            ('UpdateDate', normalize_date_format(line[3])),
+        ]
+        yield 'mac', {'address': str(line[1])}, udfs
 
-def get_mac_address(configuration, address):
-    mac_addr = None
-    try:
-        mac_addr = configuration.get_mac_address(address)
-    except PortalException:
-        pass
-    return mac_addr
-    
 def normalize_date_format(date_str):
     return date_str.replace('/', '-')
 
-def register_mac_address(configuration, address, asset_code, employee_code, update_date):
-    mac_address = get_mac_address(configuration, address)
-    if mac_address is not None:
-        print('MAC Address %s is in configuration(%s)' % (address, configuration.get_name()))
-    else:
-        print('MAC Address %s is NOT in configuration(%s)' % (address, configuration.get_name()))
-        print('update_date = %s' % str(update_date))
-        mac_address = configuration.add_mac_address(address)
-    mac_address.set_property('AssetCode', asset_code)
-    mac_address.set_property('EmployeeCode', employee_code)
-    mac_address.set_property('UpdateDate', normalize_date_format(update_date))
-    mac_address.update()
+def normalize_mac_address(address):
+    """Return a MAC address as BAM shows it, AA-BB-CC-DD-EE-FF, whatever separators it was given with"""
+    digits = ''.join(c for c in str(address).upper() if c not in ':-.')
+    if len(digits) != 12:
+        return str(address)
+    return '-'.join(digits[i:i + 2] for i in range(0, 12, 2))
+
+def mac_address_key(item):
+    return normalize_mac_address(properties_to_map(item.properties)['address'])
+
+def mac_address_changes(line):
+    return None, {
+        'AssetCode': str(line[0]),
+        'EmployeeCode': str(line[2]),
+        'UpdateDate': normalize_date_format(str(line[3])),
+    }
+
+def register_mac_addresses(api, mac_address_list):
+    configuration = api.get_configuration(config.default_configuration)
+    upserter = BulkUpserter(api)
+    existing = upserter.scan(configuration.get_id(), Entity.MACAddress, mac_address_key)
+
+    def add_mac_address(client, line):
+        properties = mac_address_changes(line)[1]
+        return client.service.addMACAddress(configuration.get_id(), str(line[1]), map_to_properties(properties))
+
+    return upserter.run(mac_address_list, lambda line: normalize_mac_address(line[1]), existing,
+                        mac_address_changes, add_mac_address)
 
-def upload_migration_xml(api, workflow_dir, filename):
-    hostname = urlparse(api.get_url()).hostname
-    print('Hostname: %s' % hostname)
-    ssh = SSHClient()
-    ssh.set_missing_host_key_policy(AutoAddPolicy())
-    ssh.connect(hostname, username='root', password='root')
-    
-    scp = SCPClient(ssh.get_transport())
-    scp.put(workflow_dir + '/' + filename, '/data/migration/incoming/')
-    
-def migrate_xml(api, workflow_dir):
-    upload_migration_xml(api, workflow_dir, 'temporary.xml')
-    try:
-        api._api_client.service.migrateFile('temporary.xml')
-    except WebFault as e:
-        raise BAMException(str(e))        
-    return
+def migrate_mac_addresses(api, workflow_dir, mac_address_list):
+    return migrate_elements(api, workflow_dir, 'bulk_register_mac_address', mac_address_elements(mac_address_list),
+                            config.default_configuration, ROWS_PER_FILE, COMPRESS_MIGRATION)
@@ -0,0 +1,194 @@
+# Copyright 2020 BlueCat Networks (USA) Inc. and its affiliates
+# -*- coding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# By: BlueCat Networks
+# Date: 2020-06-01
+# Gateway Version: 18.10.2
+# Description: Streaming BAM migration file writer and pipelined uploader
+#
+# Usage:
+#
+#     from .migration_writer import migrate_elements
+#
+#     elements = (('mac', {'address': line[1]}, [('AssetCode', line[0])]) for line in rows)
+#     migrate_elements(g.user.get_api(), module_path(), 'bulk_register_mac_address', elements)
+
+import datetime
+import gzip
+import os
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+from xml.sax.saxutils import quoteattr
+
+from paramiko import SSHClient, AutoAddPolicy
+from scp import SCPClient
+from suds import WebFault
+
+from bluecat.api_exception import BAMException
+from bluecat_portal import config
+
+MIGRATION_DIR = '/data/migration/incoming/'
+# Elements per migration file, larger inputs are split into several files migrated one after another
+ROWS_PER_FILE = 100000
+
+HEADER = '''<?xml version="1.0" encoding="UTF-8"?>
+<!DOCTYPE data PUBLIC "-//BlueCat Networks/Proteus Migration Specification 9.0//EN" "http://www.bluecatnetworks.com/proteus-migration-9.0.dtd">
+<data>
+\t<configuration name=%s>
+'''
+FOOTER = '''\t</configuration>
+</data>
+'''
+
+
+class MigrationWriter(object):
+    """
+    Writes one migration file element by element, so memory use does not depend on its size.
+    With compress the file is gzip compressed and its name ends with .gz.
+    """
+
+    def __init__(self, path, configuration_name=None, compress=False):
+        self.path = path + '.gz' if compress else path
+        self.count = 0
+        if compress:
+            self._file = gzip.open(self.path, 'wt', encoding='utf-8')
+        else:
+            self._file = open(self.path, 'w', encoding='utf-8')
+        self._file.write(HEADER % quoteattr(configuration_name or config.default_configuration))
+
+    def write_element(self, tag, attributes, udfs=()):
+        """Write <tag attributes...> with a <value name= data=/> child per (name, value) of udfs"""
+        line = '\t\t<%s%s>\n' % (tag, ''.join(' %s=%s' % (name, quoteattr(str(value))) for name, value in attributes.items()))
+        for name, value in udfs:
+            line += '\t\t\t<value name=%s data=%s/>\n' % (quoteattr(name), quoteattr(str(value)))
+        self._file.write(line + '\t\t</%s>\n' % tag)
+        self.count += 1
+
+    def close(self):
+        if self._file is not None:
+            self._file.write(FOOTER)
+            self._file.close()
+            self._file = None
+
+    def discard(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
+
+
+def write_migration_files(directory, name, elements, configuration_name=None, rows_per_file=ROWS_PER_FILE,
+                          compress=False):
+    """
+    Write elements, (tag, attributes, udfs) tuples, to migration files of at most rows_per_file
+    elements in directory and yield the path of each file as soon as it is complete.
+    """
+    prefix = os.path.join(directory, '%s-%s' % (name, datetime.datetime.now().strftime('%Y%m%d%H%M%S%f')))
+    index = 0
+    writer = None
+    try:
+        for element in elements:
+            if writer is None:
+                writer = MigrationWriter('%s-%d.xml' % (prefix, index), configuration_name, compress)
+                index += 1
+            writer.write_element(*element)
+            if rows_per_file <= writer.count:
+                writer.close()
+                path, writer = writer.path, None
+                yield path
+        if writer is not None:
+            writer.close()
+            path, writer = writer.path, None
+            yield path
+    finally:
+        if writer is not None:
+            writer.discard()
+
+
+class MigrationUploader(object):
+    """Copies migration files to BAM over one SSH connection and starts their migration"""
+
+    def __init__(self, api):
+        self._api = api
+        self._ssh = None
+
+    def __enter__(self):
+        hostname = urlparse(self._api.get_url()).hostname
+        self._ssh = SSHClient()
+        self._ssh.set_missing_host_key_policy(AutoAddPolicy())
+        self._ssh.connect(hostname, username='root', password='root')
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._ssh.close()
+
+    def migrate(self, path):
+        """Upload a migration file, uncompress it on BAM if needed and migrate it, removing the local copy"""
+        scp = SCPClient(self._ssh.get_transport())
+        try:
+            scp.put(path, MIGRATION_DIR)
+        finally:
+            scp.close()
+            os.remove(path)
+        filename = os.path.basename(path)
+        if filename.endswith('.gz'):
+            _, stdout, stderr = self._ssh.exec_command('gunzip -f ' + MIGRATION_DIR + filename)
+            if stdout.channel.recv_exit_status() != 0:
+                raise BAMException('Failed to uncompress %s: %s' % (filename, stderr.read().decode('utf-8')))
+            filename = filename[:-len('.gz')]
+        try:
+            self._api._api_client.service.migrateFile(filename)
+        except WebFault as e:
+            raise BAMException(str(e))
+
+
+def migrate_elements(api, directory, name, elements, configuration_name=None, rows_per_file=ROWS_PER_FILE,
+                     compress=False):
+    """
+    Write elements to migration files and migrate them into BAM. Each file is uploaded and
+    migrated on a background thread while the next one is written, and at most one file waits
+    for its upload, so disk use stays within two files whatever the input size.
+
+    :return: The number of migration files.
+    """
+    count = 0
+    files = write_migration_files(directory, name, elements, configuration_name, rows_per_file, compress)
+    with MigrationUploader(api) as uploader, ThreadPoolExecutor(max_workers=1) as pool:
+        pending = None
+        try:
+            for path in files:
+                if pending is not None:
+                    try:
+                        pending.result()
+                    except Exception:
+                        os.remove(path)
+                        raise
+                pending = pool.submit(uploader.migrate, path)
+                count += 1
+            if pending is not None:
+                pending.result()
+        finally:
+            files.close()
+    return count
@@ -25,61 +25,37 @@ import sys
 from flask import url_for, redirect, render_template, flash, g, request, jsonify
 
 from bluecat import route, util, user
+from bluecat.entity import Entity
+from bluecat.util import map_to_properties
 import config.default_config as config
 from main_app import app
 
 from .bulk_register_user_form import get_resource_text
 from .bulk_register_user_form import GenericFormTemplate
+from .bulk_upsert import BulkUpserter, wanted_properties, summarize, FAILED
 
 
 # No updateUserPassword method on user class yet.
-def update_password(user, password):
-    options = []
-    try:
-        user._api_client.service.updateUserPassword(user.get_id(), password, options)
-    except WebFault as e:
-        print('Exception at update_password(%s)' % util.safe_str(e))
-        raise BAMException(safe_str(e))
+# A password cannot be compared with the stored one, so a given password is always set.
+def update_password(client, user, line):
+    password = line[1]
+    if 0 < len(password):
+        client.service.updateUserPassword(user.id, password, [])
+        return True
+    return False
 
-def register_user(api, user_list):
-    for line in user_list:
-        user_name = line[0]
-        password = line[1]
-        email = line[2]
-        last_name = line[3]
-        first_name = line[4]
-        user_type = line[5]
-        access_type = line[6]
-        
-        print('Finding User %s' % user_name)
+def user_changes(line):
+    return None, wanted_properties(email=line[2], LastName=line[3], FirstName=line[4], userAccessType=line[6])
+
+def add_user(client, line):
+    properties = wanted_properties(email=line[2], userAccessType=line[6], LastName=line[3], FirstName=line[4],
+                                   userType=line[5])
+    return client.service.addUser(line[0], line[1], map_to_properties(properties))
 
-        try:
-            user = api.get_user(user_name)
-            print('Found user(%s) id(%d)' % (user_name, user.get_id()))
-            if 0 < len(email):
-                user.set_property('email', email)
-            if 0 < len(last_name):
-                user.set_property('LastName', last_name)
-            if 0 < len(first_name):
-                user.set_property('FirstName', first_name)
-            if 0 < len(access_type):
-                user.set_property('userAccessType', access_type)
-            user.update()
-            
-            if 0 < len(password):
-                update_password(user, password)
-            
-        except Exception as e:
-            print('Exception %s' % util.safe_str(e))
-            properties = ''
-            if 0 < len(last_name):
-                properties += 'LastName=' + last_name
-            if 0 < len(first_name):
-                properties += '|FirstName=' + first_name
-            if 0 < len(user_type):
-                properties += '|userType=' + user_type
-            print('Adding User %s' % user_name)
-            user = api.add_user(user_name, password, email, access_type, properties)
+def register_user(api, user_list):
+    upserter = BulkUpserter(api)
+    existing = upserter.scan(0, Entity.User)
+    return upserter.run(user_list, lambda line: line[0], existing, user_changes, add_user, update_password)
 
 
 # The workflow name must be the first part of any endpoints defined in this file.
@@ -102,9 +78,15 @@ def bulk_register_user_bulk_register_user_page():
 @util.exception_catcher
 def bulk_register_user_submit_bulk_user_list():
     user_list = request.get_json()  
-    register_user(g.user.get_api(), user_list)
-    
+    report = register_user(g.user.get_api(), user_list)
+    for entry in report:
+        if entry['action'] == FAILED:
+            g.user.logger.error('Failed to register user %s: %s' % (entry['key'], entry['error']))
+
     text=get_resource_text()
-    g.user.logger.info('SUCCESS')
-    flash(text['success'], 'succeed')
-    return jsonify('', 200)
+    summary = summarize(report)
+    if summary[FAILED] == 0:
+        g.user.logger.info('SUCCESS')
+        flash(text['success'], 'succeed')
+    flash(text['result'].format(**summary), 'succeed' if summary[FAILED] == 0 else 'failed')
+    return jsonify(report)
@@ -13,12 +13,18 @@
 # limitations under the License.
 
 
-from flask import render_template, flash, g, json
+from flask import render_template, flash, g, jsonify
 from bluecat import route, util
 import config.default_config as config
 from main_app import app
 from .cache_example_form import GenericFormTemplate
-import os, time
+from .shared_cache import get_cache
+import os
+
+# Addresses read from BAM per getEntities call and resolved per get_host_records_by_ip call
+PAGE_SIZE = 1000
+
+cache = get_cache('cache_example')
 
 
 @route(app, '/cache_example/cache_example_endpoint')
@@ -53,104 +59,51 @@ def cache_example_cache_example_page_form():
     )
 
 
-def get_ip_network_records(conf, network_cidr):
-    cache_file_name = str(conf)+"-"+network_cidr+".json"
-
-    cached_results = read_cache(cache_file_name, 600)
-    if len(cached_results) > 0:
-        print(cached_results)
-        return cached_results
+@route(app, '/cache_example/cache_stats')
+@util.workflow_permission_required('cache_example_page')
+@util.exception_catcher
+def cache_example_cache_stats():
+    return jsonify(cache.stats.as_dict())
 
 
-    configuration = g.user.get_api().get_entity_by_id(conf)
+def get_ip_network_records(conf, network_cidr):
+    key = 'records:%s:%s:%s' % (g.user.get_username(), conf, network_cidr)
     try:
-        network = configuration.get_ip_range_by_ip("IP4Network", network_cidr)
+        return cache.get_or_load(key, lambda: _load_ip_network_records(conf, network_cidr), ttl=600)
     except Exception as e:
         flash(e)
-        network = None
-    return_ips = {}
-    if network is not None:
-        ips = network.get_children_of_type("IP4Address")
+        return {}
+
 
-        for ip in ips:
-            records = ip.get_linked_entities("HostRecord")
+def _load_ip_network_records(conf, network_cidr):
+    """Return {address: {record ID: record name}} of a network, resolving records one page of addresses at a time"""
+    api = g.user.get_api()
+    configuration = api.get_entity_by_id(conf)
+    network = configuration.get_ip_range_by_ip("IP4Network", network_cidr)
+    return_ips = {}
+    start = 0
+    while True:
+        page = api._api_client.service.getEntities(network.get_id(), 'IP4Address', start, PAGE_SIZE)
+        if not util.has_response(page):
+            break
+        ips = [api.instantiate_entity(item) for item in page.item]
+        for ip, records in configuration.get_host_records_by_ip(ips):
             ip_records = {}
             for record in records:
-                ip_records[record.get_id()] = record.get_full_name()
+                ip_records[record.get_id()] = record.get_property('absoluteName')
             return_ips[ip.get_address()] = ip_records
-    cache_it(return_ips, cache_file_name)
+        if len(page.item) < PAGE_SIZE:
+            break
+        start += PAGE_SIZE
     return return_ips
 
 
 def get_configs(cached=False):
-    cache = False
-    if cached:
-        configs = read_cache("configurations.json", 120)
-        if len(configs) != 0:
-            cache=True
-    if cache == False:
-        configs = util.get_configurations(default_val=True)
-        cache_it(configs, "configurations.json")
-    return configs
-
-
-def cache_it(cache, filename, location='cache', create_location=True):
-    full_path = location
-    if location[:5] == "cache":
-        path = os.path.dirname(os.path.abspath(__file__))
-        full_path = path + "/" + location + "/" + filename
-    _save_data(full_path, cache, create_location)
-
-
-def read_cache(filename, exp=0, location='cache'):
-    full_path = location + "/" + filename
-    if location[:5] == "cache":
-        path = os.path.dirname(os.path.abspath(__file__))
-        full_path = path + "/" + location + "/" + filename
-    return _get_file(full_path, exp)
-
-
-
-
+    key = 'configurations:%s' % g.user.get_username()
+    if not cached:
+        cache.delete(key)
+    return cache.get_or_load(key, lambda: util.get_configurations(default_val=True), ttl=120)
 
 
 def _module_path():
     return os.path.dirname(os.path.abspath(__file__))
-
-
-def _file_age(filepath):
-    return time.time() - os.path.getmtime(filepath)
-
-
-def _save_data(file, data, create=False):
-    try:
-        if create:
-            with open(file, 'w+') as f:
-                json.dump(data, f, sort_keys=True, indent=4)
-        else:
-            with open(file, 'w') as f:
-                json.dump(data, f, sort_keys=True, indent=4)
-    except Exception as e:
-        print(e)
-        print("Failed to save")
-    return
-
-
-def _get_file(file, exp=0):
-    print(file)
-    try:
-        seconds = int(_file_age(file))
-        if exp != 0 and seconds > exp:
-            return {}
-    except Exception as e:
-        print(e)
-    try:
-        with open(file, 'r') as f:
-
-            datastore = json.load(f)
-    except:
-        datastore = {}
-    return datastore
-
-
-
@@ -0,0 +1,351 @@
+# Copyright 2020 BlueCat Networks (USA) Inc. and its affiliates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Two tier cache for Gateway workflows.
+
+Values are kept in an in-process LRU and in a SQLite file shared by every Gateway worker process,
+both with a TTL. The shared tier is bounded by the total size of its values and evicts the least
+recently used ones first. get_or_load lets only one caller per key, in any process, run the loader
+on a miss while the others wait for its result. Values must be JSON serializable and are returned
+as they read back from JSON, whichever tier they come from; treat them as read only.
+
+Usage from another workflow:
+
+    from ..cache_example.shared_cache import get_cache
+
+    cache = get_cache('my_workflow')
+    networks = cache.get_or_load('networks:' + cidr, lambda: load_networks(cidr), ttl=300)
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+DEFAULT_TTL = 600
+# Entries kept in the in-process tier of each cache
+LOCAL_MAX_ENTRIES = 1000
+# Seconds the in-process tier trusts a value before reading the shared tier again, so deletes
+# made by other processes are seen within this time
+LOCAL_TTL = 30
+# Bytes of JSON kept in the shared tier of each cache
+SHARED_MAX_BYTES = 64 * 1024 * 1024
+# Seconds other callers wait for a loader running in another process before loading themselves
+LOAD_TIMEOUT = 60
+LOAD_POLL_INTERVAL = 0.1
+# Access times of shared tier hits are written in one batch this often, or once this many are pending,
+# so readers do not take the SQLite write lock on every hit
+ACCESS_FLUSH_INTERVAL = 5
+ACCESS_FLUSH_SIZE = 1000
+
+SCHEMA = [
+    'CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, value TEXT, size INTEGER, expires REAL, '
+    'accessed REAL)',
+    'CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed)',
+    'CREATE TABLE IF NOT EXISTS loads (key TEXT PRIMARY KEY, expires REAL)',
+]
+
+
+def _module_path():
+    return os.path.dirname(os.path.abspath(__file__))
+
+
+class CacheStats(object):
+    """Hit, miss, eviction and load counters of one cache in this process"""
+
+    FIELDS = ('local_hits', 'shared_hits', 'misses', 'evictions', 'expirations', 'loads', 'load_errors',
+              'load_waits')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = dict((field, 0) for field in self.FIELDS)
+
+    def add(self, field, count=1):
+        with self._lock:
+            self._counts[field] += count
+
+    def as_dict(self):
+        with self._lock:
+            stats = OrderedDict((field, self._counts[field]) for field in self.FIELDS)
+        lookups = stats['local_hits'] + stats['shared_hits'] + stats['misses']
+        stats['hit_ratio'] = round(float(stats['local_hits'] + stats['shared_hits']) / lookups, 3) if lookups else 0
+        return stats
+
+
+class LocalTier(object):
+    """In-process LRU of (expires, value) entries"""
+
+    def __init__(self, max_entries, stats):
+        self.max_entries = max_entries
+        self._stats = stats
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.time():
+                del self._entries[key]
+                self._stats.add('expirations')
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key, expires, value):
+        with self._lock:
+            self._entries[key] = (expires, value)
+            self._entries.move_to_end(key)
+            while self.max_entries < len(self._entries):
+                self._entries.popitem(last=False)
+                self._stats.add('evictions')
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class SharedTier(object):
+    """SQLite file of JSON values shared by every process, bounded by max_bytes"""
+
+    def __init__(self, db_file, max_bytes, stats):
+        self.db_file = db_file
+        self.max_bytes = max_bytes
+        self._stats = stats
+        self._connections = threading.local()
+        self._accessed = {}
+        self._accessed_lock = threading.Lock()
+        self._flushed_at = time.time()
+        directory = os.path.dirname(db_file)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        with self._connect() as connection:
+            connection.execute('PRAGMA journal_mode=WAL')
+            for statement in SCHEMA:
+                connection.execute(statement)
+
+    def _connect(self):
+        # One connection per thread, each use commits or rolls back its own transaction
+        connection = getattr(self._connections, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.db_file, timeout=30)
+            self._connections.connection = connection
+        return connection
+
+    def get(self, key):
+        """Return (expires, JSON text) of a live entry, None if there is none"""
+        now = time.time()
+        with self._connect() as connection:
+            row = connection.execute('SELECT expires, value FROM entries WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                return None
+            if row[0] < now:
+                connection.execute('DELETE FROM entries WHERE key = ? AND expires < ?', (key, now))
+                self._stats.add('expirations')
+                return None
+        with self._accessed_lock:
+            self._accessed[key] = now
+            flush = ACCESS_FLUSH_SIZE <= len(self._accessed) or self._flushed_at + ACCESS_FLUSH_INTERVAL <= now
+        if flush:
+            with self._connect() as connection:
+                self._write_accessed(connection)
+        return row
+
+    def _write_accessed(self, connection):
+        """Write the pending access times of hits, which eviction orders entries by"""
+        with self._accessed_lock:
+            accessed, self._accessed = self._accessed, {}
+            self._flushed_at = time.time()
+        if accessed:
+            connection.executemany('UPDATE entries SET accessed = ? WHERE key = ?',
+                                   [(when, key) for key, when in accessed.items()])
+
+    def put(self, key, expires, text):
+        now = time.time()
+        with self._connect() as connection:
+            self._write_accessed(connection)
+            connection.execute('INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?)',
+                               (key, text, len(text), expires, now))
+            self._evict(connection, now)
+
+    def _evict(self, connection, now):
+        connection.execute('DELETE FROM entries WHERE expires < ?', (now,))
+        total = connection.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        evicted = 0
+        for key, size in connection.execute('SELECT key, size FROM entries ORDER BY accessed').fetchall():
+            if total <= self.max_bytes:
+                break
+            connection.execute('DELETE FROM entries WHERE key = ?', (key,))
+            total -= size
+            evicted += 1
+        self._stats.add('evictions', evicted)
+
+    def delete(self, key):
+        with self._connect() as connection:
+            connection.execute('DELETE FROM entries WHERE key = ?', (key,))
+
+    def clear(self):
+        with self._connect() as connection:
+            connection.execute('DELETE FROM entries')
+
+    def acquire_load(self, key, timeout):
+        """Claim the right to load key, True unless another process holds a live claim"""
+        now = time.time()
+        with self._connect() as connection:
+            connection.execute('DELETE FROM loads WHERE key = ? AND expires < ?', (key, now))
+            cursor = connection.execute('INSERT OR IGNORE INTO loads VALUES (?, ?)', (key, now + timeout))
+            return cursor.rowcount == 1
+
+    def release_load(self, key):
+        with self._connect() as connection:
+            connection.execute('DELETE FROM loads WHERE key = ?', (key,))
+
+
+class SharedCache(object):
+    """
+    A named cache with an in-process LRU tier in front of a SQLite tier in
+    <directory>/<name>.db that all Gateway worker processes share.
+    """
+
+    def __init__(self, name, directory=None, ttl=DEFAULT_TTL, local_max_entries=LOCAL_MAX_ENTRIES,
+                 local_ttl=LOCAL_TTL, shared_max_bytes=SHARED_MAX_BYTES, load_timeout=LOAD_TIMEOUT):
+        self.name = name
+        self.ttl = ttl
+        self.local_ttl = local_ttl
+        self.load_timeout = load_timeout
+        self.stats = CacheStats()
+        self._local = LocalTier(local_max_entries, self.stats)
+        directory = directory or os.path.join(_module_path(), 'cache')
+        self._shared = SharedTier(os.path.join(directory, '%s.db' % name), shared_max_bytes, self.stats)
+        self._loads = {}
+        self._loads_lock = threading.Lock()
+
+    def _remember(self, key, expires, text):
+        value = json.loads(text)
+        self._local.put(key, min(expires, time.time() + self.local_ttl), value)
+        return value
+
+    def _lookup(self, key, count=True):
+        """Return (True, value) on a hit in either tier, (False, None) on a miss"""
+        entry = self._local.get(key)
+        if entry is not None:
+            if count:
+                self.stats.add('local_hits')
+            return True, entry[1]
+        row = self._shared.get(key)
+        if row is not None:
+            if count:
+                self.stats.add('shared_hits')
+            return True, self._remember(key, row[0], row[1])
+        return False, None
+
+    def get(self, key, default=None):
+        found, value = self._lookup(key)
+        if not found:
+            self.stats.add('misses')
+            return default
+        return value
+
+    def set(self, key, value, ttl=None):
+        """Store value for ttl seconds and return it as later gets will"""
+        text = json.dumps(value, sort_keys=True)
+        expires = time.time() + (self.ttl if ttl is None else ttl)
+        self._shared.put(key, expires, text)
+        return self._remember(key, expires, text)
+
+    def delete(self, key):
+        self._local.delete(key)
+        self._shared.delete(key)
+
+    def clear(self):
+        self._local.clear()
+        self._shared.clear()
+
+    def get_or_load(self, key, loader, ttl=None):
+        """
+        Return the cached value of key, calling loader() to compute and store it on a miss.
+        Concurrent misses of the same key share one loader call: other threads of this process
+        wait for it directly and other processes poll the shared tier until it is stored.
+        """
+        found, value = self._lookup(key)
+        if found:
+            return value
+        self.stats.add('misses')
+
+        with self._loads_lock:
+            event = self._loads.get(key)
+            leader = event is None
+            if leader:
+                event = threading.Event()
+                self._loads[key] = event
+        if not leader:
+            self.stats.add('load_waits')
+            event.wait(self.load_timeout)
+            # Already counted as a miss, finding the loaded value is not a hit
+            found, value = self._lookup(key, count=False)
+            if found:
+                return value
+            return self._load(key, loader, ttl)
+
+        try:
+            deadline = time.time() + self.load_timeout
+            while not self._shared.acquire_load(key, self.load_timeout):
+                # Another process is loading the key, use its result once stored
+                self.stats.add('load_waits')
+                time.sleep(LOAD_POLL_INTERVAL)
+                found, value = self._lookup(key, count=False)
+                if found:
+                    return value
+                if deadline < time.time():
+                    return self._load(key, loader, ttl)
+            try:
+                return self._load(key, loader, ttl)
+            finally:
+                self._shared.release_load(key)
+        finally:
+            with self._loads_lock:
+                del self._loads[key]
+            event.set()
+
+    def _load(self, key, loader, ttl):
+        self.stats.add('loads')
+        try:
+            value = loader()
+        except Exception:
+            self.stats.add('load_errors')
+            raise
+        return self.set(key, value, ttl)
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_cache(name, **kwargs):
+    """Return the SharedCache of that name in this process, created with kwargs on first use"""
+    with _caches_lock:
+        cache = _caches.get(name)
+        if cache is None:
+            cache = SharedCache(name, **kwargs)
+            _caches[name] = cache
+        return cache
@@ -0,0 +1,129 @@
+# Copyright 2020 BlueCat Networks. All rights reserved.
+""" Cloud Discovery for AWS - parallel multi-region inventory engine """
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import threading
+import boto3
+
+# Upper bound on concurrent AWS API calls made by a single discovery run
+DISCOVERY_WORKERS = 8
+
+# Resource types the engine knows how to collect, in import order
+RESOURCE_TYPES = ('vpcs', 'subnets', 'instances', 'elbv2')
+
+
+def get_name_tag(tags):
+    """Return the value of the Name tag from a boto3 tag list"""
+    for tag in tags or []:
+        if tag['Key'] == 'Name':
+            return tag['Value']
+    return ''
+
+
+def paginate(client, operation, result_key, **kwargs):
+    """Return every item of a describe call, following NextToken/Marker pages"""
+    if not client.can_paginate(operation):
+        return getattr(client, operation)(**kwargs).get(result_key, [])
+    items = []
+    for page in client.get_paginator(operation).paginate(**kwargs):
+        items.extend(page.get(result_key, []))
+    return items
+
+
+def fetch_vpcs(session, region):
+    """Return all VPCs of a region keyed by VpcId"""
+    client = session.client('ec2', region_name=region)
+    return {vpc['VpcId']: vpc for vpc in paginate(client, 'describe_vpcs', 'Vpcs')}
+
+
+def fetch_subnets(session, region):
+    """Return all VPC subnets of a region keyed by SubnetId"""
+    client = session.client('ec2', region_name=region)
+    return {subnet['SubnetId']: subnet for subnet in paginate(client, 'describe_subnets', 'Subnets')}
+
+
+def fetch_instances(session, region):
+    """Return all EC2 instances of a region as a flat list"""
+    client = session.client('ec2', region_name=region)
+    instances = []
+    for reservation in paginate(client, 'describe_instances', 'Reservations'):
+        for instance in reservation['Instances']:
+            instance.setdefault('OwnerId', reservation.get('OwnerId', ''))
+            instances.append(instance)
+    return instances
+
+
+def fetch_load_balancers(session, region):
+    """Return all ELBv2 load balancers of a region with their target groups and targets attached"""
+    client = session.client('elbv2', region_name=region)
+    load_balancers = paginate(client, 'describe_load_balancers', 'LoadBalancers')
+    by_arn = {}
+    for load_balancer in load_balancers:
+        load_balancer['TargetGroups'] = []
+        by_arn[load_balancer['LoadBalancerArn']] = load_balancer
+    for target_group in paginate(client, 'describe_target_groups', 'TargetGroups'):
+        health = client.describe_target_health(TargetGroupArn=target_group['TargetGroupArn'])
+        target_group['Targets'] = health['TargetHealthDescriptions']
+        for arn in target_group.get('LoadBalancerArns', []):
+            if arn in by_arn:
+                by_arn[arn]['TargetGroups'].append(target_group)
+    return load_balancers
+
+
+FETCHERS = {
+    'vpcs': fetch_vpcs,
+    'subnets': fetch_subnets,
+    'instances': fetch_instances,
+    'elbv2': fetch_load_balancers,
+}
+
+
+class DiscoveryEngine(object):
+    """
+    Collects AWS inventory for several regions at once.
+    Every (region, resource type) pair is fetched as one task on a bounded worker pool using
+    paginated bulk describe calls, so no per-instance lookups are made against AWS.
+    """
+
+    def __init__(self, credentials, max_workers=DISCOVERY_WORKERS, progress=None):
+        self._credentials = credentials
+        self._max_workers = max_workers
+        self._progress = progress
+        self._lock = threading.Lock()
+        self._done = {}
+
+    def _report(self, region, stage, total):
+        if self._progress is not None:
+            self._progress(region, stage, self._done[region], total)
+
+    def _fetch(self, region, resource):
+        # boto3 sessions are not thread safe, so each task builds its own
+        session = boto3.session.Session(**self._credentials)
+        return FETCHERS[resource](session, region)
+
+    def collect(self, regions, resources):
+        """
+        Fetch the requested resource types for every region.
+        Returns {region: {resource: data, 'errors': {resource: message}}}
+        """
+        resources = [resource for resource in RESOURCE_TYPES if resource in resources]
+        inventory = {}
+        for region in regions:
+            inventory[region] = {'errors': {}}
+            self._done[region] = 0
+            self._report(region, 'Queued', len(resources))
+        with ThreadPoolExecutor(max_workers=self._max_workers) as pool:
+            futures = {}
+            for region in regions:
+                for resource in resources:
+                    futures[pool.submit(self._fetch, region, resource)] = (region, resource)
+            for future in as_completed(futures):
+                region, resource = futures[future]
+                try:
+                    inventory[region][resource] = future.result()
+                except Exception as thisexception:
+                    inventory[region][resource] = None
+                    inventory[region]['errors'][resource] = str(thisexception)
+                with self._lock:
+                    self._done[region] += 1
+                self._report(region, 'Collected ' + resource, len(resources))
+        return inventory
@@ -0,0 +1,59 @@
+# Copyright 2020 BlueCat Networks. All rights reserved.
+""" Cloud Discovery for AWS - per discovery run BAM entity cache """
+import collections
+import threading
+
+
+class EntityCache(object):
+    """
+    Memoises BAM configurations, views, blocks and networks for the lifetime of one discovery run.
+    Entries are keyed by (entity type, parent ID, name or CIDR). Entities created on a miss are
+    inserted into the cache, and an entry is dropped again whenever creating or using it fails.
+    """
+
+    def __init__(self, miss_exceptions=(Exception,)):
+        self._miss_exceptions = miss_exceptions
+        self._entities = {}
+        self._lock = threading.RLock()
+        self.hits = collections.Counter()
+        self.misses = collections.Counter()
+
+    def get_or_create(self, entity_type, parent_id, name, getter, creator=None):
+        """
+        Return the cached entity, otherwise call getter() and, if that finds nothing, creator().
+        getter may either return None or raise one of miss_exceptions when the entity does not exist.
+        """
+        key = (entity_type, parent_id, name)
+        with self._lock:
+            if key in self._entities:
+                self.hits[entity_type] += 1
+                return self._entities[key]
+            self.misses[entity_type] += 1
+            try:
+                entity = getter()
+            except self._miss_exceptions:
+                entity = None
+            if entity is None and creator is not None:
+                try:
+                    entity = creator()
+                except Exception:
+                    self._entities.pop(key, None)
+                    raise
+            if entity is not None:
+                self._entities[key] = entity
+            return entity
+
+    def invalidate(self, entity_type, parent_id, name):
+        """Drop a single entry, e.g. after an operation on it failed"""
+        with self._lock:
+            self._entities.pop((entity_type, parent_id, name), None)
+
+    def clear(self):
+        """Drop every entry, keeping the hit/miss counters"""
+        with self._lock:
+            self._entities.clear()
+
+    def stats(self):
+        """Return total hits and misses"""
+        with self._lock:
+            return sum(self.hits.values()), sum(self.misses.values())
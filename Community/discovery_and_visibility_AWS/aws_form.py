@@ -29,9 +29,11 @@ def raw_synctable_data(*args, **kwargs):
             {"title": "AWS Region"},
             {"title": "BlueCat Configuration"},
             {"title": "State Changes"},
+            {"title": "Queue Lag"},
+            {"title": "Throughput"},
         ],
         "data": [
-            ["", "", "", ""],
+            ["", "", "", "", "", ""],
         ]
     }
 
@@ -184,6 +186,17 @@ class GenericFormTemplate(GatewayForm): # pylint: disable=too-few-public-methods
     )
     para14 = PlainHTML("</div>")
 
+    aws_regions_desc = PlainHTML('<br><p>Additional AWS regions to discover in parallel with the selected region, as a comma separated list (e.g. eu-west-1,ap-southeast-2)</p>')
+    para13b = PlainHTML("<div class='single'>")
+    aws_discovery_regions = CustomStringField(
+        required=False,
+        label='Additional AWS Regions',
+        default="",
+        validators=[],
+        is_disabled_on_start=False,
+    )
+    para14b = PlainHTML("</div>")
+
     single_config_mode_desc2 = PlainHTML('<br><p><b>NOTE</b> :- Changing the AWS Region will dynamically update the Bluecat configuration, this can optionally be overridden by manually entering a new configuration name into the field</p>')
 
     single_config_mode_desc3 = PlainHTML('<br><b class="subtitle">Per VPC configuration mode</b><p>If VPC subnets are overlapping in the AWS region then the per VPC Configration Mode should be enabled, a unique BlueCat configuration per VPC will then be dynamically created during discovery</p><br>')
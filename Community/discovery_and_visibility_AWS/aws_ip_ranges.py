@@ -0,0 +1,147 @@
+# Copyright 2020 BlueCat Networks. All rights reserved.
+""" Cloud Discovery for AWS - cached and indexed AWS ip-ranges.json prefix store """
+import collections
+import ipaddress
+import json
+import os
+import threading
+import requests
+import requests.exceptions
+
+IP_RANGES_URL = 'https://ip-ranges.amazonaws.com/ip-ranges.json'
+IP_RANGES_CACHE = 'ip_ranges_cache.json'
+IP_RANGES_TIMEOUT = 30
+
+
+class PrefixIndex(object):
+    """
+    Longest-prefix-match index over a set of IPv4 or IPv6 prefixes.
+    Prefixes are bucketed by length in hash tables of network address -> prefix, so a lookup
+    is at most one probe per distinct prefix length present (a handful for ip-ranges.json),
+    independent of the number of prefixes.
+    """
+
+    def __init__(self, version, prefixes=()):
+        self._version = version
+        self._buckets = {}
+        self._lengths = []
+        for prefix in prefixes:
+            self.add(prefix)
+
+    def add(self, prefix):
+        """Add a prefix in CIDR notation"""
+        network = ipaddress.ip_network(prefix, strict=False)
+        self._buckets.setdefault(network.prefixlen, {})[int(network.network_address)] = str(network)
+        self._lengths = sorted(self._buckets, reverse=True)
+
+    def lookup(self, address):
+        """Return the most specific prefix containing address, or None"""
+        address = ipaddress.ip_address(address)
+        if address.version != self._version:
+            return None
+        value = int(address)
+        width = address.max_prefixlen
+        for length in self._lengths:
+            mask = ((1 << length) - 1) << (width - length)
+            prefix = self._buckets[length].get(value & mask)
+            if prefix is not None:
+                return prefix
+        return None
+
+    def __len__(self):
+        return sum(len(bucket) for bucket in self._buckets.values())
+
+
+class AWSPrefixStore(object):
+    """
+    Local copy of the AWS ip-ranges.json file.
+    The file is persisted on disk together with its syncToken and ETag and is only downloaded
+    again when AWS publishes a new version (conditional GET with If-None-Match).
+    Region/service filtering is answered from pre-built sets and containment from a PrefixIndex.
+    """
+
+    def __init__(self, cache_file, url=IP_RANGES_URL):
+        self._cache_file = cache_file
+        self._url = url
+        self._lock = threading.Lock()
+        self._data = None
+        self._prefixes = {4: collections.defaultdict(set), 6: collections.defaultdict(set)}
+        self._indexes = {}
+        self.sync_token = None
+        self.etag = None
+
+    def _read_cache(self):
+        try:
+            with open(self._cache_file, 'r') as cache:
+                return json.load(cache)
+        except (IOError, OSError, ValueError):
+            return None
+
+    def _write_cache(self, data):
+        temp_file = self._cache_file + '.tmp'
+        with open(temp_file, 'w') as cache:
+            json.dump(data, cache)
+        os.replace(temp_file, self._cache_file)
+
+    def _build(self, data):
+        prefixes = {4: collections.defaultdict(set), 6: collections.defaultdict(set)}
+        for item in data.get('prefixes', []):
+            prefixes[4][(item['region'], item['service'])].add(item['ip_prefix'])
+        for item in data.get('ipv6_prefixes', []):
+            prefixes[6][(item['region'], item['service'])].add(item['ipv6_prefix'])
+        self._data = data
+        self._prefixes = prefixes
+        self._indexes = {}
+        self.sync_token = data.get('syncToken')
+        self.etag = data.get('etag')
+
+    def refresh(self):
+        """Load the cached file and download a newer version from AWS if one was published"""
+        with self._lock:
+            cached = self._data or self._read_cache()
+            headers = {}
+            if cached and cached.get('etag'):
+                headers['If-None-Match'] = cached['etag']
+            try:
+                response = requests.get(self._url, headers=headers, timeout=IP_RANGES_TIMEOUT)
+                if response.status_code == 304:
+                    data = cached
+                else:
+                    response.raise_for_status()
+                    data = response.json()
+                    data['etag'] = response.headers.get('ETag')
+                    if not cached or cached.get('syncToken') != data.get('syncToken'):
+                        self._write_cache(data)
+            except (requests.exceptions.RequestException, ValueError):
+                # Keep serving the last good copy if AWS cannot be reached
+                if not cached:
+                    raise
+                data = cached
+            if data is not self._data:
+                self._build(data)
+
+    def _ensure_loaded(self):
+        if self._data is None:
+            self.refresh()
+
+    def blocks(self, region, service='EC2', version=4):
+        """Return the sorted prefixes published for a region and service"""
+        self._ensure_loaded()
+        return sorted(self._prefixes[version].get((region, service), ()))
+
+    def index(self, region, service='EC2', version=4):
+        """Return the PrefixIndex for a region and service, built on first use"""
+        self._ensure_loaded()
+        key = (region, service, version)
+        index = self._indexes.get(key)
+        if index is None:
+            index = PrefixIndex(version, self._prefixes[version].get((region, service), ()))
+            self._indexes[key] = index
+        return index
+
+    def find(self, address, region, service='EC2'):
+        """Return the AWS public block of a region containing address, or None"""
+        if not address:
+            return None
+        version = ipaddress.ip_address(address).version
+        return self.index(region, service, version).lookup(address)
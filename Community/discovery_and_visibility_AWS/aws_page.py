@@ -8,8 +8,6 @@ from configparser import ConfigParser
 import ipaddress
 import boto3
 from botocore.exceptions import ClientError
-import requests
-import requests.exceptions
 from flask import render_template, flash, g, jsonify, copy_current_request_context
 import pytz
 from apscheduler.schedulers.background import BackgroundScheduler
@@ -22,8 +20,13 @@ import config.default_config as config
 from main_app import app
 from app_user import UserSession
 from .aws_form import GenericFormTemplate
+from .aws_discovery import DiscoveryEngine, get_name_tag
+from .aws_sqs_consumer import SQSConsumer
+from .aws_ip_ranges import AWSPrefixStore, IP_RANGES_CACHE
+from .aws_entity_cache import EntityCache
 import logging
 import collections
+import threading
 
 logging.basicConfig()
 logging.getLogger('apscheduler').setLevel(logging.DEBUG)
@@ -34,16 +37,23 @@ JOB = ""
 JOBS = []
 DISCOVERYSTATUS = ""
 DISCOVERY_STATS = []
+DISCOVERY_PROGRESS = collections.OrderedDict()
 SYNCSCHEDULER = BackgroundScheduler(timezone=pytz.utc)
 SYNCSCHEDULER.start()
 RELEASE_VERSION = "1.0.7"
 STATECHANGES = collections.OrderedDict()
+STATECHANGES_LOCK = threading.Lock()
+CONSUMERS = {}
 SYNCHISTORY = []
 
 def module_path():
     """ Returns module path dirname """
     return os.path.dirname(os.path.abspath(__file__))
 
+PREFIX_STORE = AWSPrefixStore(os.path.join(module_path(), IP_RANGES_CACHE))
+PUBLIC_BLOCKS = {}
+PUBLIC_BLOCKS_LOCK = threading.Lock()
+
 def get_api():
     """Fetches API from flask globals:return: API
     """
@@ -73,9 +83,22 @@ def jobstatus():
         d['Target'] = job.name
         region = str(job.id)
         d['StateChanges'] = str(STATECHANGES[region])
+        if region in CONSUMERS:
+            metrics = CONSUMERS[region].metrics.as_dict()
+            d['QueueLag'] = "{depth} msgs / {lag}s".format(depth=metrics['QueueDepth'], lag=metrics['LagSeconds'])
+            d['Throughput'] = "{rate}/s ({latency}ms avg)".format(rate=metrics['EventsPerSecond'], latency=metrics['LatencyAvgMs'])
+            d['Metrics'] = metrics
+        else:
+            d['QueueLag'] = ""
+            d['Throughput'] = ""
         templist.append(d)
     return jsonify(templist)
 
+@route(app, '/aws/jobs/metrics', methods=['GET'])
+def jobmetrics():
+    """returns SQS consumer lag, throughput and latency per region in JSON"""
+    return jsonify({region: consumer.metrics.as_dict() for region, consumer in CONSUMERS.items()})
+
 @route(app, '/aws/synchistory', methods=['GET'])
 def synchistory():
     """returns sync history in JSON for feedback on form"""
@@ -98,7 +121,7 @@ def aws_aws_page():
 @route(app,'/aws/discovery_stats', methods=['GET'])
 def last_discovery_stats():
     global DISCOVERY_STATS
-    return jsonify(DISCOVERY_STATS)
+    return jsonify(DISCOVERY_STATS + list(DISCOVERY_PROGRESS.values()))
 
 @route(app, '/aws/form', methods=['POST'])
 @util.workflow_permission_required('aws_page')
@@ -183,25 +206,25 @@ def aws_aws_page_form():
         # Check and Create AWS Device udfs
         check_and_create_aws_udfs()
 
-        # AWS VPC Discovery
+        # AWS Discovery, collected in parallel across regions and run as a background job
+        discovery_regions = get_discovery_regions(aws_region_name, form.aws_discovery_regions.data)
+        discovery_resources = set()
         if form.aws_vpc_import.data:
-            if single_config_mode and form.aws_public_blocks.data:
-                importawspublic(form.configuration.data)
-            # Create the required BAM configurations
-            if not discovervpcs():
-                return render_template('aws_page.html', form=form, text=util.get_text(module_path(), config.language), options=g.user.get_options(), )
-
-        # AWS EC2 Discovery
+            discovery_resources.update(['vpcs', 'subnets'])
         if form.aws_ec2_import.data:
-            discoverec2(aws_type,ec2_subtype)
-
-        # AWS ELBv2 Discovery
+            discovery_resources.update(['vpcs', 'subnets', 'instances'])
         if form.aws_elbv2_import.data:
-            discoverelbv2(aws_type,elbv2_subtype)
+            discovery_resources.update(['vpcs', 'elbv2'])
+        discovery_user = g.user
+
+        @copy_current_request_context
+        def discoveryjob():
+            g.user = discovery_user
+            run_discovery(form, discovery_regions, discovery_resources, aws_type, ec2_subtype, elbv2_subtype)
 
-        # AWS Route53 Discovery
-        if form.aws_route53_import.data:
-            discoverr53()
+        if discovery_resources or form.aws_route53_import.data:
+            DISCOVERYSTATUS = datetime.utcnow().strftime("%m/%d/%Y %H:%M:%S") + " - Starting Discovery of " + ", ".join(discovery_regions)
+            SYNCSCHEDULER.add_job(discoveryjob, trigger='date', run_date=datetime.utcnow(), id='discovery', name='Discovery', replace_existing=True)
 
         if form.aws_sync_start.data:
             DISCOVERYSTATUS = "Initialising Continuous Visibility for " + aws_region_name
@@ -347,7 +370,7 @@ def aws_aws_page_form():
                 global configuration, import_amazon_dns, target_zone, dynamic_deployment
                 global DISCOVERYSTATUS, SYNCSCHEDULER, JOB, JOBS, STATECHANGES, SYNCHISTORY
 
-                awspubs = awsblocks(form.aws_region_name.data)
+                PREFIX_STORE.refresh()
                 bam_url = config.api_url[0][1]
                 username = form.aws_sync_user.data
                 password = form.aws_sync_pass.data
@@ -389,75 +412,147 @@ def aws_aws_page_form():
 
 
 
-                while True:
-                    if not JOB:
-                        DISCOVERYSTATUS = datetime.utcnow().strftime("%m/%d/%Y %H:%M:%S") + " - Visibility Terminated for " + SQS_QUEUE['REGION']
-                        sync_hist_halt = collections.OrderedDict()
-                        sync_hist_halt['Region'] = thissyncregion
-                        sync_hist_halt['Time'] = datetime.utcnow().strftime("%m/%d/%Y %H:%M:%S")
-                        sync_hist_halt['EC2'] = "Visibility"
-                        sync_hist_halt['Action'] = "Terminated"
-                        SYNCHISTORY.append((sync_hist_halt))
-                        JOBS = []
-                        return
-
-                    g.user = u
-
-                    # Check the SQS session expiration
-                    timenow = datetime.now(timezone.utc)
-                    timeexpire = sts_client["Credentials"]["Expiration"]
-                    time_difference = timeexpire - timenow
-                    expiration_timer = time_difference_in_minutes = time_difference / timedelta(minutes=1)
-                    if expiration_timer < 1:
-                        g.user.logger.info("SQS Session - Less than 1 minutes till session expiration")
-                        g.user.logger.info("SQS Session - Refreshing session....")
-                        try:
-                            sts_client, sqs, sqs_resource, aws_sqs_queue, ec2_client, ec2_resource = connect_sqs(service_access_key, service_secret_key, SQS_QUEUE['REGION'])
-                        except Exception as thisexception:
-                            g.user.logger.info(thisexception)
-
-                    # Try and get the next message from the SQS queue
-                    try:
-                        g.user.logger.info('Checking SQS queue {} for message'.format(SQS_QUEUE['QUEUE']))
-                        messages = sqs.receive_message(QueueUrl=SQS_QUEUE['QUEUE'], MaxNumberOfMessages=1, WaitTimeSeconds=5) # Get the next message from queue
-                    except Exception as thisexception:
-                        g.user.logger.info(str(thisexception), "Exception receiving message")
-                        if "expired_token" in str(thisexception):
-                            g.user.logger.info("Refresh of AWS session required")
-
-                    if 'Messages' in messages: # when the queue is exhausted, the response dict contains no 'Messages' key
-                        for message in messages['Messages']: # 'Messages' is a list
-                            body = json.loads(message['Body'])
-                            g.user.logger.info(message, 'Message')
-                            DISCOVERYSTATUS = datetime.utcnow().strftime("%m/%d/%Y %H:%M:%S") + " - State Change for " + str(body['detail']['instance-id']) + " in " + SQS_QUEUE['REGION']
-                            # Handle terminated EC2 state
-                            if body['detail']['state'] == "terminated":
-                                # login to BAM using the API account, do stuff, logout
-                                conn = api.API(bam_url)
-                                conn.login(form.aws_sync_user.data,form.aws_sync_pass.data)
-                                DISCOVERYSTATUS = datetime.utcnow().strftime("%m/%d/%Y %H:%M:%S") + " - Terminating " + str(body['detail']['instance-id']) + " in " + SQS_QUEUE['REGION']
-                                g.user.logger.info('EC2 Instance Terminated - Deleting')
-                                instanceid = body['detail']['instance-id']
-                                instanceid = instanceid.split()
-                                instance = ec2_client.describe_instances(InstanceIds=instanceid)
-                                g.user.logger.info(instance)
-                                for r in instance['Reservations']:
-                                    for i in r['Instances']:
-                                        g.user.logger.info(i['InstanceId'], "Instance ID")
-                                        config_list = set()
-                                        configurations = conn.get_configurations()
-                                        for conf in configurations:
-                                            config_list.add(conf.get_id())
-                                        for conf_id in config_list:
-                                            try:
-                                                dev = conn._api_client.service.getEntityByName(conf_id, i['InstanceId'], "Device")
-                                                if dev.id != 0:
-                                                    g.user.logger.info(i['InstanceId'], "Instance Device Found")
-                                                    g.user.logger.info(conf_id, "In Config")
-                                                    g.user.logger.info(i['InstanceId'], "Deleting Terminated Device")
-                                                    conn._api_client.service.delete(dev.id)
-                                            except Exception as thisexception:
-                                                g.user.logger.info(thisexception)
+                # Apply a single (coalesced) EC2 state change to BAM, called concurrently per instance
+                def handle_state_change(body):
+                    global DISCOVERYSTATUS, STATECHANGES, SYNCHISTORY
+                    g.user.logger.info(body, 'Message')
+                    DISCOVERYSTATUS = datetime.utcnow().strftime("%m/%d/%Y %H:%M:%S") + " - State Change for " + str(body['detail']['instance-id']) + " in " + SQS_QUEUE['REGION']
+                    # Handle terminated EC2 state
+                    if body['detail']['state'] == "terminated":
+                        # login to BAM using the API account, do stuff, logout
+                        conn = api.API(bam_url)
+                        conn.login(form.aws_sync_user.data,form.aws_sync_pass.data)
+                        DISCOVERYSTATUS = datetime.utcnow().strftime("%m/%d/%Y %H:%M:%S") + " - Terminating " + str(body['detail']['instance-id']) + " in " + SQS_QUEUE['REGION']
+                        g.user.logger.info('EC2 Instance Terminated - Deleting')
+                        instanceid = body['detail']['instance-id']
+                        instanceid = instanceid.split()
+                        instance = ec2_client.describe_instances(InstanceIds=instanceid)
+                        g.user.logger.info(instance)
+                        for r in instance['Reservations']:
+                            for i in r['Instances']:
+                                g.user.logger.info(i['InstanceId'], "Instance ID")
+                                config_list = set()
+                                configurations = conn.get_configurations()
+                                for conf in configurations:
+                                    config_list.add(conf.get_id())
+                                for conf_id in config_list:
+                                    try:
+                                        dev = conn._api_client.service.getEntityByName(conf_id, i['InstanceId'], "Device")
+                                        if dev.id != 0:
+                                            g.user.logger.info(i['InstanceId'], "Instance Device Found")
+                                            g.user.logger.info(conf_id, "In Config")
+                                            g.user.logger.info(i['InstanceId'], "Deleting Terminated Device")
+                                            conn._api_client.service.delete(dev.id)
+                                    except Exception as thisexception:
+                                        g.user.logger.info(thisexception)
+                        if import_amazon_dns:
+                            if dynamic_deployment:
+                                hostrecs = conn.custom_search("EC2InstanceID=%s" %i['InstanceId'], "HostRecord")
+                                hosts = []
+                            for host in hostrecs:
+                                hosts.append(host)
+                                g.user.logger.info(host, "Target HostRecs")
+                            # Delete all IPv4 Address and External Host Records
+                            g.user.logger.info("Updating the Amazon DNS records for a Terminated Instance")
+                            try:
+                                for objtype in ("IP4Address", "IP6Address", "HostRecord"):
+                                    stuff = conn.custom_search("EC2InstanceID=%s" %i['InstanceId'], objtype)
+                                    for thing in stuff:
+                                        g.user.logger.info(thing, "Deleting")
+                                        thing.delete()
+                            except Exception as thisexception:
+                                g.user.logger.info(thisexception)
+                            if dynamic_deployment:
+                                for this in hosts:
+                                    try:
+                                        DISCOVERYSTATUS = datetime.utcnow().strftime("%m/%d/%Y %H:%M:%S") +" - Selective Deployment"
+                                        g.user.logger.info("Attempting Selective Deploy")
+                                        g.user.logger.info(this,"this")
+                                        hostidlist = []
+                                        hostidlist.append(str(this.get_id()))
+                                        g.user.logger.info(hostidlist,"HostID list")
+                                        result = conn.selective_deploy(hostidlist)
+                                        g.user.logger.info(result,"Selective Deployment Status")
+                                    except Exception as thisexception:
+                                        g.user.logger.info(thisexception, "Exception Selective Deploy")
+                        DISCOVERYSTATUS = datetime.utcnow().strftime("%m/%d/%Y %H:%M:%S") +" - Terminated " + str(body['detail']['instance-id']) + " in " + SQS_QUEUE['REGION']
+
+                        sync_hist_term = collections.OrderedDict()
+                        sync_hist_term['Region'] = thissyncregion
+                        sync_hist_term['Time'] = datetime.utcnow().strftime("%m/%d/%Y %H:%M:%S")
+                        sync_hist_term['EC2'] = i['InstanceId']
+                        sync_hist_term['Action'] = "Terminated"
+                        SYNCHISTORY.append((sync_hist_term))
+                        with STATECHANGES_LOCK:
+                            STATECHANGES[thissyncregion] = STATECHANGES[thissyncregion] + 1
+                        conn.logout()
+
+                    # Handle stopped EC2 state
+                    elif body['detail']['state'] == "stopped":
+                        # login to BAM using the API account, do stuff, logout
+                        conn = api.API(bam_url)
+                        conn.login(form.aws_sync_user.data,form.aws_sync_pass.data)
+                        g.user.logger.info('EC2 Instance Stopped - Updating')
+                        instanceid = body['detail']['instance-id']
+                        instanceid = instanceid.split()
+                        instance = ec2_client.describe_instances(InstanceIds=instanceid)
+                        DISCOVERYSTATUS = datetime.utcnow().strftime("%m/%d/%Y %H:%M:%S") + " - Stopping " + str(body['detail']['instance-id']) + " in " + SQS_QUEUE['REGION']
+                        g.user.logger.info(instance)
+                        for r in instance['Reservations']:
+                            for i in r['Instances']:
+                                g.user.logger.info(i)
+                                g.user.logger.info(i['InstanceId'], "Instance ID")
+                                nametag = get_name_tag(i.get('Tags'))
+                                for n in i['NetworkInterfaces']:
+                                    g.user.logger.info(n['OwnerId'], "OwnerID")
+                                v6_address = ""
+                                for n2 in i['NetworkInterfaces']:
+                                    v6_addresses = n2['Ipv6Addresses']
+                                    for v2 in v6_addresses:
+                                        v6_address = v2['Ipv6Address']
+                                        g.user.logger.info(v6_address, "Instance IPv6 address")
+                                vpc_name = get_vpc_name(ec2_client, i['VpcId'])
+                                if single_config_mode:
+                                    config_name = SQS_QUEUE['CONFIGURATION']
+                                else:
+                                    if vpc_name:
+                                        config_name = SQS_QUEUE['REGION'] + " - " + i['VpcId'] + " - " + vpc_name
+                                    else:
+                                        config_name = SQS_QUEUE['REGION'] + " - " + i['VpcId']
+                                conf_entity = conn.get_configuration(config_name)
+                                conf = conf_entity.get_id()
+                                try:
+                                    dev = conn._api_client.service.getEntityByName(conf, i['InstanceId'], "Device")
+                                    g.user.logger.info(dev)
+                                except Exception as thisexception:
+                                    g.user.logger.info(thisexception)
+                                if dev.id != 0:
+                                    g.user.logger.info(i['InstanceId'], "Device in Address Manager")
+                                    try:
+                                        g.user.logger.info(i['InstanceId'], "Deleting Device")
+                                        conn._api_client.service.delete(dev.id)
+                                    except Exception as thisexception:
+                                        g.user.logger.info(thisexception)
+                                now = datetime.utcnow().strftime("%m/%d/%Y %H:%M:%S")
+                                try:
+                                    pubip = i['PublicIpAddress']
+                                except KeyError:
+                                    pubip = ""
+                                try:
+                                    keyname = i['KeyName']
+                                except KeyError:
+                                    keyname = ""
+                                publicblocks = get_public_block(conf_entity, pubip, SQS_QUEUE['REGION'])
+                                if publicblocks:
+                                    g.user.logger.info("AWS Public Blocks in configuration")
+                                else:
+                                    g.user.logger.info("AWS Public Blocks NOT available in configuration")
+                                props = "PrivateDNSName="+i['PrivateDnsName'] + '|' + "PublicDNSName=" + i['PublicDnsName'] + '|' + "InstanceState="+body['detail']['state'] + '|' + "InstanceType="+i['InstanceType'] + "|" + "AvailabilityZone=" + i['Placement']['AvailabilityZone'] + "|" + "|CloudAtlasSyncTime=" + now + "|" + \
+                                "LaunchTime=" + i['LaunchTime'].strftime("%m/%d/%Y %H:%M:%S") + '|' + "Owner=" + n['OwnerId'] + '|' + 'KeyName=' + keyname + '|' + 'NAMETAG=' + nametag
+                                if i['PrivateIpAddress'] and pubip and publicblocks:
+                                    devips = i['PrivateIpAddress'] + "," + pubip
+                                else:
+                                    devips = i['PrivateIpAddress']
                                 if import_amazon_dns:
                                     if dynamic_deployment:
                                         hostrecs = conn.custom_search("EC2InstanceID=%s" %i['InstanceId'], "HostRecord")
@@ -465,8 +560,7 @@ def aws_aws_page_form():
                                     for host in hostrecs:
                                         hosts.append(host)
                                         g.user.logger.info(host, "Target HostRecs")
-                                    # Delete all IPv4 Address and External Host Records
-                                    g.user.logger.info("Updating the Amazon DNS records for a Terminated Instance")
+                                    g.user.logger.info(i['InstanceId'], "Deleting the Amazon DNS records Host Records / IPv4 Addresses for a Stopped Instance")
                                     try:
                                         for objtype in ("IP4Address", "IP6Address", "HostRecord"):
                                             stuff = conn.custom_search("EC2InstanceID=%s" %i['InstanceId'], objtype)
@@ -474,13 +568,13 @@ def aws_aws_page_form():
                                                 g.user.logger.info(thing, "Deleting")
                                                 thing.delete()
                                     except Exception as thisexception:
-                                        g.user.logger.info(thisexception)
+                                        g.user.logger.info(thisexception, "Exception Deleting")
                                     if dynamic_deployment:
                                         for this in hosts:
                                             try:
                                                 DISCOVERYSTATUS = datetime.utcnow().strftime("%m/%d/%Y %H:%M:%S") +" - Selective Deployment"
                                                 g.user.logger.info("Attempting Selective Deploy")
-                                                g.user.logger.info(this,"this")
+                                                g.user.logger.info(this.get_property("absoluteName"),"AbsoluteName")
                                                 hostidlist = []
                                                 hostidlist.append(str(this.get_id()))
                                                 g.user.logger.info(hostidlist,"HostID list")
@@ -488,393 +582,320 @@ def aws_aws_page_form():
                                                 g.user.logger.info(result,"Selective Deployment Status")
                                             except Exception as thisexception:
                                                 g.user.logger.info(thisexception, "Exception Selective Deploy")
-                                DISCOVERYSTATUS = datetime.utcnow().strftime("%m/%d/%Y %H:%M:%S") +" - Terminated " + str(body['detail']['instance-id']) + " in " + SQS_QUEUE['REGION']
-
-                                sync_hist_term = collections.OrderedDict()
-                                sync_hist_term['Region'] = thissyncregion
-                                sync_hist_term['Time'] = datetime.utcnow().strftime("%m/%d/%Y %H:%M:%S")
-                                sync_hist_term['EC2'] = i['InstanceId']
-                                sync_hist_term['Action'] = "Terminated"
-                                SYNCHISTORY.append((sync_hist_term))
-                                STATECHANGES[thissyncregion] = STATECHANGES[thissyncregion] + 1
-                                conn.logout()
-
-                            # Handle stopped EC2 state
-                            elif body['detail']['state'] == "stopped":
-                                # login to BAM using the API account, do stuff, logout
-                                conn = api.API(bam_url)
-                                conn.login(form.aws_sync_user.data,form.aws_sync_pass.data)
-                                g.user.logger.info('EC2 Instance Stopped - Updating')
-                                instanceid = body['detail']['instance-id']
-                                instanceid = instanceid.split()
-                                instance = ec2_client.describe_instances(InstanceIds=instanceid)
-                                DISCOVERYSTATUS = datetime.utcnow().strftime("%m/%d/%Y %H:%M:%S") + " - Stopping " + str(body['detail']['instance-id']) + " in " + SQS_QUEUE['REGION']
-                                g.user.logger.info(instance)
-                                for r in instance['Reservations']:
-                                    for i in r['Instances']:
-                                        g.user.logger.info(i)
-                                        g.user.logger.info(i['InstanceId'], "Instance ID")
-                                        nametag = get_instance_name(i['InstanceId'],ec2_resource)
-                                        for n in i['NetworkInterfaces']:
-                                            g.user.logger.info(n['OwnerId'], "OwnerID")
-                                        v6_address = ""
-                                        for n2 in i['NetworkInterfaces']:
-                                            v6_addresses = n2['Ipv6Addresses']
-                                            for v2 in v6_addresses:
-                                                v6_address = v2['Ipv6Address']
-                                                g.user.logger.info(v6_address, "Instance IPv6 address")
-                                        vpc = ec2_resource.Vpc(i['VpcId'])
-                                        vpc_name = ""
-                                        if vpc.tags:
-                                            for tag in vpc.tags:
-                                                if tag['Key'] == "Name":
-                                                    vpc_name = tag['Value']
-                                        if single_config_mode:
-                                            config_name = SQS_QUEUE['CONFIGURATION']
-                                        else:
-                                            if vpc_name:
-                                                config_name = SQS_QUEUE['REGION'] + " - " + i['VpcId'] + " - " + vpc_name
-                                            else:
-                                                config_name = SQS_QUEUE['REGION'] + " - " + i['VpcId']
-                                        conf_entity = conn.get_configuration(config_name)
-                                        conf = conf_entity.get_id()
-                                        try:
-                                            dev = conn._api_client.service.getEntityByName(conf, i['InstanceId'], "Device")
-                                            g.user.logger.info(dev)
-                                        except Exception as thisexception:
-                                            g.user.logger.info(thisexception)
-                                        if dev.id != 0:
-                                            g.user.logger.info(i['InstanceId'], "Device in Address Manager")
-                                            try:
-                                                g.user.logger.info(i['InstanceId'], "Deleting Device")
-                                                conn._api_client.service.delete(dev.id)
-                                            except Exception as thisexception:
-                                                g.user.logger.info(thisexception)
-                                        now = datetime.utcnow().strftime("%m/%d/%Y %H:%M:%S")
-                                        try:
-                                            pubip = i['PublicIpAddress']
-                                        except KeyError:
-                                            pubip = ""
-                                        try:
-                                            keyname = i['KeyName']
-                                        except KeyError:
-                                            keyname = ""
-                                        for block in awspubs:
-                                            props = "name=" + SQS_QUEUE['REGION'] + " / Public AWS Block"
-                                            try:
-                                                publicblocks = conf_entity.get_entity_by_cidr(block)
-                                            except PortalException:
-                                                publicblocks = None
-                                        if publicblocks:
-                                            g.user.logger.info("AWS Public Blocks in configuration")
-                                        else:
-                                            g.user.logger.info("AWS Public Blocks NOT available in configuration")
-                                        props = "PrivateDNSName="+i['PrivateDnsName'] + '|' + "PublicDNSName=" + i['PublicDnsName'] + '|' + "InstanceState="+body['detail']['state'] + '|' + "InstanceType="+i['InstanceType'] + "|" + "AvailabilityZone=" + i['Placement']['AvailabilityZone'] + "|" + "|CloudAtlasSyncTime=" + now + "|" + \
-                                        "LaunchTime=" + i['LaunchTime'].strftime("%m/%d/%Y %H:%M:%S") + '|' + "Owner=" + n['OwnerId'] + '|' + 'KeyName=' + keyname + '|' + 'NAMETAG=' + nametag
-                                        if i['PrivateIpAddress'] and pubip and publicblocks:
-                                            devips = i['PrivateIpAddress'] + "," + pubip
-                                        else:
-                                            devips = i['PrivateIpAddress']
-                                        if import_amazon_dns:
-                                            if dynamic_deployment:
-                                                hostrecs = conn.custom_search("EC2InstanceID=%s" %i['InstanceId'], "HostRecord")
-                                                hosts = []
-                                            for host in hostrecs:
-                                                hosts.append(host)
-                                                g.user.logger.info(host, "Target HostRecs")
-                                            g.user.logger.info(i['InstanceId'], "Deleting the Amazon DNS records Host Records / IPv4 Addresses for a Stopped Instance")
-                                            try:
-                                                for objtype in ("IP4Address", "IP6Address", "HostRecord"):
-                                                    stuff = conn.custom_search("EC2InstanceID=%s" %i['InstanceId'], objtype)
-                                                    for thing in stuff:
-                                                        g.user.logger.info(thing, "Deleting")
-                                                        thing.delete()
-                                            except Exception as thisexception:
-                                                g.user.logger.info(thisexception, "Exception Deleting")
-                                            if dynamic_deployment:
-                                                for this in hosts:
+
+                                try:
+                                    g.user.logger.info(i['InstanceId'], "Adding stopped EC2 Device")
+                                    conn._api_client.service.addDevice(conf, i['InstanceId'], aws_type, aws_type_ec2, devips, v6_address, props)
+                                except Exception as thisexception:
+                                    g.user.logger.info(thisexception)
+                                g.user.logger.info("Updating IPs with InstanceID ....")
+                                config_entity = conn.get_configuration(config_name)
+                                if pubip:
+                                    try:
+                                        ip_address_pub = config_entity.get_ip4_address(i['PublicIpAddress'])
+                                        ip_address_pub.set_property("EC2InstanceID", i['InstanceId'])
+                                        ip_address_pub.update()
+                                    except Exception as thisexception:
+                                        g.user.logger.info(thisexception, "Exception Getting Public IPv4")
+                                if v6_address:
+                                    try:
+                                        ip_address_pub6 = config_entity.get_ip6_address(v6_address)
+                                        ip_address_pub6.set_property("EC2InstanceID", i['InstanceId'])
+                                        ip_address_pub6.update()
+                                    except Exception as thisexception:
+                                        g.user.logger.info(thisexception, "Exception Getting Public IPv6")
+                                try:
+                                    ip_address_private = config_entity.get_ip4_address(i['PrivateIpAddress'])
+                                    ip_address_private.set_property("EC2InstanceID", i['InstanceId'])
+                                    ip_address_private.update()
+                                except Exception as thisexception:
+                                    g.user.logger.info(thisexception, "Exception Getting Private IP")
+                                if nametag:
+                                    DISCOVERYSTATUS = datetime.utcnow().strftime("%m/%d/%Y %H:%M:%S") +" - Stopped " + str(body['detail']['instance-id']) + " (" + nametag + ") in " + SQS_QUEUE['REGION']
+                                else:
+                                    DISCOVERYSTATUS = datetime.utcnow().strftime("%m/%d/%Y %H:%M:%S") +" - Stopped " + str(body['detail']['instance-id']) + " in " + SQS_QUEUE['REGION']
+
+                        sync_hist_stopped = collections.OrderedDict()
+                        sync_hist_stopped['Region'] = thissyncregion
+                        sync_hist_stopped['Time'] = datetime.utcnow().strftime("%m/%d/%Y %H:%M:%S")
+                        if nametag:
+                            sync_hist_stopped['EC2'] = i['InstanceId'] + " (" + str(nametag) + ")"
+                        else:
+                            sync_hist_stopped['EC2'] = i['InstanceId']
+                        sync_hist_stopped['Action'] = "Stopped"
+                        SYNCHISTORY.append((sync_hist_stopped))
+                        with STATECHANGES_LOCK:
+                            STATECHANGES[thissyncregion] = STATECHANGES[thissyncregion] + 1
+
+                        conn.logout()
+
+                    # Handle running EC2 state
+                    elif body['detail']['state'] == "running":
+                        # login to BAM using the API account, do stuff, logout
+                        conn = api.API(bam_url)
+                        conn.login(form.aws_sync_user.data,form.aws_sync_pass.data)
+                        g.user.logger.info('EC2 Instance Running - Updating')
+                        instanceid = body['detail']['instance-id']
+                        instanceid = instanceid.split()
+                        instance = ec2_client.describe_instances(InstanceIds=instanceid)
+                        g.user.logger.info(instance)
+                        DISCOVERYSTATUS = datetime.utcnow().strftime("%m/%d/%Y %H:%M:%S") + " - Starting " + str(body['detail']['instance-id']) + " in " + SQS_QUEUE['REGION']
+                        for r in instance['Reservations']:
+                            for i in r['Instances']:
+                                g.user.logger.info(i)
+                                g.user.logger.info(i['InstanceId'], "Instance ID")
+                                nametag = get_name_tag(i.get('Tags'))
+                                g.user.logger.info(nametag, "Instance Name Tag")
+                                for n in i['NetworkInterfaces']:
+                                    g.user.logger.info(n['OwnerId'], "OwnerID")
+                                v6_address = ""
+                                for n2 in i['NetworkInterfaces']:
+                                    v6_addresses = n2['Ipv6Addresses']
+                                    for v2 in v6_addresses:
+                                        v6_address = v2['Ipv6Address']
+                                        g.user.logger.info(v6_address, "Instance IPv6 address")
+                                vpc_name = get_vpc_name(ec2_client, i['VpcId'])
+                                if single_config_mode:
+                                    config_name = SQS_QUEUE['CONFIGURATION']
+                                else:
+                                    if vpc_name:
+                                        config_name = SQS_QUEUE['REGION'] + " - " + i['VpcId'] + " - " + vpc_name
+                                    else:
+                                        config_name = SQS_QUEUE['REGION'] + " - " + i['VpcId']
+                                conf_entity = conn.get_configuration(config_name)
+                                conf = conf_entity.get_id()
+                                try:
+                                    dev = conn._api_client.service.getEntityByName(conf, i['InstanceId'], "Device")
+                                    g.user.logger.info(dev)
+                                except Exception as thisexception:
+                                    g.user.logger.info(thisexception)
+                                if dev.id != 0:
+                                    g.user.logger.info(i['InstanceId'], "Device in Address Manager")
+                                    try:
+                                        g.user.logger.info(i['InstanceId'], "Deleting Device")
+                                        conn._api_client.service.delete(dev.id)
+                                    except Exception as thisexception:
+                                        g.user.logger.info(thisexception)
+                                now = datetime.utcnow().strftime("%m/%d/%Y %H:%M:%S")
+                                try:
+                                    pubip = i['PublicIpAddress']
+                                    g.user.logger.info("EC2 instance has a public IP")
+                                except KeyError:
+                                    g.user.logger.info("EC2 instance DOES NOT have a public IP")
+                                    pubip = ""
+                                try:
+                                    keyname = i['KeyName']
+                                    g.user.logger.info("EC2 instance has SSH Key")
+                                except KeyError:
+                                    g.user.logger.info("EC2 instance has no SSH Key")
+                                    keyname = ""
+
+                                publicblocks = get_public_block(conf_entity, pubip, SQS_QUEUE['REGION'])
+                                if publicblocks:
+                                    g.user.logger.info("AWS Public Blocks in configuration")
+                                else:
+                                    g.user.logger.info("AWS Public Blocks NOT available in configuration")
+                                props = "PrivateDNSName="+i['PrivateDnsName'] + '|' + "PublicDNSName=" + i['PublicDnsName'] + '|' + "InstanceState="+body['detail']['state'] + '|' + "InstanceType="+i['InstanceType'] + "|" + "AvailabilityZone=" + i['Placement']['AvailabilityZone'] + "|"  + "|CloudAtlasSyncTime=" + now + "|" + \
+                                "LaunchTime=" + i['LaunchTime'].strftime("%m/%d/%Y %H:%M:%S") + '|' + "Owner=" + n['OwnerId'] + '|' + 'KeyName=' + keyname + '|' + 'NAMETAG=' + nametag
+                                if i['PrivateIpAddress'] and pubip and publicblocks:
+                                    devips = i['PrivateIpAddress'] + "," + pubip
+                                else:
+                                    devips = i['PrivateIpAddress']
+                                if import_amazon_dns:
+                                    g.user.logger.info(i['InstanceId'], "Deleting the Amazon DNS records Host Records / IPv4 Address for a Running Instance")
+                                    try:
+                                        for objtype in ("IP4Address", "IP6Address", "HostRecord"):
+                                            stuff = conn.custom_search("EC2InstanceID=%s" %i['InstanceId'], objtype)
+                                            for thing in stuff:
+                                                g.user.logger.info(thing, "Deleting")
+                                                thing.delete()
+                                                if dynamic_deployment:
+                                                    DISCOVERYSTATUS = datetime.utcnow().strftime("%m/%d/%Y %H:%M:%S") +" - Selective Deployment"
+                                                    g.user.logger.info("Attempting Selective Deploy")
+                                                    g.user.logger.info(thing,"thing")
+                                                    g.user.logger.info(thing.get_id(),"ID")
+                                                    hostidlist = []
+                                                    hostidlist.append(str(thing.get_id()))
+                                                    g.user.logger.info(hostidlist,"HostID list")
                                                     try:
-                                                        DISCOVERYSTATUS = datetime.utcnow().strftime("%m/%d/%Y %H:%M:%S") +" - Selective Deployment"
-                                                        g.user.logger.info("Attempting Selective Deploy")
-                                                        g.user.logger.info(this.get_property("absoluteName"),"AbsoluteName")
-                                                        hostidlist = []
-                                                        hostidlist.append(str(this.get_id()))
-                                                        g.user.logger.info(hostidlist,"HostID list")
                                                         result = conn.selective_deploy(hostidlist)
-                                                        g.user.logger.info(result,"Selective Deployment Status")
                                                     except Exception as thisexception:
-                                                        g.user.logger.info(thisexception, "Exception Selective Deploy")
-                                                        
-                                        try:
-                                            g.user.logger.info(i['InstanceId'], "Adding stopped EC2 Device")
-                                            conn._api_client.service.addDevice(conf, i['InstanceId'], aws_type, aws_type_ec2, devips, v6_address, props)
-                                        except Exception as thisexception:
-                                            g.user.logger.info(thisexception)
-                                        g.user.logger.info("Updating IPs with InstanceID ....")
-                                        config_entity = conn.get_configuration(config_name)
-                                        if pubip:
-                                            try:
-                                                ip_address_pub = config_entity.get_ip4_address(i['PublicIpAddress'])
-                                                ip_address_pub.set_property("EC2InstanceID", i['InstanceId'])
-                                                ip_address_pub.update()
-                                            except Exception as thisexception:
-                                                g.user.logger.info(thisexception, "Exception Getting Public IPv4")
-                                        if v6_address:
-                                            try:
-                                                ip_address_pub6 = config_entity.get_ip6_address(v6_address)
-                                                ip_address_pub6.set_property("EC2InstanceID", i['InstanceId'])
-                                                ip_address_pub6.update()
-                                            except Exception as thisexception:
-                                                g.user.logger.info(thisexception, "Exception Getting Public IPv6")
+                                                        g.user.logger.info(thisexception)
+                                                    g.user.logger.info(result,"Selective Deployment Status")
+
+                                    except Exception as thisexception:
+                                        g.user.logger.info(thisexception, "Exception Deleting")
+                                try:
+                                    g.user.logger.info(i['InstanceId'], "Adding running EC2 Device")
+                                    conn._api_client.service.addDevice(conf, i['InstanceId'], aws_type, aws_type_ec2, devips, v6_address, props)
+                                except Exception as thisexception:
+                                    g.user.logger.info(thisexception, "Exception Adding Device")
+
+                                g.user.logger.info("Updating IPs with InstanceID ....")
+                                config_entity = conn.get_configuration(config_name)
+                                if pubip:
+                                    try:
+                                        ip_address_pub = config_entity.get_ip4_address(i['PublicIpAddress'])
+                                        ip_address_pub.set_property("EC2InstanceID", i['InstanceId'])
+                                        ip_address_pub.update()
+                                    except Exception as thisexception:
+                                        g.user.logger.info(thisexception, "Exception Getting Public IPv4")
+                                if v6_address:
+                                    try:
+                                        ip_address_pub6 = config_entity.get_ip6_address(v6_address)
+                                        ip_address_pub6.set_property("EC2InstanceID", i['InstanceId'])
+                                        ip_address_pub6.update()
+                                    except Exception as thisexception:
+                                        g.user.logger.info(thisexception, "Exception Getting Public IPv6")
+                                try:
+                                    ip_address_private = config_entity.get_ip4_address(i['PrivateIpAddress'])
+                                    ip_address_private.set_property("EC2InstanceID", i['InstanceId'])
+                                    ip_address_private.update()
+                                except Exception as thisexception:
+                                    g.user.logger.info(thisexception, "Exception Getting Private IP")
+                                nametagdns = nametag.replace(" ","_") # Replace any spaces with hyphen
+                                nametagdns = nametagdns.lower() # convert the nametag to lower case
+                                if (import_amazon_dns and i['PublicDnsName'] and publicblocks and pubip):
+                                    external_view = config_entity.get_view("Amazon DNS External")
+                                    internal_view = config_entity.get_view("Amazon DNS Internal")
+                                    if SQS_QUEUE['TARGETZONE']:
                                         try:
-                                            ip_address_private = config_entity.get_ip4_address(i['PrivateIpAddress'])
-                                            ip_address_private.set_property("EC2InstanceID", i['InstanceId'])
-                                            ip_address_private.update()
-                                        except Exception as thisexception:
-                                            g.user.logger.info(thisexception, "Exception Getting Private IP")
-                                        if nametag:
-                                            DISCOVERYSTATUS = datetime.utcnow().strftime("%m/%d/%Y %H:%M:%S") +" - Stopped " + str(body['detail']['instance-id']) + " (" + nametag + ") in " + SQS_QUEUE['REGION']
-                                        else:
-                                            DISCOVERYSTATUS = datetime.utcnow().strftime("%m/%d/%Y %H:%M:%S") +" - Stopped " + str(body['detail']['instance-id']) + " in " + SQS_QUEUE['REGION']
-
-                                sync_hist_stopped = collections.OrderedDict()
-                                sync_hist_stopped['Region'] = thissyncregion
-                                sync_hist_stopped['Time'] = datetime.utcnow().strftime("%m/%d/%Y %H:%M:%S")
-                                if nametag:
-                                    sync_hist_stopped['EC2'] = i['InstanceId'] + " (" + str(nametag) + ")"
-                                else:
-                                    sync_hist_stopped['EC2'] = i['InstanceId']
-                                sync_hist_stopped['Action'] = "Stopped"
-                                SYNCHISTORY.append((sync_hist_stopped))
-                                STATECHANGES[thissyncregion] = STATECHANGES[thissyncregion] + 1
-
-                                conn.logout()
-
-                            # Handle running EC2 state
-                            elif body['detail']['state'] == "running":
-                                # login to BAM using the API account, do stuff, logout
-                                conn = api.API(bam_url)
-                                conn.login(form.aws_sync_user.data,form.aws_sync_pass.data)
-                                g.user.logger.info('EC2 Instance Running - Updating')
-                                instanceid = body['detail']['instance-id']
-                                instanceid = instanceid.split()
-                                instance = ec2_client.describe_instances(InstanceIds=instanceid)
-                                g.user.logger.info(instance)
-                                DISCOVERYSTATUS = datetime.utcnow().strftime("%m/%d/%Y %H:%M:%S") + " - Starting " + str(body['detail']['instance-id']) + " in " + SQS_QUEUE['REGION']
-                                for r in instance['Reservations']:
-                                    for i in r['Instances']:
-                                        g.user.logger.info(i)
-                                        g.user.logger.info(i['InstanceId'], "Instance ID")
-                                        nametag = get_instance_name(i['InstanceId'],ec2_resource)
-                                        g.user.logger.info(nametag, "Instance Name Tag")
-                                        for n in i['NetworkInterfaces']:
-                                            g.user.logger.info(n['OwnerId'], "OwnerID")
-                                        v6_address = ""
-                                        for n2 in i['NetworkInterfaces']:
-                                            v6_addresses = n2['Ipv6Addresses']
-                                            for v2 in v6_addresses:
-                                                v6_address = v2['Ipv6Address']
-                                                g.user.logger.info(v6_address, "Instance IPv6 address")
-                                        vpc = ec2_resource.Vpc(i['VpcId'])
-                                        vpc_name = ""
-                                        if vpc.tags:
-                                            for tag in vpc.tags:
-                                                if tag['Key'] == "Name":
-                                                    vpc_name = tag['Value']
-                                        if single_config_mode:
-                                            config_name = SQS_QUEUE['CONFIGURATION']
-                                        else:
-                                            if vpc_name:
-                                                config_name = SQS_QUEUE['REGION'] + " - " + i['VpcId'] + " - " + vpc_name
+                                            g.user.logger.info(SQS_QUEUE['TARGETZONE'], "Adding HOST for EC2 instance to target zone")
+                                            if is_valid_hostname(nametag):
+                                                try:
+                                                    public_host_record = external_view.add_host_record(nametagdns + "." + SQS_QUEUE['TARGETZONE'], [str(i['PublicIpAddress'])])
+                                                    thishostname = nametagdns + "." + SQS_QUEUE['TARGETZONE']
+                                                except Exception as thisexception:
+                                                    public_host_record = external_view.add_host_record(nametagdns + "_" + i['InstanceId'] + "." + SQS_QUEUE['TARGETZONE'], [str(i['PublicIpAddress'])])
+                                                    thishostname = nametagdns + "_" + i['InstanceId'] + "." + SQS_QUEUE['TARGETZONE']
                                             else:
-                                                config_name = SQS_QUEUE['REGION'] + " - " + i['VpcId']
-                                        conf_entity = conn.get_configuration(config_name)
-                                        conf = conf_entity.get_id()
-                                        try:
-                                            dev = conn._api_client.service.getEntityByName(conf, i['InstanceId'], "Device")
-                                            g.user.logger.info(dev)
+                                                public_host_record = external_view.add_host_record(str(i['InstanceId']) + "." + SQS_QUEUE['TARGETZONE'], [str(i['PublicIpAddress'])])
+                                                thishostname = str(i['InstanceId']) + "." + SQS_QUEUE['TARGETZONE']
+                                            public_host_record.set_property("EC2InstanceID", str(i['InstanceId']))
+                                            public_host_record.update()
                                         except Exception as thisexception:
                                             g.user.logger.info(thisexception)
-                                        if dev.id != 0:
-                                            g.user.logger.info(i['InstanceId'], "Device in Address Manager")
+                                        if dynamic_deployment:
+                                            DISCOVERYSTATUS = datetime.utcnow().strftime("%m/%d/%Y %H:%M:%S") +" - Selective Deployment"
                                             try:
-                                                g.user.logger.info(i['InstanceId'], "Deleting Device")
-                                                conn._api_client.service.delete(dev.id)
+                                                hostidlist = []
+                                                hostidlist.append(str(public_host_record.get_id()))
+                                                g.user.logger.info(hostidlist,"HostID list")
+                                                result = conn.selective_deploy(hostidlist)
+                                                g.user.logger.info(result,"Selective Deployment Status")
                                             except Exception as thisexception:
                                                 g.user.logger.info(thisexception)
-                                        now = datetime.utcnow().strftime("%m/%d/%Y %H:%M:%S")
-                                        try:
-                                            pubip = i['PublicIpAddress']
-                                            g.user.logger.info("EC2 instance has a public IP")
-                                        except KeyError:
-                                            g.user.logger.info("EC2 instance DOES NOT have a public IP")
-                                            pubip = ""
-                                        try:
-                                            keyname = i['KeyName']
-                                            g.user.logger.info("EC2 instance has SSH Key")
-                                        except KeyError:
-                                            g.user.logger.info("EC2 instance has no SSH Key")
-                                            keyname = ""
-
-                                        for block in awspubs:
-                                            props = "name=" + SQS_QUEUE['REGION'] + " / Public AWS Block"
-                                            try:
-                                                publicblocks = conf_entity.get_entity_by_cidr(block)
-                                            except PortalException:
-                                                publicblocks = None
-                                        if publicblocks:
-                                            g.user.logger.info("AWS Public Blocks in configuration")
-                                        else:
-                                            g.user.logger.info("AWS Public Blocks NOT available in configuration")
-                                        props = "PrivateDNSName="+i['PrivateDnsName'] + '|' + "PublicDNSName=" + i['PublicDnsName'] + '|' + "InstanceState="+body['detail']['state'] + '|' + "InstanceType="+i['InstanceType'] + "|" + "AvailabilityZone=" + i['Placement']['AvailabilityZone'] + "|"  + "|CloudAtlasSyncTime=" + now + "|" + \
-                                        "LaunchTime=" + i['LaunchTime'].strftime("%m/%d/%Y %H:%M:%S") + '|' + "Owner=" + n['OwnerId'] + '|' + 'KeyName=' + keyname + '|' + 'NAMETAG=' + nametag
-                                        if i['PrivateIpAddress'] and pubip and publicblocks:
-                                            devips = i['PrivateIpAddress'] + "," + pubip
-                                        else:
-                                            devips = i['PrivateIpAddress']
-                                        if import_amazon_dns:
-                                            g.user.logger.info(i['InstanceId'], "Deleting the Amazon DNS records Host Records / IPv4 Address for a Running Instance")
-                                            try:
-                                                for objtype in ("IP4Address", "IP6Address", "HostRecord"):
-                                                    stuff = conn.custom_search("EC2InstanceID=%s" %i['InstanceId'], objtype)
-                                                    for thing in stuff:
-                                                        g.user.logger.info(thing, "Deleting")
-                                                        thing.delete()
-                                                        if dynamic_deployment:
-                                                            DISCOVERYSTATUS = datetime.utcnow().strftime("%m/%d/%Y %H:%M:%S") +" - Selective Deployment"
-                                                            g.user.logger.info("Attempting Selective Deploy")
-                                                            g.user.logger.info(thing,"thing")
-                                                            g.user.logger.info(thing.get_id(),"ID")
-                                                            hostidlist = []
-                                                            hostidlist.append(str(thing.get_id()))
-                                                            g.user.logger.info(hostidlist,"HostID list")
-                                                            try:
-                                                                result = conn.selective_deploy(hostidlist)
-                                                            except Exception as thisexception:
-                                                                g.user.logger.info(thisexception)
-                                                            g.user.logger.info(result,"Selective Deployment Status")
 
-                                            except Exception as thisexception:
-                                                g.user.logger.info(thisexception, "Exception Deleting")
+                                    try:
+                                        g.user.logger.info(SQS_QUEUE['TARGETZONE'], "Adding default HOST for EC2 instance")
+                                        public_host_record = external_view.add_host_record(i['PublicDnsName'] , [str(i['PublicIpAddress'])])
+                                        public_host_record.set_property("EC2InstanceID", str(i['InstanceId']))
+                                        public_host_record.update()
+                                    except Exception as thisexception:
+                                        g.user.logger.info(thisexception)
+                                    if dynamic_deployment:
                                         try:
-                                            g.user.logger.info(i['InstanceId'], "Adding running EC2 Device")
-                                            conn._api_client.service.addDevice(conf, i['InstanceId'], aws_type, aws_type_ec2, devips, v6_address, props)
+                                            hostidlist = []
+                                            hostidlist.append(str(public_host_record.get_id()))
+                                            g.user.logger.info(hostidlist,"HostID list")
+                                            result = conn.selective_deploy(hostidlist)
+                                            g.user.logger.info(result,"Selective Deployment Status")
                                         except Exception as thisexception:
-                                            g.user.logger.info(thisexception, "Exception Adding Device")
-
-                                        g.user.logger.info("Updating IPs with InstanceID ....")
-                                        config_entity = conn.get_configuration(config_name)
-                                        if pubip:
-                                            try:
-                                                ip_address_pub = config_entity.get_ip4_address(i['PublicIpAddress'])
-                                                ip_address_pub.set_property("EC2InstanceID", i['InstanceId'])
-                                                ip_address_pub.update()
-                                            except Exception as thisexception:
-                                                g.user.logger.info(thisexception, "Exception Getting Public IPv4")
-                                        if v6_address:
-                                            try:
-                                                ip_address_pub6 = config_entity.get_ip6_address(v6_address)
-                                                ip_address_pub6.set_property("EC2InstanceID", i['InstanceId'])
-                                                ip_address_pub6.update()
-                                            except Exception as thisexception:
-                                                g.user.logger.info(thisexception, "Exception Getting Public IPv6")
+                                            g.user.logger.info(thisexception)
+                                if (import_amazon_dns and i['PrivateDnsName'] and body['detail']['state'] == 'running'):
+                                    internal_view = config_entity.get_view("Amazon DNS Internal")
+                                    if SQS_QUEUE['TARGETZONE']:
                                         try:
-                                            ip_address_private = config_entity.get_ip4_address(i['PrivateIpAddress'])
-                                            ip_address_private.set_property("EC2InstanceID", i['InstanceId'])
-                                            ip_address_private.update()
+                                            g.user.logger.info(SQS_QUEUE['REGION'] + "." + SQS_QUEUE['TARGETZONE'], "Adding HOST record for EC2 instance to target zone")
+                                            a_record = internal_view.add_host_record(str(nametagdns) + "." + SQS_QUEUE['REGION'] + "." + SQS_QUEUE['TARGETZONE'], [str(i['PrivateIpAddress'])])
+                                            a_record.set_property("EC2InstanceID", str(i['InstanceId']))
+                                            a_record.update()
                                         except Exception as thisexception:
-                                            g.user.logger.info(thisexception, "Exception Getting Private IP")
-                                        nametagdns = nametag.replace(" ","_") # Replace any spaces with hyphen
-                                        nametagdns = nametagdns.lower() # convert the nametag to lower case
-                                        if (import_amazon_dns and i['PublicDnsName'] and publicblocks and pubip):
-                                            external_view = config_entity.get_view("Amazon DNS External")
-                                            internal_view = config_entity.get_view("Amazon DNS Internal")
-                                            if SQS_QUEUE['TARGETZONE']:
-                                                try:
-                                                    g.user.logger.info(SQS_QUEUE['TARGETZONE'], "Adding HOST for EC2 instance to target zone")
-                                                    if is_valid_hostname(nametag):
-                                                        try:
-                                                            public_host_record = external_view.add_host_record(nametagdns + "." + SQS_QUEUE['TARGETZONE'], [str(i['PublicIpAddress'])])
-                                                            thishostname = nametagdns + "." + SQS_QUEUE['TARGETZONE']
-                                                        except Exception as thisexception:
-                                                            public_host_record = external_view.add_host_record(nametagdns + "_" + i['InstanceId'] + "." + SQS_QUEUE['TARGETZONE'], [str(i['PublicIpAddress'])])
-                                                            thishostname = nametagdns + "_" + i['InstanceId'] + "." + SQS_QUEUE['TARGETZONE']
-                                                    else:
-                                                        public_host_record = external_view.add_host_record(str(i['InstanceId']) + "." + SQS_QUEUE['TARGETZONE'], [str(i['PublicIpAddress'])])
-                                                        thishostname = str(i['InstanceId']) + "." + SQS_QUEUE['TARGETZONE']
-                                                    public_host_record.set_property("EC2InstanceID", str(i['InstanceId']))
-                                                    public_host_record.update()
-                                                except Exception as thisexception:
-                                                    g.user.logger.info(thisexception)
-                                                if dynamic_deployment:
-                                                    DISCOVERYSTATUS = datetime.utcnow().strftime("%m/%d/%Y %H:%M:%S") +" - Selective Deployment"
-                                                    try:
-                                                        hostidlist = []
-                                                        hostidlist.append(str(public_host_record.get_id()))
-                                                        g.user.logger.info(hostidlist,"HostID list")
-                                                        result = conn.selective_deploy(hostidlist)
-                                                        g.user.logger.info(result,"Selective Deployment Status")
-                                                    except Exception as thisexception:
-                                                        g.user.logger.info(thisexception)
-
                                             try:
-                                                g.user.logger.info(SQS_QUEUE['TARGETZONE'], "Adding default HOST for EC2 instance")
-                                                public_host_record = external_view.add_host_record(i['PublicDnsName'] , [str(i['PublicIpAddress'])])
-                                                public_host_record.set_property("EC2InstanceID", str(i['InstanceId']))
-                                                public_host_record.update()
-                                            except Exception as thisexception:
-                                                g.user.logger.info(thisexception)
-                                            if dynamic_deployment:
-                                                try:
-                                                    hostidlist = []
-                                                    hostidlist.append(str(public_host_record.get_id()))
-                                                    g.user.logger.info(hostidlist,"HostID list")
-                                                    result = conn.selective_deploy(hostidlist)
-                                                    g.user.logger.info(result,"Selective Deployment Status")
-                                                except Exception as thisexception:
-                                                    g.user.logger.info(thisexception)
-                                        if (import_amazon_dns and i['PrivateDnsName'] and body['detail']['state'] == 'running'):
-                                            internal_view = config_entity.get_view("Amazon DNS Internal")
-                                            if SQS_QUEUE['TARGETZONE']:
-                                                try:
-                                                    g.user.logger.info(SQS_QUEUE['REGION'] + "." + SQS_QUEUE['TARGETZONE'], "Adding HOST record for EC2 instance to target zone")
-                                                    a_record = internal_view.add_host_record(str(nametagdns) + "." + SQS_QUEUE['REGION'] + "." + SQS_QUEUE['TARGETZONE'], [str(i['PrivateIpAddress'])])
-                                                    a_record.set_property("EC2InstanceID", str(i['InstanceId']))
-                                                    a_record.update()
-                                                except Exception as thisexception:
-                                                    try:
-                                                        a_record = internal_view.add_host_record(str(nametagdns) + "_" + str(i['InstanceId']) + "." + SQS_QUEUE['REGION'] + "." + SQS_QUEUE['TARGETZONE'], [str(i['PrivateIpAddress'])])
-                                                        a_record.set_property("EC2InstanceID", str(i['InstanceId']))
-                                                        a_record.update()
-                                                    except Exception as thisexception:
-                                                        g.user.logger.info(thisexception)
-                                            try:
-                                                g.user.logger.info(SQS_QUEUE['REGION'] + "." + SQS_QUEUE['TARGETZONE'], "Adding default HOST record for EC2 instance to default private zone")
-                                                a_record = internal_view.add_host_record(str(i['PrivateDnsName']), [str(i['PrivateIpAddress'])])
+                                                a_record = internal_view.add_host_record(str(nametagdns) + "_" + str(i['InstanceId']) + "." + SQS_QUEUE['REGION'] + "." + SQS_QUEUE['TARGETZONE'], [str(i['PrivateIpAddress'])])
                                                 a_record.set_property("EC2InstanceID", str(i['InstanceId']))
                                                 a_record.update()
                                             except Exception as thisexception:
                                                 g.user.logger.info(thisexception)
-                                if nametag:
-                                    DISCOVERYSTATUS = datetime.utcnow().strftime("%m/%d/%Y %H:%M:%S") +" - Started " + str(body['detail']['instance-id']) + " (" + nametag + ") in " + SQS_QUEUE['REGION']
-                                else:
-                                    DISCOVERYSTATUS = datetime.utcnow().strftime("%m/%d/%Y %H:%M:%S") +" - Started " + str(body['detail']['instance-id']) + " in " + SQS_QUEUE['REGION']
+                                    try:
+                                        g.user.logger.info(SQS_QUEUE['REGION'] + "." + SQS_QUEUE['TARGETZONE'], "Adding default HOST record for EC2 instance to default private zone")
+                                        a_record = internal_view.add_host_record(str(i['PrivateDnsName']), [str(i['PrivateIpAddress'])])
+                                        a_record.set_property("EC2InstanceID", str(i['InstanceId']))
+                                        a_record.update()
+                                    except Exception as thisexception:
+                                        g.user.logger.info(thisexception)
+                        if nametag:
+                            DISCOVERYSTATUS = datetime.utcnow().strftime("%m/%d/%Y %H:%M:%S") +" - Started " + str(body['detail']['instance-id']) + " (" + nametag + ") in " + SQS_QUEUE['REGION']
+                        else:
+                            DISCOVERYSTATUS = datetime.utcnow().strftime("%m/%d/%Y %H:%M:%S") +" - Started " + str(body['detail']['instance-id']) + " in " + SQS_QUEUE['REGION']
+
+                        sync_hist_running = collections.OrderedDict()
+                        sync_hist_running['Region'] = thissyncregion
+                        sync_hist_running['Time'] = datetime.utcnow().strftime("%m/%d/%Y %H:%M:%S")
+                        if nametag:
+                            sync_hist_running['EC2'] = i['InstanceId'] + " (" + str(nametag) + ")"
+                        else:
+                            sync_hist_running['EC2'] = i['InstanceId']
+                        sync_hist_running['Action'] = "Started"
+                        SYNCHISTORY.append((sync_hist_running))
+                        with STATECHANGES_LOCK:
+                            STATECHANGES[thissyncregion] = STATECHANGES[thissyncregion] + 1
+
+                        conn.logout()
+
+                def handle_event(body):
+                    with app.app_context():
+                        g.user = u
+                        try:
+                            handle_state_change(body)
+                        except Exception as thisexception:
+                            g.user.logger.info(str(thisexception), "Exception handling state change")
+                            raise
 
-                                sync_hist_running = collections.OrderedDict()
-                                sync_hist_running['Region'] = thissyncregion
-                                sync_hist_running['Time'] = datetime.utcnow().strftime("%m/%d/%Y %H:%M:%S")
-                                if nametag:
-                                    sync_hist_running['EC2'] = i['InstanceId'] + " (" + str(nametag) + ")"
-                                else:
-                                    sync_hist_running['EC2'] = i['InstanceId']
-                                sync_hist_running['Action'] = "Started"
-                                SYNCHISTORY.append((sync_hist_running))
-                                STATECHANGES[thissyncregion] = STATECHANGES[thissyncregion] + 1
+                consumer = SQSConsumer(sqs, SQS_QUEUE['QUEUE'], handle_event)
+                CONSUMERS[thissyncregion] = consumer
 
-                                conn.logout()
-                            sqs.delete_message(QueueUrl=SQS_QUEUE['QUEUE'], ReceiptHandle=message['ReceiptHandle']) # Delete Processed Message from queue
-                    else:
-                        g.user.logger.info("No updates in queue")
+
+                while True:
+                    if not JOB:
+                        DISCOVERYSTATUS = datetime.utcnow().strftime("%m/%d/%Y %H:%M:%S") + " - Visibility Terminated for " + SQS_QUEUE['REGION']
+                        sync_hist_halt = collections.OrderedDict()
+                        sync_hist_halt['Region'] = thissyncregion
+                        sync_hist_halt['Time'] = datetime.utcnow().strftime("%m/%d/%Y %H:%M:%S")
+                        sync_hist_halt['EC2'] = "Visibility"
+                        sync_hist_halt['Action'] = "Terminated"
+                        SYNCHISTORY.append((sync_hist_halt))
+                        consumer.close()
+                        if CONSUMERS.get(thissyncregion) is consumer:
+                            del CONSUMERS[thissyncregion]
+                        JOBS = []
+                        return
+
+                    g.user = u
+
+                    # Check the SQS session expiration
+                    timenow = datetime.now(timezone.utc)
+                    timeexpire = sts_client["Credentials"]["Expiration"]
+                    time_difference = timeexpire - timenow
+                    expiration_timer = time_difference_in_minutes = time_difference / timedelta(minutes=1)
+                    if expiration_timer < 1:
+                        g.user.logger.info("SQS Session - Less than 1 minutes till session expiration")
+                        g.user.logger.info("SQS Session - Refreshing session....")
+                        try:
+                            sts_client, sqs, sqs_resource, aws_sqs_queue, ec2_client, ec2_resource = connect_sqs(service_access_key, service_secret_key, SQS_QUEUE['REGION'])
+                        except Exception as thisexception:
+                            g.user.logger.info(thisexception)
+
+                    # Receive, coalesce and process the next batch of messages from the SQS queue
+                    consumer.sqs_client = sqs
+                    try:
+                        g.user.logger.info('Checking SQS queue {} for messages'.format(SQS_QUEUE['QUEUE']))
+                        if not consumer.poll():
+                            g.user.logger.info("No updates in queue")
+                    except Exception as thisexception:
+                        g.user.logger.info(str(thisexception), "Exception receiving message")
+                        if "expired_token" in str(thisexception):
+                            g.user.logger.info("Refresh of AWS session required")
 
 
 
@@ -890,11 +911,7 @@ def aws_aws_page_form():
 
 
 
-        if form.aws_sync_start.data:
-            return render_template('aws_page.html', form=form, text=util.get_text(module_path(), config.language), options=g.user.get_options(), )
-        else:
-            DISCOVERYSTATUS = datetime.utcnow().strftime("%m/%d/%Y %H:%M:%S") + " - Completed Discovery of " + str(aws_region_name)
-            return render_template('aws_page.html', form=form, text=util.get_text(module_path(), config.language), options=g.user.get_options(), )
+        return render_template('aws_page.html', form=form, text=util.get_text(module_path(), config.language), options=g.user.get_options(), )
     else:
         DISCOVERYSTATUS = datetime.utcnow().strftime("%m/%d/%Y %H:%M:%S") + " - ERROR: AWS Credentials Missing or Incorrect"
         return render_template('aws_page.html', form=form, text=util.get_text(module_path(), config.language), options=g.user.get_options(), )
@@ -970,23 +987,139 @@ def get_device(config_id, device_name):
         device = get_api().instantiate_entity(response)
     return device
 
+# Build the list of regions to discover from the selected region and any additional regions
+def get_discovery_regions(selected_region, additional_regions):
+    """Return the de-duplicated list of AWS regions to discover"""
+    regions = [selected_region]
+    for region in (additional_regions or "").split(","):
+        region = region.strip()
+        if region and region not in regions:
+            regions.append(region)
+    return regions
+
+# boto3 credential arguments for the current discovery session
+def aws_credentials():
+    """Return boto3 credential keyword arguments"""
+    credentials = {'aws_access_key_id': aws_access_key_id, 'aws_secret_access_key': aws_secret_access_key}
+    if assume_role or mfa:
+        credentials['aws_session_token'] = aws_session_token
+    return credentials
+
+# Record per-region discovery progress, served alongside DISCOVERY_STATS
+def discovery_progress(region, stage, done="", total=""):
+    """Update the discovery progress row for a region"""
+    d_progress = collections.OrderedDict()
+    d_progress['Region'] = region
+    d_progress['Time'] = datetime.utcnow().strftime("%m/%d/%Y %H:%M:%S")
+    d_progress['Infrastructure'] = "Discovery Progress - " + stage
+    d_progress['count'] = "{done}/{total}".format(done=done, total=total) if total != "" else ""
+    DISCOVERY_PROGRESS[region] = d_progress
+
+# Cached lookups of the BAM entities shared by many AWS resources during a discovery run
+def cached_configuration(cache, config_name):
+    """Get or create an Amazon Web Services configuration"""
+    def create():
+        conf = get_api().create_configuration(config_name)
+        conf.set_property('configurationGroup', 'Amazon Web Services')
+        conf.update()
+        return conf
+    return cache.get_or_create('Configuration', 0, config_name, lambda: get_api().get_configuration(config_name), create)
+
+def cached_view(cache, config_entity, view_name):
+    """Get or create a DNS view in a configuration"""
+    return cache.get_or_create('View', config_entity.get_id(), view_name, lambda: config_entity.get_view(view_name), lambda: config_entity.add_view(view_name))
+
+def cached_block(cache, config_entity, cidr, props):
+    """Get or create an IPv4 block in a configuration"""
+    return cache.get_or_create('IP4Block', config_entity.get_id(), cidr, lambda: config_entity.get_entity_by_cidr(cidr), lambda: config_entity.add_ip4_block_by_cidr(cidr, properties=props))
+
+def cached_network(cache, config_entity, blk, cidr, props):
+    """Get or create an IPv4 network in a block"""
+    return cache.get_or_create('IP4Network', config_entity.get_id(), cidr, lambda: config_entity.get_entity_by_cidr(cidr), lambda: blk.add_ip4_network(cidr, props))
+
+# Add the BAM entity cache hit/miss counts of a region to the discovery_stats
+def record_cache_stats(region, cache, hits_before, misses_before):
+    """Record cache hits (saved BAM round trips) and misses for a region"""
+    global DISCOVERY_STATS
+    hits, misses = cache.stats()
+    d_hits = collections.OrderedDict()
+    d_hits['Region'] = region
+    d_hits['Time'] = datetime.utcnow().strftime("%m/%d/%Y %H:%M:%S")
+    d_hits['Infrastructure'] = "BAM Entity Cache Hits"
+    d_hits['count'] = hits - hits_before
+    DISCOVERY_STATS.append((d_hits))
+    d_misses = collections.OrderedDict()
+    d_misses['Region'] = region
+    d_misses['Time'] = datetime.utcnow().strftime("%m/%d/%Y %H:%M:%S")
+    d_misses['Infrastructure'] = "BAM Entity Cache Misses"
+    d_misses['count'] = misses - misses_before
+    DISCOVERY_STATS.append((d_misses))
+
+# Collect AWS inventory for all regions in parallel, then import each region into BAM
+def run_discovery(form, regions, resources, aws_type, ec2_subtype, elbv2_subtype):
+    """Run a multi-region discovery"""
+    global DISCOVERYSTATUS
+    DISCOVERY_PROGRESS.clear()
+    DISCOVERYSTATUS = datetime.utcnow().strftime("%m/%d/%Y %H:%M:%S") + " - Collecting AWS inventory for " + ", ".join(regions)
+    engine = DiscoveryEngine(aws_credentials(), progress=discovery_progress)
+    inventories = engine.collect(regions, resources)
+    failed_regions = []
+    cache = EntityCache(miss_exceptions=(PortalException, BAMException))
+
+    for region in regions:
+        inventory = inventories[region]
+        hits, misses = cache.stats()
+
+        # AWS VPC Discovery
+        if form.aws_vpc_import.data:
+            if single_config_mode and form.aws_public_blocks.data:
+                discovery_progress(region, 'AWS Public Blocks')
+                importawspublic(form.configuration.data, region)
+            # Create the required BAM configurations
+            if not discovervpcs(region, inventory, cache):
+                discovery_progress(region, 'Failed')
+                failed_regions.append(region)
+                continue
+
+        # AWS EC2 Discovery
+        if form.aws_ec2_import.data:
+            discoverec2(aws_type, ec2_subtype, region, inventory, cache)
+
+        # AWS ELBv2 Discovery
+        if form.aws_elbv2_import.data:
+            discoverelbv2(aws_type, elbv2_subtype, region, inventory, cache)
+        discovery_progress(region, 'Completed')
+        record_cache_stats(region, cache, hits, misses)
+
+    # AWS Route53 Discovery
+    if form.aws_route53_import.data:
+        discoverr53()
+
+    if failed_regions:
+        DISCOVERYSTATUS = datetime.utcnow().strftime("%m/%d/%Y %H:%M:%S") + " - Completed Discovery, ERROR in " + ", ".join(failed_regions)
+    else:
+        DISCOVERYSTATUS = datetime.utcnow().strftime("%m/%d/%Y %H:%M:%S") + " - Completed Discovery of " + ", ".join(regions)
+
 # Import AWS public address space
-def importawspublic(targetconfiguration):
+def importawspublic(targetconfiguration, region):
     """Import Public AWS address space into BAM"""
     global DISCOVERYSTATUS,DISCOVERY_STATS
-    DISCOVERYSTATUS = "Discovering AWS Public Blocks for " + aws_region_name
+    DISCOVERYSTATUS = "Discovering AWS Public Blocks for " + region
     try:
         conf = get_api().get_configuration(targetconfiguration)
     except PortalException:
         conf = get_api().create_configuration(targetconfiguration)
     conf.set_property('configurationGroup', 'Amazon Web Services')
     conf.update()
-    awspublicv4 = awsblocks(aws_region_name)
-    awspublicv6 = awsblocks6(aws_region_name)
+    PREFIX_STORE.refresh()
+    with PUBLIC_BLOCKS_LOCK:
+        PUBLIC_BLOCKS.clear()
+    awspublicv4 = awsblocks(region)
+    awspublicv6 = awsblocks6(region)
 
     # Add IPv4 public block count to discovery_stats
     d_pub_v4 = collections.OrderedDict()
-    d_pub_v4['Region'] = aws_region_name
+    d_pub_v4['Region'] = region
     d_pub_v4['Time'] = datetime.utcnow().strftime("%m/%d/%Y %H:%M:%S")
     d_pub_v4['Infrastructure'] = "AWS IPv4 Public Blocks"
     d_pub_v4['count'] = len(awspublicv4)
@@ -994,14 +1127,14 @@ def importawspublic(targetconfiguration):
 
     # Add IPv6 public block count to discovery_stats
     d_pub_v6 = collections.OrderedDict()
-    d_pub_v6['Region'] = aws_region_name
+    d_pub_v6['Region'] = region
     d_pub_v6['Time'] = datetime.utcnow().strftime("%m/%d/%Y %H:%M:%S")
     d_pub_v6['Infrastructure'] = "AWS IPv6 Public Blocks"
     d_pub_v6['count'] = len(awspublicv6)
     DISCOVERY_STATS.append((d_pub_v6))
 
     for block4 in awspublicv4:
-        props = "name=" + aws_region_name + " / Public AWS Block"
+        props = "name=" + region + " / Public AWS Block"
         try:
             blk = conf.get_entity_by_cidr(block4)
         except PortalException:
@@ -1018,63 +1151,64 @@ def importawspublic(targetconfiguration):
             except:
                 pass
     for block6 in awspublicv6:
-        props = "name=" + aws_region_name + " / Public AWS Block"
+        props = "name=" + region + " / Public AWS Block"
         try:
             parentblock = conf.get_ip6_global_unicast_block()
             parentblock.get_ip6_block_by_prefix(block6)
         except Exception as thisexception:
             if 'No IP6Block found with prefix' in str(thisexception):
-                parentblock.add_ip6_block_by_prefix(block6, block_name=aws_region_name + "/ Public AWS Block")
+                parentblock.add_ip6_block_by_prefix(block6, block_name=region + "/ Public AWS Block")
 
-# Download AWS ip-ranges and filter to IPv4 EC2 prefix blocks
+# AWS ip-ranges filtered to IPv4 EC2 prefix blocks, served from the local prefix store
 def awsblocks(target_region):
     """Get IPv4 block prefixes from AWS"""
-    ip_ranges = requests.get('https://ip-ranges.amazonaws.com/ip-ranges.json').json()['prefixes']
-    ec2_ips = [item['ip_prefix'] for item in ip_ranges if item["service"] == "EC2"]
-    region_ips = [item['ip_prefix'] for item in ip_ranges if item["region"] == target_region]
-    amazon_ips_ec2 = []
-    for ips in ec2_ips:
-        if ips in region_ips:
-            amazon_ips_ec2.append(ips)
-    return amazon_ips_ec2
-
-# Download AWS ip-ranges and filter to IPv6 EC2 prefix blocks
+    return PREFIX_STORE.blocks(target_region, 'EC2', 4)
+
+# AWS ip-ranges filtered to IPv6 EC2 prefix blocks, served from the local prefix store
 def awsblocks6(target_region):
     """Get IPv6 block prefixes from AWS"""
-    ip_ranges = requests.get('https://ip-ranges.amazonaws.com/ip-ranges.json').json()['ipv6_prefixes']
-    ec2_ips = [item['ipv6_prefix'] for item in ip_ranges if item["service"] == "EC2"]
-    region_ips = [item['ipv6_prefix'] for item in ip_ranges if item["region"] == target_region]
-    amazon_ips_ec2 = []
-    for ips in ec2_ips:
-        if ips in region_ips:
-            amazon_ips_ec2.append(ips)
-    return amazon_ips_ec2
+    return PREFIX_STORE.blocks(target_region, 'EC2', 6)
+
+# Find the AWS public block containing an IP address in a BAM configuration
+def get_public_block(conf_entity, ip, region):
+    """Return the BAM entity ID of the AWS public block containing ip, looked up once per configuration"""
+    block = PREFIX_STORE.find(ip, region)
+    if block is None:
+        return None
+    key = (conf_entity.get_id(), block)
+    with PUBLIC_BLOCKS_LOCK:
+        if key in PUBLIC_BLOCKS:
+            return PUBLIC_BLOCKS[key]
+    try:
+        entity = conf_entity.get_entity_by_cidr(block)
+        block_id = entity.get_id() if entity is not None else None
+    except PortalException:
+        block_id = None
+    with PUBLIC_BLOCKS_LOCK:
+        PUBLIC_BLOCKS[key] = block_id
+    return block_id
 
 # Import Private VPCs
-def discovervpcs():
+def discovervpcs(region, inventory, cache):
     """ import private vpcs into """
     form = GenericFormTemplate()
     global DISCOVERYSTATUS,DISCOVERY_STATS
-    if assume_role or mfa:
-        ec2 = boto3.resource('ec2', region_name=aws_region_name, aws_access_key_id=aws_access_key_id, aws_secret_access_key=aws_secret_access_key, aws_session_token=aws_session_token)
-        client = boto3.client('ec2', region_name=aws_region_name, aws_access_key_id=aws_access_key_id, aws_secret_access_key=aws_secret_access_key, aws_session_token=aws_session_token)
-    else:
-        ec2 = boto3.resource('ec2', region_name=aws_region_name, aws_access_key_id=aws_access_key_id, aws_secret_access_key=aws_secret_access_key)
-        client = boto3.client('ec2', region_name=aws_region_name, aws_access_key_id=aws_access_key_id, aws_secret_access_key=aws_secret_access_key)
-    try:
-        vpcs = list(ec2.vpcs.filter())
-    except Exception as thisexception:
+    if inventory.get('vpcs') is None:
+        thisexception = inventory['errors'].get('vpcs', '')
         g.user.logger.info(str(thisexception).lower(), "DescribeVPC Exception")
         if "aws was not able to validate the provided access credentials" in str(thisexception).lower():
             DISCOVERYSTATUS = datetime.utcnow().strftime("%m/%d/%Y %H:%M:%S") + " - ERROR Authentication, check AWS API parameters"
-            return False
         elif "you are not authorized to perform this operation" in str(thisexception).lower():
             DISCOVERYSTATUS = datetime.utcnow().strftime("%m/%d/%Y %H:%M:%S") + " - ERROR Authentication, you are not authorised to Describe VPCs"
-            return False
+        else:
+            DISCOVERYSTATUS = datetime.utcnow().strftime("%m/%d/%Y %H:%M:%S") + " - ERROR Describing VPCs in " + region
+        return False
+    vpcs = inventory['vpcs']
+    subnets = inventory.get('subnets') or {}
 
     # Add the number of VPCs to the discovery_stats
     d_vpcs = collections.OrderedDict()
-    d_vpcs['Region'] = aws_region_name
+    d_vpcs['Region'] = region
     d_vpcs['Time'] = datetime.utcnow().strftime("%m/%d/%Y %H:%M:%S")
     d_vpcs['Infrastructure'] = 'VPCs'
     d_vpcs['count'] = len(vpcs)
@@ -1082,61 +1216,47 @@ def discovervpcs():
 
     # Add the number of VPC Subnets to the discovery_stats
     d_subs = collections.OrderedDict()
-    d_subs['Region'] = aws_region_name
+    d_subs['Region'] = region
     d_subs['Time'] = datetime.utcnow().strftime("%m/%d/%Y %H:%M:%S")
     d_subs['Infrastructure'] = 'VPC Subnets'
-
-    subs_count = 0
-    for v in vpcs:
-        subs = list(v.subnets.all())
-        subs_count = subs_count + len(subs)
-    d_subs['count'] = subs_count
+    d_subs['count'] = len(subnets)
     DISCOVERY_STATS.append((d_subs))
 
-    for vpc in vpcs:
-        DISCOVERYSTATUS = "Discovering AWS VPCs"
-        vpc_name = ""
+    # Group the bulk fetched subnets by VPC
+    vpc_subnets = collections.defaultdict(list)
+    for subnet in subnets.values():
+        vpc_subnets[subnet['VpcId']].append(subnet)
+
+    for index, vpc in enumerate(vpcs.values(), 1):
+        DISCOVERYSTATUS = "Discovering AWS VPCs in " + region
+        discovery_progress(region, 'VPCs', index, len(vpcs))
+        vpc_id = vpc['VpcId']
+        vpc_name = get_name_tag(vpc.get('Tags'))
         v6_block = ""
-        # Get the VPC name if set
-        if vpc.tags:
-            for tag in vpc.tags:
-                if tag['Key'] == "Name":
-                    vpc_name = tag['Value']
         if single_config_mode:
-            try:
-                config_name = get_api().get_configuration(form.configuration.data)
-                config_name = config_name.name
-            except PortalException:
-                config_name = get_api().create_configuration(form.configuration.data)
-                config_name = config_name.name
+            config_name = form.configuration.data
         else:
             if vpc_name:
-                config_name = aws_region_name + " - " + vpc.id + " - " + vpc_name
+                config_name = region + " - " + vpc_id + " - " + vpc_name
             else:
-                config_name = aws_region_name + " - " + vpc.id
+                config_name = region + " - " + vpc_id
         # Get the IPv6 block for the VPC if defined
-        if vpc.ipv6_cidr_block_association_set:
-            for vdata in vpc.ipv6_cidr_block_association_set:
-                v6_block = vdata['Ipv6CidrBlock']
-        try:
-            conf = get_api().get_configuration(config_name)
-        except PortalException:
-            conf = get_api().create_configuration(config_name)
-        conf.set_property('configurationGroup', 'Amazon Web Services')
-        conf.update()
+        for vdata in vpc.get('Ipv6CidrBlockAssociationSet', []):
+            v6_block = vdata['Ipv6CidrBlock']
+        conf = cached_configuration(cache, config_name)
 
         # Import AWS IPv4 and IPv6 public block - Dynamic Configuration Mode Only - for each VPC config
         if form.aws_public_blocks.data and not single_config_mode:
             DISCOVERYSTATUS = "Discovering AWS Public Blocks"
-            importawspublic(config_name)
+            importawspublic(config_name, region)
 
         # Add IPv4 VPC block to BAM
         if vpc_name:
-            props = "name=" + aws_region_name + " / " + vpc.id + " / " + vpc_name
+            props = "name=" + region + " / " + vpc_id + " / " + vpc_name
         else:
-            props = "name=" + aws_region_name + " / " + vpc.id
+            props = "name=" + region + " / " + vpc_id
         try:
-            blk = conf.add_ip4_block_by_cidr(vpc.cidr_block, properties=props)
+            blk = conf.add_ip4_block_by_cidr(vpc['CidrBlock'], properties=props)
         except BAMException as thisexception:
             if 'duplicate' not in str(thisexception).lower():
                 raise thisexception
@@ -1156,99 +1276,84 @@ def discovervpcs():
                 g.user.logger.info(ip6,"Block")
                 blkv6 = conf.get_ip_range_by_ip('',ip6)
 
-        for subnet in vpc.subnets.all():
-            response = client.describe_subnets(SubnetIds=[subnet.id,])
-            data = response['Subnets']
-            for dat in data:
-                DISCOVERYSTATUS = "Discovering VPC Subnets"
-                availablityzone = dat['AvailabilityZone']
-                cidrblock = dat['CidrBlock']
-                subnetv6 = dat['Ipv6CidrBlockAssociationSet']
-                v6sub = ""
-                try:
-                    for dic in subnetv6:
-                        if 'Ipv6CidrBlock' in dic:
-                            v6sub = dic['Ipv6CidrBlock']
-                            g.user.logger.info(v6sub,"Sub")
-                except AttributeError:
-                    pass
-                subnetd = ec2.Subnet(subnet.id)
-                subnet_name = ""
-                if subnetd.tags:
-                    for tag in subnetd.tags:
-                        if tag['Key'] == "Name":
-                            subnet_name = tag['Value']
-                if subnet_name:
-                    props = "name=" + subnet.id + " - " + availablityzone + ' - ' + subnet_name
-                else:
-                    props = "name=" + subnet.id + " - " + availablityzone
-                blk = conf.get_entity_by_cidr(vpc.cidr_block)
-                try:
-                    sub = blk.add_ip4_network(cidrblock, props)
-                except BAMException as thisexception:
-                    sub = blk.get_entity_by_cidr(cidrblock, entity_type='IP4Network')
+        for dat in vpc_subnets[vpc_id]:
+            DISCOVERYSTATUS = "Discovering VPC Subnets in " + region
+            availablityzone = dat['AvailabilityZone']
+            cidrblock = dat['CidrBlock']
+            v6sub = ""
+            for dic in dat.get('Ipv6CidrBlockAssociationSet', []):
+                if 'Ipv6CidrBlock' in dic:
+                    v6sub = dic['Ipv6CidrBlock']
+                    g.user.logger.info(v6sub,"Sub")
+            subnet_name = get_name_tag(dat.get('Tags'))
+            if subnet_name:
+                props = "name=" + dat['SubnetId'] + " - " + availablityzone + ' - ' + subnet_name
+            else:
+                props = "name=" + dat['SubnetId'] + " - " + availablityzone
+            blk = cached_block(cache, conf, vpc['CidrBlock'], props)
+            try:
+                sub = blk.add_ip4_network(cidrblock, props)
+            except BAMException as thisexception:
+                sub = blk.get_entity_by_cidr(cidrblock, entity_type='IP4Network')
 
-                # Reserve AWS VPC Fixed address in VPC Subnets
-                # See https://docs.aws.amazon.com/vpc/latest/userguide/VPC_Subnets.html
+            # Reserve AWS VPC Fixed address in VPC Subnets
+            # See https://docs.aws.amazon.com/vpc/latest/userguide/VPC_Subnets.html
+            try:
+                # First free address is Amazon DNS
+                first = sub.get_first_addresses(1)
+                first2 = ipaddress.IPv4Address(first[0])+2
+                first3 = ipaddress.IPv4Address(first[0])+3
+                amazondns = sub.assign_ip4_address(first2,"", "", "MAKE_RESERVED", properties='')
+                # Next Available address is Amazon DHCP
+                amazondns.set_name("Reserved by AWS DNS")
+                amazondns.update()
+                amazondhcp = sub.assign_ip4_address(first3,"", "", "MAKE_RESERVED", properties='')
+                amazondhcp.set_name("Reserved by AWS Future")
+                amazondhcp.update()
+            except BAMException as thisexception:
+                if 'duplicate' not in str(thisexception).lower():
+                    raise thisexception
+
+            if v6sub and blkv6:
                 try:
-                    # First free address is Amazon DNS
-                    first = sub.get_first_addresses(1)
-                    first2 = ipaddress.IPv4Address(first[0])+2
-                    first3 = ipaddress.IPv4Address(first[0])+3
-                    amazondns = sub.assign_ip4_address(first2,"", "", "MAKE_RESERVED", properties='')
-                    # Next Available address is Amazon DHCP
-                    amazondns.set_name("Reserved by AWS DNS")
-                    amazondns.update()
-                    amazondhcp = sub.assign_ip4_address(first3,"", "", "MAKE_RESERVED", properties='')
-                    amazondhcp.set_name("Reserved by AWS Future")
-                    amazondhcp.update()
-                except BAMException as thisexception:
-                    if 'duplicate' not in str(thisexception).lower():
-                        raise thisexception
-
-                if v6sub and blkv6:
-                    try:
-                        block_name = props.split('=', 1)[-1]
-                        blkv6.add_ip6_network_by_prefix(v6sub, name=block_name)
-                    except Exception as thisexception:
-                        pass
+                    block_name = props.split('=', 1)[-1]
+                    blkv6.add_ip6_network_by_prefix(v6sub, name=block_name)
+                except Exception as thisexception:
+                    pass
     return True
 
 # Import ELBv2 devices
-def discoverelbv2(aws_type, elbv2_subtype):
+def discoverelbv2(aws_type, elbv2_subtype, region, inventory, cache):
     form = GenericFormTemplate()
     global DISCOVERYSTATUS,DISCOVERY_STATS
-    DISCOVERYSTATUS = "Discovering ELBv2 LoadBalancers"
-    if assume_role or mfa:
-        elbclient = boto3.client('elbv2', region_name=aws_region_name, aws_access_key_id=aws_access_key_id, aws_secret_access_key=aws_secret_access_key, aws_session_token=aws_session_token)
-        ec2 = boto3.resource('ec2', region_name=aws_region_name, aws_access_key_id=aws_access_key_id, aws_secret_access_key=aws_secret_access_key, aws_session_token=aws_session_token)
-    else:
-        elbclient = boto3.client('elbv2', region_name=aws_region_name, aws_access_key_id=aws_access_key_id, aws_secret_access_key=aws_secret_access_key)
-        ec2 = boto3.resource('ec2', region_name=aws_region_name, aws_access_key_id=aws_access_key_id, aws_secret_access_key=aws_secret_access_key)
-    lbs = elbclient.describe_load_balancers()
+    DISCOVERYSTATUS = "Discovering ELBv2 LoadBalancers in " + region
+    lbs = inventory.get('elbv2')
+    if lbs is None:
+        g.user.logger.info(inventory['errors'].get('elbv2'), "DescribeLoadBalancers Exception")
+        DISCOVERYSTATUS = datetime.utcnow().strftime("%m/%d/%Y %H:%M:%S") + " - ERROR Describing ELBv2 LoadBalancers in " + region
+        return
+    vpcs = inventory.get('vpcs') or {}
 
     # Add the number of ELBv2 instances to the discovery_stats
     d_elb = collections.OrderedDict()
-    d_elb['Region'] = aws_region_name
+    d_elb['Region'] = region
     d_elb['Time'] = datetime.utcnow().strftime("%m/%d/%Y %H:%M:%S")
     d_elb['Infrastructure'] = "ELBv2"
-    d_elb_count = list(elbclient.describe_load_balancers())
-    d_elb['count'] = len(d_elb_count)
+    d_elb['count'] = len(lbs)
     DISCOVERY_STATS.append((d_elb))
 
-    for x in lbs['LoadBalancers']:
+    for index, x in enumerate(lbs, 1):
+        discovery_progress(region, 'ELBv2', index, len(lbs))
         lbname = x['LoadBalancerName']
         lbdnsname = x['DNSName']
-        lbarn = x['LoadBalancerArn']
         lbvpcid = x['VpcId']
         lbtype = x['Type']
         lbstate = str(x['State']['Code'])
         target_list = []
-        targetgroups = elbclient.describe_target_groups(LoadBalancerArn=lbarn)
-        for y in targetgroups['TargetGroups']:
+        targetgroup = ""
+        for y in x['TargetGroups']:
             targetgroup = y['TargetGroupName']
-            z = elbclient.describe_target_health(TargetGroupArn=y['TargetGroupArn'])
-            for target in z['TargetHealthDescriptions']:
+            for target in y['Targets']:
                 try:
                     ip = str(ipaddress.ip_address(target['Target']['Id']))
                     target_list.append(ip)
@@ -1256,26 +1361,15 @@ def discoverelbv2(aws_type, elbv2_subtype):
                     target_list.append(target['Target']['Id'])
         target_list = ','.join(target_list)
         target_list = str(target_list)
-        vpc = ec2.Vpc(lbvpcid)
-        vpc_name = ""
-        if vpc.tags:
-            for tag in vpc.tags:
-                if tag['Key'] == "Name":
-                    vpc_name = tag['Value']
+        vpc_name = get_name_tag(vpcs.get(lbvpcid, {}).get('Tags'))
         if single_config_mode:
-            config_name = get_api().get_configuration(form.configuration.data)
-            config_name = config_name.name
+            config_name = form.configuration.data
         else:
             if vpc_name:
-                config_name = aws_region_name + " - " + lbvpcid + " - " + vpc_name
+                config_name = region + " - " + lbvpcid + " - " + vpc_name
             else:
-                config_name = aws_region_name + " - " + lbvpcid
-        try:
-            config_entity = get_api().get_configuration(config_name)
-        except PortalException:
-            config_entity = get_api().create_configuration(config_name)
-            config_entity.set_property('configurationGroup', 'Amazon Web Services')
-            config_entity.update()
+                config_name = region + " - " + lbvpcid
+        config_entity = cached_configuration(cache, config_name)
         dev = get_device(config_entity.get_id(), lbname)
         if dev is not None:
             get_api()._api_client.service.delete(dev.get_id())
@@ -1294,145 +1388,107 @@ def discoverelbv2(aws_type, elbv2_subtype):
             g.user.logger.info(str(thisexception))
 
 # Import EC2 devices
-def discoverec2(aws_type, ec2_subtype):
+def discoverec2(aws_type, ec2_subtype, region, inventory, cache):
     form = GenericFormTemplate()
     global DISCOVERYSTATUS,DISCOVERY_STATS
-    DISCOVERYSTATUS = "Discovering EC2 Instances"
-    if assume_role or mfa:
-        ec2 = boto3.resource('ec2', region_name=aws_region_name, aws_access_key_id=aws_access_key_id, aws_secret_access_key=aws_secret_access_key, aws_session_token=aws_session_token)
-        client = boto3.client('ec2', region_name=aws_region_name, aws_access_key_id=aws_access_key_id, aws_secret_access_key=aws_secret_access_key, aws_session_token=aws_session_token)
-    else:
-        ec2 = boto3.resource('ec2', region_name=aws_region_name, aws_access_key_id=aws_access_key_id, aws_secret_access_key=aws_secret_access_key)
-        client = boto3.client('ec2', region_name=aws_region_name, aws_access_key_id=aws_access_key_id, aws_secret_access_key=aws_secret_access_key)
+    DISCOVERYSTATUS = "Discovering EC2 Instances in " + region
+    instances = inventory.get('instances')
+    if instances is None:
+        g.user.logger.info(inventory['errors'].get('instances'), "DescribeInstances Exception")
+        DISCOVERYSTATUS = datetime.utcnow().strftime("%m/%d/%Y %H:%M:%S") + " - ERROR Describing EC2 Instances in " + region
+        return
+    vpcs = inventory.get('vpcs') or {}
+    subnets = inventory.get('subnets') or {}
 
     # Add the number of EC2 instances to the discovery_stats
     d_ec2 = collections.OrderedDict()
-    d_ec2['Region'] = aws_region_name
+    d_ec2['Region'] = region
     d_ec2['Time'] = datetime.utcnow().strftime("%m/%d/%Y %H:%M:%S")
     d_ec2['Infrastructure'] = "EC2 Devices"
-    d_ec2_count = list(ec2.instances.all())
-    d_ec2['count'] = len(d_ec2_count)
+    d_ec2['count'] = len(instances)
     DISCOVERY_STATS.append((d_ec2))
 
-    for instance in ec2.instances.all():
-        if instance.state['Name'] == 'terminated':
+    for index, instance in enumerate(instances, 1):
+        discovery_progress(region, 'EC2 Devices', index, len(instances))
+        instance_state = instance['State']['Name']
+        if instance_state == 'terminated':
             continue
-        if instance.subnet_id:
-            subnet = ec2.Subnet(instance.subnet_id)
-            subnet_name = ""
-        if subnet.tags:
-            for tag in subnet.tags:
-                if tag['Key'] == "Name":
-                    subnet_name = tag['Value']
-        if instance.vpc_id:
-            vpc = ec2.Vpc(instance.vpc_id)
-            vpc_name = ""
-            if vpc.tags:
-                for tag in vpc.tags:
-                    if tag['Key'] == "Name":
-                        vpc_name = tag['Value']
-            # Currently not used in code path, gather DHCP options
-            # if vpc.dhcp_options:
-            #     dhcp_options = ec2.DhcpOptions(vpc.dhcp_options.id)
+        instance_id = instance['InstanceId']
+        vpc_id = instance.get('VpcId', '')
+        subnet = subnets.get(instance.get('SubnetId'), {})
+        subnet_name = get_name_tag(subnet.get('Tags'))
+        vpc = vpcs.get(vpc_id, {})
+        vpc_name = get_name_tag(vpc.get('Tags'))
+        private_ip_address = instance.get('PrivateIpAddress', '')
+        public_ip_address = instance.get('PublicIpAddress', '')
+        private_dns_name = instance.get('PrivateDnsName', '')
+        public_dns_name = instance.get('PublicDnsName', '')
         v6_address = ""
-        if instance.network_interfaces_attribute:
-            for v in instance.network_interfaces_attribute:
-                v6_addresses = v['Ipv6Addresses']
-                for v2 in v6_addresses:
-                    v6_address = v2['Ipv6Address']
+        owner = instance.get('OwnerId', '')
+        for v in instance.get('NetworkInterfaces', []):
+            owner = v['OwnerId']
+            for v2 in v['Ipv6Addresses']:
+                v6_address = v2['Ipv6Address']
         if single_config_mode:
-            config_name = get_api().get_configuration(form.configuration.data)
-            config_name = config_name.name
+            config_name = form.configuration.data
         else:
             if vpc_name:
-                config_name = aws_region_name + " - " + instance.vpc_id + " - " + vpc_name
+                config_name = region + " - " + vpc_id + " - " + vpc_name
             else:
-                config_name = aws_region_name + " - " + instance.vpc_id
-        try:
-            config_entity = get_api().get_configuration(config_name)
-        except PortalException:
-            config_entity = get_api().create_configuration(config_name)
-            config_entity.set_property('configurationGroup', 'Amazon Web Services')
-            config_entity.update()
+                config_name = region + " - " + vpc_id
+        config_entity = cached_configuration(cache, config_name)
         if import_amazon_dns:
-            # Get or Add view "Amazon DNS Internal" to VPC configuration
-            try:
-                internal_view = config_entity.get_view("Amazon DNS Internal")
-            except Exception as thisexception:
-                internal_view = config_entity.add_view("Amazon DNS Internal")
-            # Get or Add view "Amazon DNS External" to VPC configuration
-            try:
-                external_view = config_entity.get_view("Amazon DNS External")
-            except Exception as thisexception:
-                external_view = config_entity.add_view("Amazon DNS External")
+            # Get or Add views "Amazon DNS Internal" and "Amazon DNS External" to VPC configuration
+            internal_view = cached_view(cache, config_entity, "Amazon DNS Internal")
+            external_view = cached_view(cache, config_entity, "Amazon DNS External")
         props = "name=" + config_entity.name
-        try:
-            blk = config_entity.get_entity_by_cidr(vpc.cidr_block)
-        except PortalException:
-            blk = None
-        if blk is None:
+        blk = None
+        if vpc:
             try:
-                blk = config_entity.add_ip4_block_by_cidr(vpc.cidr_block, properties=props)
-            except:
-                pass
-        try:
-            sub = config_entity.get_entity_by_cidr(subnet.cidr_block)
-        except PortalException:
-            sub = None
-        if sub is None:
+                blk = cached_block(cache, config_entity, vpc['CidrBlock'], props)
+            except Exception:
+                blk = None
+        if subnet and blk is not None:
             if subnet_name:
-                props = "name=" + instance.subnet_id + " - " + subnet_name
+                props = "name=" + subnet['SubnetId'] + " - " + subnet_name
             else:
-                props = "name=" + instance.subnet_id
+                props = "name=" + subnet['SubnetId']
             try:
-                sub = blk.add_ip4_network(subnet.cidr_block, props)
-            except:
-                pass
-        config_entity = get_api().get_configuration(config_name)
-        dev = get_device(config_entity.get_id(), instance.id)
+                cached_network(cache, config_entity, blk, subnet['CidrBlock'], props)
+            except Exception:
+                cache.invalidate('IP4Block', config_entity.get_id(), vpc['CidrBlock'])
+        dev = get_device(config_entity.get_id(), instance_id)
         if dev is not None:
             get_api()._api_client.service.delete(dev.get_id())
-        instanceid = instance.id.split()
-        instance_detailed = client.describe_instances(InstanceIds=instanceid)
-        for r in instance_detailed['Reservations']:
-            for i in r['Instances']:
-                nametag = ''
-                ec2instance = ec2.Instance(instance.id)
-                if ec2instance.tags:
-                    for tags in ec2instance.tags:
-                        if tags["Key"] == 'Name':
-                            nametag = tags["Value"]
-                for n in i['NetworkInterfaces']:
-                    owner = n['OwnerId']
+        nametag = get_name_tag(instance.get('Tags'))
         now = datetime.utcnow().strftime("%m-%d-%Y %H:%M:%S")
         props = ""
-        if instance.private_ip_address and instance.public_ip_address and form.aws_public_blocks.data:
-            devips = instance.private_ip_address + "," + instance.public_ip_address
+        if private_ip_address and public_ip_address and form.aws_public_blocks.data:
+            devips = private_ip_address + "," + public_ip_address
         else:
-            devips = instance.private_ip_address
+            devips = private_ip_address
         devip6 = ""
         if v6_address and form.aws_public_blocks.data:
             devip6 = v6_address
         try:
-            newdevice = add_device(config_entity.get_id(), instance.id, aws_type.get_id(), ec2_subtype.get_id(), devips, devip6, props)
-            newdevice.set_property("PrivateDNSName", str(instance.private_dns_name))
-            newdevice.set_property("PublicDNSName", str(instance.public_dns_name))
-            newdevice.set_property("InstanceState", str(instance.state['Name']))
-            newdevice.set_property("InstanceType", str(instance.instance_type))
-            newdevice.set_property("AvailabilityZone", str(instance.placement['AvailabilityZone']))
+            newdevice = add_device(config_entity.get_id(), instance_id, aws_type.get_id(), ec2_subtype.get_id(), devips, devip6, props)
+            newdevice.set_property("PrivateDNSName", str(private_dns_name))
+            newdevice.set_property("PublicDNSName", str(public_dns_name))
+            newdevice.set_property("InstanceState", str(instance_state))
+            newdevice.set_property("InstanceType", str(instance['InstanceType']))
+            newdevice.set_property("AvailabilityZone", str(instance['Placement']['AvailabilityZone']))
             newdevice.set_property("CloudAtlasSyncTime", str(now))
-            newdevice.set_property("LaunchTime", str(instance.launch_time.strftime("%m/%d/%Y %H:%M:%S")))
+            newdevice.set_property("LaunchTime", str(instance['LaunchTime'].strftime("%m/%d/%Y %H:%M:%S")))
             newdevice.set_property("Owner", str(owner))
-            newdevice.set_property("KeyName", str(instance.key_name))
+            newdevice.set_property("KeyName", str(instance.get('KeyName')))
             newdevice.set_property("NAMETAG", str(nametag))
             newdevice.update()
         except BAMException as thisexception:
             g.user.logger.info(str(thisexception))
-        config_entity = g.user.get_api().get_configuration(config_name)
-        if (instance.public_ip_address and form.aws_public_blocks.data):
+        if (public_ip_address and form.aws_public_blocks.data):
             try:
-                ip_address_pub = config_entity.get_ip4_address(instance.public_ip_address)
-                ip_address_pub.set_property("EC2InstanceID", instance.id)
+                ip_address_pub = config_entity.get_ip4_address(public_ip_address)
+                ip_address_pub.set_property("EC2InstanceID", instance_id)
                 ip_address_pub.update()
             except Exception as thisexception:
                 g.user.logger.info(thisexception, "Exception Getting Public IPv4")
@@ -1440,27 +1496,27 @@ def discoverec2(aws_type, ec2_subtype):
         if (v6_address and form.aws_public_blocks.data):
             try:
                 ip_address_pub6 = config_entity.get_ip6_address(v6_address)
-                ip_address_pub6.set_property("EC2InstanceID", instance.id)
+                ip_address_pub6.set_property("EC2InstanceID", instance_id)
                 ip_address_pub6.update()
             except Exception as thisexception:
                 g.user.logger.info(thisexception, "Exception Getting Public IPv6")
         try:
-            ip_address_private = config_entity.get_ip4_address(instance.private_ip_address)
-            ip_address_private.set_property("EC2InstanceID", instance.id)
+            ip_address_private = config_entity.get_ip4_address(private_ip_address)
+            ip_address_private.set_property("EC2InstanceID", instance_id)
             ip_address_private.update()
         except Exception as thisexception:
             g.user.logger.info(thisexception, "Exception Getting Private IP")
 
         nametag = nametag.replace(" ","_") # Replace any spaces with hyphen
         nametag = nametag.lower() # convert the nametag to lower case
-        if (import_amazon_dns and instance.public_dns_name and form.aws_public_blocks.data and instance.state['Name'] == 'running'):
-            if instance.public_ip_address:
+        if (import_amazon_dns and public_dns_name and form.aws_public_blocks.data and instance_state == 'running'):
+            if public_ip_address:
                 try:
                     # Add the new target domain to the external view
                     if target_zone:
                         external_view.add_zone(target_zone, deployable=True)
                     # Add the default Amazon DNS zone to the external view
-                    external_view.add_zone(instance.public_dns_name.split('.',1)[-1], deployable=True)
+                    external_view.add_zone(public_dns_name.split('.',1)[-1], deployable=True)
 
                 except Exception as thisexception:
                     if "Duplicate" in str(thisexception):
@@ -1469,55 +1525,55 @@ def discoverec2(aws_type, ec2_subtype):
                 if is_valid_hostname(nametag):
                     try:
                         if target_zone:
-                            public_host_record = external_view.add_host_record(nametag + "." + target_zone, [instance.public_ip_address])
-                            public_host_record.set_property("EC2InstanceID", instance.id)
+                            public_host_record = external_view.add_host_record(nametag + "." + target_zone, [public_ip_address])
+                            public_host_record.set_property("EC2InstanceID", instance_id)
                             public_host_record.update()
                     except Exception as thisexception:
                         g.user.logger.info(str(thisexception))
                         g.user.logger.info("Error Adding TAG Public Host Record to Target Zone, appending instanceID")
                         try:
-                            public_host_record = external_view.add_host_record(nametag + "_" + instance.id + "." + target_zone, [instance.public_ip_address])
-                            public_host_record.set_property("EC2InstanceID", instance.id)
+                            public_host_record = external_view.add_host_record(nametag + "_" + instance_id + "." + target_zone, [public_ip_address])
+                            public_host_record.set_property("EC2InstanceID", instance_id)
                             public_host_record.update()
                         except Exception as thisexception:
                             g.user.logger.info(str(thisexception))
                 else:
                     try:
                         if target_zone:
-                            public_host_record = external_view.add_host_record(instance.id + "." + target_zone, [instance.public_ip_address])
-                            public_host_record.set_property("EC2InstanceID", instance.id)
+                            public_host_record = external_view.add_host_record(instance_id + "." + target_zone, [public_ip_address])
+                            public_host_record.set_property("EC2InstanceID", instance_id)
                             public_host_record.update()
                     except Exception as thisexception:
                         g.user.logger.info(str(thisexception))
 
                 try:
-                    public_host_record = external_view.add_host_record(instance.public_dns_name, [instance.public_ip_address])
-                    public_host_record.set_property("EC2InstanceID", instance.id)
+                    public_host_record = external_view.add_host_record(public_dns_name, [public_ip_address])
+                    public_host_record.set_property("EC2InstanceID", instance_id)
                     public_host_record.update()
                 except Exception as thisexception:
                     g.user.logger.info(str(thisexception))
 
 
-        if import_amazon_dns and instance.private_dns_name and instance.state['Name'] == 'running':
+        if import_amazon_dns and private_dns_name and instance_state == 'running':
                 try:
                     if target_zone:
-                        internal_view.add_zone(aws_region_name + "." + target_zone, deployable=True)
-                    internal_view.add_zone(instance.private_dns_name.split('.',1)[-1], deployable=True)
+                        internal_view.add_zone(region + "." + target_zone, deployable=True)
+                    internal_view.add_zone(private_dns_name.split('.',1)[-1], deployable=True)
                 except Exception as thisexception:
                     if "Duplicate" in str(thisexception):
                         pass
                 if is_valid_hostname(nametag):
                     try:
                         if target_zone:
-                            a_record = internal_view.add_host_record(nametag + "." + aws_region_name + "." + target_zone, [instance.private_ip_address])
-                            a_record.set_property("EC2InstanceID", instance.id)
+                            a_record = internal_view.add_host_record(nametag + "." + region + "." + target_zone, [private_ip_address])
+                            a_record.set_property("EC2InstanceID", instance_id)
                             a_record.update()
                     except Exception as thisexception:
                         g.user.logger.info(str(thisexception))
                         g.user.logger.info("Error Adding TAG Private Host Record to Target Zone, appending instanceID")
                         try:
-                            a_record = internal_view.add_host_record(nametag + "_" + instance.id + "." + aws_region_name + "." + target_zone, [instance.private_ip_address])
-                            a_record.set_property("EC2InstanceID", instance.id)
+                            a_record = internal_view.add_host_record(nametag + "_" + instance_id + "." + region + "." + target_zone, [private_ip_address])
+                            a_record.set_property("EC2InstanceID", instance_id)
                             a_record.update()
                         except Exception as thisexception:
                             g.user.logger.info(str(thisexception))
@@ -1525,15 +1581,15 @@ def discoverec2(aws_type, ec2_subtype):
                 else:
                     try:
                         if target_zone:
-                            a_record = internal_view.add_host_record(instance.private_dns_name.split(".")[0]+"." + aws_region_name + "." + target_zone, [instance.private_ip_address])
-                            a_record.set_property("EC2InstanceID", instance.id)
+                            a_record = internal_view.add_host_record(private_dns_name.split(".")[0]+"." + region + "." + target_zone, [private_ip_address])
+                            a_record.set_property("EC2InstanceID", instance_id)
                             a_record.update()
                     except Exception as thisexception:
                         g.user.logger.info(str(thisexception))
 
                 try:
-                    a_record = internal_view.add_host_record(instance.private_dns_name, [instance.private_ip_address])
-                    a_record.set_property("EC2InstanceID", instance.id)
+                    a_record = internal_view.add_host_record(private_dns_name, [private_ip_address])
+                    a_record.set_property("EC2InstanceID", instance_id)
                     a_record.update()
                 except Exception as thisexception:
                     g.user.logger.info(str(thisexception))
@@ -1705,6 +1761,14 @@ def discoverr53():
 
 
 
+# Given a VPC ID provide the name tag
+def get_vpc_name(ec2_client, vpcid):
+    """get the VPC name tag"""
+    response = ec2_client.describe_vpcs(VpcIds=[vpcid])
+    for vpc in response['Vpcs']:
+        return get_name_tag(vpc.get('Tags'))
+    return ''
+
 # Given an EC2 instanceID provide the name tag
 def get_instance_name(instanceid,ec2r):
     """get the EC2 instance tag"""
@@ -0,0 +1,185 @@
+# Copyright 2020 BlueCat Networks. All rights reserved.
+""" Cloud Discovery for AWS - batched SQS consumer for EC2 state-change events """
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import datetime
+import collections
+import json
+import threading
+import time
+
+# SQS returns at most 10 messages per receive_message/delete_message_batch call
+MAX_BATCH_SIZE = 10
+POLL_WAIT_SECONDS = 5
+CONSUMER_WORKERS = 8
+LATENCY_SAMPLES = 1000
+THROUGHPUT_WINDOW_SECONDS = 60
+
+
+def event_key(body, message):
+    """Key used to coalesce events, the EC2 instance ID or the message ID if the event has none"""
+    try:
+        return body['detail']['instance-id']
+    except (KeyError, TypeError):
+        return message['MessageId']
+
+
+def coalesce_messages(messages, received=None):
+    """
+    Collapse a batch of SQS messages to the latest event per EC2 instance.
+    Returns an OrderedDict of {key: body} in arrival order of the surviving events.
+    If received is given it is filled with {key: [message, ...]}, every message under the key of its event.
+    """
+    events = collections.OrderedDict()
+    for message in messages:
+        body = json.loads(message['Body'])
+        key = event_key(body, message)
+        if received is not None:
+            received.setdefault(key, []).append(message)
+        previous = events.get(key)
+        if previous is not None and previous.get('time', '') > body.get('time', ''):
+            continue
+        events.pop(key, None)
+        events[key] = body
+    return events
+
+
+class ConsumerMetrics(object):
+    """Lag, throughput and per-event latency counters for a consumer"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._latencies = collections.deque(maxlen=LATENCY_SAMPLES)
+        self._completed = collections.deque()
+        self.received = 0
+        self.coalesced = 0
+        self.processed = 0
+        self.failed = 0
+        self.queue_depth = 0
+        self.lag_seconds = 0
+        self.last_error = ""
+        self.last_poll = ""
+
+    def record_batch(self, received, events, oldest_sent):
+        """Record a received batch and the age of its oldest message"""
+        with self._lock:
+            self.received += received
+            self.coalesced += received - events
+            self.lag_seconds = round(max(time.time() - oldest_sent, 0), 1) if oldest_sent else 0
+            self.last_poll = datetime.utcnow().strftime("%m/%d/%Y %H:%M:%S")
+
+    def record_event(self, latency, error=None):
+        """Record the handling time of one event"""
+        now = time.time()
+        with self._lock:
+            self._latencies.append(latency)
+            self._completed.append(now)
+            while self._completed and self._completed[0] < now - THROUGHPUT_WINDOW_SECONDS:
+                self._completed.popleft()
+            if error is None:
+                self.processed += 1
+            else:
+                self.failed += 1
+                self.last_error = str(error)
+
+    def as_dict(self):
+        """Return the metrics in JSON serialisable form"""
+        with self._lock:
+            latencies = sorted(self._latencies)
+            now = time.time()
+            recent = [stamp for stamp in self._completed if stamp >= now - THROUGHPUT_WINDOW_SECONDS]
+        stats = collections.OrderedDict()
+        stats['Received'] = self.received
+        stats['Coalesced'] = self.coalesced
+        stats['Processed'] = self.processed
+        stats['Failed'] = self.failed
+        stats['QueueDepth'] = self.queue_depth
+        stats['LagSeconds'] = self.lag_seconds
+        stats['EventsPerSecond'] = round(len(recent) / float(THROUGHPUT_WINDOW_SECONDS), 2)
+        if latencies:
+            stats['LatencyAvgMs'] = round(sum(latencies) / len(latencies) * 1000, 1)
+            stats['LatencyP95Ms'] = round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] * 1000, 1)
+            stats['LatencyMaxMs'] = round(latencies[-1] * 1000, 1)
+        else:
+            stats['LatencyAvgMs'] = stats['LatencyP95Ms'] = stats['LatencyMaxMs'] = 0
+        stats['LastPoll'] = self.last_poll
+        stats['LastError'] = self.last_error
+        return stats
+
+
+class SQSConsumer(object):
+    """
+    Receives EC2 state-change events in batches of up to 10, coalesces repeated events for the
+    same instance so only the latest state is applied, handles independent instances concurrently
+    and acknowledges with delete_message_batch the messages whose event was handled. The messages
+    of a failed event are left in the queue, so SQS delivers them again once their visibility
+    timeout expires.
+    """
+
+    def __init__(self, sqs_client, queue_url, handler, max_workers=CONSUMER_WORKERS, wait_time=POLL_WAIT_SECONDS, metrics=None):
+        self.sqs_client = sqs_client
+        self.queue_url = queue_url
+        self._handler = handler
+        self._wait_time = wait_time
+        self._pool = ThreadPoolExecutor(max_workers=max_workers)
+        self.metrics = metrics if metrics is not None else ConsumerMetrics()
+
+    def _handle(self, body):
+        """Handle one event, returning False if the handler failed"""
+        start = time.time()
+        try:
+            self._handler(body)
+        except Exception as thisexception:
+            self.metrics.record_event(time.time() - start, thisexception)
+            return False
+        self.metrics.record_event(time.time() - start)
+        return True
+
+    def _acknowledge(self, messages):
+        failed = []
+        for offset in range(0, len(messages), MAX_BATCH_SIZE):
+            entries = [
+                {'Id': str(index), 'ReceiptHandle': message['ReceiptHandle']}
+                for index, message in enumerate(messages[offset:offset + MAX_BATCH_SIZE])
+            ]
+            response = self.sqs_client.delete_message_batch(QueueUrl=self.queue_url, Entries=entries)
+            failed.extend(response.get('Failed', []))
+        return failed
+
+    def refresh_queue_depth(self):
+        """Update the approximate number of messages waiting in the queue"""
+        attributes = self.sqs_client.get_queue_attributes(QueueUrl=self.queue_url, AttributeNames=['ApproximateNumberOfMessages'])
+        self.metrics.queue_depth = int(attributes['Attributes'].get('ApproximateNumberOfMessages', 0))
+
+    def poll(self):
+        """
+        Receive, handle and acknowledge one batch of messages.
+        Returns the number of events handled after coalescing.
+        """
+        response = self.sqs_client.receive_message(
+            QueueUrl=self.queue_url,
+            MaxNumberOfMessages=MAX_BATCH_SIZE,
+            WaitTimeSeconds=self._wait_time,
+            AttributeNames=['SentTimestamp'],
+        )
+        messages = response.get('Messages', [])
+        if not messages:
+            self.metrics.record_batch(0, 0, None)
+            self.metrics.queue_depth = 0
+            return 0
+        received = {}
+        events = coalesce_messages(messages, received)
+        sent = [int(message['Attributes']['SentTimestamp']) for message in messages if 'SentTimestamp' in message.get('Attributes', {})]
+        oldest_sent = min(sent) / 1000.0 if sent else None
+        self.metrics.record_batch(len(messages), len(events), oldest_sent)
+        futures = collections.OrderedDict((key, self._pool.submit(self._handle, body)) for key, body in events.items())
+        wait(futures.values())
+        handled = [message for key, future in futures.items() if future.result() for message in received[key]]
+        failed = self._acknowledge(handled)
+        if failed:
+            self.metrics.last_error = "delete_message_batch failed for {count} messages".format(count=len(failed))
+        self.refresh_queue_depth()
+        return len(events)
+
+    def close(self):
+        """Stop the worker pool"""
+        self._pool.shutdown(wait=True)
@@ -282,7 +282,7 @@ function sync_table() {
       autoWidth: false,
       processing: false,
       data: data,
-      columns: [ { data: "StartTime"}, { data: "Region"}, { data: "Target"}, { data: "StateChanges"}, ]
+      columns: [ { data: "StartTime"}, { data: "Region"}, { data: "Target"}, { data: "StateChanges"}, { data: "QueueLag"}, { data: "Throughput"}, ]
     }
   );
 }};;
@@ -15,8 +15,10 @@
 from flask import request, g, abort, jsonify
 import bluecat.server_endpoints as se
 from bluecat import route, util
+from bluecat.util import has_response
 from main_app import app
 from bluecat.api_exception import PortalException, BAMException
+from .zone_index import get_zone_index
 
 exceptions = (BAMException, Exception, PortalException)
 wf_name = "itsm_api"
@@ -234,17 +236,30 @@ def get_zone(config, zone_name, view):
 
 def find_zone_by_absolute_name(config, name, view):
     try:
-        search_result = g.user.get_api()._api_client.service.getZonesByHint(config.get_id(), 0, 10, "hint=" + name)
-        zones = [g.user.get_api().instantiate_entity(e) for e in search_result.item]
-        for zone in zones:
-            if (zone.get_property("absoluteName") == name and zone.get_parent_of_type("View").get_name() == view):
-                match_zone = zone
+        api = g.user.get_api()
+        zone_index = get_zone_index(api, g.user.get_username(), config.get_id(), view)
+        zone = zone_index.get(name)
+        if zone is None:
+            # The index can be up to REFRESH_INTERVAL seconds old, look for a zone created since in BAM
+            match_zone = find_zone_by_hint(api, config, name, view)
+            if match_zone is not None:
+                zone_index.expired = True
+                return match_zone
     except (BAMException, PortalException, Exception) as e:
-        app.logger.error(e.message)
+        app.logger.error(str(e))
+        return False
+    if zone is None:
         return False
-    if 'match_zone' in locals():
-        return match_zone
-    return False
+    return api.instantiate_entity(zone)
+
+def find_zone_by_hint(api, config, name, view):
+    search_result = api._api_client.service.getZonesByHint(config.get_id(), 0, 10, "hint=" + name)
+    if not has_response(search_result):
+        return None
+    for zone in [api.instantiate_entity(e) for e in search_result.item]:
+        if (zone.get_property("absoluteName") == name and zone.get_parent_of_type("View").get_name() == view):
+            return zone
+    return None
 
 def no_data():
     return jsonify({"data": {}, "status":"FAIL", "message":"No data sent"})
@@ -0,0 +1,325 @@
+# Copyright 2020 BlueCat Networks. All rights reserved.
+""" manage_records - asynchronous, resumable bulk jobs """
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+import collections
+import csv
+import json
+import os
+import threading
+import time
+import uuid
+
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_COMPLETED = 'completed'
+JOB_FAILED = 'failed'
+JOB_INTERRUPTED = 'interrupted'
+JOB_FINISHED = (JOB_COMPLETED, JOB_FAILED)
+
+# Seconds between two sweeps of the job directory for expired jobs
+SWEEP_INTERVAL = 3600
+
+
+def now():
+    return datetime.now().strftime("%m/%d/%Y %H:%M:%S")
+
+
+def line_group(line):
+    """Rows for the same FQDN must be applied in file order, so they are grouped on name.zone"""
+    if len(line) < 5:
+        return None
+    return ('%s.%s' % (line[3].strip(), line[4].strip())).lower()
+
+
+class BulkJob(object):
+    """
+    One bulk file being processed in the background.
+    The job state is journalled to <job_id>.json next to the uploaded <job_id>.csv and the
+    per-line results are appended to <job_id>.results. Rows are committed a chunk at a time:
+    results are written, the pending deployments are flushed, and only then is committed_row
+    advanced, so an interrupted job can be resumed from its last committed row.
+    """
+
+    def __init__(self, job_dir, job_id):
+        self.job_dir = job_dir
+        self.job_id = job_id
+        self.state = {}
+        self._lock = threading.Lock()
+
+    @property
+    def csv_file(self):
+        return os.path.join(self.job_dir, '%s.csv' % self.job_id)
+
+    @property
+    def state_file(self):
+        return os.path.join(self.job_dir, '%s.json' % self.job_id)
+
+    @property
+    def results_file(self):
+        return os.path.join(self.job_dir, '%s.results' % self.job_id)
+
+    def load(self):
+        with open(self.state_file, 'r') as state_file:
+            self.state = json.load(state_file)
+        return self
+
+    def save(self):
+        with self._lock:
+            temp_file = self.state_file + '.tmp'
+            with open(temp_file, 'w') as state_file:
+                json.dump(self.state, state_file)
+            os.replace(temp_file, self.state_file)
+
+    def status(self):
+        with self._lock:
+            return dict(self.state)
+
+    def update(self, **kwargs):
+        with self._lock:
+            self.state.update(kwargs)
+            self.state['updated'] = now()
+
+    def results(self, offset=0, limit=100, failed_only=False):
+        """Return one page of the per-line results and the number of results matching the filter"""
+        page = []
+        total = 0
+        if not os.path.exists(self.results_file):
+            return page, total
+        with open(self.results_file, 'r') as results_file:
+            for entry in results_file:
+                result = json.loads(entry)
+                if failed_only and result['status'] == 'ok':
+                    continue
+                if offset <= total < offset + limit:
+                    page.append(result)
+                total += 1
+        return page, total
+
+
+class BulkJobManager(object):
+    """
+    Starts, tracks and resumes bulk jobs.
+    process_line(line) -> (key_name, line_message, line_data, deploy_ids, ok) handles one row and
+    deploy(ids) -> (response_code, message) runs one selective deployment. Both are called from
+    worker threads inside run_context(user), which must set up the flask application context and
+    give each thread its own SOAP client, since suds clients are not thread safe.
+    The optional prepare_chunk(lines) is called once per chunk before its rows are processed.
+    Completed and failed jobs whose journal is older than retention seconds are removed by sweep(),
+    which runs at most once per SWEEP_INTERVAL when a job is submitted.
+    """
+
+    def __init__(self, job_dir, process_line, deploy, run_context, max_workers=8, chunk_size=200, deploy_batch_size=500,
+                 prepare_chunk=None, retention=None):
+        self.job_dir = job_dir
+        self._process_line = process_line
+        self._deploy = deploy
+        self._run_context = run_context
+        self._max_workers = max_workers
+        self._chunk_size = chunk_size
+        self._deploy_batch_size = deploy_batch_size
+        self._prepare_chunk = prepare_chunk
+        self._retention = retention
+        self._last_sweep = 0
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def _job_path(self):
+        if not os.path.isdir(self.job_dir):
+            os.makedirs(self.job_dir)
+        return self.job_dir
+
+    def submit(self, uploaded_file, filename, user):
+        """Store the uploaded file, register a job for it and start it in the background"""
+        if self._retention is not None and time.time() - self._last_sweep >= SWEEP_INTERVAL:
+            self.sweep()
+        job = BulkJob(self._job_path(), uuid.uuid4().hex)
+        uploaded_file.save(job.csv_file)
+        with open(job.csv_file, 'r', newline='') as csv_file:
+            total_rows = sum(1 for line in csv.reader(csv_file) if line)
+        job.state = collections.OrderedDict([
+            ('job_id', job.job_id),
+            ('filename', filename),
+            ('status', JOB_QUEUED),
+            ('total_rows', total_rows),
+            ('committed_row', 0),
+            ('processed', 0),
+            ('succeeded', 0),
+            ('failed', 0),
+            ('deployed', 0),
+            ('deploy_errors', 0),
+            ('results_size', 0),
+            ('message', ''),
+            ('created', now()),
+            ('updated', now()),
+        ])
+        job.save()
+        self._start(job, user)
+        return job
+
+    def get(self, job_id):
+        """Return the running job or the journalled one, None if the ID is unknown"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is not None:
+            return job
+        job = BulkJob(self.job_dir, job_id)
+        if not os.path.exists(job.state_file):
+            return None
+        job.load()
+        if job.state['status'] in (JOB_QUEUED, JOB_RUNNING):
+            # Journalled as running but not running in this process, Gateway was restarted
+            job.state['status'] = JOB_INTERRUPTED
+        return job
+
+    def sweep(self):
+        """Remove the files of finished jobs older than the retention period, return the number of jobs removed"""
+        self._last_sweep = time.time()
+        if self._retention is None or not os.path.isdir(self.job_dir):
+            return 0
+        expires = self._last_sweep - self._retention
+        removed = 0
+        for name in os.listdir(self.job_dir):
+            job_id, ext = os.path.splitext(name)
+            if ext != '.json' or self.is_running(job_id):
+                continue
+            job = BulkJob(self.job_dir, job_id)
+            try:
+                if os.path.getmtime(job.state_file) >= expires or job.load().state['status'] not in JOB_FINISHED:
+                    continue
+            except (OSError, ValueError, KeyError):
+                continue
+            for path in (job.csv_file, job.results_file, job.state_file):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+            removed += 1
+        return removed
+
+    def is_running(self, job_id):
+        with self._lock:
+            return job_id in self._jobs
+
+    def resume(self, job_id, user):
+        """Restart an interrupted or failed job from its last committed row"""
+        job = self.get(job_id)
+        if job is None or self.is_running(job_id) or job.state['status'] == JOB_COMPLETED:
+            return None
+        self._start(job, user)
+        return job
+
+    def _start(self, job, user):
+        with self._lock:
+            self._jobs[job.job_id] = job
+        job.update(status=JOB_RUNNING, message='')
+        job.save()
+        thread = threading.Thread(target=self._run, args=(job, user), name='bulk-%s' % job.job_id)
+        thread.daemon = True
+        thread.start()
+
+    def _run(self, job, user):
+        try:
+            with ThreadPoolExecutor(max_workers=self._max_workers) as pool:
+                self._process(job, user, pool)
+        except Exception as e:
+            job.update(status=JOB_FAILED, message='Stopped at row %d: %s' % (job.state['committed_row'], str(e)))
+        else:
+            job.update(status=JOB_COMPLETED, message='Successfully processed bulk file: %s' % job.state['filename'])
+        finally:
+            job.save()
+            with self._lock:
+                self._jobs.pop(job.job_id, None)
+
+    def _process(self, job, user, pool):
+        # Drop results written after the last commit of a previous, interrupted run
+        with open(job.results_file, 'a') as results_file:
+            results_file.truncate(job.state['results_size'])
+        committed_row = job.state['committed_row']
+        chunk = []
+        with open(job.csv_file, 'r', newline='') as csv_file:
+            row = 0
+            for line in csv.reader(csv_file):
+                if not line:
+                    continue
+                row += 1
+                if row <= committed_row:
+                    continue
+                chunk.append((row, line))
+                if len(chunk) >= self._chunk_size:
+                    self._commit(job, user, pool, chunk)
+                    chunk = []
+        if chunk:
+            self._commit(job, user, pool, chunk)
+
+    def _run_group(self, user, rows):
+        results = []
+        with self._run_context(user):
+            for row, line in rows:
+                try:
+                    key_name, line_message, line_data, deploy_ids, ok = self._process_line(line)
+                except Exception as e:
+                    key_name = ','.join(line[:5])
+                    line_message = 'Encountered an error while processing line: %s' % str(e)
+                    line_data, deploy_ids, ok = {}, [], False
+                results.append((row, key_name, line_message, line_data, deploy_ids, ok))
+        return results
+
+    def _flush_deployments(self, job, user, ids):
+        """Deploy the collected entity IDs in batches of deploy_batch_size"""
+        deployed = errors = 0
+        with self._run_context(user):
+            for offset in range(0, len(ids), self._deploy_batch_size):
+                batch = ids[offset:offset + self._deploy_batch_size]
+                response_code, deploy_message = self._deploy(batch)
+                if response_code == 200:
+                    deployed += len(batch)
+                else:
+                    errors += 1
+                    job.update(message=str(deploy_message))
+        return deployed, errors
+
+    def _commit(self, job, user, pool, chunk):
+        if self._prepare_chunk is not None:
+            self._prepare_chunk([line for row, line in chunk])
+        groups = collections.OrderedDict()
+        for row, line in chunk:
+            groups.setdefault(line_group(line) or row, []).append((row, line))
+        results = []
+        for future in [pool.submit(self._run_group, user, rows) for rows in groups.values()]:
+            results.extend(future.result())
+        results.sort(key=lambda result: result[0])
+
+        deploy_ids = list(collections.OrderedDict.fromkeys(
+            entity_id for result in results for entity_id in result[4]))
+        deployed, deploy_errors = self._flush_deployments(job, user, deploy_ids) if deploy_ids else (0, 0)
+
+        succeeded = failed = 0
+        with open(job.results_file, 'a') as results_file:
+            for row, key_name, line_message, line_data, ids, ok in results:
+                entry = collections.OrderedDict([
+                    ('row', row),
+                    ('key', key_name),
+                    ('status', 'ok' if ok else 'error'),
+                    ('line_message', line_message),
+                    ('line_data', line_data),
+                ])
+                results_file.write(json.dumps(entry) + '\n')
+                if ok:
+                    succeeded += 1
+                else:
+                    failed += 1
+            results_file.flush()
+            results_size = results_file.tell()
+
+        state = job.status()
+        job.update(
+            committed_row=chunk[-1][0],
+            processed=state['processed'] + len(results),
+            succeeded=state['succeeded'] + succeeded,
+            failed=state['failed'] + failed,
+            deployed=state['deployed'] + deployed,
+            deploy_errors=state['deploy_errors'] + deploy_errors,
+            results_size=results_size,
+        )
+        job.save()
@@ -0,0 +1,124 @@
+# Copyright 2020 BlueCat Networks. All rights reserved.
+""" manage_records - concurrent ICMP/TCP liveness probes with a short lived result cache """
+from concurrent.futures import ThreadPoolExecutor
+import errno
+import ipaddress
+import socket
+import subprocess
+import threading
+import time
+
+PROBE_ICMP = 'icmp'
+PROBE_TCP = 'tcp'
+
+
+def icmp_probe(ip_address, timeout):
+    """Send one echo request, True if the address answered within timeout seconds"""
+    ping_command = 'ping6' if ipaddress.ip_address(ip_address).version == 6 else 'ping'
+    try:
+        result = subprocess.run([ping_command, '-c', '1', '-W', str(int(max(timeout, 1))), ip_address],
+                                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                                timeout=timeout + 1, shell=False)
+    except subprocess.TimeoutExpired:
+        return False
+    return result.returncode == 0
+
+
+def tcp_probe(ip_address, timeout, ports):
+    """Try to connect to each port, a completed or refused connection means something is there"""
+    for port in ports:
+        try:
+            connection = socket.create_connection((ip_address, port), timeout=timeout)
+        except ConnectionRefusedError:
+            return True
+        except (socket.timeout, OSError) as e:
+            if getattr(e, 'errno', None) == errno.ECONNREFUSED:
+                return True
+            continue
+        connection.close()
+        return True
+    return False
+
+
+class LivenessProber(object):
+    """
+    Checks whether something answers at an IP address before a record is pointed at it.
+    Probes run concurrently on a shared worker pool and results are cached for ttl seconds, so
+    an address that appears several times in a batch is only probed once. Concurrent requests
+    for the same address wait for the probe already in flight instead of starting another.
+    """
+
+    def __init__(self, method=PROBE_ICMP, timeout=1, tcp_ports=(22, 80, 443), ttl=30, max_workers=32):
+        self.method = method
+        self.timeout = timeout
+        self.tcp_ports = tuple(tcp_ports)
+        self.ttl = ttl
+        self._pool = ThreadPoolExecutor(max_workers=max_workers)
+        # Re-entrant because add_done_callback runs _store immediately if the probe already finished
+        self._lock = threading.RLock()
+        self._cache = {}
+        self._pending = {}
+        self.hits = 0
+        self.misses = 0
+
+    def _probe(self, ip_address):
+        if self.method == PROBE_TCP:
+            return tcp_probe(ip_address, self.timeout, self.tcp_ports)
+        return icmp_probe(ip_address, self.timeout)
+
+    def _store(self, ip_address, future):
+        try:
+            alive = future.result()
+        except Exception:
+            alive = None
+        with self._lock:
+            self._pending.pop(ip_address, None)
+            if alive is not None:
+                self._cache[ip_address] = (alive, time.time() + self.ttl)
+
+    def _submit(self, ip_address):
+        # Caller holds self._lock
+        future = self._pending.get(ip_address)
+        if future is None:
+            self.misses += 1
+            future = self._pool.submit(self._probe, ip_address)
+            self._pending[ip_address] = future
+            future.add_done_callback(lambda done, ip_address=ip_address: self._store(ip_address, done))
+        return future
+
+    def _cached(self, ip_address):
+        # Caller holds self._lock
+        entry = self._cache.get(ip_address)
+        if entry is None:
+            return None
+        if entry[1] < time.time():
+            del self._cache[ip_address]
+            return None
+        self.hits += 1
+        return entry[0]
+
+    def sweep(self, ip_addresses):
+        """Probe every address not already cached in parallel and return {ip_address: alive}"""
+        results = {}
+        futures = {}
+        with self._lock:
+            for ip_address in set(ip_addresses):
+                alive = self._cached(ip_address)
+                if alive is None:
+                    futures[ip_address] = self._submit(ip_address)
+                else:
+                    results[ip_address] = alive
+        for ip_address, future in futures.items():
+            try:
+                results[ip_address] = future.result()
+            except Exception:
+                results[ip_address] = False
+        return results
+
+    def is_alive(self, ip_address):
+        """Return True if something answered at ip_address, from the cache when possible"""
+        return self.sweep([ip_address])[ip_address]
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
@@ -1,16 +1,20 @@
 # Copyright 2020 BlueCat Networks. All rights reserved.
 
 from flask import request, g, jsonify
-import os
-import subprocess
-import csv
-from subprocess import CalledProcessError
+import contextlib
+import copy
+import threading
 from werkzeug.utils import secure_filename
 
 from bluecat import route, util
 from main_app import app
 from bluecat.api_exception import APIException, BAMException, PortalException
 from .manage_records_config import DEFAULT_CONFIG_NAME, DEFAULT_VIEW_NAME, DEFAULT_VIEW_ID
+from .manage_records_config import BULK_JOB_DIR, BULK_WORKERS, BULK_CHUNK_SIZE, BULK_DEPLOY_BATCH_SIZE, \
+    BULK_DEPLOY_TIMEOUT, BULK_PING_CHECK, BULK_JOB_RETENTION_DAYS
+from .manage_records_config import PING_METHOD, PING_TIMEOUT, PING_TCP_PORTS, PING_CACHE_TTL, PING_WORKERS
+from .bulk_jobs import BulkJobManager
+from .liveness import LivenessProber
 
 
 #
@@ -395,9 +399,9 @@ def bulk_process_endpoint():
     # TXT - record_type,action,deploy,name,zone,text
     # MX - record_type,action,deploy,name,zone,linked_record
     # TLSA - record_type,action,deploy,name,zone,data
-    response_code = 200
+    # The file is processed in the background, poll /manage_records/bulk_jobs/<job_id> for progress
+    response_code = 202
     response_data = {'message': ''}
-    ids = []
 
     submitted_file = request.files['file']
     if submitted_file.filename is None or submitted_file.filename == '':
@@ -405,73 +409,184 @@ def bulk_process_endpoint():
         response_code = 400
     elif is_csv(submitted_file.filename):
         try:
-            filename = os.path.join('bluecat_portal/uploads', secure_filename(submitted_file.filename))
-            submitted_file.save(filename)
-
-            file_reader = csv.reader(open(filename, 'rU'))
-
-            for line in file_reader:
-                line_data = {}
-                info = {'name': line[3].strip(),
-                        'zone': line[4].strip()
-                        }
-                should_deploy = line[2]
-                key_name = '%s-%s-%s.%s' % (line[0], line[1], line[3].strip(), line[4].strip())
-
-                if line[1] == 'C' or line[1] == 'U':
-                    if line[0] == 'A' or line[0] == 'AAAA':
-                        info['ip'] = line[5].strip()
-                    elif line[0] == 'CNAME':
-                        info['linked_record'] = line[5].strip()
-                    elif line[0] == 'TXT':
-                        info['text'] = line[5]
-                    elif line[0] == 'MX':
-                        info['linked_record'] = line[5].strip()
-                        info['priority'] = line[6].strip()
-                    elif line[0] == 'TLSA':
-                        info['data'] = line[5]
-
-                try:
-                    if line[1] == 'C':
-                        response_code, response_message, line_data, should_deploy, ids = \
-                            create_record(line[0], info, line_data, response_code, should_deploy)
-                        line_message = 'Completed create with the following message: %s' % response_message
-                    elif line[1] == 'D':
-                        response_code, response_message, should_deploy, ids = \
-                            delete_record(line[0], info, response_code, should_deploy)
-                        line_message = 'Completed delete with the following message: %s' % response_message
-                    elif line[1] == 'U':
-                        response_code, response_message, line_data, should_deploy, ids = \
-                            update_record(line[0], info, line_data, should_deploy)
-                        line_message = 'Completed update with the following message: %s' % response_message
-                    else:
-                        line_message = 'Invalid operation submitted: %s, skipping line' % line[1]
-
-                    if should_deploy == 'True':
-                        response_code, deploy_message = deploy(ids)
-                        line_data['deploy_info'] = deploy_message
-
-                except (APIException, BAMException, PortalException) as e:
-                    line_message = 'Encountered an error while processing line: %s' % util.safe_str(e)
-
-                response_data[key_name] = {'line_message': line_message,
-                                           'line_data': line_data}
-
-        except Exception as e:
+            job = BULK_JOBS.submit(submitted_file, secure_filename(submitted_file.filename), g.user)
+        except (IOError, OSError) as e:
             response_code = 500
-            response_message = 'Encountered an error while processing the file, stopped processing: %s' % util.safe_str(e)
+            response_message = 'Unable to store the bulk file, exception: %s' % util.safe_str(e)
         else:
-            os.remove(os.path.join('bluecat_portal/uploads', secure_filename(submitted_file.filename)))
-            response_message = 'Successfully processed bulk file: %s' % submitted_file.filename
+            response_data['job_id'] = job.job_id
+            response_data['total_rows'] = job.state['total_rows']
+            response_message = 'Started processing bulk file: %s' % submitted_file.filename
     else:
         response_message = 'Invalid file submitted. Either not a csv or doesn\'t exist, %s' % submitted_file.filename
         response_code = 400
 
-    g.user.logger.info('bulk_create completed with the following message: %s' % response_message)
+    g.user.logger.info('bulk_process completed with the following message: %s' % response_message)
     response_data['message'] = response_message
     return jsonify(response_data), response_code
 
 
+@route(app, '/manage_records/bulk_jobs/<job_id>', methods=['GET'])
+@util.rest_workflow_permission_required('manage_records')
+@util.rest_exception_catcher
+def bulk_job_endpoint(job_id):
+    job = BULK_JOBS.get(job_id)
+    if job is None:
+        return jsonify({'message': 'Unknown bulk job: %s' % job_id}), 404
+    response_data = job.status()
+    response_data.pop('results_size', None)
+    return jsonify(response_data), 200
+
+
+@route(app, '/manage_records/bulk_jobs/<job_id>/results', methods=['GET'])
+@util.rest_workflow_permission_required('manage_records')
+@util.rest_exception_catcher
+def bulk_job_results_endpoint(job_id):
+    # Query parameters: offset, limit (max 1000) and failed=true to only list lines that failed
+    job = BULK_JOBS.get(job_id)
+    if job is None:
+        return jsonify({'message': 'Unknown bulk job: %s' % job_id}), 404
+    try:
+        offset = max(int(request.args.get('offset', 0)), 0)
+        limit = min(max(int(request.args.get('limit', 100)), 1), 1000)
+    except ValueError:
+        return jsonify({'message': 'offset and limit must be integers'}), 400
+    failed_only = request.args.get('failed', '').lower() == 'true'
+
+    results, total = job.results(offset, limit, failed_only)
+    response_data = {
+        'job_id': job_id,
+        'status': job.status()['status'],
+        'offset': offset,
+        'limit': limit,
+        'total': total,
+        'results': results,
+    }
+    return jsonify(response_data), 200
+
+
+@route(app, '/manage_records/bulk_jobs/<job_id>/resume', methods=['POST'])
+@util.rest_workflow_permission_required('manage_records')
+@util.rest_exception_catcher
+def bulk_job_resume_endpoint(job_id):
+    job = BULK_JOBS.resume(job_id, g.user)
+    if job is None:
+        response_code = 409
+        response_message = 'Bulk job %s is unknown, still running or already completed' % job_id
+    else:
+        response_code = 202
+        response_message = 'Resumed bulk job %s after row %d' % (job_id, job.state['committed_row'])
+
+    g.user.logger.info('bulk_job_resume completed with the following message: %s' % response_message)
+    return jsonify({'message': response_message, 'job_id': job_id}), response_code
+
+
+def process_bulk_line(line):
+    info = {'name': line[3].strip(),
+            'zone': line[4].strip()
+            }
+    line_data = {}
+    ids = []
+    response_code = 200
+    key_name = '%s-%s-%s.%s' % (line[0], line[1], line[3].strip(), line[4].strip())
+
+    if line[1] == 'C' or line[1] == 'U':
+        if line[0] == 'A' or line[0] == 'AAAA':
+            info['ip'] = line[5].strip()
+        elif line[0] == 'CNAME':
+            info['linked_record'] = line[5].strip()
+        elif line[0] == 'TXT':
+            info['text'] = line[5]
+        elif line[0] == 'MX':
+            info['linked_record'] = line[5].strip()
+            info['priority'] = line[6].strip()
+        elif line[0] == 'TLSA':
+            info['data'] = line[5]
+
+    try:
+        if line[1] == 'C':
+            response_code, response_message, line_data, should_deploy, ids = \
+                create_record(line[0], info, line_data, response_code, line[2] == 'True', BULK_PING_CHECK)
+            line_message = 'Completed create with the following message: %s' % response_message
+        elif line[1] == 'D':
+            response_code, response_message, should_deploy, ids = \
+                delete_record(line[0], info, response_code, line[2] == 'True')
+            line_message = 'Completed delete with the following message: %s' % response_message
+        elif line[1] == 'U':
+            response_code, response_message, line_data, should_deploy, ids = \
+                update_record(line[0], info, line_data, line[2] == 'True', BULK_PING_CHECK)
+            line_message = 'Completed update with the following message: %s' % response_message
+        else:
+            response_code = 400
+            should_deploy = False
+            line_message = 'Invalid operation submitted: %s, skipping line' % line[1]
+    except (APIException, BAMException, PortalException) as e:
+        return key_name, 'Encountered an error while processing line: %s' % util.safe_str(e), line_data, [], False
+
+    # Deployments are collected and flushed in batches by the bulk job
+    return key_name, line_message, line_data, ids if should_deploy else [], response_code == 200
+
+
+_worker_sessions = threading.local()
+
+
+def clone_client(shared):
+    """Return a clone of a suds client for one thread, suds clients are not thread safe"""
+    try:
+        # A cloned suds client starts with an empty cookie jar, carry the BAM session over
+        client = shared.clone()
+        for cookie in shared.options.transport.cookiejar:
+            client.options.transport.cookiejar.set_cookie(cookie)
+    except AttributeError:
+        return shared
+    return client
+
+
+def worker_session(user):
+    """
+    Return a copy of user for the current thread whose API has its own clone of the suds client,
+    so bulk job workers never share one. The user is returned as is if its client cannot be cloned.
+    """
+    if getattr(_worker_sessions, 'user', None) is not user:
+        session = user
+        api = user.get_api()
+        client = clone_client(api._api_client)
+        if client is not api._api_client:
+            worker_api = copy.copy(api)
+            worker_api._api_client = client
+            session = copy.copy(user)
+            session.get_api = lambda: worker_api
+        _worker_sessions.user = user
+        _worker_sessions.session = session
+    return _worker_sessions.session
+
+
+@contextlib.contextmanager
+def user_context(user):
+    with app.app_context():
+        g.user = worker_session(user)
+        yield
+
+
+def deploy_batch(ids):
+    return deploy(ids, timeout=BULK_DEPLOY_TIMEOUT)
+
+
+def prepare_bulk_chunk(lines):
+    if BULK_PING_CHECK:
+        ping_sweep([line[5].strip() for line in lines
+                    if len(line) > 5 and line[0] == 'A' and line[1] in ('C', 'U') and line[5].strip()])
+
+
+PROBER = LivenessProber(method=PING_METHOD, timeout=PING_TIMEOUT, tcp_ports=PING_TCP_PORTS,
+                        ttl=PING_CACHE_TTL, max_workers=PING_WORKERS)
+
+BULK_JOBS = BulkJobManager(BULK_JOB_DIR, process_bulk_line, deploy_batch, user_context,
+                           max_workers=BULK_WORKERS, chunk_size=BULK_CHUNK_SIZE,
+                           deploy_batch_size=BULK_DEPLOY_BATCH_SIZE, prepare_chunk=prepare_bulk_chunk,
+                           retention=BULK_JOB_RETENTION_DAYS * 86400 if BULK_JOB_RETENTION_DAYS is not None else None)
+
+
 @route(app, '/manage_records/deploy_records', methods=['POST'])
 @util.rest_workflow_permission_required('manage_records')
 @util.rest_exception_catcher
@@ -499,10 +614,10 @@ def deploy_records_endpoint():
     return jsonify(response_data), response_code
 
 
-def deploy(ids):
+def deploy(ids, timeout=30):
     try:
         # API call to run the selective deployment
-        deploy_return = g.user.get_api().selective_deploy_synchronous(ids, properties='scope=related', timeout=30)
+        deploy_return = g.user.get_api().selective_deploy_synchronous(ids, properties='scope=related', timeout=timeout)
         return 200, deploy_return
     except (APIException, BAMException, PortalException) as e:
         return 500, 'Unable to deploy the records, exception: %s' % util.safe_str(e)
@@ -608,18 +723,13 @@ def check_common_reservation(json_data):
 
 
 def ping_check(ip_address, record_type):
-    try:
-        if record_type == 'A':
-            ping_command = 'ping'
-        elif record_type == 'AAAA':
-            ping_command = 'ping6'
-        output = subprocess.check_output([ping_command, ip_address, '-c 1'], stderr=subprocess.STDOUT,
-                                         shell=False)
-    except CalledProcessError as e:
-        if '0 packets received' in str(e.output):
-            return False
-
-    return True
+    # Returns True if something answered at the address, results are cached for PING_CACHE_TTL seconds
+    return PROBER.is_alive(ip_address)
+
+
+def ping_sweep(ip_addresses):
+    # Probe all the addresses of a batch in parallel so the per record ping_check calls hit the cache
+    return PROBER.sweep(ip_addresses)
 
 
 def is_csv(filename):
@@ -5,3 +5,30 @@ DEFAULT_CONFIG_NAME = 'Default'
 # Default View ID
 DEFAULT_VIEW_NAME = 'test1'
 DEFAULT_VIEW_ID = 100910
+
+# Bulk jobs
+# Directory the uploaded bulk files, job journals and per-line results are kept in
+BULK_JOB_DIR = 'bluecat_portal/uploads/manage_records_jobs'
+# Number of rows processed concurrently, rows for the same name.zone are always applied in order
+BULK_WORKERS = 8
+# Rows committed at a time, a resumed job restarts after the last committed chunk
+BULK_CHUNK_SIZE = 200
+# Maximum number of entity IDs passed to one selective deployment
+BULK_DEPLOY_BATCH_SIZE = 500
+# Timeout in seconds of a batched selective deployment
+BULK_DEPLOY_TIMEOUT = 300
+# Days the files of completed and failed jobs are kept, None keeps them forever
+BULK_JOB_RETENTION_DAYS = 7
+# Ping check the IPs of A records created or updated by bulk jobs
+BULK_PING_CHECK = False
+
+# Ping check
+# 'icmp' sends one echo request, 'tcp' tries to connect to PING_TCP_PORTS
+PING_METHOD = 'icmp'
+# Seconds to wait for an answer
+PING_TIMEOUT = 1
+PING_TCP_PORTS = (22, 80, 443)
+# Seconds a probe result is reused for
+PING_CACHE_TTL = 30
+# Number of probes run concurrently
+PING_WORKERS = 32
@@ -21,14 +21,20 @@
 # Various Flask framework items.
 import json
 import csv
+import heapq
 import ipaddress
 import os
+import socket
+import struct
+import tempfile
+from contextlib import contextmanager
 
 import openpyxl
+from openpyxl.cell import WriteOnlyCell
 from openpyxl.styles import Font, PatternFill, Alignment
 from openpyxl.styles.colors import Color
-from openpyxl.worksheet.dimensions import RowDimension
-from openpyxl.utils.cell import column_index_from_string, get_column_letter
+from openpyxl.utils.cell import column_index_from_string, get_column_letter, coordinate_from_string
+from openpyxl.utils.indexed_list import IndexedList
 
 from bluecat import util
 from bluecat.entity import Entity
@@ -36,6 +42,8 @@ from bluecat.api_exception import BAMException, PortalException
 
 import config.default_config as config
 
+from .prefetch import ChildPrefetcher
+
 col_config = {}
 CONFIG_FILE = '%s/config_%s.json'
 
@@ -58,6 +66,17 @@ LINK_FONT = Font(underline='single', color=Color(theme=10, type="theme"))
 BOLD_LINK_FONT = Font(bold=True, underline='single', color=Color(theme=10, type="theme"))
 TITLE_FILL_COLOR = PatternFill('solid', fgColor='9BC2E6')
 
+# Assigned addresses held in memory per network before a sorted run is spilled to a temporary file
+SORT_BUFFER_ROWS = 100000
+# Rows per Excel worksheet, a network with more addresses continues on the next sheet
+EXCEL_MAX_ROWS = 1048576
+# Concurrent BAM sessions used to fetch blocks and networks while the file is written
+DEFAULT_SESSIONS = 4
+# Blocks and networks are the nodes of the exported tree, networks are its leaves
+TREE_TYPES = (Entity.IP4Block, Entity.IP4Network)
+# Networks up to this size have their addresses fetched ahead too, larger ones are paged while written
+PREFETCH_MAX_ADDRESSES = 4096
+
 def load_config(module_dir, nodes):
     global col_config
     col_config = json.load(open(CONFIG_FILE % (module_dir, config.language)))
@@ -89,24 +108,24 @@ def get_range(entity):
             range = entity.get_property('start') + '-' + entity.get_property('end')
         return range
 
-def get_sorted_children(parent):
-    nodes = []
-    ip4_blocks = parent.get_children_of_type(Entity.IP4Block)
-    for ip4_block in ip4_blocks:
-        node = {}
-        node['entity'] = ip4_block
-        node['order'] = get_order(ip4_block)
-        nodes.append(node)
-        
-    ip4_networks = parent.get_children_of_type(Entity.IP4Network)
-    for ip4_network in ip4_networks:
-        node = {}
-        node['entity'] = ip4_network
-        node['order'] = get_order(ip4_network)
-        nodes.append(node)
-        
-    nodes.sort(key = lambda node: node['order'])
-    return nodes
+def get_child_types(entity):
+    if entity.get_type() == Entity.IP4Network:
+        return ()
+    return TREE_TYPES
+
+def get_child_types_with_addresses(entity):
+    if entity.get_type() == Entity.IP4Network:
+        if ipaddress.ip_network(entity.get_property('CIDR')).num_addresses <= PREFETCH_MAX_ADDRESSES:
+            return (Entity.IP4Address,)
+        return ()
+    return TREE_TYPES
+
+def create_prefetcher(api):
+    return ChildPrefetcher(api, col_config.get('sessions', DEFAULT_SESSIONS))
+
+def walk_tree(prefetcher, entity, include_root=False, addresses=False):
+    types_of = get_child_types_with_addresses if addresses else get_child_types
+    return prefetcher.walk(entity, types_of, TREE_TYPES, get_order, include_root)
 
 def set_common_props(node, parent, level, entity):
     node['id'] = entity.get_id()
@@ -161,97 +180,165 @@ def construct_structure_row(indent, entity):
     return row
     
 # -----------------------------------
-# IP Address CSV writing functions.
+# IP Address row streaming functions.
 # -----------------------------------
-def write_header(writer):
-    header = []
-    props = col_config['address']
-    for prop in props:
-        header.append(prop['title'])
-    
-    writer.writerow(header)
-    
-def write_blunk_address(writer, address, name):
+def int2ip4(address):
+    return socket.inet_ntoa(struct.pack('!I', address))
+
+def construct_address_row(ip4_address):
     row = []
     props = col_config['address']
     for prop in props:
         id = prop['id']
         if id == 'ip_address':
-            row.append(util.int2ip4(int(address)))
+            row.append(ip4_address.get_address())
         elif id == 'name':
-            row.append(name)
+            row.append(ip4_address.get_name())
         else:
-            row.append(None)
-    writer.writerow(row)
+            row.append(ip4_address.get_property(id))
+    return row
 
-def write_ip4_address(writer, ip4_address):
+def construct_blunk_row(address, name):
     row = []
     props = col_config['address']
     for prop in props:
         id = prop['id']
         if id == 'ip_address':
-            row.append(ip4_address.get_address())
+            row.append(address)
         elif id == 'name':
-            row.append(ip4_address.get_name())
+            row.append(name)
         else:
-            row.append(ip4_address.get_property(id))
-    writer.writerow(row)
-    
-def write_ip4_addresses(writer, ip4_network, ip4_addresses):
-    for ip4_address in ip4_addresses:
-        write_ip4_address(writer, ip4_address)
+            row.append(None)
+    return row
 
-def write_full_ip4_addresses(writer, ip4_network, ip4_addresses):
-    iter_address = iter(ip4_addresses)
-    ip4_address = None
+class SortedAddressRows(object):
+    """
+    Collects (address, row) pairs of a network and returns them in address order.
+    At most buffer_rows pairs are held in memory, further pairs are sorted into runs
+    on temporary files which are merged when iterating.
+    """
+
+    def __init__(self, buffer_rows=SORT_BUFFER_ROWS):
+        self._buffer_rows = buffer_rows
+        self._buffer = []
+        self._runs = []
+
+    def add(self, address, row):
+        self._buffer.append((address, row))
+        if len(self._buffer) >= self._buffer_rows:
+            self._spill()
+
+    def _spill(self):
+        self._buffer.sort(key=lambda item: item[0])
+        run = tempfile.TemporaryFile('w+', encoding='utf-8')
+        for item in self._buffer:
+            run.write(json.dumps(item) + '\n')
+        run.seek(0)
+        self._runs.append(run)
+        self._buffer = []
+
+    def _read_run(self, run):
+        for line in run:
+            address, row = json.loads(line)
+            yield address, row
+
+    def __iter__(self):
+        self._buffer.sort(key=lambda item: item[0])
+        if not self._runs:
+            return iter(self._buffer)
+        runs = [self._read_run(run) for run in self._runs]
+        return heapq.merge(iter(self._buffer), *runs, key=lambda item: item[0])
+
+    def close(self):
+        for run in self._runs:
+            run.close()
+        self._runs = []
+        self._buffer = []
+
+@contextmanager
+def collect_ip4_addresses(ip4_network, ip4_addresses=None):
+    # get_children_of_type pages through the addresses unless they were prefetched,
+    # each one is reduced to its row straight away
+    if ip4_addresses is None:
+        ip4_addresses = ip4_network.get_children_of_type(Entity.IP4Address)
+    rows = SortedAddressRows()
     try:
-        ip4_address = next(iter_address)
-    except StopIteration:
-        pass
-        
+        for ip4_address in ip4_addresses:
+            rows.add(util.ip42int(ip4_address.get_address()), construct_address_row(ip4_address))
+        yield rows
+    finally:
+        rows.close()
+
+def iter_unallocated_rows(start_address, end_address):
+    if end_address < start_address:
+        return
+    if col_config.get('collapse_unallocated', False):
+        if start_address == end_address:
+            yield construct_blunk_row(int2ip4(start_address), '')
+        else:
+            yield construct_blunk_row(int2ip4(start_address) + '-' + int2ip4(end_address), '')
+    else:
+        # One template row is reused, only its IP address changes
+        row = construct_blunk_row(None, '')
+        ids = [prop['id'] for prop in col_config['address']]
+        ip_index = ids.index('ip_address') if 'ip_address' in ids else None
+        for address in range(start_address, end_address + 1):
+            if ip_index is not None:
+                row[ip_index] = int2ip4(address)
+            yield list(row)
+
+def iter_ip4_address_rows(ip4_network, address_rows, full):
+    """Yield the address rows of a network, with the unallocated addresses in between when full is set"""
+    if full != True:
+        for address, row in address_rows:
+            yield row
+        return
+
     cidr = ip4_network.get_property('CIDR')
     network = ipaddress.IPv4Network(cidr)
-    start_address = util.ip42int(str(network.network_address))
-    end_address = util.ip42int(str(network.broadcast_address))
-    
+    start_address = int(network.network_address)
+    end_address = int(network.broadcast_address)
+
     mask = int(cidr.split('/')[1])
     if mask <= 30:
-        write_blunk_address(writer, start_address, NETWORKID_DISPLAY_NAME)
+        yield construct_blunk_row(int2ip4(start_address), NETWORKID_DISPLAY_NAME)
         start_address += 1
         end_address -= 1
-        
-    for address in range(start_address, end_address + 1):
-        if ip4_address is not None and address == util.ip42int(ip4_address.get_address()):
-            write_ip4_address(writer, ip4_address)
-            try:
-                ip4_address = next(iter_address)
-            except StopIteration:
-                ip4_address = None
-                pass
-        else:
-            write_blunk_address(writer, address, '')
-            
+
+    next_address = start_address
+    for address, row in address_rows:
+        if address < next_address or end_address < address:
+            continue
+        for blunk_row in iter_unallocated_rows(next_address, address - 1):
+            yield blunk_row
+        yield row
+        next_address = address + 1
+    for blunk_row in iter_unallocated_rows(next_address, end_address):
+        yield blunk_row
+
     if mask <= 30:
-        write_blunk_address(writer, end_address + 1, BROADCAST_DISPLAY_NAME)
+        yield construct_blunk_row(int2ip4(end_address + 1), BROADCAST_DISPLAY_NAME)
 
-def write_ip4_network(writer, ip4_network, full):
-    children = ip4_network.get_children_of_type(Entity.IP4Address)
-    ip4_addresses = list(children)
-    ip4_addresses.sort(key = lambda e: util.ip42int(e.get_address()))
+# -----------------------------------
+# IP Address CSV writing functions.
+# -----------------------------------
+def write_header(writer):
+    header = []
+    props = col_config['address']
+    for prop in props:
+        header.append(prop['title'])
     
+    writer.writerow(header)
+
+def write_ip4_network(writer, ip4_network, full, ip4_addresses=None):
     write_header(writer)
-    if full == True:
-        write_full_ip4_addresses(writer, ip4_network, ip4_addresses)
-    else:
-        write_ip4_addresses(writer, ip4_network, ip4_addresses)
+    with collect_ip4_addresses(ip4_network, ip4_addresses) as address_rows:
+        writer.writerows(iter_ip4_address_rows(ip4_network, address_rows, full))
     
-def write_tree(api, writer, entity, full):
-    if entity.get_type() == Entity.IP4Network:
-        write_ip4_network(writer, entity, full)
-    else:
-        nodes = get_sorted_children(entity)
-        for node in nodes:
-            write_tree(api, writer, node['entity'], full)
+def write_tree(prefetcher, writer, entity, full):
+    for level, node, children in walk_tree(prefetcher, entity, include_root=True, addresses=True):
+        if node.get_type() == Entity.IP4Network:
+            write_ip4_network(writer, node, full, children.get(Entity.IP4Address))
         
 # --------------------------------------------
 # Network Structure CSV writing functions.
@@ -264,14 +351,9 @@ def write_structure_header(writer):
     
     writer.writerow(header)
     
-def write_structure(api, writer, level, entity):
-    if entity.get_type() != Entity.IP4Network:
-        nodes = get_sorted_children(entity)
-        if 0 < len(nodes):
-            for node in nodes:
-                row = construct_structure_row(level, node['entity'])
-                writer.writerow(row)
-                write_structure(api, writer, level + 1, node['entity'])
+def write_structure(prefetcher, writer, entity):
+    for level, node, children in walk_tree(prefetcher, entity):
+        writer.writerow(construct_structure_row(level, node))
 
 # --------------------------------------------
 # Top Writing function for CSV format.
@@ -283,33 +365,68 @@ def export_as_csv(api, dirname, filename, id, contents, full):
     f = open(dirname + '/' + filename, 'w', encoding=encoding)
     writer = csv.writer(f, lineterminator = '\n')
     
-    if contents == 'struct' or contents == 'both':
-        write_structure_header(writer)
-        write_structure(api, writer, 0, entity)
-        
-    if contents == 'ip' or contents == 'both':
-        write_tree(api, writer, entity, full)
+    with create_prefetcher(api) as prefetcher:
+        if contents == 'struct' or contents == 'both':
+            write_structure_header(writer)
+            write_structure(prefetcher, writer, entity)
+
+        if contents == 'ip' or contents == 'both':
+            write_tree(prefetcher, writer, entity, full)
     f.close()
 
 # -------------------------------------
 # IP Address Excel writing functions.
 # -------------------------------------
+class SheetWriter(object):
+    """
+    Appends rows to a write-only worksheet starting at start_column.
+    Rows are streamed to disk as they are appended, so only the current row is kept in memory.
+    """
+
+    def __init__(self, sheet, start_column):
+        self.sheet = sheet
+        self.index = 0
+        self._padding = [None] * (column_index_from_string(start_column) - 1)
+
+    def append(self, row, column=None):
+        if column is None:
+            padding = self._padding
+        else:
+            padding = [None] * (column_index_from_string(column) - 1)
+        self.sheet.append(padding + list(row))
+        self.index += 1
+        return self.index
+
+    def skip_to(self, index):
+        while self.index < index - 1:
+            self.sheet.append([])
+            self.index += 1
+
+def create_workbook(template):
+    # A write-only workbook cannot be based on the template, so only its default font is taken over
+    workbook = openpyxl.Workbook(write_only=True)
+    template_workbook = openpyxl.load_workbook(template)
+    fonts = list(workbook._fonts)
+    fonts[0] = template_workbook._fonts[0]
+    workbook._fonts = IndexedList(fonts)
+    template_workbook.close()
+    return workbook
+
 def get_sheet_name(entity):
     return get_range(entity).replace('/', ' MASK ')
 
-def write_row_for_excel(sheet, start_column, index, row):
-    start_column_idx = column_index_from_string(start_column)
-    for column in range(len(row)):
-        sheet.cell(row=index, column=start_column_idx + column, value=row[column])
-        
-def set_fill_color(sheet, start_column, index, row):
-    start_column_idx = column_index_from_string(start_column)
-    
-    for column in range(len(row)):
-        cell = sheet.cell(row=index, column=start_column_idx + column)
-        cell.fill = TITLE_FILL_COLOR
-        cell.font = BOLD_FONT
-        
+def styled_cell(sheet, value, font=None, fill=None, hyperlink=None, alignment=None):
+    cell = WriteOnlyCell(sheet, value=value)
+    if font is not None:
+        cell.font = font
+    if fill is not None:
+        cell.fill = fill
+    if hyperlink is not None:
+        cell.hyperlink = hyperlink
+    if alignment is not None:
+        cell.alignment = alignment
+    return cell
+
 def set_column_width(sheet, start_column, widthes):
     start_column_idx = column_index_from_string(start_column)
 
@@ -323,121 +440,63 @@ def add_auto_filters(sheet, start_column, start_row, length):
     filter_range = start_column + str(start_row) +  ':' + end_column + str(start_row)
     sheet.auto_filter.ref = filter_range
 
-def write_title_for_excel(sheet, entity, linked_cells):
-    title_cell_index = col_config['excel']['title_cell_index']
-    title_string = SHEET_TITLE_FOR_NETWORK + get_range(entity)
-    if entity.get_name() != None:
-        title_string += ' - ' + entity.get_name()
-    sheet[title_cell_index].value = title_string
-    if 0 < len(linked_cells):
-        sheet[title_cell_index].hyperlink = linked_cells[str(entity.get_id())]
-        sheet[title_cell_index].font = BOLD_LINK_FONT
+def write_title_for_excel(writer, title_string, hyperlink=None):
+    title_column, title_row = coordinate_from_string(col_config['excel']['title_cell_index'])
+    writer.skip_to(title_row)
+    if hyperlink is not None:
+        cell = styled_cell(writer.sheet, title_string, font=BOLD_LINK_FONT, hyperlink=hyperlink)
     else:
-        sheet[title_cell_index].font = BOLD_FONT            
-    
-def write_header_for_excel(sheet, start_column, start_row):
-    header = []
-    widthes = []
-    props = col_config['address']
-    for prop in props:
-        header.append(prop['title'])
-        widthes.append(prop['width'])
-    
-    write_row_for_excel(sheet, start_column, start_row, header)
-    set_fill_color(sheet, start_column, start_row, header)
-    set_column_width(sheet, start_column, widthes)
-    sheet.freeze_panes = 'A' + str(start_row + 1)
-    
-def write_blunk_address_for_excel(sheet, start_column, index, address, name):
-    start_column_idx = column_index_from_string(start_column)
-
-    sheet.cell(row=index, column=start_column_idx, value=util.int2ip4(int(address)))
-    sheet.cell(row=index, column=start_column_idx + 1, value=name)
-    
-def write_ip4_address_for_excel(sheet, start_column, index, ip4_address):
-    row = []
-    props = col_config['address']
-    for prop in props:
-        id = prop['id']
-        if id == 'ip_address':
-            row.append(ip4_address.get_address())
-        elif id == 'name':
-            row.append(ip4_address.get_name())
-        else:
-            row.append(ip4_address.get_property(id))
-            
-    write_row_for_excel(sheet, start_column, index, row)
-    
-def write_ip4_addresses_for_excel(sheet, start_column, start_row, ip4_network, ip4_addresses):
-    index = start_row + 1
-    
-    for ip4_address in ip4_addresses:
-        write_ip4_address_for_excel(sheet, start_column, index, ip4_address)
-        index += 1
-        
-def write_full_ip4_addresses_for_excel(sheet, start_column, start_row, ip4_network, ip4_addresses):
-    index = start_row + 1
-    iter_address = iter(ip4_addresses)
-    ip4_address = None
-    try:
-        ip4_address = next(iter_address)
-    except StopIteration:
-        pass
-        
-    cidr = ip4_network.get_property('CIDR')
-    network = ipaddress.IPv4Network(cidr)
-    start_address = util.ip42int(str(network.network_address))
-    end_address = util.ip42int(str(network.broadcast_address))
-    
-    mask = int(cidr.split('/')[1])
-    if mask <= 30:
-        write_blunk_address_for_excel(sheet, start_column, index, start_address, NETWORKID_DISPLAY_NAME)
-        start_address += 1
-        end_address -= 1
-        index += 1
-        
-    for address in range(start_address, end_address + 1):
-        if ip4_address is not None and address == util.ip42int(ip4_address.get_address()):
-            write_ip4_address_for_excel(sheet, start_column, index, ip4_address)
-            try:
-                ip4_address = next(iter_address)
-            except StopIteration:
-                pass
-        else:
-            write_blunk_address_for_excel(sheet, start_column, index, address, '')
-        index += 1
-        
-    if mask <= 30:
-        write_blunk_address_for_excel(sheet, start_column, index, end_address + 1, BROADCAST_DISPLAY_NAME)
-
-def write_ip4_network_for_excel(workbook, start_column, start_row, ip4_network, full, linked_cells):
-    children = ip4_network.get_children_of_type(Entity.IP4Address)
-    ip4_addresses = list(children)
-    ip4_addresses.sort(key = lambda e: util.ip42int(e.get_address()))
-    
-    sheet = workbook.create_sheet(title=get_sheet_name(ip4_network))
-    write_title_for_excel(sheet, ip4_network, linked_cells)
-    write_header_for_excel(sheet, start_column, start_row)
-    add_auto_filters(sheet, start_column, start_row, len(col_config['address']))
-
-    if full == True:
-        write_full_ip4_addresses_for_excel(sheet, start_column, start_row, ip4_network, ip4_addresses)
-    else:
-        write_ip4_addresses_for_excel(sheet, start_column, start_row, ip4_network, ip4_addresses)
-
-def write_tree_for_excel(api, workbook, start_column, start_row, entity, full, linked_cells):
-    if entity.get_type() == Entity.IP4Network:
-        write_ip4_network_for_excel(workbook, start_column, start_row, entity, full, linked_cells)
-    else:
-        nodes = get_sorted_children(entity)
-        for node in nodes:
-            write_tree_for_excel(api, workbook, start_column, start_row, node['entity'], full, linked_cells)
+        cell = styled_cell(writer.sheet, title_string, font=BOLD_FONT)
+    writer.append([cell], column=title_column)
+
+def write_header_for_excel(writer, start_column, start_row, props):
+    # Column widths, frozen panes and filters must be set before the first row is streamed
+    set_column_width(writer.sheet, start_column, [prop['width'] for prop in props])
+    writer.sheet.freeze_panes = 'A' + str(start_row + 1)
+    add_auto_filters(writer.sheet, start_column, start_row, len(props))
+
+def write_header_row_for_excel(writer, start_row, props):
+    writer.skip_to(start_row)
+    writer.append([styled_cell(writer.sheet, prop['title'], font=BOLD_FONT, fill=TITLE_FILL_COLOR) for prop in props])
+
+def create_ip4_network_sheet(workbook, start_column, start_row, ip4_network, linked_cells, part):
+    title = get_sheet_name(ip4_network)
+    if 1 < part:
+        title += ' (%d)' % part
+    writer = SheetWriter(workbook.create_sheet(title=title), start_column)
+    write_header_for_excel(writer, start_column, start_row, col_config['address'])
+
+    title_string = SHEET_TITLE_FOR_NETWORK + get_range(ip4_network)
+    if ip4_network.get_name() != None:
+        title_string += ' - ' + ip4_network.get_name()
+    write_title_for_excel(writer, title_string, linked_cells.get(str(ip4_network.get_id())))
+    write_header_row_for_excel(writer, start_row, col_config['address'])
+    return writer
+
+def write_ip4_network_for_excel(workbook, start_column, start_row, ip4_network, full, linked_cells,
+                                ip4_addresses=None):
+    part = 1
+    writer = create_ip4_network_sheet(workbook, start_column, start_row, ip4_network, linked_cells, part)
+    with collect_ip4_addresses(ip4_network, ip4_addresses) as address_rows:
+        for row in iter_ip4_address_rows(ip4_network, address_rows, full):
+            if EXCEL_MAX_ROWS <= writer.index:
+                writer.sheet.close()
+                part += 1
+                writer = create_ip4_network_sheet(workbook, start_column, start_row, ip4_network, linked_cells, part)
+            writer.append(row)
+    # Finish the sheet now so its temporary file is not kept open until the workbook is saved
+    writer.sheet.close()
+
+def write_tree_for_excel(prefetcher, workbook, start_column, start_row, entity, full, linked_cells):
+    for level, node, children in walk_tree(prefetcher, entity, include_root=True, addresses=True):
+        if node.get_type() == Entity.IP4Network:
+            write_ip4_network_for_excel(workbook, start_column, start_row, node, full, linked_cells,
+                                        children.get(Entity.IP4Address))
 
 # --------------------------------------------
 # Network Structure Excel writing functions.
 # --------------------------------------------
-def write_structure_title_for_excel(sheet, entity):
-    title_cell_index = col_config['excel']['title_cell_index']
+def get_structure_title(entity):
     title_string = ''
     if entity.get_type() == Entity.Configuration:
         title_string = SHEET_TITLE_FOR_CONFIGURATION + entity.get_name()
@@ -449,47 +508,25 @@ def write_structure_title_for_excel(sheet, entity):
         title_string += get_range(entity)
         if entity.get_name() != None:
             title_string += ' - ' + entity.get_name()
-            
-    sheet[title_cell_index].value = title_string
-    sheet[title_cell_index].font = BOLD_FONT            
+    return title_string
 
-def write_structure_header_for_excel(start_column, start_row, sheet):
-    header = []
-    widthes = []
-    props = col_config['range']
-    for prop in props:
-        header.append(prop['title'])
-        widthes.append(prop['width'])
-    
-    write_row_for_excel(sheet, start_column, start_row, header)
-    set_fill_color(sheet, start_column, start_row, header)
-    set_column_width(sheet, start_column, widthes)
-    sheet.freeze_panes = 'A' + str(start_row + 1)
-
-def write_structure_node_for_excel(api, sheet, level, start_column, index, entity, add_link, linked_cells):
+def write_structure_node_for_excel(writer, level, start_column, entity, add_link, linked_cells):
     row = construct_structure_row(0, entity)
-    write_row_for_excel(sheet, start_column, index, row)
-    cell = sheet.cell(row=index, column=column_index_from_string(start_column))
-    cell.alignment = Alignment(indent=level)
+    index = writer.index + 1
+    if 0 < level:
+        writer.sheet.row_dimensions[index].outline_level = level
     if entity.get_type() == Entity.IP4Network and True == add_link:
-        cell.hyperlink = "#'" + get_sheet_name(entity) + "'!" + col_config['excel']['title_cell_index']
-        cell.font = LINK_FONT
-        linked_cells[str(entity.get_id())] = "#'" + sheet.title + "'!" + start_column + str(index)
-    
-def write_structure_for_excel(api, sheet, level, start_column, index, entity, add_link, linked_cells):
-    if entity.get_type() != Entity.IP4Network:
-        nodes = get_sorted_children(entity)
-        
-        if 0 < len(nodes):
-            for node in nodes:
-                write_structure_node_for_excel(api, sheet, level, \
-                                               start_column, index, node['entity'], add_link, linked_cells)
-                if 0 < level:
-                    sheet.row_dimensions[index].outline_level = level
-                index += 1
-                index = write_structure_for_excel(api, sheet, level + 1, \
-                                                  start_column, index, node['entity'], add_link, linked_cells)
-    return index
+        hyperlink = "#'" + get_sheet_name(entity) + "'!" + col_config['excel']['title_cell_index']
+        row[0] = styled_cell(writer.sheet, row[0], font=LINK_FONT, hyperlink=hyperlink,
+                             alignment=Alignment(indent=level))
+        linked_cells[str(entity.get_id())] = "#'" + writer.sheet.title + "'!" + start_column + str(index)
+    else:
+        row[0] = styled_cell(writer.sheet, row[0], alignment=Alignment(indent=level))
+    writer.append(row)
+
+def write_structure_for_excel(prefetcher, writer, start_column, entity, add_link, linked_cells):
+    for level, node, children in walk_tree(prefetcher, entity):
+        write_structure_node_for_excel(writer, level, start_column, node, add_link, linked_cells)
 
 # --------------------------------------------
 # Top Writing function for Excel format.
@@ -500,20 +537,18 @@ def export_as_excel(api, dirname, filename, id, contents, full):
     start_row = excel_config['start_row']
     linked_cells = {}
 
-    workbook = openpyxl.load_workbook(dirname + '/templates/MeiryoUI.xlsx')
-    sheet = workbook.active
+    workbook = create_workbook(dirname + '/templates/MeiryoUI.xlsx')
     entity = api.get_entity_by_id(id)
-    if contents == 'struct' or contents == 'both':
-        sheet.title = get_sheet_name(entity)
-        write_structure_title_for_excel(sheet, entity)
-        write_structure_header_for_excel(start_column, start_row, sheet)
-        add_auto_filters(sheet, start_column, start_row, len(col_config['range']))
-        write_structure_for_excel(api, sheet, 0, start_column, start_row + 1, \
-                                  entity, (True if contents == 'both' else False), linked_cells)
-    else:
-        workbook.remove(sheet)
-    
-    if contents == 'ip' or contents == 'both':
-        write_tree_for_excel(api, workbook, start_column, start_row, entity, full, linked_cells)
+    with create_prefetcher(api) as prefetcher:
+        if contents == 'struct' or contents == 'both':
+            writer = SheetWriter(workbook.create_sheet(title=get_sheet_name(entity)), start_column)
+            write_header_for_excel(writer, start_column, start_row, col_config['range'])
+            write_title_for_excel(writer, get_structure_title(entity))
+            write_header_row_for_excel(writer, start_row, col_config['range'])
+            write_structure_for_excel(prefetcher, writer, start_column, entity,
+                                      (True if contents == 'both' else False), linked_cells)
+            writer.sheet.close()
+
+        if contents == 'ip' or contents == 'both':
+            write_tree_for_excel(prefetcher, workbook, start_column, start_row, entity, full, linked_cells)
     workbook.save(dirname + '/' + filename)
-    
\ No newline at end of file
@@ -0,0 +1,134 @@
+# Copyright 2020 BlueCat Networks (USA) Inc. and its affiliates
+# -*- coding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# By: BlueCat Networks
+# Date: 2020-06-01
+# Gateway Version: 19.5.1
+# Description: Concurrent, order preserving BAM tree traversal shared by the exporters
+
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+from bluecat.util import has_response
+
+PAGE_SIZE = 1000
+
+
+def clone_client(shared):
+    """Return a clone of a suds client for one thread, suds clients are not thread safe"""
+    try:
+        # A cloned suds client starts with an empty cookie jar, carry the BAM session over
+        client = shared.clone()
+        for cookie in shared.options.transport.cookiejar:
+            client.options.transport.cookiejar.set_cookie(cookie)
+    except AttributeError:
+        return shared
+    return client
+
+
+class ChildPrefetcher(object):
+    """
+    Walks a BAM entity tree depth-first in a deterministic order while fetching children ahead.
+    Each worker thread talks to BAM through its own copy of the user's SOAP client, so up to
+    `sessions` getEntities calls are in flight at once. While one node is being written, the
+    children of the next `lookahead` siblings are already being fetched, one request per
+    (node, entity type) pair. Only the calling thread submits work and waits for results.
+    """
+
+    def __init__(self, api, sessions=4, lookahead=None, page_size=PAGE_SIZE):
+        self._api = api
+        self._sessions = max(1, sessions)
+        self._lookahead = lookahead or self._sessions * 2
+        self._page_size = page_size
+        self._local = threading.local()
+        self._pool = ThreadPoolExecutor(max_workers=self._sessions)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        self._pool.shutdown(wait=True)
+
+    def _client(self):
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self._local.client = clone_client(self._api._api_client)
+        return client
+
+    def fetch(self, parent_id, entity_type):
+        """Return every child of parent_id of the given type, fetched on the calling thread's session"""
+        client = self._client()
+        children = []
+        start = 0
+        while True:
+            page = client.service.getEntities(parent_id, entity_type, start, self._page_size)
+            if not has_response(page):
+                break
+            children.extend(self._api.instantiate_entity(item) for item in page.item)
+            if len(page.item) < self._page_size:
+                break
+            start += self._page_size
+        return children
+
+    def iter_children(self, parents, types_of):
+        """
+        Yield (parent, OrderedDict(entity type -> children)) for each parent in order.
+        types_of(parent) returns the entity types to fetch for that parent.
+        """
+        parents = iter(parents)
+        pending = deque()
+
+        def fill():
+            while len(pending) < self._lookahead:
+                parent = next(parents, None)
+                if parent is None:
+                    return
+                futures = [(entity_type, self._pool.submit(self.fetch, parent.get_id(), entity_type))
+                           for entity_type in types_of(parent)]
+                pending.append((parent, futures))
+
+        fill()
+        while pending:
+            parent, futures = pending.popleft()
+            children = OrderedDict((entity_type, future.result()) for entity_type, future in futures)
+            fill()
+            yield parent, children
+
+    def walk(self, root, types_of, tree_types, sort_key, include_root=False):
+        """
+        Yield (level, entity, children) for the descendants of root in depth-first pre-order.
+        Children of the types in tree_types are descended into, sorted by sort_key; children of
+        any other type returned by types_of are only handed to the caller.
+        With include_root the root itself is yielded first at level 0.
+        """
+        for entity, children in self.iter_children([root], types_of):
+            level = 0
+            if include_root:
+                yield level, entity, children
+                level += 1
+            for item in self._walk(children, types_of, tree_types, sort_key, level):
+                yield item
+
+    def _walk(self, children, types_of, tree_types, sort_key, level):
+        nodes = [child for entity_type in tree_types for child in children.get(entity_type, [])]
+        nodes.sort(key=sort_key)
+        for entity, grandchildren in self.iter_children(nodes, types_of):
+            yield level, entity, grandchildren
+            for item in self._walk(grandchildren, types_of, tree_types, sort_key, level + 1):
+                yield item
@@ -0,0 +1,215 @@
+# Copyright 2020 BlueCat Networks (USA) Inc. and its affiliates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Measures how many events per second the query_logger Poller formats and sends to a
+TCP syslog server, for the previous per-event implementation and the current one.
+Both write to a local TCP sink and the LEEF lines they produce are compared.
+
+Usage: python3 poller_benchmark.py [events]
+"""
+__author__ = 'BlueCat Networks'
+
+import datetime as dt
+import json
+import logging
+import os
+import socket
+import sys
+import threading
+import time
+from collections import OrderedDict
+from logging.handlers import SysLogHandler
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+from poller import Poller  # noqa: E402
+from edge_logging import EdgeLogger  # noqa: E402
+
+
+class Config(object):
+    """Stands in for QueryLogger.get_value, reading the workflow config.json"""
+
+    def __init__(self, port):
+        config_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'config.json')
+        with open(config_file) as f:
+            self._config = json.load(f)
+        self._config['datalog'].update({'server': '127.0.0.1', 'port': port, 'protocol': 'tcp'})
+
+    def get_value(self, section, key):
+        return self._config[section].get(key)
+
+
+class NullLogger(object):
+    def info(self, message):
+        pass
+
+    def debug(self, message):
+        pass
+
+
+class Sink(object):
+    """TCP syslog server that keeps what it receives"""
+
+    def __init__(self):
+        self._server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._server.bind(('127.0.0.1', 0))
+        self._server.listen(5)
+        self.port = self._server.getsockname()[1]
+        self._data = []
+        self._lock = threading.Lock()
+        thread = threading.Thread(target=self._accept)
+        thread.daemon = True
+        thread.start()
+
+    def _accept(self):
+        while True:
+            connection, _ = self._server.accept()
+            thread = threading.Thread(target=self._receive, args=(connection,))
+            thread.daemon = True
+            thread.start()
+
+    def _receive(self, connection):
+        while True:
+            chunk = connection.recv(1 << 20)
+            if not chunk:
+                return
+            with self._lock:
+                self._data.append(chunk)
+
+    def wait_for(self, count):
+        deadline = time.time() + 60
+        while time.time() < deadline:
+            with self._lock:
+                if b''.join(self._data).count(b'\x00') >= count:
+                    break
+            time.sleep(0.05)
+
+    def take(self):
+        with self._lock:
+            data = b''.join(self._data)
+            self._data = []
+        return [line.split(b' BCDNSEDGE ', 1)[1] for line in data.split(b'\x00') if line]
+
+
+class LegacyPoller(object):
+    """The previous formatter: one OrderedDict, strftime and logging call per event"""
+
+    def __init__(self, cfg, data_logger):
+        self._datalog = data_logger
+        self._delimiter = cfg.get_value('datalog', 'delimeter')
+        self._preamble = '{}|{}|{}|{}|'.format(
+            cfg.get_value('datalog', 'leef_version'),
+            cfg.get_value('datalog', 'vendor'),
+            cfg.get_value('datalog', 'product'),
+            cfg.get_value('datalog', 'version')
+        )
+        self._mapper = cfg.get_value('datalog', 'mapper')
+
+    def _process_edge_data(self, data):
+        for query in data:
+            message = OrderedDict()
+            for siemattr in self._mapper:
+                edgeattr = self._mapper[siemattr]
+                if siemattr == 'devTime':
+                    qtime = dt.datetime.utcfromtimestamp(int(query['time']) / 1000.0)
+                    qtime = qtime.replace(tzinfo=dt.timezone.utc)
+                    message.update({siemattr: qtime.strftime('%d %b %Y %H:%M:%S %z')})
+                    message.update({'devTimeFormat': 'MMM dd yyyy HH:mm:ss.SSS z'})
+                elif siemattr == 'policy':
+                    message.update({siemattr: ','.join(policy['name'] for policy in query['matchedPolicies'])})
+                elif siemattr == 'threats':
+                    message.update({siemattr: ','.join(threat['type'] for threat in query['threats'])})
+                elif siemattr == 'threatIndicators':
+                    message.update({siemattr: ','.join(i for threat in query['threats'] for i in threat['indicators'])})
+                elif siemattr == 'rawData':
+                    message.update({siemattr: query['query']})
+                elif siemattr == 'queryKind':
+                    kind = 'other'
+                    if query['queryType'] in ('A', 'AAAA'):
+                        kind = 'forward'
+                    elif query['queryType'] == 'PTR':
+                        kind = 'reverse'
+                    message.update({siemattr: kind})
+                elif siemattr == 'queryStatus':
+                    if query['actionTaken'] == 'block':
+                        status = 'prevented'
+                    elif query['response'] == 'SERVFAIL':
+                        status = 'failed'
+                    else:
+                        status = 'succeeded'
+                    message.update({siemattr: status})
+                elif edgeattr in query.keys():
+                    message.update({siemattr: query[edgeattr]})
+                else:
+                    message.update({siemattr: 'Not in Log'})
+            values = sorted([(str(k) + "=" + str(v)) for k, v in iter(message.items())])
+            self._datalog.info(self._preamble + query['actionTaken'] + '|{}|'.format(self._delimiter) +
+                               self._delimiter.join(values))
+
+
+def generate_events(count):
+    start = int(time.time() * 1000)
+    events = []
+    for index in range(count):
+        blocked = index % 7 == 0
+        events.append({
+            'recordId': str(index),
+            'time': start + index * 3,
+            'actionTaken': 'block' if blocked else 'query',
+            'response': 'NXDOMAIN' if blocked else 'NOERROR',
+            'query': 'host%d.example.com' % (index % 5000),
+            'queryType': ('A', 'AAAA', 'PTR', 'MX')[index % 4],
+            'site': 'site-%d' % (index % 10),
+            'source': '10.0.%d.%d' % (index // 256 % 256, index % 256),
+            'matchedPolicies': [{'name': 'policy-%d' % (index % 3)}] if blocked else [],
+            'threats': [{'type': 'DGA', 'indicators': ['dga-%d' % (index % 11)]}] if blocked else [],
+        })
+    return events
+
+
+def run(name, process, events, sink):
+    start = time.time()
+    process(events)
+    sink.wait_for(len(events))
+    elapsed = time.time() - start
+    print('%-8s %8d events in %6.2fs  %10.0f events/sec' % (name, len(events), elapsed, len(events) / elapsed))
+    return sink.take()
+
+
+def main():
+    count = int(sys.argv[1]) if 1 < len(sys.argv) else 100000
+    events = generate_events(count)
+    sink = Sink()
+    cfg = Config(sink.port)
+
+    logger = logging.getLogger('LEEF-legacy')
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    handler = SysLogHandler(address=('127.0.0.1', sink.port), facility=SysLogHandler.LOG_LOCAL1,
+                            socktype=socket.SOCK_STREAM)
+    handler.setFormatter(logging.Formatter(cfg.get_value('datalog', 'logger_formatter'),
+                                           cfg.get_value('datalog', 'time_formatter')))
+    logger.addHandler(handler)
+    before = run('before', LegacyPoller(cfg, logger)._process_edge_data, events, sink)
+    logger.removeHandler(handler)
+    handler.close()
+
+    poller = Poller(cfg, NullLogger(), EdgeLogger('datalog', cfg))
+    after = run('after', poller._process_edge_data, events, sink)
+
+    print('LEEF output identical: %s' % (before == after))
+
+
+if __name__ == '__main__':
+    main()
@@ -20,6 +20,7 @@
 
 import os
 import sys
+import codecs
 import requests
 import json
 
@@ -42,6 +43,42 @@ api_url = {
 
 class EdgeException(Exception): pass
 
+
+def iter_json_array(chunks):
+    """Incrementally parse a JSON array from an iterable of byte chunks, yielding each element"""
+    decoder = json.JSONDecoder()
+    # Multi-byte characters may be split across chunks
+    text_decoder = codecs.getincrementaldecoder('utf-8')()
+    buffer = ''
+    started = False
+    for chunk in chunks:
+        buffer += text_decoder.decode(chunk)
+        position = 0
+        while True:
+            while position < len(buffer) and buffer[position] in ' \t\r\n,':
+                position += 1
+            if position == len(buffer):
+                break
+            if not started:
+                if buffer[position] != '[':
+                    raise EdgeException('Query log stream is not a JSON array')
+                started = True
+                position += 1
+                continue
+            if buffer[position] == ']':
+                return
+            try:
+                record, end = decoder.raw_decode(buffer, position)
+            except ValueError:
+                # Incomplete record, wait for the next chunk
+                break
+            if end == len(buffer) and not isinstance(record, (dict, list)):
+                # A number may continue in the next chunk
+                break
+            position = end
+            yield record
+        buffer = buffer[position:]
+
 class EdgeAPI(object):
 
     def __init__ (self, edgeurl, debug=False):
@@ -50,6 +87,7 @@ class EdgeAPI(object):
         self._token = ''
         self._etag = ''
         self._debug = debug
+        self._session = None
 
     def validate_edgeurl(self):
         valid = False
@@ -100,6 +138,10 @@ class EdgeAPI(object):
 #             if self._debug:
 #                 print('DEBUG: Exceptin <%s>' % str(e))
 
+    def set_session(self, session):
+        """Use a shared requests.Session, and its connection pool, for service point status calls"""
+        self._session = session
+
     def set_token(self, token):
         self._token = token
         self._etag = ''
@@ -198,13 +240,34 @@ class EdgeAPI(object):
                 print('DEBUG: Exceptin <%s>' % str(e))
         return results
 
+    def iter_query_log_stream(self, chunk_size=65536):
+        """
+        Yield query log records one at a time while the response is still downloading.
+        The ETag is only advanced once the whole stream has been read, so an interrupted
+        stream is fetched again by the next call.
+        """
+        headers = {'Authorization': 'Basic ' + self._token, 'ETag': self._etag}
+        response = requests.get(self._edgeurl + api_url['query_log_stream'], headers=headers, stream=True)
+        try:
+            if response.status_code != 200:
+                if self._debug:
+                    print('DEBUG: failed response <%s>' % str(response.status_code))
+                raise EdgeException(response)
+            for record in iter_json_array(response.iter_content(chunk_size=chunk_size)):
+                yield record
+            if 'ETag' in response.headers.keys() and response.headers['ETag'] is not None:
+                self._etag = response.headers['ETag']
+        finally:
+            response.close()
+
     def get_service_point_status_url(self, sp_address):
         return 'http://' + sp_address + api_url['get_service_point_status']
 
     def get_service_point_status(self, sp_address, timeout=1):
         status = None
         try:
-            response = requests.get('http://' + sp_address + api_url['get_service_point_status'], timeout=timeout)
+            http = self._session if self._session is not None else requests
+            response = http.get('http://' + sp_address + api_url['get_service_point_status'], timeout=timeout)
             if response.status_code == 200:
                 status = response.json()
             else:
@@ -20,6 +20,88 @@ __author__ = 'BlueCat Networks'
 import logging
 from logging.handlers import SysLogHandler
 import socket
+import threading
+import time
+
+
+class SyslogBatchWriter(object):
+    """
+    Writes many syslog messages at once, bypassing the per-record overhead of logging.
+    Lines are framed exactly as SysLogHandler frames them (<PRI>, formatted message, NUL).
+    Over TCP one persistent connection is kept and lines are sent in buffers of up to
+    batch_bytes, over UDP each line is still its own datagram.
+    """
+
+    SENTINEL = '\x01MESSAGE\x01'
+
+    def __init__(self, address, socktype, facility, formatter, logger_name, batch_bytes=65536):
+        self._address = address
+        self._socktype = socktype
+        self._formatter = formatter
+        self._logger_name = logger_name
+        self._batch_bytes = batch_bytes
+        self._priority = '<%d>' % ((facility << 3) | SysLogHandler.LOG_INFO)
+        self._header_second = None
+        self._header = ('', '')
+        self._socket = None
+        self._lock = threading.Lock()
+
+    def _get_header(self):
+        # The formatter only depends on the time, so its output is split around a sentinel once per second
+        second = int(time.time())
+        if second != self._header_second:
+            record = logging.LogRecord(self._logger_name, logging.INFO, __file__, 0, SyslogBatchWriter.SENTINEL, None, None)
+            head, tail = self._formatter.format(record).split(SyslogBatchWriter.SENTINEL, 1)
+            self._header = (self._priority + head, tail + '\000')
+            self._header_second = second
+        return self._header
+
+    def _connect(self):
+        if self._socket is None:
+            if self._socktype == socket.SOCK_STREAM:
+                self._socket = socket.create_connection(self._address)
+            else:
+                self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        return self._socket
+
+    def _send(self, payload):
+        try:
+            self._connect().sendall(payload)
+        except OSError:
+            # The server may have dropped the connection since the last poll, reconnect once
+            self.close()
+            self._connect().sendall(payload)
+
+    def write(self, messages):
+        """Write the messages and return the number of lines sent"""
+        with self._lock:
+            head, tail = self._get_header()
+            if self._socktype == socket.SOCK_STREAM:
+                buffer = []
+                size = 0
+                for message in messages:
+                    line = (head + message + tail).encode('utf-8')
+                    buffer.append(line)
+                    size += len(line)
+                    if size >= self._batch_bytes:
+                        self._send(b''.join(buffer))
+                        buffer = []
+                        size = 0
+                if buffer:
+                    self._send(b''.join(buffer))
+            else:
+                sock = self._connect()
+                for message in messages:
+                    sock.sendto((head + message + tail).encode('utf-8'), self._address)
+        return len(messages)
+
+    def close(self):
+        if self._socket is not None:
+            try:
+                self._socket.close()
+            except OSError:
+                pass
+            self._socket = None
 
 
 class EdgeLogger(object):
@@ -30,6 +112,7 @@ class EdgeLogger(object):
         logger = logging.getLogger(cfg.get_value(name, 'logger_name'))
         formatter = logging.Formatter(cfg.get_value(name, 'logger_formatter'),
                                       cfg.get_value(name, 'time_formatter'))
+        self._writer = None
         if log_type == 'file':
             logger.setLevel(cfg.get_value(name, 'log_level'))
             handler = logging.handlers.TimedRotatingFileHandler(
@@ -37,10 +120,12 @@ class EdgeLogger(object):
         elif log_type == 'leef':
             protocol = cfg.get_value(name, 'protocol')
             socket_type = socket.SOCK_STREAM if protocol == 'tcp' else socket.SOCK_DGRAM
+            address = (cfg.get_value(name, 'server'), cfg.get_value(name, 'port'))
             logger.setLevel(logging.INFO)
-            handler = SysLogHandler(address=(
-                cfg.get_value(name, 'server'), cfg.get_value(name, 'port')),
+            handler = SysLogHandler(address=address,
                         facility=logging.handlers.SysLogHandler.LOG_LOCAL1, socktype=socket_type)
+            self._writer = SyslogBatchWriter(address, socket_type, SysLogHandler.LOG_LOCAL1, formatter,
+                                             cfg.get_value(name, 'logger_name'))
         else:
             raise NameError('No valid log_type ' + log_type + ', valid values are file or leef')
         logger.addHandler(handler)
@@ -50,11 +135,21 @@ class EdgeLogger(object):
 
     def __del__(self):
         self._store.removeHandler(self._handler)
+        if self._writer is not None:
+            self._writer.close()
 
     def info(self, message):
         """Write INFO message to log."""
         self._store.info(message)
 
+    def write_batch(self, messages):
+        """Write many INFO messages to log."""
+        if self._writer is not None:
+            return self._writer.write(messages)
+        for message in messages:
+            self._store.info(message)
+        return len(messages)
+
     def error(self, message):
         """Write ERROR message to log."""
         self._store.error(message)
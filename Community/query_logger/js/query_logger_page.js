@@ -18,3 +18,21 @@
 // Description: Query Logger JS
 
 // JavaScript for your page goes in here.
+
+// Refresh the lag, throughput and dropped event counters every five seconds
+$(document).ready(function() {
+    if (!document.getElementById('query_logger_stats')) {
+        return;
+    }
+    setInterval(function() {
+        $.ajax({
+            url: "/query_logger/stats",
+            method: 'GET',
+            success: function(stats) {
+                $.each(stats, function(name, value) {
+                    $('#stat_' + name).text(value);
+                });
+            }
+        });
+    }, 5000);
+});
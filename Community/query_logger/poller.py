@@ -18,15 +18,83 @@ Copyright BlueCat Networks, Inc. 2019
 __author__ = 'BlueCat Networks'
 
 import datetime as dt
-import resource
-import sys
-import signal
+import queue
+import threading
 import time
 from collections import OrderedDict
 
 
-import requests
-from pytz import timezone
+# Fields the Poller derives from the query instead of copying an Edge attribute
+DEV_TIME_FORMAT = 'MMM dd yyyy HH:mm:ss.SSS z'
+NOT_IN_LOG = 'Not in Log'
+
+
+class TimestampCache(object):
+    """
+    Formats Edge millisecond timestamps as LEEF devTime.
+    devTime has a resolution of one second and a poll returns many queries per second,
+    so each second is formatted once.
+    """
+
+    MAX_ENTRIES = 4096
+
+    def __init__(self, time_format='%d %b %Y %H:%M:%S +0000'):
+        self._time_format = time_format
+        self._cache = {}
+
+    def format(self, milliseconds):
+        second = int(milliseconds) // 1000
+        formatted = self._cache.get(second)
+        if formatted is None:
+            if len(self._cache) >= TimestampCache.MAX_ENTRIES:
+                self._cache.clear()
+            formatted = dt.datetime.utcfromtimestamp(second).strftime(self._time_format)
+            self._cache[second] = formatted
+        return formatted
+
+
+class PollerStats(object):
+    """Counters of the fetch and format/emit stages, shown on the query_logger page"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.polls = 0
+        self.skipped_polls = 0
+        self.catch_up_polls = 0
+        self.fetched = 0
+        self.emitted = 0
+        self.dropped = 0
+        self.queue_high_water = 0
+        self.lag_seconds = 0
+        self.last_poll = ''
+        self.last_poll_seconds = 0
+        self.last_error = ''
+
+    def add(self, **counters):
+        with self._lock:
+            for name, value in counters.items():
+                setattr(self, name, getattr(self, name) + value)
+
+    def set(self, **values):
+        with self._lock:
+            for name, value in values.items():
+                setattr(self, name, value)
+
+    def as_dict(self):
+        with self._lock:
+            stats = OrderedDict()
+            stats['Polls'] = self.polls
+            stats['SkippedPolls'] = self.skipped_polls
+            stats['CatchUpPolls'] = self.catch_up_polls
+            stats['Fetched'] = self.fetched
+            stats['Emitted'] = self.emitted
+            stats['Dropped'] = self.dropped
+            stats['QueueHighWater'] = self.queue_high_water
+            stats['LagSeconds'] = self.lag_seconds
+            stats['LastPoll'] = self.last_poll
+            stats['LastPollSeconds'] = self.last_poll_seconds
+            stats['LastError'] = self.last_error
+        return stats
 
 
 class Poller(object):
@@ -46,29 +114,22 @@ class Poller(object):
             cfg.get_value('datalog', 'version')
         )
         self._mapper = cfg.get_value('datalog', 'mapper')
+        self._timestamps = TimestampCache()
+        self._headers = {}
+        self._fields = self._compile_mapper(self._mapper)
+        self._queue_size = cfg.get_value('poll', 'queue_size') or 10000
+        self._queue_timeout = cfg.get_value('poll', 'queue_timeout') or 5
+        self._batch_size = cfg.get_value('poll', 'batch_size') or 1000
+        self.stats = PollerStats()
 
     def _get_threats(self, threats):
-        first = True
-        threat_list = ''
-        for threat in threats:
-            if first:
-                first = False
-            else:
-                threat_list += ','
-            threat_list += threat['type']
-        return threat_list
+        return ','.join([threat['type'] for threat in threats])
 
     def _get_threatIndicators(self, threats):
-        first = True
-        indicator_list = ''
-        for thread in threats:
-            for indicator in thread['indicators']:
-                if first:
-                    first = False
-                else:
-                    indicator_list += ','
-                indicator_list += indicator
-        return indicator_list
+        return ','.join([indicator for threat in threats for indicator in threat['indicators']])
+
+    def _get_policies(self, policies):
+        return ','.join([policy['name'] for policy in policies])
 
     def _get_query_kind(self, queryType):
         query_kind = 'other'
@@ -88,58 +149,120 @@ class Poller(object):
             query_status = 'succeeded'
         return query_status
 
-    def _log_query(self, data, action):
-        message = self._preamble + action + '|{}|'.format(self._delimiter) + data
-        self._datalog.info(message)
+    def _get_attribute(self, edgeattr):
+        def extract(query):
+            value = query.get(edgeattr, NOT_IN_LOG)
+            return value if value.__class__ is str else str(value)
+        return extract
+
+    def _compile_mapper(self, mapper):
+        """
+        Turn the configured mapper into a list of (prefix, extractor) pairs, computed once.
+        The pairs are ordered the way the sorted "key=value" strings used to be, so a LEEF
+        line is built by a single join over the pipeline.
+        """
+        extractors = {}
+        for siemattr, edgeattr in mapper.items():
+            if siemattr == 'devTime':
+                extractors[siemattr] = lambda query: self._timestamps.format(query['time'])
+                extractors['devTimeFormat'] = lambda query: DEV_TIME_FORMAT
+            elif siemattr == 'policy':
+                extractors[siemattr] = lambda query: self._get_policies(query['matchedPolicies'])
+            elif siemattr == 'threats':
+                extractors[siemattr] = lambda query: self._get_threats(query['threats'])
+            elif siemattr == 'threatIndicators':
+                extractors[siemattr] = lambda query: self._get_threatIndicators(query['threats'])
+            elif siemattr == 'rawData':
+                extractors[siemattr] = lambda query: str(query['query'])
+            elif siemattr == 'queryKind':
+                extractors[siemattr] = lambda query: self._get_query_kind(query['queryType'])
+            elif siemattr == 'queryStatus':
+                extractors[siemattr] = self._get_query_status
+            else:
+                extractors[siemattr] = self._get_attribute(edgeattr)
+        return [(str(siemattr) + '=', extractors[siemattr])
+                for siemattr in sorted(extractors, key=lambda siemattr: str(siemattr) + '=')]
+
+    def _get_header(self, action):
+        header = self._headers.get(action)
+        if header is None:
+            header = self._preamble + str(action) + '|{}|'.format(self._delimiter)
+            self._headers[action] = header
+        return header
 
-    def _generate_log_message(self, message):
-        values = sorted([(str(k) + "=" + str(v))
-                         for k, v in iter(message.items())])
-        return self._delimiter.join(values)
+    def _format_query(self, query):
+        return self._get_header(query['actionTaken']) + self._delimiter.join(
+            [prefix + extract(query) for prefix, extract in self._fields])
 
     def _process_edge_data(self, data):
-        for query in data:
-            record_id = query['recordId']
-            message = OrderedDict()
-            for siemattr in self._mapper:
-                edgeattr = self._mapper[siemattr]
-                if siemattr == 'devTime':
-                    qtime = dt.datetime.utcfromtimestamp(int(query['time']) / 1000.0)
-                    qtime = qtime.replace(tzinfo=timezone('UTC'))
-                    message.update({siemattr: qtime.strftime('%d %b %Y %H:%M:%S %z')})
-                    message.update({'devTimeFormat': 'MMM dd yyyy HH:mm:ss.SSS z'})
-                elif siemattr == 'policy':
-                    first = True
-                    policy_list = ''
-                    for policy in query['matchedPolicies']:
-                        if first:
-                            first = False
-                        else:
-                            policy_list += ','
-                        policy_list += policy['name']
-                    message.update({siemattr: policy_list})
-                elif siemattr == 'threats':
-                    message.update({siemattr: self._get_threats(query['threats'])})
-                elif siemattr == 'threatIndicators':
-                    message.update({siemattr: self._get_threatIndicators(query['threats'])})
-                elif siemattr == 'rawData':
-                    message.update({siemattr: query['query']})
-                elif siemattr == 'queryKind':
-                    message.update({siemattr: self._get_query_kind(query['queryType'])})
-                elif siemattr == 'queryStatus':
-                    message.update({siemattr: self._get_query_status(query)})
-                elif edgeattr in query.keys():
-                    message.update({siemattr: query[edgeattr]})
-                else:
-                    message.update({siemattr: 'Not in Log'})
-            action = query['actionTaken']
-            self._applog.debug(record_id)
-            self._log_query(self._generate_log_message(message), action)
+        messages = [self._format_query(query) for query in data]
+        self._applog.debug('Formatted records %s to %s' % (data[0]['recordId'], data[-1]['recordId']))
+        self._datalog.write_batch(messages)
+        return len(messages)
+
+    def _emit(self, events):
+        """Format/emit stage, drains the queue in batches until the fetch stage is done"""
+        done = False
+        while not done:
+            batch = [events.get()]
+            while len(batch) < self._batch_size:
+                try:
+                    batch.append(events.get_nowait())
+                except queue.Empty:
+                    break
+            if batch[-1] is None:
+                batch.pop()
+                done = True
+            if batch:
+                self._process_edge_data(batch)
+                lag = max(time.time() - int(batch[-1]['time']) / 1000.0, 0)
+                self.stats.add(emitted=len(batch))
+                self.stats.set(lag_seconds=round(lag, 1))
 
     def get_event_from_api(self, edge_api):
-        data = edge_api.query_log_stream()
-        if data is not None and 0 < len(data):
-            self._applog.info('Processing %d events' % len(data))
-            self._process_edge_data(data)
+        """
+        Stream one poll of the query log through a bounded queue to the format/emit stage.
+        Records are parsed as they arrive. When the emit stage falls behind, the fetch stage
+        blocks for up to queue_timeout seconds per record and then drops it.
+        Returns the number of records fetched.
+        """
+        start = time.time()
+        events = queue.Queue(maxsize=self._queue_size)
+        errors = []
+
+        def emit():
+            try:
+                self._emit(events)
+            except Exception as e:
+                errors.append(e)
+                # Keep draining so the fetch stage is never blocked by a dead consumer
+                while events.get() is not None:
+                    self.stats.add(dropped=1)
+
+        emitter = threading.Thread(target=emit, name='query_logger-emit')
+        emitter.daemon = True
+        emitter.start()
+        fetched = dropped = 0
+        try:
+            for record in edge_api.iter_query_log_stream():
+                fetched += 1
+                try:
+                    events.put(record, timeout=self._queue_timeout)
+                except queue.Full:
+                    dropped += 1
+                    self.stats.add(dropped=1)
+                if fetched % 1000 == 0:
+                    self.stats.set(queue_high_water=max(self.stats.queue_high_water, events.qsize()))
+        finally:
+            events.put(None)
+            emitter.join()
+            self.stats.add(polls=1, fetched=fetched)
+            self.stats.set(last_poll=dt.datetime.now().strftime("%m/%d/%Y %H:%M:%S"),
+                           last_poll_seconds=round(time.time() - start, 2))
+        if errors:
+            raise errors[0]
+        if 0 < fetched:
+            self._applog.info('Processed %d events, %d dropped' % (fetched, dropped))
         else:
             self._applog.info('No events found')
+        return fetched
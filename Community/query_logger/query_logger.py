@@ -36,6 +36,7 @@ class QueryLoggerException(Exception): pass
 class QueryLogger(object):
     _unique_instance = None
     _lock = Lock()
+    _poll_lock = Lock()
     _config_file = os.path.dirname(os.path.abspath(__file__)) + '/config.json'
 
     @classmethod
@@ -80,15 +81,43 @@ class QueryLogger(object):
 
 
     def process_logs(self):
-        if not self._edge_api.validate_edgeurl():
+        # At most one poll is in flight, an overlapping run is skipped instead of queued.
+        # The configuration lock is not held while polling so the UI stays responsive.
+        poller = self._poller
+        edge_api = self._edge_api
+        if poller is None or edge_api is None:
+            return False
+        if not QueryLogger._poll_lock.acquire(blocking=False):
+            poller.stats.add(skipped_polls=1)
             return False
 
         succeed = False
-        with QueryLogger._lock:
-            self._poller.get_event_from_api(self._edge_api)
+        try:
+            if not edge_api.validate_edgeurl():
+                return False
+            catch_up = self.get_value('poll', 'catch_up')
+            max_catch_up_polls = self.get_value('poll', 'max_catch_up_polls') or 10
+            fetched = poller.get_event_from_api(edge_api)
+            # In catch-up mode keep polling while Edge still returns records, up to max_catch_up_polls
+            catch_up_polls = 0
+            while catch_up and 0 < fetched and catch_up_polls < max_catch_up_polls and self._poller is poller:
+                catch_up_polls += 1
+                poller.stats.add(catch_up_polls=1)
+                fetched = poller.get_event_from_api(edge_api)
             succeed = True
+        except Exception as e:
+            poller.stats.set(last_error=str(e))
+            if self._debug:
+                print('DEBUG: Exceptin <%s>' % str(e))
+        finally:
+            QueryLogger._poll_lock.release()
         return succeed
 
+    def get_stats(self):
+        if self._poller is None:
+            return None
+        return self._poller.stats.as_dict()
+
     def _create_poller(self):
         app_logger = EdgeLogger('applog', self)
         data_logger = EdgeLogger('datalog', self)
@@ -118,7 +147,8 @@ class QueryLogger(object):
             if interval is not None and 0 < interval:
                 self._edge_api = edge_api
                 self._poller = poller
-                self._job = self._scheduler.add_job(self.process_logs, 'interval', seconds=interval)
+                self._job = self._scheduler.add_job(self.process_logs, 'interval', seconds=interval,
+                                                    max_instances=1, coalesce=True)
                 succeed = True
 
         except Exception as e:
@@ -17,12 +17,12 @@ import os
 import sys
 import codecs
 
-from flask import url_for, redirect, render_template, flash, g
+from flask import url_for, redirect, render_template, flash, g, jsonify
 from wtforms.validators import DataRequired, IPAddress, URL, NumberRange
 from wtforms import SubmitField
 
 from bluecat.wtform_extensions import GatewayForm
-from bluecat.wtform_fields import CustomStringField
+from bluecat.wtform_fields import CustomStringField, CustomBooleanField
 from bluecat import route, util
 import config.default_config as config
 from main_app import app
@@ -72,6 +72,12 @@ class GenericFormTemplate(GatewayForm):
         validators=[DataRequired(message=require_message)]
     )
 
+    catch_up = CustomBooleanField(
+        label=text['label_catch_up'],
+        is_disabled_on_start=False,
+        default=False
+    )
+
     submit = SubmitField(label=text['label_submit'])
 
 
@@ -89,14 +95,24 @@ def query_logger_query_logger_page():
     form.edge_token.data = query_logger.get_value('edge', 'token')
     form.syslog_server.data = query_logger.get_value('datalog', 'server')
     form.poll_interval.data = query_logger.get_value('poll', 'interval')
+    form.catch_up.data = query_logger.get_value('poll', 'catch_up')
 
     return render_template(
         'query_logger_page.html',
         form=form,
         text=util.get_text(module_path(), config.language),
         options=g.user.get_options(),
+        stats=query_logger.get_stats(),
     )
 
+
+@route(app, '/query_logger/stats')
+@util.workflow_permission_required('query_logger_page')
+@util.exception_catcher
+def query_logger_stats():
+    query_logger = QueryLogger.get_instance(debug=True)
+    return jsonify(query_logger.get_stats() or {})
+
 @route(app, '/query_logger/form', methods=['POST'])
 @util.workflow_permission_required('query_logger_page')
 @util.exception_catcher
@@ -110,6 +126,7 @@ def query_logger_query_logger_page_form():
         query_logger.set_value('edge', 'token', form.edge_token.data)
         query_logger.set_value('datalog', 'server', form.syslog_server.data)
         query_logger.set_value('poll', 'interval', int(form.poll_interval.data))
+        query_logger.set_value('poll', 'catch_up', bool(form.catch_up.data))
 
         query_logger.save()
         query_logger.register_job()
@@ -126,4 +143,5 @@ def query_logger_query_logger_page_form():
             form=form,
             text=util.get_text(module_path(), config.language),
             options=g.user.get_options(),
+            stats=QueryLogger.get_instance(debug=True).get_stats(),
         )
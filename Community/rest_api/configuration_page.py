@@ -25,6 +25,7 @@ from flask_restplus import fields, Resource, reqparse
 
 from bluecat import util
 import config.default_config as config
+from .path_cache import path_cache
 from main_app import api
 
 
@@ -109,7 +110,8 @@ class Configuration(Resource):
     @util.rest_workflow_permission_required('rest_page')
     def delete(self, configuration):
         """ Delete Configuration with specified name. """
-        configuration = g.user.get_api().get_configuration(configuration)
-        configuration.delete()
+        configuration_entity = g.user.get_api().get_configuration(configuration)
+        configuration_entity.delete()
+        path_cache.invalidate(configuration)
         return '', 204
 
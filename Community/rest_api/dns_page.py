@@ -22,10 +22,13 @@
 
 from flask import g, jsonify
 from flask_restplus import fields, reqparse, Resource
-import bluecat.server_endpoints as se
 from bluecat import util
+from bluecat.entity import Entity
 import config.default_config as config
 from .configuration_page import config_doc, config_defaults, entity_parser, entity_model, entity_return_model
+from .paging import collection_parser, stream_collection
+from .path_cache import get_cached_entity, path_cache
+from .zone_index import expire_zone_indexes, get_absolute_name, get_zone_index
 from main_app import api
 
 
@@ -193,17 +196,18 @@ class View(Resource):
     @util.rest_workflow_permission_required('rest_page')
     def get(self, configuration, view):
         """ Get View belonging to default or provided Configuration. """
-        configuration = g.user.get_api().get_configuration(configuration)
-        view = configuration.get_view(view)
+        view = get_view(configuration, view)
         result = view.to_json()
         return result
 
     @util.rest_workflow_permission_required('rest_page')
     def delete(self, configuration, view):
         """ Delete View belonging to default or provided Configuration. """
-        configuration = g.user.get_api().get_configuration(configuration)
-        view = configuration.get_view(view)
-        view.delete()
+        view_entity = get_view(configuration, view)
+        view_entity.delete()
+        path_cache.invalidate(configuration, 'views', view)
+        path_cache.invalidate(configuration, 'zones', view)
+        expire_zone_indexes()
         return '', 204
 
 
@@ -223,11 +227,7 @@ class Zone(Resource):
         1. zone_name
         2. zone_name1/zones/subzone_name2/zones/subzone_name3
         """
-        configuration = g.user.get_api().get_configuration(configuration)
-        zone_parent = configuration.get_view(view)
-        zone_hierarchy = zone.split('/zones')
-        zone_entity = zone_parent.get_zone(zone_hierarchy[0])
-        zone = check_zone_in_path(zone_entity, zone_hierarchy[0], zone_hierarchy[1:], zone_parent)
+        zone = get_zone(configuration, view, zone)
         if zone is None:
             return 'No matching Zone(s) found', 404
         return zone.to_json()
@@ -242,14 +242,12 @@ class Zone(Resource):
         1. zone_name
         2. zone_name1/zones/subzone_name2/zones/subzone_name3
         """
-        configuration = g.user.get_api().get_configuration(configuration)
-        zone_parent = configuration.get_view(view)
-        zone_hierarchy = zone.split('/zones')
-        zone_entity = zone_parent.get_zone(zone_hierarchy[0])
-        zone = check_zone_in_path(zone_entity, zone_hierarchy[0], zone_hierarchy[1:], zone_parent)
-        if zone is None:
+        zone_entity = get_zone(configuration, view, zone)
+        if zone_entity is None:
             return 'No matching Zone(s) found', 404
-        zone.delete()
+        zone_entity.delete()
+        path_cache.invalidate(configuration, 'zones', view)
+        expire_zone_indexes()
         return '', 204
 
 
@@ -269,24 +267,21 @@ class ZoneHintCollection(Resource):
         2. abc.domain
         3. abc.domain.com
         """
-        configuration = g.user.get_api().get_configuration(configuration)
+        api = g.user.get_api()
+        configuration = api.get_configuration(configuration)
         try:
-            zones = se.get_zones_data_by_hint(configuration.get_id(), view, hint)
+            zones = get_zone_index(api, g.user.get_username(), configuration.get_id(), view).find_by_hint(hint)
         except Exception:
             zones = None
-        if zones == None or zones['status'] == 'FAIL':
+        if not zones:
             return 'No matching Zone(s) found', 404
         return_data = []
-        for zone in zones['data']['select_field']:
-            zone_object = g.user.get_api().get_entity_by_id(zone['id'])
-            properties = ""
-            for prop, value in zone_object.get_properties().items():
-                properties += prop + "=" + value + "|"
+        for zone in zones:
             return_data.append({
-                'id': zone['id'],
-                'name': zone['txt'],
+                'id': zone.id,
+                'name': get_absolute_name(zone),
                 'type': 'Zone',
-                'properties': properties
+                'properties': zone.properties
             })
 
         return return_data
@@ -309,15 +304,12 @@ class ZoneCollection(Resource):
         1. zone_name
         2. zone_name1/zones/zone_name2
         """
-        configuration = g.user.get_api().get_configuration(configuration)
-        zone_parent = configuration.get_view(view)
-        leaf_zone = zone_parent
         if zone:
-            zone_hierarchy = zone.split('/zones')
-            zone_entity = zone_parent.get_zone(zone_hierarchy[0])
-            leaf_zone = check_zone_in_path(zone_entity, zone_hierarchy[0], zone_hierarchy[1:], zone_parent)
+            leaf_zone = get_zone(configuration, view, zone)
             if leaf_zone is None:
                 return 'No matching Zone(s) found', 404
+        else:
+            leaf_zone = get_view(configuration, view)
         zones = leaf_zone.get_zones()
         result = [zone_entity.to_json() for zone_entity in zones]
         return jsonify(result)
@@ -335,17 +327,15 @@ class ZoneCollection(Resource):
         2. zone_name1/zones/zone_name2
         """
         data = entity_parser.parse_args()
-        configuration = g.user.get_api().get_configuration(configuration)
-        view = configuration.get_view(view)
-        zone_parent = view
-        zone_hierarchy = zone.split('/zones')
-        zone_entity = zone_parent.get_zone(zone_hierarchy[0])
-        zone = check_zone_in_path(zone_entity, zone_hierarchy[0], zone_hierarchy[1:], zone_parent)
-        if zone is None:
+        parent_zone = get_zone(configuration, view, zone)
+        if parent_zone is None:
             return 'No matching Zone(s) found', 404
         zone_name = data['name']
         kwargs = util.properties_to_map(data['properties'])
-        zone = view.add_zone('%s.%s' % (zone_name, zone.get_full_name()), **kwargs)
+        zone = get_view(configuration, view).add_zone('%s.%s' % (zone_name, parent_zone.get_full_name()), **kwargs)
+        # A zone name containing "/" can change what an existing zone path resolves to
+        path_cache.invalidate(configuration, 'zones', view)
+        expire_zone_indexes()
         return zone.to_json(), 201
 
 
@@ -374,6 +364,37 @@ def check_zone_in_path(zone_entity, pre_path, post_path, zone_parent, delimiter=
         return None
 
 
+def get_view(configuration, view):
+    """Return the view with the given name in the configuration"""
+    key = (configuration, 'views', view)
+    view_entity = get_cached_entity(key, Entity.View)
+    if view_entity is None:
+        view_entity = g.user.get_api().get_configuration(configuration).get_view(view)
+        if view_entity is not None:
+            path_cache.put(key, view_entity.get_id())
+    return view_entity
+
+
+def get_zone(configuration, view, zone):
+    """
+    Return the zone at the end of a zone path such as zone_name1/zones/subzone_name2 in the view,
+    None if there is no such zone. Resolved paths are cached, so a repeated lookup of the same
+    path is a single get_entity_by_id however deep the zone is.
+    """
+    key = (configuration, 'zones', view, zone)
+    zone_entity = get_cached_entity(key, Entity.Zone)
+    if zone_entity is None:
+        zone_parent = get_view(configuration, view)
+        if zone_parent is None:
+            return None
+        zone_hierarchy = zone.split('/zones')
+        zone_entity = zone_parent.get_zone(zone_hierarchy[0])
+        zone_entity = check_zone_in_path(zone_entity, zone_hierarchy[0], zone_hierarchy[1:], zone_parent)
+        if zone_entity is not None:
+            path_cache.put(key, zone_entity.get_id())
+    return zone_entity
+
+
 @host_ns.route('/')
 @host_zone_ns.route('/')
 @host_default_ns.route('/', defaults=dns_defaults)
@@ -382,18 +403,18 @@ class HostRecordCollection(Resource):
 
     @util.rest_workflow_permission_required('rest_page')
     @host_ns.response(201, 'Host Record successfully created.')
+    @host_ns.expect(collection_parser)
     def get(self, configuration, view, zone=None):
-        """ Get all host records belonging to default or provided Configuration and View plus Zone hierarchy. """
-        configuration = g.user.get_api().get_configuration(configuration)
-        view = configuration.get_view(view)
-        zone_parent = view
-        zone_hierarchy = zone.split('/zones')
-        zone_entity = zone_parent.get_zone(zone_hierarchy[0])
-        zone = check_zone_in_path(zone_entity, zone_hierarchy[0], zone_hierarchy[1:], zone_parent)
-
-        host_records = zone.get_children_of_type(zone.HostRecord)
-        result = [host.to_json() for host in host_records]
-        return jsonify(result)
+        """
+        Get all host records belonging to default or provided Configuration and View plus Zone hierarchy.
+        Supports limit and cursor paging and fields selection.
+        """
+        if zone is None:
+            return 'No matching Zone(s) found', 404
+        zone = get_zone(configuration, view, zone)
+        if zone is None:
+            return 'No matching Zone(s) found', 404
+        return stream_collection(zone, Entity.HostRecord)
 
     @util.rest_workflow_permission_required('rest_page')
     @host_ns.response(201, 'Host Record successfully created.', model=entity_return_model)
@@ -401,21 +422,17 @@ class HostRecordCollection(Resource):
     def post(self, configuration, view, zone=None):
         """ Create a host record belonging to default or provided Configuration and View plus Zone hierarchy. """
         data = host_parser.parse_args()
-        configuration = g.user.get_api().get_configuration(configuration)
-        view = configuration.get_view(view)
-
         if zone is None:
             absolute_name = data['absolute_name']
         else:
-            zone_parent = view
-            zone_hierarchy = zone.split('/zones')
-            zone_entity = zone_parent.get_zone(zone_hierarchy[0])
-            zone = check_zone_in_path(zone_entity, zone_hierarchy[0], zone_hierarchy[1:], zone_parent)
+            zone = get_zone(configuration, view, zone)
+            if zone is None:
+                return 'No matching Zone(s) found', 404
             absolute_name = data['absolute_name'] + '.' + zone.get_full_name()
         ip4_address_list = data['ip4_address'].split(',')
         ttl = data.get('ttl', -1)
         properties = data.get('properties', '')
-        host_record = view.add_host_record(absolute_name, ip4_address_list, ttl, properties)
+        host_record = get_view(configuration, view).add_host_record(absolute_name, ip4_address_list, ttl, properties)
         result = host_record.to_json()
         return result, 201
 
@@ -540,20 +557,18 @@ class CNameRecordCollection(Resource):
 
     @util.rest_workflow_permission_required('rest_page')
     @cname_ns.response(200, 'Found CName records.')
+    @cname_ns.expect(collection_parser)
     def get(self, configuration, view, zone=None):
-        """ Get all cname records belonging to default or provided Configuration and View plus Zone hierarchy. """
-        configuration = g.user.get_api().get_configuration(configuration)
-        view = configuration.get_view(view)
+        """
+        Get all cname records belonging to default or provided Configuration and View plus Zone hierarchy.
+        Supports limit and cursor paging and fields selection.
+        """
         if zone is None:
             return 'No matching Zone(s) found', 404
-        zone_parent = view
-        zone_hierarchy = zone.split('/zones')
-        zone_entity = zone_parent.get_zone(zone_hierarchy[0])
-        zone = check_zone_in_path(zone_entity, zone_hierarchy[0], zone_hierarchy[1:], zone_parent)
-
-        host_records = zone.get_children_of_type(zone.AliasRecord)
-        result = [host.to_json() for host in host_records]
-        return jsonify(result)
+        zone = get_zone(configuration, view, zone)
+        if zone is None:
+            return 'No matching Zone(s) found', 404
+        return stream_collection(zone, Entity.AliasRecord)
 
     @util.rest_workflow_permission_required('rest_page')
     @cname_ns.response(201, 'CName Record successfully created.', model=entity_return_model)
@@ -561,21 +576,17 @@ class CNameRecordCollection(Resource):
     def post(self, configuration, view, zone=None):
         """ Create a cname record belonging to default or provided Configuration and View plus Zone hierarchy. """
         data = cname_parser.parse_args()
-        configuration = g.user.get_api().get_configuration(configuration)
-        view = configuration.get_view(view)
-
         if zone is None:
             absolute_name = data['absolute_name']
         else:
-            zone_parent = view
-            zone_hierarchy = zone.split('/zones')
-            zone_entity = zone_parent.get_zone(zone_hierarchy[0])
-            zone = check_zone_in_path(zone_entity, zone_hierarchy[0], zone_hierarchy[1:], zone_parent)
+            zone = get_zone(configuration, view, zone)
+            if zone is None:
+                return 'No matching Zone(s) found', 404
             absolute_name = data['absolute_name'] + '.' + zone.get_full_name()
         ip4_address_list = data['linked_record']
         ttl = data.get('ttl', -1)
         properties = data.get('properties', '')
-        cname_record = view.add_alias_record(absolute_name, ip4_address_list, ttl, properties)
+        cname_record = get_view(configuration, view).add_alias_record(absolute_name, ip4_address_list, ttl, properties)
         result = cname_record.to_json()
         return result, 201
 
@@ -24,7 +24,10 @@ from flask import g, jsonify
 from flask_restplus import fields, reqparse, Resource
 import bluecat.server_endpoints as se
 from bluecat import util
+from bluecat.entity import Entity
 from .configuration_page import config_defaults, entity_return_model
+from .paging import collection_parser, stream_collection
+from .path_cache import get_cached_entity, path_cache
 from main_app import api
 
 
@@ -129,6 +132,36 @@ ip4_address_post_parser.add_argument('action', location="json", help='The action
 ip4_address_post_parser.add_argument('properties', location="json", help='The properties of the record')
 
 
+def get_ip4_block(configuration, block):
+    """
+    Return the entity at the end of a block path such as 10.0.0.0/8/ipv4_blocks/10.1.0.0/16,
+    the configuration itself for an empty path and None if a block of the path does not exist.
+    The deepest block of the path that is already cached is read by ID and only the rest of
+    the path is walked, one get_entity_by_cidr per level.
+    """
+    block_hierarchy = []
+    if block:
+        block_hierarchy = [block_cidr.strip('/') for block_cidr in block.split('ipv4_blocks')]
+    keys = [(configuration, 'ipv4_blocks', '/'.join(block_hierarchy[:depth + 1]))
+            for depth in range(len(block_hierarchy))]
+
+    entity = None
+    depth = len(block_hierarchy)
+    while entity is None and 0 < depth:
+        entity = get_cached_entity(keys[depth - 1], Entity.IP4Block)
+        if entity is None:
+            depth -= 1
+    if entity is None:
+        entity = g.user.get_api().get_configuration(configuration)
+
+    for block_cidr, key in zip(block_hierarchy[depth:], keys[depth:]):
+        entity = entity.get_entity_by_cidr(block_cidr, entity.IP4Block)
+        if entity is None:
+            return None
+        path_cache.put(key, entity.get_id())
+    return entity
+
+
 @ip4_address_ns.route('/ipv4_networks/<string:network>/get_next_ip/')
 @ip4_address_default_ns.route('/ipv4_networks/<string:network>/get_next_ip/', defaults=config_defaults)
 @ip4_address_ns.response(404, 'IPv4 address not found')
@@ -218,14 +251,9 @@ class IPv4NextNetworkCollection(Resource):
         name = data.get('name', '')
         size = data.get('size', '')
         properties = data.get('properties', '')
-        range = g.user.get_api().get_configuration(configuration)
-        block_hierarchy = []
-        if block:
-            block_hierarchy = block.split('ipv4_blocks')
-
-        for block in block_hierarchy:
-            block_cidr = block.strip('/')
-            range = range.get_entity_by_cidr(block_cidr, range.IP4Block)
+        range = get_ip4_block(configuration, block)
+        if range is None:
+            return 'IPv4 network not found', 404
         network = range.get_next_available_ip_range(size, "IP4Network", properties)
         network.set_name(name)
         network.update()
@@ -242,6 +270,7 @@ class IPv4NextNetworkCollection(Resource):
 class IPv4BlockCollection(Resource):
 
     @util.rest_workflow_permission_required('rest_page')
+    @ip4_block_ns.expect(collection_parser)
     def get(self, configuration, block=None):
         """
         Get all direct child IPv4 Blocks belonging to default or provided Configuration and Block hierarchy.
@@ -250,19 +279,13 @@ class IPv4BlockCollection(Resource):
 
         1. 10.1.0.0/16
         2. 10.1.0.0/16/ipv4_blocks/10.1.1.0/24/ipv4_blocks/
-        """
-        range = g.user.get_api().get_configuration(configuration)
-        block_hierarchy = []
-        if block:
-            block_hierarchy = block.split('ipv4_blocks')
 
-        for block in block_hierarchy:
-            block_cidr = block.strip('/')
-            range = range.get_entity_by_cidr(block_cidr, range.IP4Block)
-        blocks = range.get_ip4_blocks()
-
-        result = [block_entity.to_json() for block_entity in blocks]
-        return jsonify(result)
+        Supports limit and cursor paging and fields selection.
+        """
+        range = get_ip4_block(configuration, block)
+        if range is None:
+            return 'IPv4 Blocks not found', 404
+        return stream_collection(range, Entity.IP4Block)
 
 
 @ip4_block_ns.route('/<path:block>/')
@@ -281,12 +304,9 @@ class IPv4Block(Resource):
         1. 10.1.0.0/16
         2. 10.1.0.0/16/ipv4_blocks/10.1.1.0/24
         """
-        range = g.user.get_api().get_configuration(configuration)
-        block_hierarchy = block.split('ipv4_blocks')
-
-        for block in block_hierarchy:
-            block_cidr = block.strip('/')
-            range = range.get_entity_by_cidr(block_cidr, range.IP4Block)
+        range = get_ip4_block(configuration, block)
+        if range is None:
+            return 'No matching IPv4 Block(s) found', 404
 
         result = range.to_json()
         return jsonify(result)
@@ -299,23 +319,20 @@ class IPv4Block(Resource):
 class IPv4NetworkCollection(Resource):
 
     @util.rest_workflow_permission_required('rest_page')
+    @ip4_network_config_block_ns.expect(collection_parser)
     def get(self, configuration, block):
         """
         Get all IPv4 Networks belonging to default or provided Configuration and Block hierarchy.
         Path can be of the format:
 
         1. ipv4_blocks/10.1.0.0/16/ipv4_blocks/10.1.1.0/24/ipv4_networks/
-        """
-        range = g.user.get_api().get_configuration(configuration)
-        block_hierarchy = block.split('ipv4_blocks')
-        for block in block_hierarchy:
-            block_cidr = block.strip('/')
-
-            range = range.get_entity_by_cidr(block_cidr, range.IP4Block)
-        networks = range.get_children_of_type(range.IP4Network)
 
-        result = [network.to_json() for network in networks]
-        return jsonify(result)
+        Supports limit and cursor paging and fields selection.
+        """
+        range = get_ip4_block(configuration, block)
+        if range is None:
+            return 'No matching IPv4 Network(s) found', 404
+        return stream_collection(range, Entity.IP4Network)
 
 
 @ip4_network_ns.route('/<path:network>/')
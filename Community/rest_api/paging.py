@@ -0,0 +1,144 @@
+# Copyright 2020 BlueCat Networks (USA) Inc. and its affiliates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# By: BlueCat Networks
+# Date: 2020-06-01
+# Gateway Version: 19.8.1
+# Description: Paged, projected and streamed JSON responses for the collection endpoints.
+
+import base64
+import json
+from collections import OrderedDict
+
+from flask import g, Response, stream_with_context
+from flask_restplus import reqparse
+from bluecat.util import has_response
+
+# Entities asked from BAM per getEntities call
+PAGE_SIZE = 1000
+# Largest page a client can ask for with limit
+MAX_LIMIT = 1000
+FIELDS = ('id', 'name', 'type', 'properties')
+NEXT_CURSOR_HEADER = 'X-Next-Cursor'
+
+collection_parser = reqparse.RequestParser()
+collection_parser.add_argument(
+    'limit',
+    type=int,
+    location='args',
+    help='The number of entities to return, at most %d. The cursor of the next page is returned in the %s '
+         'header.' % (MAX_LIMIT, NEXT_CURSOR_HEADER),
+)
+collection_parser.add_argument('cursor', location='args', help='The %s of the previous page' % NEXT_CURSOR_HEADER)
+collection_parser.add_argument(
+    'fields',
+    location='args',
+    help='Comma separated fields to return for each entity: %s' % ','.join(FIELDS),
+)
+
+
+def encode_cursor(parent_id, start):
+    return base64.urlsafe_b64encode(json.dumps([parent_id, start]).encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor, parent_id):
+    """Return the offset a cursor points at, None if it is malformed or belongs to another collection"""
+    try:
+        cursor_parent, start = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8'))
+    except Exception:
+        return None
+    if cursor_parent != parent_id or not isinstance(start, int) or start < 0:
+        return None
+    return start
+
+
+def fetch_page(api, parent_id, entity_type, start, count):
+    page = api._api_client.service.getEntities(parent_id, entity_type, start, count)
+    if not has_response(page):
+        return []
+    return page.item
+
+
+def iter_pages(api, parent_id, entity_type, start):
+    """Yield the children of parent_id of the given type PAGE_SIZE at a time"""
+    while True:
+        items = fetch_page(api, parent_id, entity_type, start, PAGE_SIZE)
+        if items:
+            yield items
+        if len(items) < PAGE_SIZE:
+            return
+        start += PAGE_SIZE
+
+
+def serialize(api, item, fields):
+    """Return the JSON of one BAM entity, only instantiating it when its properties are needed"""
+    if fields is None:
+        return api.instantiate_entity(item).to_json()
+    if 'properties' in fields:
+        entity_json = api.instantiate_entity(item).to_json()
+        return OrderedDict((field, entity_json.get(field)) for field in fields)
+    values = {'id': item.id, 'name': item.name, 'type': item.type}
+    return OrderedDict((field, values[field]) for field in fields)
+
+
+def generate_json(api, pages, fields):
+    yield '['
+    separator = ''
+    for items in pages:
+        yield separator + ','.join(json.dumps(serialize(api, item, fields)) for item in items)
+        separator = ','
+    yield ']\n'
+
+
+def stream_collection(parent, entity_type):
+    """
+    Return the children of parent of the given type as a streamed JSON list.
+    Without limit every child from the cursor on is returned, read from BAM PAGE_SIZE at a time
+    while the response is being sent. With limit one page is returned and, if there are more
+    children, the cursor of the next page is set in the X-Next-Cursor header.
+    """
+    args = collection_parser.parse_args()
+    parent_id = parent.get_id()
+
+    fields = None
+    if args['fields']:
+        fields = [field.strip() for field in args['fields'].split(',') if field.strip()]
+        if not fields or not set(fields) <= set(FIELDS):
+            return 'Invalid fields, expected a comma separated list of: %s' % ','.join(FIELDS), 400
+
+    start = 0
+    if args['cursor']:
+        start = decode_cursor(args['cursor'], parent_id)
+        if start is None:
+            return 'Invalid cursor', 400
+
+    api = g.user.get_api()
+    next_cursor = None
+    limit = args['limit']
+    if limit is None:
+        pages = iter_pages(api, parent_id, entity_type, start)
+    else:
+        if not 0 < limit <= MAX_LIMIT:
+            return 'Invalid limit, expected a value between 1 and %d' % MAX_LIMIT, 400
+        # One extra entity tells whether there is a next page
+        items = fetch_page(api, parent_id, entity_type, start, limit + 1)
+        if limit < len(items):
+            items = items[:limit]
+            next_cursor = encode_cursor(parent_id, start + limit)
+        pages = [items] if items else []
+
+    response = Response(stream_with_context(generate_json(api, pages, fields)), mimetype='application/json')
+    if next_cursor is not None:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
+    return response
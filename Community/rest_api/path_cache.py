@@ -0,0 +1,96 @@
+# Copyright 2020 BlueCat Networks (USA) Inc. and its affiliates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# By: BlueCat Networks
+# Date: 2020-06-01
+# Gateway Version: 19.8.1
+# Description: Cache of the entity IDs that configuration, block, view and zone paths resolve to.
+
+import threading
+import time
+from collections import OrderedDict
+
+from flask import g
+
+# Seconds a resolved path is trusted before it is walked again
+PATH_CACHE_TTL = 300
+# Number of resolved paths kept, the least recently used ones are dropped first
+PATH_CACHE_SIZE = 10000
+
+
+class PathCache(object):
+    """
+    Entity IDs of resolved paths, keyed by tuples starting with the configuration name:
+    (configuration, 'ipv4_blocks', cidr path), (configuration, 'views', view) and
+    (configuration, 'zones', view, zone path). Only IDs are kept, the entity is always read again
+    with the requesting user's session, so a cached path costs one BAM call however deep it is.
+    """
+
+    def __init__(self, ttl=PATH_CACHE_TTL, max_entries=PATH_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, key, entity_id):
+        with self._lock:
+            self._entries[key] = (time.time() + self.ttl, entity_id)
+            self._entries.move_to_end(key)
+            while self.max_entries < len(self._entries):
+                self._entries.popitem(last=False)
+
+    def discard(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def invalidate(self, *prefix):
+        """Drop every path whose key starts with prefix, e.g. invalidate(configuration, 'zones', view)"""
+        with self._lock:
+            for key in [key for key in self._entries if key[:len(prefix)] == prefix]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+path_cache = PathCache()
+
+
+def get_cached_entity(key, entity_type):
+    """Return the entity a cached path resolves to, None if the path is unknown or no longer valid"""
+    entity_id = path_cache.get(key)
+    if entity_id is None:
+        return None
+    try:
+        entity = g.user.get_api().get_entity_by_id(entity_id)
+    except Exception:
+        entity = None
+    # The entity may have been deleted or replaced outside of this API since the path was cached
+    if entity is None or entity.get_type() != entity_type:
+        path_cache.discard(key)
+        return None
+    return entity
+
@@ -0,0 +1,293 @@
+# Copyright 2020 BlueCat Networks (USA) Inc. and its affiliates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# By: BlueCat Networks
+# Date: 2020-06-01
+# Gateway Version: 19.8.1
+# Description: In-process index of the zones of a view by absolute name, shared by rest_api and itsm_api.
+
+import bisect
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from bluecat.util import has_response
+
+PAGE_SIZE = 1000
+MAX_WORKERS = 8
+# Seconds an index is used as is before the changes made since are read from the audit log
+REFRESH_INTERVAL = 300
+# Seconds added to the audit log window so changes made while the last refresh ran are not missed
+AUDIT_MARGIN = 60
+# A refresh that finds more changed entities than this rebuilds the index instead
+MAX_AUDIT_LOOKUPS = 1000
+# Zones returned for a hint, like the getZonesByHint searches the index replaces
+HINT_LIMIT = 10
+
+
+def get_absolute_name(item):
+    """Return the absoluteName property of a zone as returned by the SOAP API"""
+    for prop in (item.properties or '').split('|'):
+        if prop.startswith('absoluteName='):
+            return prop[len('absoluteName='):]
+    return item.name
+
+
+def clone_client(shared):
+    """Return a clone of a suds client for one thread, suds clients are not thread safe"""
+    try:
+        # A cloned suds client starts with an empty cookie jar, carry the BAM session over
+        client = shared.clone()
+        for cookie in shared.options.transport.cookiejar:
+            client.options.transport.cookiejar.set_cookie(cookie)
+    except AttributeError:
+        return shared
+    return client
+
+
+class _Fetcher(object):
+    """getEntities, getEntityById and getParent on a per thread copy of the user's SOAP client"""
+
+    def __init__(self, api, page_size):
+        self._api = api
+        self._page_size = page_size
+        self._local = threading.local()
+
+    def client(self):
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self._local.client = clone_client(self._api._api_client)
+        return client
+
+    def zones(self, parent_id):
+        zones = []
+        start = 0
+        while True:
+            page = self.client().service.getEntities(parent_id, 'Zone', start, self._page_size)
+            if not has_response(page):
+                break
+            zones.extend(page.item)
+            if len(page.item) < self._page_size:
+                break
+            start += self._page_size
+        return zones
+
+    def entity(self, entity_id):
+        try:
+            item = self.client().service.getEntityById(entity_id)
+        except Exception:
+            return None
+        return item if item and item.id else None
+
+    def parent_id(self, entity_id):
+        try:
+            parent = self.client().service.getParent(entity_id)
+        except Exception:
+            return None
+        return parent.id if parent else None
+
+
+class ZoneIndex(object):
+    """
+    The zones of one view by lower case absolute name.
+    Names are looked up in a dict, and hints, which match the start of absolute names like BAM's
+    getZonesByHint, by bisecting a sorted list of the names, so neither needs a BAM call. The
+    index is built by walking the view once, one level of concurrent getEntities calls at a time,
+    and is then kept current from the audit log: every REFRESH_INTERVAL seconds only the zones
+    changed, created or deleted since the last refresh are read again. When the audit log cannot
+    be read or lists too many changes the index is rebuilt.
+    """
+
+    def __init__(self, configuration_id, view_name, max_workers=MAX_WORKERS, page_size=PAGE_SIZE):
+        self.configuration_id = configuration_id
+        self.view_name = view_name
+        self.view_id = None
+        self.refreshed_at = None
+        self.expired = False
+        self._max_workers = max_workers
+        self._page_size = page_size
+        # zone ID -> (lower case absolute name, parent ID, SOAP item)
+        self._zones = {}
+        self._ids = {}
+        self._names = []
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+
+    def get(self, absolute_name):
+        """Return the zone with the given absolute name, None if there is none"""
+        with self._lock:
+            zone_id = self._ids.get(absolute_name.lower())
+            return self._zones[zone_id][2] if zone_id is not None else None
+
+    def find_by_hint(self, hint, limit=HINT_LIMIT):
+        """Return the zones whose absolute names start with hint, in name order"""
+        hint = hint.lower()
+        zones = []
+        with self._lock:
+            position = bisect.bisect_left(self._names, hint)
+            while position < len(self._names) and self._names[position].startswith(hint):
+                zones.append(self._zones[self._ids[self._names[position]]][2])
+                if limit is not None and limit <= len(zones):
+                    break
+                position += 1
+        return zones
+
+    def is_stale(self):
+        return self.refreshed_at is None or self.expired or self.refreshed_at + REFRESH_INTERVAL < time.time()
+
+    def refresh(self, api):
+        """
+        Bring the index up to date if it is stale. While one request refreshes an index that was
+        built before, other requests keep using it as is instead of waiting.
+        """
+        if not self.is_stale():
+            return
+        if not self._refresh_lock.acquire(self.refreshed_at is None):
+            return
+        try:
+            if not self.is_stale():
+                return
+            started = time.time()
+            self.expired = False
+            fetcher = _Fetcher(api, self._page_size)
+            with ThreadPoolExecutor(max_workers=self._max_workers) as pool:
+                if self.refreshed_at is None or not self._update(api, fetcher, pool):
+                    self._build(fetcher, pool)
+            self.refreshed_at = started
+        finally:
+            self._refresh_lock.release()
+
+    def _walk(self, fetcher, pool, parent_ids):
+        """Return {zone ID: (parent ID, item)} of every zone below the given parents"""
+        zones = {}
+        frontier = list(parent_ids)
+        while frontier:
+            futures = [(parent_id, pool.submit(fetcher.zones, parent_id)) for parent_id in frontier]
+            frontier = []
+            for parent_id, future in futures:
+                for item in future.result():
+                    zones[item.id] = (parent_id, item)
+                    frontier.append(item.id)
+        return zones
+
+    def _build(self, fetcher, pool):
+        view = fetcher.client().service.getEntityByName(self.configuration_id, self.view_name, 'View')
+        if not view or not view.id:
+            raise ValueError('View %s not found' % self.view_name)
+        zones = self._walk(fetcher, pool, [view.id])
+        with self._lock:
+            self.view_id = view.id
+            self._zones = {}
+            self._ids = {}
+            self._add(zones)
+            self._sort()
+
+    def _update(self, api, fetcher, pool):
+        """Apply the changes listed in the audit log since the last refresh, False if a rebuild is needed"""
+        interval = '%d seconds' % (time.time() - self.refreshed_at + AUDIT_MARGIN)
+        try:
+            logs = api.get_audit_logs(interval, transaction_id=None, descending=False)
+        except Exception:
+            return False
+        entity_ids = set(int(log['object_id']) for log in logs)
+        if self.view_id in entity_ids or MAX_AUDIT_LOOKUPS < len(entity_ids):
+            return False
+
+        futures = [(entity_id, pool.submit(fetcher.entity, entity_id)) for entity_id in entity_ids]
+        changed = {}
+        removed = []
+        for entity_id, future in futures:
+            item = future.result()
+            if item is not None and item.type == 'Zone':
+                changed[entity_id] = item
+            elif entity_id in self._zones:
+                removed.append(entity_id)
+        parents = [(entity_id, pool.submit(fetcher.parent_id, entity_id)) for entity_id in changed]
+        parents = dict((entity_id, future.result()) for entity_id, future in parents)
+
+        with self._lock:
+            for zone_id in removed:
+                self._remove(zone_id)
+            # Parents have shorter names than their subzones, so a new parent is placed first
+            moved = []
+            for item in sorted(changed.values(), key=lambda item: len(get_absolute_name(item))):
+                parent_id = parents[item.id]
+                known = self._zones.get(item.id)
+                if parent_id != self.view_id and parent_id not in self._zones:
+                    if known is not None:
+                        self._remove(item.id)
+                    continue
+                if known is None or known[0] != get_absolute_name(item).lower():
+                    moved.append(item.id)
+                self._add({item.id: (parent_id, item)})
+        # New and renamed zones need their subzones read again, their absolute names changed too
+        if moved:
+            zones = self._walk(fetcher, pool, moved)
+            with self._lock:
+                self._add(zones)
+        with self._lock:
+            self._sort()
+        return True
+
+    def _add(self, zones):
+        for zone_id, (parent_id, item) in zones.items():
+            known = self._zones.get(zone_id)
+            if known is not None and self._ids.get(known[0]) == zone_id:
+                del self._ids[known[0]]
+            absolute_name = get_absolute_name(item).lower()
+            self._zones[zone_id] = (absolute_name, parent_id, item)
+            self._ids[absolute_name] = zone_id
+
+    def _remove(self, zone_id):
+        """Drop a zone and its subzones"""
+        children = {}
+        for other_id, (absolute_name, parent_id, item) in self._zones.items():
+            children.setdefault(parent_id, []).append(other_id)
+        pending = [zone_id]
+        while pending:
+            other_id = pending.pop()
+            pending.extend(children.get(other_id, []))
+            known = self._zones.pop(other_id, None)
+            if known is not None and self._ids.get(known[0]) == other_id:
+                del self._ids[known[0]]
+
+    def _sort(self):
+        self._names = sorted(self._ids)
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_zone_index(api, owner, configuration_id, view_name):
+    """
+    Return the zone index of a view, built or refreshed with api as needed.
+    Indexes are kept per owner, the user name they were built for, so no one is shown zones
+    their BAM access rights do not cover.
+    """
+    key = (owner, configuration_id, view_name)
+    with _indexes_lock:
+        index = _indexes.get(key)
+        if index is None:
+            index = ZoneIndex(configuration_id, view_name)
+            _indexes[key] = index
+    index.refresh(api)
+    return index
+
+
+def expire_zone_indexes():
+    """Have every index read the audit log on its next use, after zones were changed through the API"""
+    with _indexes_lock:
+        for index in _indexes.values():
+            index.expired = True
@@ -0,0 +1,224 @@
+# Copyright 2020 BlueCat Networks (USA) Inc. and its affiliates
+# -*- coding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# By: BlueCat Networks
+# Date: 2020-06-01
+# Gateway Version: 19.5.1
+# Description: SDWAN Firewall Rule Updater fwrl_sync.py
+
+import os
+import json
+from threading import Lock
+
+RULE_COMMENT = 'DNS Edge Domainlist'
+# Characters of destCidr per firewall rule, larger domain lists are split across several rules.
+# Can be overridden with "sdwan_rule_max_length" in config.json.
+MAX_RULE_LENGTH = 4000
+# Synchronizations kept in the sync history
+HISTORY_SIZE = 20
+
+
+def normalize_domain(domain):
+    domain = domain.strip()
+    if domain.endswith('.'):
+        domain = domain[:-1]
+    return domain
+
+
+def to_destination(domain, fqdn):
+    return domain if fqdn else '*.' + domain
+
+
+def rule_settings(edge_dl):
+    return {'port': edge_dl['port'], 'protocol': edge_dl['protocol'], 'fqdn': edge_dl['fqdn'] == "True"}
+
+
+class SyncPlan(object):
+    """Domain list states and rules computed by DomainListSync.plan, applied by commit once pushed"""
+
+    def __init__(self):
+        self.lists = {}
+        self.rules = []
+        self.changed = False
+        self.stats = {'domains': 0, 'added': 0, 'removed': 0, 'rules': 0, 'rules_rebuilt': 0}
+
+
+class DomainListSync(object):
+    """
+    Keeps the domains of every domain list as last pushed to Meraki, split into rules of at most
+    max_length characters of destinations. plan compares newly downloaded lists with them and only
+    touches the rules holding added or removed domains: removed domains are dropped from their
+    rules and added ones fill the rules that have room left before new rules are made, so the
+    other rules are reused as they are. A list whose port, protocol or FQDN setting changed is
+    split again from scratch.
+    The state is saved to a JSON file next to config.json so it survives Gateway restarts.
+    """
+
+    def __init__(self, state_file, debug=False):
+        self._state_file = state_file
+        self._debug = debug
+        self._lock = Lock()
+        self._lists = {}
+        self._history = []
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self._state_file):
+            return
+        try:
+            with open(self._state_file) as f:
+                state = json.load(f)
+            self._lists = state.get('domainlists', {})
+            self._history = state.get('history', [])
+        except (IOError, ValueError) as e:
+            if self._debug:
+                print('DEBUG: Exceptin <%s>' % str(e))
+
+    def _save(self):
+        state = {'domainlists': self._lists, 'history': self._history}
+        temp_file = self._state_file + '.tmp'
+        with open(temp_file, 'w') as f:
+            json.dump(state, f)
+        os.replace(temp_file, self._state_file)
+
+    def reset(self):
+        """Forget the synchronized domains so the next plan rebuilds every rule"""
+        with self._lock:
+            self._lists = {}
+            self._save()
+
+    def get_history(self):
+        with self._lock:
+            return list(self._history)
+
+    def plan(self, edge_dls, domainlists, create_rule, max_length=MAX_RULE_LENGTH):
+        """
+        Return the SyncPlan of the configured lists edge_dls given the downloaded domainlists,
+        {name: [domain, ...]}. Lists that were not downloaded get no rules, like before.
+        create_rule(destinations, port, protocol, comments) builds one firewall rule.
+        """
+        plan = SyncPlan()
+        with self._lock:
+            previous_lists = dict(self._lists)
+        previous_order = list(previous_lists)
+        for edge_dl in edge_dls:
+            name = edge_dl['name']
+            if name not in domainlists:
+                continue
+            previous = previous_lists.pop(name, None)
+            state = self._plan_list(edge_dl, domainlists[name], previous, create_rule, max_length, plan)
+            plan.lists[name] = state
+            for shard in state['shards']:
+                plan.rules.append(shard['rule'])
+            plan.stats['domains'] += state['size']
+        if previous_lists or list(plan.lists) != [name for name in previous_order if name in plan.lists]:
+            # Lists that are no longer configured or downloaded lose their rules, reordered ones move them
+            plan.changed = True
+        plan.stats['rules'] = len(plan.rules)
+        return plan
+
+    def _plan_list(self, edge_dl, domainlist, previous, create_rule, max_length, plan):
+        name = edge_dl['name']
+        settings = rule_settings(edge_dl)
+        if previous is not None and previous['settings'] == settings and \
+                previous['hash_value'] == edge_dl['hash_value']:
+            return previous
+
+        domains = set(normalize_domain(domain) for domain in domainlist)
+        domains.discard('')
+        if previous is None or previous['settings'] != settings:
+            shards = []
+            added = domains
+            removed = set()
+        else:
+            shards = [list(shard['domains']) for shard in previous['shards']]
+            current = set()
+            for shard in shards:
+                current.update(shard)
+            added = domains - current
+            removed = current - domains
+
+        fqdn = settings['fqdn']
+        dirty = set()
+        if removed:
+            for index, shard in enumerate(shards):
+                kept = [domain for domain in shard if domain not in removed]
+                if len(kept) != len(shard):
+                    shards[index] = kept
+                    dirty.add(index)
+        if added:
+            lengths = [self._length(shard, fqdn) for shard in shards]
+            index = 0
+            for domain in sorted(added):
+                length = len(to_destination(domain, fqdn)) + 1
+                while index < len(shards) and max_length < lengths[index] + length and shards[index]:
+                    index += 1
+                if index == len(shards):
+                    shards.append([])
+                    lengths.append(0)
+                shards[index].append(domain)
+                lengths[index] += length
+                dirty.add(index)
+
+        # Rules keep their place in the list, emptied ones are dropped and renumber the rest
+        previous_shards = previous['shards'] if previous is not None and previous['settings'] == settings else []
+        count = len([shard for shard in shards if shard])
+        new_shards = []
+        for index, shard in enumerate(shards):
+            if not shard:
+                continue
+            comments = self._comments(name, len(new_shards), count)
+            if index not in dirty and index < len(previous_shards) and \
+                    previous_shards[index]['rule']['comment'] == comments:
+                new_shards.append(previous_shards[index])
+                continue
+            destinations = [to_destination(domain, fqdn) for domain in shard]
+            rule = create_rule(destinations, settings['port'], settings['protocol'], comments)
+            new_shards.append({'domains': shard, 'rule': rule})
+            plan.stats['rules_rebuilt'] += 1
+
+        if previous is None or previous['settings'] != settings or dirty or \
+                len(new_shards) != len(previous['shards']):
+            plan.changed = True
+        plan.stats['added'] += len(added)
+        plan.stats['removed'] += len(removed)
+        return {
+            'edge_id': edge_dl['edge_id'],
+            'hash_value': edge_dl['hash_value'],
+            'settings': settings,
+            'size': len(domains),
+            'shards': new_shards,
+        }
+
+    def _length(self, shard, fqdn):
+        return sum(len(to_destination(domain, fqdn)) + 1 for domain in shard)
+
+    def _comments(self, name, index, count):
+        comments = RULE_COMMENT + ' (' + name + ')'
+        if 1 < count:
+            comments += ' %d/%d' % (index + 1, count)
+        return comments
+
+    def commit(self, plan, stats):
+        """Keep the state of a plan whose rules were pushed, or did not need to be, and record stats"""
+        with self._lock:
+            # Lists that were not downloaded again are the same objects, no need to rewrite the file
+            updated = len(plan.lists) != len(self._lists) or \
+                any(self._lists.get(name) is not state for name, state in plan.lists.items())
+            self._lists = plan.lists
+            self._history.append(stats)
+            del self._history[:-HISTORY_SIZE]
+            if updated:
+                self._save()
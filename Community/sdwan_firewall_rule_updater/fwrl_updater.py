@@ -23,6 +23,7 @@ import sys
 import datetime
 import pytz
 import json
+import time
 import hashlib
 from threading import Lock
 from apscheduler.schedulers.background import BackgroundScheduler
@@ -30,6 +31,8 @@ from apscheduler.schedulers.background import BackgroundScheduler
 from dnsedge.edgeapi import EdgeAPI
 from sdwan.merakiapi import MerakiAPI
 
+from .fwrl_sync import DomainListSync, MAX_RULE_LENGTH, RULE_COMMENT
+
 class FWRLUpdaterException(Exception): pass
 
 
@@ -37,6 +40,7 @@ class FWRLUpdater(object):
     _unique_instance = None
     _lock = Lock()
     _config_file = os.path.dirname(os.path.abspath(__file__)) + '/config.json'
+    _sync_state_file = os.path.dirname(os.path.abspath(__file__)) + '/sync_state.json'
 
     @classmethod
     def __internal_new__(cls):
@@ -51,6 +55,8 @@ class FWRLUpdater(object):
                     cls._unique_instance._debug = debug
                     cls._unique_instance._scheduler = None
                     cls._unique_instance._job = None
+                    cls._unique_instance._sync_lock = Lock()
+                    cls._unique_instance._sync = DomainListSync(FWRLUpdater._sync_state_file, debug=debug)
                     cls._unique_instance._load()
         return cls._unique_instance
 
@@ -112,19 +118,7 @@ class FWRLUpdater(object):
                 network_id = template['id']
         return network_id
 
-    def _convert_dls2destCidr(self, edge_dl, dls):
-        destCidr = []
-        for dl in dls:
-            domains = dl.split('.')
-            last = len(domains) - 1
-            if '' == domains[last]:
-                del domains[last]
-            if edge_dl['fqdn'] != "True":
-                domains.insert(0, '*')
-            destCidr.append('.'.join(domains))
-        return destCidr
-
-    def _update_firewall_rules_by_dls(self, meraki_api, rules, domainlists):
+    def _update_firewall_rules_by_dls(self, rules, dl_rules):
         new_rules = []
         delimiter_rule = None
         delimiter_key = self.get_value('sdwan_delimit_key')
@@ -135,21 +129,13 @@ class FWRLUpdater(object):
             if delimiter_key in comment:
                 delimiter_rule = rule
                 continue
-            elif 'Default rule' in comment or 'DNS Edge Domainlist' in comment:
+            elif 'Default rule' in comment or RULE_COMMENT in comment:
                 continue
             else:
                 new_rules.append(rule)
 
         # Add DNS Edge Domainlist Firewall Rules.
-        for edge_dl in self.get_value('edge_domainlists'):
-            dl_name = edge_dl['name']
-            if dl_name in domainlists.keys():
-                destCidr = self._convert_dls2destCidr(edge_dl, domainlists[dl_name])
-                port = edge_dl['port']
-                protocol = edge_dl['protocol']
-                comments = 'DNS Edge Domainlist (' +  dl_name + ')'
-                new_rule = meraki_api.create_allow_firewall_rule(destCidr, port, protocol, comments)
-                new_rules.append(new_rule)
+        new_rules.extend(dl_rules)
 
         if delimiter_rule is not None:
             new_rules.append(delimiter_rule)
@@ -159,6 +145,61 @@ class FWRLUpdater(object):
             print(new_rules)
         return new_rules
 
+    def _push_firewall_rules(self, meraki_api, dl_rules, stats):
+        network_id = self._get_network_id(meraki_api)
+        if network_id is None:
+            return False
+        started = time.time()
+        rules = meraki_api.get_firewall_rules(network_id)
+        new_rules = self._update_firewall_rules_by_dls(rules, dl_rules)
+        stats['payload_bytes'] = len(json.dumps({'rules': new_rules, 'syslogEnabled': True}))
+        if meraki_api.update_firewall_rules(network_id, new_rules) is None:
+            return False
+        stats['push_duration'] = round(time.time() - started, 3)
+        stats['pushed'] = True
+        return True
+
+    def _synchronize(self, edge_api, meraki_api, force):
+        """
+        Download the domain lists and push the firewall rules of the lists that changed since the
+        last synchronization, or of all of them if force. Only rules holding added or removed
+        domains are rebuilt, and nothing is pushed when no rule changed.
+        """
+        started = time.time()
+        stats = {'force': force, 'pushed': False, 'payload_bytes': 0, 'push_duration': 0}
+        self._update_domainlist_ids(edge_api)
+        domainlists = {}
+        if self._debug:
+            print("Now Checking Updated Domainlists....")
+        self._updates_domainlists(edge_api, domainlists)
+        stats['download_duration'] = round(time.time() - started, 3)
+
+        if force:
+            self._sync.reset()
+        max_length = self.get_value('sdwan_rule_max_length') or MAX_RULE_LENGTH
+        plan = self._sync.plan(self.get_value('edge_domainlists'), domainlists,
+                               meraki_api.create_allow_firewall_rule, max_length)
+        stats.update(plan.stats)
+        if not plan.changed and not force:
+            stats['duration'] = round(time.time() - started, 3)
+            self._sync.commit(plan, stats)
+            return False
+
+        if self._debug:
+            print("Now Synchronizing....")
+        if not self._push_firewall_rules(meraki_api, plan.rules, stats):
+            return False
+        timestamp = datetime.datetime.now().strftime("%Y/%m/%d %H:%M:%S.%f UTC")
+        stats['timestamp'] = timestamp
+        stats['duration'] = round(time.time() - started, 3)
+        self._sync.commit(plan, stats)
+        self.set_value('last_execution', timestamp)
+        self.save()
+        if self._debug:
+            print("Now Synchronization is complted")
+            print(stats)
+        return True
+
     def synchronize_domainlists(self):
         edge_api = EdgeAPI(self.get_value('edge_url'), debug=self._debug)
         meraki_api = MerakiAPI(self.get_value('sdwan_key'), debug=self._debug)
@@ -168,26 +209,8 @@ class FWRLUpdater(object):
 
         succeed = False
         if edge_api.login(self.get_value('edge_client_id'), self.get_value('edge_secret')):
-            self._update_domainlist_ids(edge_api)
-            domainlists = {}
-            if self._debug:
-                print("Now Checking Updated Domainlists....")
-
-            if self._updates_domainlists(edge_api, domainlists):
-                if self._debug:
-                    print("Now Synchronizing....")
-
-                network_id = self._get_network_id(meraki_api)
-                if network_id is not None:
-                    rules = meraki_api.get_firewall_rules(network_id)
-                    new_rules = self._update_firewall_rules_by_dls(meraki_api, rules, domainlists)
-                    meraki_api.update_firewall_rules(network_id, new_rules)
-                    timestamp = datetime.datetime.now().strftime("%Y/%m/%d %H:%M:%S.%f UTC")
-                    self.set_value('last_execution', timestamp)
-                    self.save()
-                    succeed = True
-                if self._debug:
-                    print("Now Synchronization is complted")
+            with self._sync_lock:
+                succeed = self._synchronize(edge_api, meraki_api, False)
             edge_api.logout()
 
         return succeed
@@ -201,25 +224,15 @@ class FWRLUpdater(object):
 
         succeed = False
         if edge_api.login(self.get_value('edge_client_id'), self.get_value('edge_secret')):
-            self._update_domainlist_ids(edge_api)
-            domainlists = {}
-            self._updates_domainlists(edge_api, domainlists)
-            if self._debug:
-                print("Now Synhronizing....")
-
-            network_id = self._get_network_id(meraki_api)
-            if network_id is not None:
-                rules = meraki_api.get_firewall_rules(network_id)
-                new_rules = self._update_firewall_rules_by_dls(meraki_api, rules, domainlists)
-                meraki_api.update_firewall_rules(network_id, new_rules)
-                timestamp = datetime.datetime.now().strftime("%Y/%m/%d %H:%M:%S.%f UTC")
-                self.set_value('last_execution', timestamp)
-                self.save()
-                succeed = True
+            with self._sync_lock:
+                succeed = self._synchronize(edge_api, meraki_api, True)
             edge_api.logout()
 
         return succeed
 
+    def get_sync_history(self):
+        return self._sync.get_history()
+
     def _clear_domainlists(self):
         for edge_domainlist in self.get_value('edge_domainlists'):
             edge_domainlist['edge_id'] = ''
@@ -231,17 +244,17 @@ class FWRLUpdater(object):
         if not meraki_api.validate_api_key():
             return False
 
-        succeed = False
-        domainlists = {}
         if self._debug:
             print("Now Clearing....")
 
-        self._clear_domainlists()
-        network_id = self._get_network_id(meraki_api)
-        if network_id is not None:
-            rules = meraki_api.get_firewall_rules(network_id)
-            new_rules = self._update_firewall_rules_by_dls(meraki_api, rules, domainlists)
-            meraki_api.update_firewall_rules(network_id, new_rules)
+        with self._sync_lock:
+            self._clear_domainlists()
+            self._sync.reset()
+            network_id = self._get_network_id(meraki_api)
+            if network_id is not None:
+                rules = meraki_api.get_firewall_rules(network_id)
+                new_rules = self._update_firewall_rules_by_dls(rules, [])
+                meraki_api.update_firewall_rules(network_id, new_rules)
         self.set_value('last_execution', "")
         self.save()
         return True
@@ -197,6 +197,13 @@ def submit_domain_lists():
     updater.set_value('edge_domainlists', domain_lists)
     return ""
 
+@route(app, '/sdwan_firewall_rule_updater/sync_history')
+@util.workflow_permission_required('sdwan_firewall_rule_updater_page')
+@util.exception_catcher
+def sync_history():
+    updater = FWRLUpdater.get_instance()
+    return jsonify(updater.get_sync_history())
+
 @route(app, '/sdwan_firewall_rule_updater/form', methods=['POST'])
 @util.workflow_permission_required('sdwan_firewall_rule_updater_page')
 @util.exception_catcher
@@ -33,6 +33,7 @@ import config.default_config as config
 from main_app import app
 
 from .sp_watcher import SPWatcher
+from .snmp_trap_sender import trap_dispatcher
 
 
 def module_path():
@@ -204,6 +205,19 @@ def load_service_points():
     service_points = sp_watcher.get_service_point_summaries()
     return jsonify(service_points)
 
+@route(app, '/service_point_watcher/get_probe_stats')
+@util.workflow_permission_required('service_point_watcher_page')
+@util.exception_catcher
+def get_probe_stats():
+    sp_watcher = SPWatcher.get_instance()
+    return jsonify(sp_watcher.get_probe_stats())
+
+@route(app, '/service_point_watcher/get_trap_stats')
+@util.workflow_permission_required('service_point_watcher_page')
+@util.exception_catcher
+def get_trap_stats():
+    return jsonify(trap_dispatcher.get_stats())
+
 @route(app, '/service_point_watcher/update_service_points', methods=['POST'])
 @util.workflow_permission_required('service_point_watcher_page')
 @util.exception_catcher
@@ -18,34 +18,160 @@
 # Gateway Version: 19.5.1
 # Description: Service Point Watcher snmp_trap_sender.py
 
+import queue
+import threading
+import time
+from collections import OrderedDict
+
 from pysnmp.hlapi import *
 
 mp_model = {
     'v1': 0,
     'v2c': 1
 }
-def send_status_notification(trap_servers, service_point, service, status):
-    print('Issuing Traps %s status with <%s>.' % (service, status))
 
-    for trap_server in trap_servers:
+# A trap repeating the last value sent for the same service point and trap type within this many
+# seconds is sent once, any change of value is always sent
+DEDUPE_WINDOW = 60
+# Traps waiting to be sent, further traps are dropped and counted while the queue is full
+QUEUE_SIZE = 10000
+
+
+class TrapDispatcher(object):
+    """
+    Sends SNMP traps from a single background thread.
+    One SnmpEngine is kept for the lifetime of the dispatcher, and the CommunityData and
+    UdpTransportTarget of each trap server are built once and reused. Callers only enqueue,
+    so the watcher sweep never waits on SNMP. A trap that only resends the last value of its
+    subject within dedupe_window seconds is suppressed, so every transition still reaches the NMS.
+    """
+
+    def __init__(self, dedupe_window=DEDUPE_WINDOW, queue_size=QUEUE_SIZE):
+        self._dedupe_window = dedupe_window
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._lock = threading.Lock()
+        self._recent = {}
+        self._targets = {}
+        self._engine = None
+        self._thread = None
+        self.sent = 0
+        self.failed = 0
+        self.deduplicated = 0
+        self.dropped = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+        self.last_error = ''
+
+    def _start(self):
+        # Caller holds self._lock
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name='snmp-trap-dispatcher')
+            self._thread.daemon = True
+            self._thread.start()
+
+    def _is_duplicate(self, subject, value):
+        # Caller holds self._lock
+        now = time.time()
+        if len(self._recent) > 10000:
+            self._recent = {k: v for k, v in self._recent.items() if now - v[1] < self._dedupe_window}
+        last = self._recent.get(subject)
+        if last is not None and last[0] == value and now - last[1] < self._dedupe_window:
+            return True
+        self._recent[subject] = (value, now)
+        return False
+
+    def dispatch(self, trap_servers, notification_oid, var_binds, subject, value):
+        """Queue one notification for every trap server, unless it resends the last value of subject"""
+        with self._lock:
+            if self._is_duplicate(subject, value):
+                self.deduplicated += 1
+                return False
+            self._start()
+        for trap_server in trap_servers:
+            try:
+                self._queue.put_nowait((trap_server, notification_oid, var_binds))
+            except queue.Full:
+                with self._lock:
+                    self.dropped += 1
+        return True
+
+    def _get_target(self, trap_server):
+        key = (trap_server['ipaddress'], trap_server['port'], trap_server['comstr'], trap_server['snmpver'])
+        target = self._targets.get(key)
+        if target is None:
+            target = (
+                CommunityData(trap_server['comstr'], mpModel=mp_model[trap_server['snmpver']]),
+                UdpTransportTarget((trap_server['ipaddress'], trap_server['port']))
+            )
+            self._targets[key] = target
+        return target
+
+    def _send(self, trap_server, notification_oid, var_binds):
+        if self._engine is None:
+            self._engine = SnmpEngine()
+        community, transport = self._get_target(trap_server)
         errorIndication, errorStatus, errorIndex, varBinds = next(
             sendNotification(
-                SnmpEngine(),
-                CommunityData(trap_server['comstr'], mpModel=mp_model[trap_server['snmpver']]),
-                UdpTransportTarget((trap_server['ipaddress'], trap_server['port'])),
+                self._engine,
+                community,
+                transport,
                 ContextData(),
                 'trap',
-                NotificationType(
-                    ObjectIdentity('1.3.6.1.4.1.13315.6.3.2.0.1')
-                ).addVarBinds(
-                    ('1.3.6.1.4.1.13315.6.3.2.1.1.0', OctetString(service_point['name'])),
-                    ('1.3.6.1.4.1.13315.6.3.2.1.2.0', OctetString(service)),
-                    ('1.3.6.1.4.1.13315.6.3.2.1.3.0', OctetString(status))
-                )
+                NotificationType(ObjectIdentity(notification_oid)).addVarBinds(*var_binds)
             )
         )
-        if errorIndication:
-            print(errorIndication)
+        return errorIndication
+
+    def _run(self):
+        while True:
+            trap_server, notification_oid, var_binds = self._queue.get()
+            start = time.time()
+            try:
+                errorIndication = self._send(trap_server, notification_oid, var_binds)
+            except Exception as e:
+                errorIndication = e
+            latency = time.time() - start
+            with self._lock:
+                self.latency_total += latency
+                self.latency_max = max(self.latency_max, latency)
+                if errorIndication:
+                    self.failed += 1
+                    self.last_error = str(errorIndication)
+                    print(errorIndication)
+                else:
+                    self.sent += 1
+
+    def get_stats(self):
+        with self._lock:
+            attempts = self.sent + self.failed
+            return OrderedDict([
+                ('sent', self.sent),
+                ('failed', self.failed),
+                ('deduplicated', self.deduplicated),
+                ('dropped', self.dropped),
+                ('queued', self._queue.qsize()),
+                ('latency_avg_ms', round(self.latency_total / attempts * 1000, 1) if attempts else 0),
+                ('latency_max_ms', round(self.latency_max * 1000, 1)),
+                ('last_error', self.last_error),
+            ])
+
+
+trap_dispatcher = TrapDispatcher()
+
+
+def send_status_notification(trap_servers, service_point, service, status):
+    print('Issuing Traps %s status with <%s>.' % (service, status))
+    trap_dispatcher.dispatch(
+        trap_servers,
+        '1.3.6.1.4.1.13315.6.3.2.0.1',
+        (
+            ('1.3.6.1.4.1.13315.6.3.2.1.1.0', OctetString(service_point['name'])),
+            ('1.3.6.1.4.1.13315.6.3.2.1.2.0', OctetString(service)),
+            ('1.3.6.1.4.1.13315.6.3.2.1.3.0', OctetString(status))
+        ),
+        ('status', service_point['id'], service),
+        status
+    )
 
 
 def send_pulling_stopped_notification(trap_servers, service_point, pulling_severity, last_pulling_time):
@@ -60,24 +186,15 @@ def send_pulling_stopped_notification(trap_servers, service_point, pulling_sever
         condition = 'Set'
         severity = 60
 
-    for trap_server in trap_servers:
-        errorIndication, errorStatus, errorIndex, varBinds = next(
-            sendNotification(
-                SnmpEngine(),
-                CommunityData(trap_server['comstr'], mpModel=mp_model[trap_server['snmpver']]),
-                UdpTransportTarget((trap_server['ipaddress'], trap_server['port'])),
-                ContextData(),
-                'trap',
-                NotificationType(
-                    ObjectIdentity('1.3.6.1.4.1.13315.6.3.2.0.2')
-                ).addVarBinds(
-                    ('1.3.6.1.4.1.13315.6.3.2.1.4.0', OctetString(condition)),
-                    ('1.3.6.1.4.1.13315.6.3.2.1.1.0', OctetString(service_point['name'])),
-                    ('1.3.6.1.4.1.13315.6.3.2.1.5.0', Integer(severity)),
-                    ('1.3.6.1.4.1.13315.6.3.2.1.6.0', OctetString(timestamp)),
-                )
-            )
-        )
-
-        if errorIndication:
-            print(errorIndication)
+    trap_dispatcher.dispatch(
+        trap_servers,
+        '1.3.6.1.4.1.13315.6.3.2.0.2',
+        (
+            ('1.3.6.1.4.1.13315.6.3.2.1.4.0', OctetString(condition)),
+            ('1.3.6.1.4.1.13315.6.3.2.1.1.0', OctetString(service_point['name'])),
+            ('1.3.6.1.4.1.13315.6.3.2.1.5.0', Integer(severity)),
+            ('1.3.6.1.4.1.13315.6.3.2.1.6.0', OctetString(timestamp)),
+        ),
+        ('pulling', service_point['id']),
+        pulling_severity
+    )
@@ -0,0 +1,141 @@
+# Copyright 2020 BlueCat Networks (USA) Inc. and its affiliates
+# -*- coding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# By: BlueCat Networks
+# Date: 2020-06-01
+# Gateway Version: 19.5.1
+# Description: Service Point Watcher sp_prober.py
+
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait
+from threading import Lock, BoundedSemaphore
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# Upper bounds of the latency histogram buckets in seconds
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 5.0)
+
+
+class LatencyHistogram(object):
+    """Fixed bucket histogram of probe latencies"""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self._buckets = buckets
+        self._counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.failures = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds, failed=False):
+        index = 0
+        while index < len(self._buckets) and self._buckets[index] < seconds:
+            index += 1
+        self._counts[index] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        if failed:
+            self.failures += 1
+
+    def as_dict(self):
+        histogram = OrderedDict()
+        for bucket, count in zip(self._buckets, self._counts):
+            histogram['le_%s' % bucket] = count
+        histogram['le_inf'] = self._counts[-1]
+        return OrderedDict([
+            ('count', self.count),
+            ('failures', self.failures),
+            ('avg_ms', round(self.total / self.count * 1000, 1) if self.count else 0),
+            ('max_ms', round(self.max * 1000, 1)),
+            ('buckets', histogram),
+        ])
+
+
+class ServicePointProber(object):
+    """
+    Probes service points concurrently on a bounded thread pool.
+    At most per_site_limit probes run against one site at a time, and every probe shares the
+    connection pool of one requests.Session, so a sweep takes about as long as its slowest
+    probe instead of the sum of all of them.
+    """
+
+    def __init__(self, max_workers=32, per_site_limit=4):
+        self._pool = ThreadPoolExecutor(max_workers=max_workers)
+        self._per_site_limit = per_site_limit
+        self._site_limits = {}
+        self._lock = Lock()
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self._histogram = LatencyHistogram()
+        self._site_histograms = {}
+        self.last_sweep_seconds = 0
+        self.last_sweep_probes = 0
+
+    def _site_limit(self, site):
+        with self._lock:
+            limit = self._site_limits.get(site)
+            if limit is None:
+                limit = BoundedSemaphore(self._per_site_limit)
+                self._site_limits[site] = limit
+            return limit
+
+    def _observe(self, site, seconds, failed):
+        with self._lock:
+            self._histogram.observe(seconds, failed)
+            histogram = self._site_histograms.get(site)
+            if histogram is None:
+                histogram = LatencyHistogram()
+                self._site_histograms[site] = histogram
+            histogram.observe(seconds, failed)
+
+    def _probe(self, edge_api, service_point, timeout, handler):
+        with self._site_limit(service_point['site']):
+            start = time.time()
+            sp_status = edge_api.get_service_point_status(service_point['ipaddress'], timeout)
+            latency = time.time() - start
+        self._observe(service_point['site'], latency, sp_status is None)
+        service_point['latency_ms'] = round(latency * 1000, 1)
+        handler(service_point, sp_status)
+
+    def probe_all(self, edge_api, service_points, timeout, handler):
+        """
+        Probe every service point and call handler(service_point, sp_status) for each result.
+        Returns the wall-clock time of the sweep in seconds.
+        """
+        edge_api.set_session(self.session)
+        start = time.time()
+        futures = [self._pool.submit(self._probe, edge_api, sp, timeout, handler) for sp in service_points]
+        wait(futures)
+        for future in futures:
+            # Surface the first handler error the same way the sequential sweep did
+            future.result()
+        self.last_sweep_seconds = round(time.time() - start, 2)
+        self.last_sweep_probes = len(futures)
+        return self.last_sweep_seconds
+
+    def get_stats(self):
+        with self._lock:
+            return OrderedDict([
+                ('last_sweep_seconds', self.last_sweep_seconds),
+                ('last_sweep_probes', self.last_sweep_probes),
+                ('all', self._histogram.as_dict()),
+                ('sites', OrderedDict(
+                    (site, histogram.as_dict()) for site, histogram in sorted(self._site_histograms.items()))),
+            ])
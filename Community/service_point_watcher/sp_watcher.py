@@ -29,6 +29,7 @@ from apscheduler.schedulers.background import BackgroundScheduler
 
 from dnsedge.edgeapi import EdgeAPI
 from .snmp_trap_sender import send_status_notification, send_pulling_stopped_notification
+from .sp_prober import ServicePointProber
 
 class SPWatcherException(Exception): pass
 
@@ -53,6 +54,7 @@ class SPWatcher(object):
                     cls._unique_instance._scheduler = None
                     cls._unique_instance._job = None
                     cls._unique_instance._service_points = []
+                    cls._unique_instance._prober = None
                     cls._unique_instance._load()
         return cls._unique_instance
 
@@ -166,9 +168,8 @@ class SPWatcher(object):
 
         return pulling_severity
 
-    def _analyze_service_point(self, edge_api, service_point, timeout):
+    def _analyze_service_point(self, service_point, sp_status):
         status = 'UNKNOWN'
-        sp_status = edge_api.get_service_point_status(service_point['ipaddress'], timeout)
         pulling_severity = 'UNKNOWN'
         if sp_status is not None:
             status = sp_status['spStatus']
@@ -233,10 +234,21 @@ class SPWatcher(object):
             return False
 
         timeout = self.get_value('timeout')
-        for sp in service_points:
-            self._analyze_service_point(edge_api, sp, timeout)
+        elapsed = self._get_prober().probe_all(edge_api, service_points, timeout, self._analyze_service_point)
+        if self._debug:
+            print('Probed %d Service Points in %.2f seconds' % (len(service_points), elapsed))
         return True
 
+    def _get_prober(self):
+        if self._prober is None:
+            max_workers = self.get_value('max_workers') or 32
+            per_site_concurrency = self.get_value('per_site_concurrency') or 4
+            self._prober = ServicePointProber(max_workers=max_workers, per_site_limit=per_site_concurrency)
+        return self._prober
+
+    def get_probe_stats(self):
+        return self._get_prober().get_stats()
+
     def collect_service_points(self):
         succeed = False
         try:
@@ -285,7 +297,8 @@ class SPWatcher(object):
             if interval is not None and 0 < interval:
                 self.watch_service_points()
                 self._job = \
-                    self._scheduler.add_job(self.watch_service_points, 'interval', seconds=interval)
+                    self._scheduler.add_job(self.watch_service_points, 'interval', seconds=interval,
+                                            max_instances=1, coalesce=True)
                 succeed = True
 
         except Exception as e:
@@ -23,6 +23,7 @@ import json
 import csv
 import ipaddress
 import os
+from contextlib import contextmanager
 
 import openpyxl
 from openpyxl.styles import Font, PatternFill, Alignment
@@ -37,6 +38,9 @@ from bluecat.api_exception import BAMException, PortalException
 
 import config.default_config as config
 
+from .incremental import ZoneSectionCache
+from .prefetch import ChildPrefetcher
+
 col_config = {}
 CONFIG_FILE = '%s/config_%s.json'
 
@@ -52,12 +56,22 @@ SHEET_TITLE_FOR_CONFIGURATION = r_text['sheet_title_for_configuration']
 SHEET_TITLE_FOR_VIEW = r_text['sheet_title_for_view']
 SHEET_TITLE_FOR_ZONE = r_text['sheet_title_for_zone']
 SHEET_TITLE_FOR_STRUCTURE = r_text['sheet_title_for_structure']
+DELTA_TITLE_FOR_CHANGE = r_text['delta_title_for_change']
+DELTA_TITLE_FOR_ZONE = r_text['delta_title_for_zone']
 
 BOLD_FONT = Font(bold=True)
 LINK_FONT = Font(underline='single', color=Color(theme=10, type="theme"))
 BOLD_LINK_FONT = Font(bold=True, underline='single', color=Color(theme=10, type="theme"))
 TITLE_FILL_COLOR = PatternFill('solid', fgColor='9BC2E6')
 
+# Concurrent BAM sessions used to fetch views, zones and records while the file is written
+DEFAULT_SESSIONS = 4
+# Views and zones are the nodes of the exported tree
+TREE_TYPES = (Entity.View, Entity.Zone)
+# Exported resource record types, each one is fetched with its own request
+RECORD_TYPES = (Entity.HostRecord, Entity.AliasRecord, Entity.MXRecord, Entity.TXTRecord,
+                Entity.SRVRecord, Entity.GenericRecord, Entity.HINFORecord, Entity.NAPTRRecord)
+
 def load_config(module_dir, nodes):
     global col_config
     col_config = json.load(open(CONFIG_FILE % (module_dir, config.language)))
@@ -92,39 +106,53 @@ def construct_node(parent, level, entity):
     node['isLeaf'] = False
     return node
 
-def get_sorted_children(parent):
-    nodes = []
-    zones = []
-    if parent.get_type() == Entity.Configuration:
-        zones = parent.get_children_of_type(Entity.View)
-    else:
-        zones = parent.get_children_of_type(Entity.Zone)
-    for zone in zones:
-        node = {}
-        node['entity'] = zone
-        node['name'] = zone.get_name()
-        nodes.append(node)
-        
-    nodes.sort(key = lambda node: node['name'])
-    return nodes
-
-def get_sorted_resource_records(zone):
-    host_records = zone.get_children_of_type(Entity.HostRecord)
-    resource_records = list(host_records)
-    alias_records = zone.get_children_of_type(Entity.AliasRecord)
-    resource_records.extend(list(alias_records))
-    mx_records = zone.get_children_of_type(Entity.MXRecord)
-    resource_records.extend(list(mx_records))
-    txt_records = zone.get_children_of_type(Entity.TXTRecord)
-    resource_records.extend(list(txt_records))
-    srv_records = zone.get_children_of_type(Entity.SRVRecord)
-    resource_records.extend(list(srv_records))
-    generic_records = zone.get_children_of_type(Entity.GenericRecord)
-    resource_records.extend(list(generic_records))
-    hinfo_records = zone.get_children_of_type(Entity.HINFORecord)
-    resource_records.extend(list(hinfo_records))
-    naptr_records = zone.get_children_of_type(Entity.NAPTRRecord)
-    resource_records.extend(list(naptr_records))
+def get_child_types(entity):
+    if entity.get_type() == Entity.Configuration:
+        return (Entity.View,)
+    return (Entity.Zone,)
+
+def get_child_types_with_records(entity, cache=None):
+    if entity.get_type() == Entity.Zone:
+        if cache is not None and not cache.is_changed(entity.get_id()):
+            return (Entity.Zone,)
+        return (Entity.Zone,) + RECORD_TYPES
+    return get_child_types(entity)
+
+def create_prefetcher(api):
+    return ChildPrefetcher(api, col_config.get('sessions', DEFAULT_SESSIONS))
+
+def walk_tree(prefetcher, entity, include_root=False, records=False, cache=None):
+    types_of = get_child_types
+    if records:
+        types_of = lambda parent: get_child_types_with_records(parent, cache)
+    return prefetcher.walk(entity, types_of, TREE_TYPES, lambda zone: zone.get_name(), include_root)
+
+@contextmanager
+def open_section_cache(api, prefetcher, dirname, id, incremental, username):
+    # Incremental exports splice the records of zones that did not change from the previous run
+    if not incremental:
+        yield None
+        return
+    incremental_config = col_config['incremental']
+    state_dir = os.path.join(dirname, incremental_config['state_dir'])
+    with ZoneSectionCache(state_dir, username, id, col_config['resource_record'],
+                          incremental_config['max_parent_lookups']) as cache:
+        cache.find_changed_zones(api, prefetcher)
+        delta_header = None
+        if incremental_config['delta']:
+            delta_header = [DELTA_TITLE_FOR_CHANGE, DELTA_TITLE_FOR_ZONE] + \
+                [prop['title'] for prop in col_config['resource_record']]
+        cache.begin(delta_header, str(col_config['encoding']))
+        yield cache
+
+def get_delta_file(dirname, id, username):
+    state_dir = os.path.join(dirname, col_config['incremental']['state_dir'])
+    return ZoneSectionCache(state_dir, username, id, col_config['resource_record']).delta_file
+
+def get_sorted_resource_records(children):
+    resource_records = []
+    for record_type in RECORD_TYPES:
+        resource_records.extend(children.get(record_type, []))
     
     resource_records.sort(key = lambda record: record.get_name())
     return resource_records
@@ -160,6 +188,34 @@ def get_record_data(resource_record):
                             resource_record.get_property('rdata'))
     return rd
 
+def construct_resource_record_row(resource_record):
+    row = []
+    props = col_config['resource_record']
+    for prop in props:
+        id = prop['id']
+        if id == 'name':
+            row.append(resource_record.get_name())
+        elif id == 'type':
+            row.append(resource_record.get_type())
+        elif id == 'record_data':
+            row.append(get_record_data(resource_record))
+        else:
+            row.append(resource_record.get_property(id))
+    return row
+
+def get_zone_records(zone, children, cache):
+    # Returns the [record ID, row] pairs of the zone, from the previous run if it was not fetched
+    if cache is not None and Entity.HostRecord not in children:
+        records = cache.read_section(zone.get_id())
+        fetched = False
+    else:
+        records = [[resource_record.get_id(), construct_resource_record_row(resource_record)]
+                   for resource_record in get_sorted_resource_records(children)]
+        fetched = True
+    if cache is not None:
+        cache.add_section(zone.get_id(), get_sheet_name(zone), records, fetched)
+    return records
+
 def construct_structure_row(indent, entity):
     
     row = []
@@ -187,39 +243,17 @@ def write_header(writer):
     
     writer.writerow(header)
     
-def write_resource_record(writer, resource_record):
-    row = []
-    props = col_config['resource_record']
-    for prop in props:
-        id = prop['id']
-        if id == 'name':
-            row.append(resource_record.get_name())
-        elif id == 'type':
-            row.append(resource_record.get_type())
-        elif id == 'record_data':
-            row.append(get_record_data(resource_record))
-        else:
-            row.append(resource_record.get_property(id))
-    
-    writer.writerow(row)
-    
-def write_resource_records(writer, resource_records):
-    for resource_record in resource_records:
-        write_resource_record(writer, resource_record)
+def write_resource_records(writer, records):
+    writer.writerows(row for record_id, row in records)
 
-def write_zone(writer, zone):
-    resource_records = get_sorted_resource_records(zone)
-    
+def write_zone(writer, zone, records):
     write_header(writer)
-    write_resource_records(writer, resource_records)
+    write_resource_records(writer, records)
     
-def write_tree(api, writer, entity):
-    if entity.get_type() == Entity.Zone:
-        write_zone(writer, entity)
-        
-    nodes = get_sorted_children(entity)
-    for node in nodes:
-        write_tree(api, writer, node['entity'])
+def write_tree(prefetcher, writer, entity, cache=None):
+    for level, node, children in walk_tree(prefetcher, entity, include_root=True, records=True, cache=cache):
+        if node.get_type() == Entity.Zone:
+            write_zone(writer, node, get_zone_records(node, children, cache))
     
 # --------------------------------------------
 # Zone Structure CSV writing functions.
@@ -232,29 +266,28 @@ def write_structure_header(writer):
     
     writer.writerow(header)
     
-def write_structure(api, writer, level, entity):
-    nodes = get_sorted_children(entity)
-    for node in nodes:
-        row = construct_structure_row(level, node['entity'])
-        writer.writerow(row)
-        write_structure(api, writer, level + 1, node['entity'])
+def write_structure(prefetcher, writer, entity):
+    for level, node, children in walk_tree(prefetcher, entity):
+        writer.writerow(construct_structure_row(level, node))
 
 # --------------------------------------------
 # Top Writing function for CSV format.
 # --------------------------------------------
-def export_as_csv(api, dirname, filename, id, contents):
+def export_as_csv(api, dirname, filename, id, contents, incremental=False, username=None):
     entity = api.get_entity_by_id(id)
 
     encoding = str(col_config['encoding'])
     f = open(dirname + '/' + filename, 'w', encoding=encoding)
     writer = csv.writer(f, lineterminator = '\n')
     
-    if contents == 'struct' or contents == 'both':
-        write_structure_header(writer)
-        write_structure(api, writer, 0, entity)
-        
-    if contents == 'records' or contents == 'both':
-        write_tree(api, writer, entity)
+    with create_prefetcher(api) as prefetcher:
+        if contents == 'struct' or contents == 'both':
+            write_structure_header(writer)
+            write_structure(prefetcher, writer, entity)
+
+        if contents == 'records' or contents == 'both':
+            with open_section_cache(api, prefetcher, dirname, id, incremental, username) as cache:
+                write_tree(prefetcher, writer, entity, cache)
     
     f.close()
 
@@ -316,44 +349,25 @@ def write_header_for_excel(sheet, start_column, start_row):
     set_column_width(sheet, start_column, widthes)
     sheet.freeze_panes = 'A' + str(start_row + 1)
     
-def write_resource_record_for_excel(sheet, start_column, index, resource_record):
-    row = []
-    props = col_config['resource_record']
-    for prop in props:
-        id = prop['id']
-        if id == 'name':
-            row.append(resource_record.get_name())
-        elif id == 'type':
-            row.append(resource_record.get_type())
-        elif id == 'record_data':
-            row.append(get_record_data(resource_record))
-        else:
-            row.append(resource_record.get_property(id))
-    write_row_for_excel(sheet, start_column, index, row)
-    
-def write_resource_records_for_excel(sheet, start_column, start_row, zone, resource_records):
+def write_resource_records_for_excel(sheet, start_column, start_row, zone, records):
     index = start_row + 1
     
-    for resource_record in resource_records:
-        write_resource_record_for_excel(sheet, start_column, index, resource_record)
+    for record_id, row in records:
+        write_row_for_excel(sheet, start_column, index, row)
         index += 1
         
-def write_zone_for_excel(workbook, start_column, start_row, zone, linked_cells):
-    resource_records = get_sorted_resource_records(zone)
-    
+def write_zone_for_excel(workbook, start_column, start_row, zone, records, linked_cells):
     sheet = workbook.create_sheet(title=get_sheet_name(zone))
     write_title_for_excel(sheet, zone, linked_cells)
     write_header_for_excel(sheet, start_column, start_row)
     add_auto_filters(sheet, start_column, start_row, len(col_config['resource_record']))
-    write_resource_records_for_excel(sheet, start_column, start_row, zone, resource_records)
+    write_resource_records_for_excel(sheet, start_column, start_row, zone, records)
 
-def write_tree_for_excel(api, workbook, start_column, start_row, entity, linked_cells):
-    if entity.get_type() == Entity.Zone:
-        write_zone_for_excel(workbook, start_column, start_row, entity, linked_cells)
-        
-    nodes = get_sorted_children(entity)
-    for node in nodes:
-        write_tree_for_excel(api, workbook, start_column, start_row, node['entity'], linked_cells)
+def write_tree_for_excel(prefetcher, workbook, start_column, start_row, entity, linked_cells, cache=None):
+    for level, node, children in walk_tree(prefetcher, entity, include_root=True, records=True, cache=cache):
+        if node.get_type() == Entity.Zone:
+            write_zone_for_excel(workbook, start_column, start_row, node,
+                                 get_zone_records(node, children, cache), linked_cells)
         
 # --------------------------------------------
 # Zone Structure Excel writing functions.
@@ -393,7 +407,7 @@ def write_structure_header_for_excel(start_column, start_row, sheet):
     set_column_width(sheet, start_column, widthes)
     sheet.freeze_panes = 'A' + str(start_row + 1)
 
-def write_structure_node_for_excel(api, sheet, level, start_column, index, entity, add_link, linked_cells):
+def write_structure_node_for_excel(sheet, level, start_column, index, entity, add_link, linked_cells):
     row = construct_structure_row(0, entity)
     write_row_for_excel(sheet, start_column, index, row)
     cell = sheet.cell(row=index, column=column_index_from_string(start_column))
@@ -403,22 +417,18 @@ def write_structure_node_for_excel(api, sheet, level, start_column, index, entit
         cell.font = LINK_FONT
         linked_cells[str(entity.get_id())] = "#'" + sheet.title + "'!" + start_column + str(index)
     
-def write_structure_for_excel(api, sheet, level, start_column, index, entity, add_link, linked_cells):
-    nodes = get_sorted_children(entity)
-    for node in nodes:
-        write_structure_node_for_excel(api, sheet, level, \
-                                        start_column, index, node['entity'], add_link, linked_cells)
+def write_structure_for_excel(prefetcher, sheet, start_column, index, entity, add_link, linked_cells):
+    for level, node, children in walk_tree(prefetcher, entity):
+        write_structure_node_for_excel(sheet, level, start_column, index, node, add_link, linked_cells)
         if 0 < level:
             sheet.row_dimensions[index].outline_level = level
         index += 1
-        index = write_structure_for_excel(api, sheet, level + 1, \
-                                            start_column, index, node['entity'], add_link, linked_cells)
     return index
 
 # --------------------------------------------
 # Top Writing function for Excel format.
 # --------------------------------------------
-def export_as_excel(api, dirname, filename, id, contents):
+def export_as_excel(api, dirname, filename, id, contents, incremental=False, username=None):
     excel_config = col_config['excel']
     start_column = excel_config['start_column']
     start_row = excel_config['start_row']
@@ -427,18 +437,20 @@ def export_as_excel(api, dirname, filename, id, contents):
     workbook = openpyxl.load_workbook(dirname + '/templates/MeiryoUI.xlsx')
     sheet = workbook.active
     entity = api.get_entity_by_id(id)
-    if contents == 'struct' or contents == 'both':
-        add_link = (True if contents == 'both' else False)
-        sheet.title = get_sheet_name(entity) + ' ' + SHEET_TITLE_FOR_STRUCTURE
-        write_structure_title_for_excel(sheet, entity, add_link, linked_cells)
-        write_structure_header_for_excel(start_column, start_row, sheet)
-        add_auto_filters(sheet, start_column, start_row, len(col_config['zone']))
-        write_structure_for_excel(api, sheet, 0, start_column, start_row + 1, \
-                                  entity, add_link, linked_cells)
-    else:
-        workbook.remove(sheet)
-    
-    if contents == 'records' or contents == 'both':
-        write_tree_for_excel(api, workbook, start_column, start_row, entity, linked_cells)
+    with create_prefetcher(api) as prefetcher:
+        if contents == 'struct' or contents == 'both':
+            add_link = (True if contents == 'both' else False)
+            sheet.title = get_sheet_name(entity) + ' ' + SHEET_TITLE_FOR_STRUCTURE
+            write_structure_title_for_excel(sheet, entity, add_link, linked_cells)
+            write_structure_header_for_excel(start_column, start_row, sheet)
+            add_auto_filters(sheet, start_column, start_row, len(col_config['zone']))
+            write_structure_for_excel(prefetcher, sheet, start_column, start_row + 1, \
+                                      entity, add_link, linked_cells)
+        else:
+            workbook.remove(sheet)
+
+        if contents == 'records' or contents == 'both':
+            with open_section_cache(api, prefetcher, dirname, id, incremental, username) as cache:
+                write_tree_for_excel(prefetcher, workbook, start_column, start_row, entity, linked_cells, cache)
     workbook.save(dirname + '/' + filename)
     
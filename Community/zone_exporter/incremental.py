@@ -0,0 +1,267 @@
+# Copyright 2020 BlueCat Networks (USA) Inc. and its affiliates
+# -*- coding: utf-8 -*-
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+# By: BlueCat Networks
+# Date: 2020-06-01
+# Gateway Version: 19.5.1
+# Description: Zone Exporter incremental export state
+
+import csv
+import hashlib
+import json
+import os
+import threading
+import time
+
+MANIFEST_VERSION = 1
+# Seconds added to the audit log window so changes made while the last export ran are not missed
+AUDIT_MARGIN = 300
+
+DELTA_ADDED = 'added'
+DELTA_REMOVED = 'removed'
+DELTA_CHANGED = 'changed'
+
+# Incremental exports of the same root by the same user must not interleave their state files
+_state_locks = {}
+_state_locks_lock = threading.Lock()
+
+
+def user_state_dir(state_dir, username):
+    """
+    Return the state directory of one user. Spliced rows were read with that user's BAM access
+    rights, so they are never reused for the export of another user.
+    """
+    return os.path.join(state_dir, hashlib.sha1(username.encode('utf-8')).hexdigest())
+
+
+def state_lock(state_dir, root_id):
+    """Return the lock guarding the state files of one root in one state directory"""
+    with _state_locks_lock:
+        return _state_locks.setdefault((state_dir, str(root_id)), threading.Lock())
+
+
+def hash_rows(rows):
+    return hashlib.sha1(json.dumps(rows, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+
+class ZoneSectionCache(object):
+    """
+    Keeps the resource record rows of every zone one user exported from one root so that the
+    next incremental export of that user only fetches the zones that changed in between.
+    <root_id>.sections holds one JSON line of [record ID, row] pairs per zone and <root_id>.json
+    the manifest: when the last run started, the column layout and, per zone, the offset of its
+    section, a hash of its rows and its record IDs. Changed zones are found from the BAM audit
+    log; when it cannot be read every zone is fetched again.
+    """
+
+    def __init__(self, state_dir, username, root_id, columns, max_parent_lookups=5000):
+        self.state_dir = user_state_dir(state_dir, username)
+        self.root_id = root_id
+        self._lock = state_lock(self.state_dir, root_id)
+        self._columns = hash_rows(columns)
+        self._max_parent_lookups = max_parent_lookups
+        self._zones = {}
+        self._last_run = None
+        self._changed = None
+        self._started = None
+        self._previous = None
+        self._sections = None
+        self._new_zones = None
+        self._delta = None
+        self._delta_writer = None
+        self.fetched = 0
+        self.reused = 0
+
+    @property
+    def manifest_file(self):
+        return os.path.join(self.state_dir, '%s.json' % self.root_id)
+
+    @property
+    def sections_file(self):
+        return os.path.join(self.state_dir, '%s.sections' % self.root_id)
+
+    @property
+    def delta_file(self):
+        return os.path.join(self.state_dir, '%s_delta.csv' % self.root_id)
+
+    def __enter__(self):
+        self._lock.acquire()
+        try:
+            self.load()
+        except Exception:
+            self._lock.release()
+            raise
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            if exc_type is None:
+                self.commit()
+            else:
+                self.abort()
+        finally:
+            self._lock.release()
+
+    def load(self):
+        """Read the manifest of the previous run, a missing or incompatible one means a full export"""
+        self._zones = {}
+        self._last_run = None
+        if not os.path.isdir(self.state_dir):
+            os.makedirs(self.state_dir)
+        if os.path.exists(self.manifest_file) and os.path.exists(self.sections_file):
+            with open(self.manifest_file, 'r') as manifest_file:
+                manifest = json.load(manifest_file)
+            if manifest.get('version') == MANIFEST_VERSION and manifest.get('columns') == self._columns:
+                self._zones = {int(zone_id): zone for zone_id, zone in manifest['zones'].items()}
+                self._last_run = manifest['last_run']
+        return self
+
+    def find_changed_zones(self, api, prefetcher):
+        """
+        Work out which known zones changed since the last run from the audit log.
+        Zones missing from the manifest are always fetched.
+        """
+        self._started = time.time()
+        self._changed = None
+        if self._last_run is None:
+            return None
+        interval = '%d seconds' % (self._started - self._last_run + AUDIT_MARGIN)
+        try:
+            logs = api.get_audit_logs(interval, transaction_id=None, descending=False)
+        except Exception:
+            return None
+
+        zone_of = {}
+        for zone_id, zone in self._zones.items():
+            zone_of[zone_id] = zone_id
+            for record_id in zone['records']:
+                zone_of[record_id] = zone_id
+        changed = set()
+        unknown = set()
+        for log in logs:
+            object_id = int(log['object_id'])
+            if object_id in zone_of:
+                changed.add(zone_of[object_id])
+            else:
+                unknown.add(object_id)
+        # Created records are not in the manifest yet, their zone is their parent
+        if self._max_parent_lookups < len(unknown):
+            return None
+        for parent_id in prefetcher.fetch_parent_ids(unknown).values():
+            if parent_id in self._zones:
+                changed.add(parent_id)
+        self._changed = changed
+        return changed
+
+    def is_changed(self, zone_id):
+        """True if the records of the zone have to be fetched from BAM"""
+        if zone_id not in self._zones:
+            return True
+        return self._changed is None or zone_id in self._changed
+
+    def read_section(self, zone_id):
+        """Return the [record ID, row] pairs the previous run exported for the zone"""
+        if self._previous is None:
+            self._previous = open(self.sections_file, 'r', encoding='utf-8')
+        self._previous.seek(self._zones[zone_id]['offset'])
+        return json.loads(self._previous.readline())
+
+    def begin(self, delta_header=None, encoding='utf-8'):
+        """Start collecting the sections of this run, with delta_header a delta file is written too"""
+        if self._started is None:
+            self._started = time.time()
+        self._sections = open(self.sections_file + '.tmp', 'w', encoding='utf-8')
+        self._new_zones = {}
+        if delta_header is not None:
+            self._delta = open(self.delta_file + '.tmp', 'w', encoding=encoding, newline='')
+            self._delta_writer = csv.writer(self._delta, lineterminator='\n')
+            self._delta_writer.writerow(delta_header)
+
+    def add_section(self, zone_id, zone_name, records, fetched):
+        """Store the [record ID, row] pairs of one zone of this run"""
+        digest = hash_rows(records)
+        if fetched:
+            self.fetched += 1
+        else:
+            self.reused += 1
+        if self._delta_writer is not None and fetched:
+            previous = self._zones.get(zone_id)
+            if previous is None:
+                self._write_delta(zone_name, [], records)
+            elif previous['hash'] != digest:
+                self._write_delta(zone_name, self.read_section(zone_id), records)
+        self._new_zones[zone_id] = {
+            'name': zone_name,
+            'offset': self._sections.tell(),
+            'hash': digest,
+            'records': [record_id for record_id, row in records],
+        }
+        self._sections.write(json.dumps(records, ensure_ascii=False) + '\n')
+
+    def _write_delta(self, zone_name, old_records, new_records):
+        old_rows = {record_id: row for record_id, row in old_records}
+        new_ids = set()
+        for record_id, row in new_records:
+            new_ids.add(record_id)
+            old_row = old_rows.get(record_id)
+            if old_row is None:
+                self._delta_writer.writerow([DELTA_ADDED, zone_name] + row)
+            elif old_row != row:
+                self._delta_writer.writerow([DELTA_CHANGED, zone_name] + row)
+        for record_id, row in old_records:
+            if record_id not in new_ids:
+                self._delta_writer.writerow([DELTA_REMOVED, zone_name] + row)
+
+    def commit(self):
+        """Replace the previous state with this run's, zones not seen this time count as removed"""
+        if self._sections is None:
+            return
+        if self._delta_writer is not None:
+            for zone_id, zone in self._zones.items():
+                if zone_id not in self._new_zones:
+                    self._write_delta(zone.get('name', ''), self.read_section(zone_id), [])
+            self._delta.close()
+            os.replace(self.delta_file + '.tmp', self.delta_file)
+        self._close_previous()
+        self._sections.close()
+        os.replace(self.sections_file + '.tmp', self.sections_file)
+        manifest = {
+            'version': MANIFEST_VERSION,
+            'columns': self._columns,
+            'last_run': self._started,
+            'zones': self._new_zones,
+        }
+        with open(self.manifest_file + '.tmp', 'w') as manifest_file:
+            json.dump(manifest, manifest_file)
+        os.replace(self.manifest_file + '.tmp', self.manifest_file)
+        self._zones = self._new_zones
+        self._last_run = self._started
+        self._sections = None
+
+    def _close_previous(self):
+        if self._previous is not None:
+            self._previous.close()
+            self._previous = None
+
+    def abort(self):
+        """Drop this run's state, the previous run's stays in place"""
+        self._close_previous()
+        for temp_file in (self._sections, self._delta):
+            if temp_file is not None:
+                temp_file.close()
+                os.remove(temp_file.name)
+        self._sections = None
+        self._delta = None
+        self._delta_writer = None
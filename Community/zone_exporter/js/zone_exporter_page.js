@@ -92,13 +92,27 @@ $(document).ready(function()
 	    var rowid = grid.getGridParam('selrow');
 	    var format = $('#format option:selected').val()
 	    var contents = $('#contents option:selected').val()
+	    var incremental = $('#incremental_output').prop('checked')
 	    if (rowid == null) {
 	        rowid = 0
 	    }
 	    var a = document.createElement('a');
 	    a.download = 'exported.csv'
-	    a.href = '/zone_exporter/load_file/' + rowid + '/' + format + '/' + contents;
+	    a.href = '/zone_exporter/load_file/' + rowid + '/' + format + '/' + contents + '/' + (incremental ? 'incremental' : 'full');
 	    a.click();
 	    $("body").removeClass("waiting");
 	});
+
+	var download_delta = $('#download_delta');
+
+	download_delta.click(function() {
+	    var rowid = grid.getGridParam('selrow');
+	    if (rowid == null) {
+	        rowid = 0
+	    }
+	    var a = document.createElement('a');
+	    a.download = 'delta.csv'
+	    a.href = '/zone_exporter/load_delta/' + rowid;
+	    a.click();
+	});
 });
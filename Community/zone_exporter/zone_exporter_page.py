@@ -24,7 +24,7 @@ import os
 import sys
 
 from flask import url_for, redirect, render_template, flash, g, jsonify, send_file
-from wtforms import SelectField
+from wtforms import SelectField, BooleanField
 
 from bluecat import route, util
 from bluecat.wtform_extensions import GatewayForm
@@ -34,12 +34,13 @@ from main_app import app
 
 from .exporter import module_path, get_resource_text
 from .exporter import load_config, construct_node
-from .exporter import export_as_csv, export_as_excel
+from .exporter import export_as_csv, export_as_excel, get_delta_file
 
 CSV_MIMETYPE = 'text/csv'
 XLSX_MIMETYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
 CSV_FILE_NAME = 'exported{0:%Y%m%d%H%M%S}.csv'
 XLSX_FILE_NAME = 'exported{0:%Y%m%d%H%M%S}.xlsx'
+DELTA_FILE_NAME = 'delta{0}.csv'
 
 def get_configuration():
     configuration = None
@@ -71,6 +72,9 @@ class GenericFormTemplate(GatewayForm):
             ('both', text['title_both'])
         ]
     )
+    incremental_output = BooleanField(
+        label=''
+    )
     
 
 # The workflow name must be the first part of any endpoints defined in this file.
@@ -146,9 +150,22 @@ def load_children_data(id, level):
 @route(app, '/zone_exporter/load_file/<int:id>/<format>/<contents>')
 @util.workflow_permission_required('zone_exporter_page')
 @util.exception_catcher
-def load_file(id, format, contents):
+def load_full_file(id, format, contents):
+    # The URL from before incremental exports, kept for existing scheduled callers and bookmarks
+    return export_file(id, format, contents, 'full')
+
+@route(app, '/zone_exporter/load_file/<int:id>/<format>/<contents>/<mode>')
+@util.workflow_permission_required('zone_exporter_page')
+@util.exception_catcher
+def load_file(id, format, contents, mode):
+    return export_file(id, format, contents, mode)
+
+def export_file(id, format, contents, mode):
+    incremental = True if mode == 'incremental' else False
     now = datetime.datetime.now()
     dirname = module_path()
+    # Scheduled exports call this URL without loading the page first
+    load_config(dirname, [])
     
     if id == 0:
         configuration = get_configuration()
@@ -156,13 +173,29 @@ def load_file(id, format, contents):
     if format == 'csv':
         filename = CSV_FILE_NAME.format(now)
         mimetype = CSV_MIMETYPE
-        export_as_csv(g.user.get_api(), dirname, filename, id, contents)
+        export_as_csv(g.user.get_api(), dirname, filename, id, contents, incremental, g.user.get_username())
     else:
         filename = XLSX_FILE_NAME.format(now)
         mimetype = XLSX_MIMETYPE
-        export_as_excel(g.user.get_api(), dirname, filename, id, contents)
+        export_as_excel(g.user.get_api(), dirname, filename, id, contents, incremental, g.user.get_username())
         
     return send_file(dirname + '/' + filename,
                          mimetype=mimetype,
                          attachment_filename=filename,
-                         as_attachment=True) 
\ No newline at end of file
+                         as_attachment=True)
+
+@route(app, '/zone_exporter/load_delta/<int:id>')
+@util.workflow_permission_required('zone_exporter_page')
+@util.exception_catcher
+def load_delta(id):
+    if id == 0:
+        configuration = get_configuration()
+        id = configuration.get_id()
+    load_config(module_path(), [])
+    delta_file = get_delta_file(module_path(), id, g.user.get_username())
+    if not os.path.exists(delta_file):
+        return jsonify({'error': 'No incremental export has been made for this entity.'}), 404
+    return send_file(delta_file,
+                         mimetype=CSV_MIMETYPE,
+                         attachment_filename=DELTA_FILE_NAME.format(id),
+                         as_attachment=True)